@@ -21,6 +21,11 @@ const char *MQTT_USER = "";  // optional
 const char *MQTT_PASS = "";  // optional
 const char *MQTT_CMD_TOPIC = "led/command";
 const char *MQTT_STATUS_TOPIC = "led/status";
+// Retained per-segment state kept by the host; replayed by the broker on subscribe.
+const char *MQTT_STATE_TOPIC_FILTER = "led/state/+";
+const char *MQTT_STATE_TOPIC_PREFIX = "led/state/";
+// Retained state is only wanted once after boot; later changes already arrive on led/command.
+constexpr uint32_t STATE_RESTORE_WINDOW_MS = 5000;
 const char *TEST_OTA_URL = "http://192.168.12.157:8000/http_ota.bin";
 const char *FW_VERSION = "fw-ota-trannyfix";
 constexpr bool DO_BOOT_HTTP_OTA = false;
@@ -70,6 +75,11 @@ constexpr int MIC_PIN_WS = 6;
 constexpr int MIC_PIN_DATA = 5;
 constexpr int MIC_SAMPLE_RATE = 16000;
 constexpr size_t MIC_BUF_SAMPLES = 256;  // small buffer for low latency
+// Host-fed levels (params.level) override the local mic until they go stale.
+constexpr uint32_t EXT_LEVEL_TIMEOUT_MS = 500;
+// Host beat events (params.beat) replace the local threshold detector while fresh.
+constexpr uint32_t EXT_BEAT_TIMEOUT_MS = 2000;
+constexpr float BEAT_HOLD_SECONDS = 0.18f;
 
 struct SegmentState {
   String pattern = "solid";
@@ -88,6 +98,9 @@ struct SegmentState {
   uint8_t gradMid[3] = {255, 255, 255};
   uint8_t gradHigh[3] = {255, 0, 120};
   bool beatMode = false;
+  float extLevel = 0.0f;     // 0..1 from host audio analysis
+  uint32_t extLevelAt = 0;   // millis() of last params.level, 0 = never
+  uint32_t extBeatAt = 0;    // millis() of last params.beat, 0 = never
 };
 
 struct SegmentRuntime {
@@ -111,6 +124,8 @@ WiFiClient wifiClient;
 PubSubClient mqtt(wifiClient);
 
 uint32_t lastWifiCheck = 0;
+uint32_t stateSubscribedAt = 0;  // millis() of the boot restore subscribe, 0 = not subscribed
+bool stateRestoreDone = false;
 float micLevel = 0.0f;          // smoothed 0..1
 float micRawLevel = 0.0f;       // instantaneous 0..1
 bool micReady = false;
@@ -225,17 +240,20 @@ void render_segment(size_t idx, float dt) {
   } else if (st.pattern == "mic_vu") {
     // Simple VU meter driven by micLevel.
     float val = st.micEnabled ? micLevel : 0.0f;
+    if (st.extLevelAt != 0 && millis() - st.extLevelAt < EXT_LEVEL_TIMEOUT_MS) {
+      val = st.extLevel;
+    }
     // Per-segment smoothing layer.
     rt.micValue = rt.micValue * st.micSmooth + val * (1.0f - st.micSmooth);
     float v = (rt.micValue - st.micFloor) * st.micGain;
     if (v < 0.0f) v = 0.0f;
     v = clamp01(v);
-    // Beat detect: simple threshold + cooldown hold.
+    // Beat detect: simple threshold + cooldown hold, unless the host is sending beats.
     const float beatThresh = 0.45f;
-    const float beatHoldSeconds = 0.18f;
-    if (st.beatMode) {
-      if (v > beatThresh && rt.beatHold <= 0.0f) {
-        rt.beatHold = beatHoldSeconds;
+    bool hostBeats = st.extBeatAt != 0 && millis() - st.extBeatAt < EXT_BEAT_TIMEOUT_MS;
+    if (st.beatMode || hostBeats) {
+      if (!hostBeats && v > beatThresh && rt.beatHold <= 0.0f) {
+        rt.beatHold = BEAT_HOLD_SECONDS;
       }
       if (rt.beatHold > 0.0f) {
         v = 1.0f;
@@ -326,6 +344,11 @@ void apply_params(SegmentState &st, JsonVariant params) {
   if (params.containsKey("mic_beat")) {
     st.beatMode = params["mic_beat"].as<bool>();
   }
+  if (params.containsKey("level")) {
+    st.extLevel = clamp01(params["level"].as<float>());
+    st.extLevelAt = millis();
+    if (st.extLevelAt == 0) st.extLevelAt = 1;
+  }
   if (params.containsKey("gradient_low")) {
     JsonArray arr = params["gradient_low"].as<JsonArray>();
     if (arr.size() == 3) {
@@ -435,6 +458,11 @@ void handle_command(JsonDocument &doc) {
     }
     JsonVariant params = doc["params"];
     apply_params(st, params);
+    if (!params.isNull() && params["beat"].as<bool>()) {
+      segmentRuntime[segIdx].beatHold = BEAT_HOLD_SECONDS;
+      st.extBeatAt = millis();
+      if (st.extBeatAt == 0) st.extBeatAt = 1;
+    }
   } else if (strcmp(cmd, "ping") == 0) {
     mqtt.publish(MQTT_STATUS_TOPIC, "{\"pong\":true}", false);
   } else if (strcmp(cmd, "ota_http") == 0) {
@@ -452,15 +480,20 @@ void handle_command(JsonDocument &doc) {
 
 void on_mqtt_message(char *topic, byte *payload, unsigned int length) {
   if (length == 0 || length > 512) return;
+  // Drop retained state that arrives after the restore window (e.g. a late broker resend).
+  if (stateRestoreDone && strncmp(topic, MQTT_STATE_TOPIC_PREFIX, strlen(MQTT_STATE_TOPIC_PREFIX)) == 0) return;
   StaticJsonDocument<512> doc;
   DeserializationError err = deserializeJson(doc, payload, length);
   if (err) {
     Serial.println("MQTT JSON parse error");
     return;
   }
-  Serial.print("MQTT cmd: ");
-  serializeJson(doc, Serial);
-  Serial.println();
+  // Host audio streams params.level/beat at high rate; don't flood the serial log with it.
+  if (!doc["params"].containsKey("level") && !doc["params"].containsKey("beat")) {
+    Serial.print("MQTT cmd: ");
+    serializeJson(doc, Serial);
+    Serial.println();
+  }
   handle_command(doc);
 }
 
@@ -511,14 +544,20 @@ void mqtt_reconnect() {
     String clientId = "esp32-led-engine-" + mac;
     Serial.println("MQTT reconnect...");
     bool ok;
+    // Persistent session (cleanSession=false) + QoS 1 subscriptions: the broker
+    // queues commands sent during a Wi-Fi drop and re-sends unacked ones.
     if (strlen(MQTT_USER) > 0) {
-      ok = mqtt.connect(clientId.c_str(), MQTT_USER, MQTT_PASS);
+      ok = mqtt.connect(clientId.c_str(), MQTT_USER, MQTT_PASS, 0, 0, false, 0, false);
     } else {
-      ok = mqtt.connect(clientId.c_str());
+      ok = mqtt.connect(clientId.c_str(), NULL, NULL, 0, 0, false, 0, false);
     }
     if (ok) {
       Serial.println("MQTT connected");
-      mqtt.subscribe(MQTT_CMD_TOPIC);
+      mqtt.subscribe(MQTT_CMD_TOPIC, 1);
+      if (!stateRestoreDone) {
+        mqtt.subscribe(MQTT_STATE_TOPIC_FILTER, 1);
+        stateSubscribedAt = millis();
+      }
       mqtt.publish(MQTT_STATUS_TOPIC, "{\"status\":\"online\"}", false);
       break;
     }
@@ -527,6 +566,16 @@ void mqtt_reconnect() {
   }
 }
 
+// Boot restore is over once the broker had time to replay retained state;
+// unsubscribe so the persistent session stops delivering every change twice.
+void end_state_restore() {
+  if (stateRestoreDone || stateSubscribedAt == 0) return;
+  if (millis() - stateSubscribedAt < STATE_RESTORE_WINDOW_MS) return;
+  if (mqtt.connected()) mqtt.unsubscribe(MQTT_STATE_TOPIC_FILTER);
+  stateRestoreDone = true;
+  Serial.println("State restore window closed");
+}
+
 // Microphone ---------------------------------------------------------------
 void setup_mic() {
   i2s_config_t cfg = {
@@ -621,6 +670,7 @@ void loop() {
     mqtt_reconnect();
   }
   mqtt.loop();
+  end_state_restore();
 
   uint32_t now = millis();
   float dt = (now - lastMillis) / 1000.0f;
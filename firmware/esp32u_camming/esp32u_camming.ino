@@ -194,8 +194,9 @@ void ensureMqtt() {
   while (!mqtt.connected()) {
     mqtt.setServer(MQTT_HOST, MQTT_PORT);
     mqtt.setCallback(mqttCallback);
-    if (mqtt.connect("esp32u-camming", MQTT_USER, MQTT_PASS)) {
-      mqtt.subscribe(MQTT_CMD_TOPIC);
+    // Persistent session + QoS 1: commands sent during a Wi-Fi drop are queued by the broker.
+    if (mqtt.connect("esp32u-camming", MQTT_USER, MQTT_PASS, 0, 0, false, 0, false)) {
+      mqtt.subscribe(MQTT_CMD_TOPIC, 1);
       StaticJsonDocument<64> doc;
       doc["status"] = "online";
       char buf[64];
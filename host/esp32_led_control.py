@@ -13,17 +13,17 @@ Expected firmware protocol on the ESP32 (see esp32_firmware/esp32_firmware.ino):
 from __future__ import annotations
 
 import argparse
-import json
 import os
-import time
 from typing import Any, Dict, List, Optional, Sequence
 
-import paho.mqtt.client as mqtt
+from led_mqtt import DeliveryError, Publisher
+from led_payload import encode_messages
 
 DEFAULT_PORT = int(os.getenv("MQTT_PORT", "1883"))
 DEFAULT_HOST = os.getenv("MQTT_HOST")
 DEFAULT_TOPIC = os.getenv("MQTT_CMD_TOPIC", "led/command")
 DEFAULT_BRIGHTNESS = 255.0
+DEFAULT_QOS = int(os.getenv("MQTT_QOS", "1"))
 
 
 def _publish(
@@ -34,19 +34,15 @@ def _publish(
     *,
     username: Optional[str] = None,
     password: Optional[str] = None,
+    qos: int = DEFAULT_QOS,
 ) -> None:
-    client = mqtt.Client(client_id=f"led-cli-{int(time.time()*1000)}")
-    if username:
-        client.username_pw_set(username, password)
-    client.connect(host, port, keepalive=15)
-    client.loop_start()
+    """Publish and wait for the broker's PUBACK (QoS 1) or the socket write (QoS 0)."""
+    bodies = encode_messages(payload, topic, topic)
+    publisher = Publisher(host, port, username, password, client_id="led-cli", keepalive=15, connect_wait=5.0)
     try:
-        client.publish(topic, json.dumps(payload), qos=0, retain=False)
-        # give the network thread a beat to flush
-        time.sleep(0.1)
+        publisher.send([(topic, body) for body in bodies], qos=qos, kind="cli")
     finally:
-        client.loop_stop()
-        client.disconnect()
+        publisher.close()
 
 
 def set_pattern(
@@ -57,6 +53,7 @@ def set_pattern(
     segment: Optional[str] = None,
     username: Optional[str] = None,
     password: Optional[str] = None,
+    qos: int = DEFAULT_QOS,
     pattern: str,
     brightness: float = DEFAULT_BRIGHTNESS,
     speed: float = 1.0,
@@ -77,7 +74,7 @@ def set_pattern(
     }
     if segment:
         payload["segment"] = segment
-    _publish(host, port, topic, payload, username=username, password=password)
+    _publish(host, port, topic, payload, username=username, password=password, qos=qos)
 
 
 def ping(
@@ -88,11 +85,12 @@ def ping(
     segment: Optional[str] = None,
     username: Optional[str] = None,
     password: Optional[str] = None,
+    qos: int = DEFAULT_QOS,
 ) -> None:
     payload: Dict[str, Any] = {"cmd": "ping"}
     if segment:
         payload["segment"] = segment
-    _publish(host, port, topic, payload, username=username, password=password)
+    _publish(host, port, topic, payload, username=username, password=password, qos=qos)
 
 
 def parse_color(values: List[str]) -> List[int]:
@@ -110,6 +108,8 @@ def main(argv: Optional[Sequence[str]] = None) -> int:
     parser.add_argument("--username", help="MQTT username")
     parser.add_argument("--password", help="MQTT password")
     parser.add_argument("--segment", help="Segment name (e.g., strip1, seg250_323, seg330_400)")
+    parser.add_argument("--qos", type=int, choices=(0, 1), default=DEFAULT_QOS,
+                        help="1 waits for the broker's ack and retries (default, env MQTT_QOS); 0 fires and forgets")
 
     sub = parser.add_subparsers(dest="cmd", required=True)
 
@@ -124,6 +124,15 @@ def main(argv: Optional[Sequence[str]] = None) -> int:
 
     args = parser.parse_args(argv)
 
+    try:
+        _run(args)
+    except (DeliveryError, OSError) as exc:
+        print(f"not delivered: {exc}")
+        return 1
+    return 0
+
+
+def _run(args: argparse.Namespace) -> None:
     if args.cmd == "set":
         color = parse_color(args.color) if args.color else None
         extra: Dict[str, Any] = {}
@@ -136,6 +145,7 @@ def main(argv: Optional[Sequence[str]] = None) -> int:
             segment=args.segment,
             username=args.username,
             password=args.password,
+            qos=args.qos,
             pattern=args.pattern,
             brightness=args.brightness,
             speed=args.speed,
@@ -150,10 +160,9 @@ def main(argv: Optional[Sequence[str]] = None) -> int:
             segment=args.segment,
             username=args.username,
             password=args.password,
+            qos=args.qos,
         )
 
-    return 0
-
 
 if __name__ == "__main__":
     raise SystemExit(main())
@@ -0,0 +1,353 @@
+"""
+Host-side audio analysis that streams levels to `mic_vu` segments over MQTT.
+
+- Reads PCM from an ALSA capture device (via `arecord`) or a WAV file stand-in.
+- Computes windowed RMS and band energies with one vectorized NumPy rFFT per
+  batch of frames, normalizes them with a decaying-peak AGC, and publishes
+  `{"cmd":"set","segment":..,"params":{"level":..}}` at 50-100 Hz.
+- Capture runs on its own thread into a bounded queue; if analysis falls
+  behind, the oldest blocks are dropped so latency stays bounded.
+- Per-stage timings (read/analyze/publish), end-to-end latency and the
+  real-time factor are printed every few seconds.
+Example:
+    python3 led_audio.py --wav song.wav --map strip1=rms --map strip2=low --rate-hz 60
+    python3 led_audio.py --alsa plughw:1,0 --map strip1=mid --dry-run
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import queue
+import subprocess
+import threading
+import time
+import wave
+from collections import deque
+from typing import Deque, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+DEFAULT_HOST = os.getenv("MQTT_HOST", "10.42.0.1")
+DEFAULT_PORT = int(os.getenv("MQTT_PORT", "1883"))
+DEFAULT_TOPIC = os.getenv("MQTT_CMD_TOPIC", "led/command")
+DEFAULT_BANDS: Dict[str, Tuple[float, float]] = {
+    "low": (20.0, 250.0),
+    "mid": (250.0, 2000.0),
+    "high": (2000.0, 8000.0),
+}
+QUEUE_BLOCKS = 8  # ~8 hops of capture backlog before dropping
+REFRESH_S = 0.2  # resend unchanged levels before the firmware's 500 ms timeout
+
+
+class WavSource:
+    """Mono float32 blocks from a WAV file, optionally paced to real time."""
+
+    def __init__(self, path: str, block: int, realtime: bool = True, loop: bool = False) -> None:
+        self.path = path
+        self.block = block
+        self.realtime = realtime
+        self.loop = loop
+        with wave.open(path, "rb") as wf:
+            self.rate = wf.getframerate()
+
+    def blocks(self) -> Iterator[np.ndarray]:
+        t0 = time.monotonic()
+        emitted = 0
+        while True:
+            with wave.open(self.path, "rb") as wf:
+                channels = wf.getnchannels()
+                width = wf.getsampwidth()
+                while True:
+                    raw = wf.readframes(self.block)
+                    if not raw:
+                        break
+                    samples = _pcm_to_float(raw, width, channels)
+                    if self.realtime:
+                        due = t0 + emitted / self.rate
+                        delay = due - time.monotonic()
+                        if delay > 0:
+                            time.sleep(delay)
+                    emitted += len(samples)
+                    yield samples
+            if not self.loop:
+                return
+
+
+class AlsaSource:
+    """Mono S16_LE capture through `arecord` so no extra Python deps are needed."""
+
+    def __init__(self, device: str, rate: int, block: int) -> None:
+        self.device = device
+        self.rate = rate
+        self.block = block
+
+    def blocks(self) -> Iterator[np.ndarray]:
+        cmd = ["arecord", "-q", "-D", self.device, "-f", "S16_LE", "-c", "1", "-r", str(self.rate), "-t", "raw"]
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, bufsize=0)
+        nbytes = self.block * 2
+        try:
+            while True:
+                raw = proc.stdout.read(nbytes)
+                if not raw:
+                    return
+                yield _pcm_to_float(raw, 2, 1)
+        finally:
+            proc.terminate()
+
+
+def _pcm_to_float(raw: bytes, width: int, channels: int) -> np.ndarray:
+    if width == 1:
+        data = (np.frombuffer(raw, dtype=np.uint8).astype(np.float32) - 128.0) / 128.0
+    elif width == 2:
+        data = np.frombuffer(raw, dtype="<i2").astype(np.float32) / 32768.0
+    elif width == 4:
+        data = np.frombuffer(raw, dtype="<i4").astype(np.float32) / 2147483648.0
+    else:
+        raise ValueError(f"unsupported sample width {width}")
+    if channels > 1:
+        data = data[: len(data) - len(data) % channels].reshape(-1, channels).mean(axis=1)
+    return data
+
+
+class Analyzer:
+    """Sliding-window RMS + band energies, one output row per hop."""
+
+    def __init__(
+        self,
+        rate: int,
+        hop: int,
+        window: int = 1024,
+        bands: Optional[Dict[str, Tuple[float, float]]] = None,
+        peak_decay_s: float = 3.0,
+        gate: float = 1e-4,
+    ) -> None:
+        self.rate = rate
+        self.hop = hop
+        self.window = window
+        self.win = np.hanning(window).astype(np.float32)
+        bands = bands or DEFAULT_BANDS
+        self.names: List[str] = ["rms"] + list(bands)
+        freqs = np.fft.rfftfreq(window, 1.0 / rate)
+        matrix = np.zeros((len(bands), len(freqs)), dtype=np.float32)
+        for i, (lo, hi) in enumerate(bands.values()):
+            mask = (freqs >= lo) & (freqs < min(hi, rate / 2.0))
+            if mask.any():
+                matrix[i, mask] = 1.0 / mask.sum()
+        self.band_matrix = matrix.T  # (bins, bands) so power @ matrix -> (frames, bands)
+        self.buf = np.zeros(window - hop, dtype=np.float32)
+        # Decaying peak per feature for auto gain; decay applied per hop.
+        self.peak = np.full(len(self.names), gate, dtype=np.float32)
+        self.decay = np.float32(np.exp(-hop / (rate * peak_decay_s)))
+        self.gate = gate
+
+    def process(self, block: np.ndarray) -> np.ndarray:
+        """Return (frames, features) levels in 0..1 for every complete hop in `block`."""
+        data = np.concatenate((self.buf, block))
+        n = 1 + (len(data) - self.window) // self.hop if len(data) >= self.window else 0
+        if n <= 0:
+            self.buf = data
+            return np.empty((0, len(self.names)), dtype=np.float32)
+        frames = np.lib.stride_tricks.sliding_window_view(data, self.window)[:: self.hop][:n]
+        self.buf = data[n * self.hop:]
+        spectrum = np.fft.rfft(frames * self.win, axis=1)
+        power = spectrum.real ** 2 + spectrum.imag ** 2
+        bands = power @ self.band_matrix
+        rms = np.sqrt(np.mean(frames[:, -self.hop:] ** 2, axis=1, keepdims=True))
+        feats = np.hstack((rms, np.sqrt(bands))).astype(np.float32)
+        out = np.empty_like(feats)
+        for i in range(n):
+            self.peak = np.maximum(feats[i], self.peak * self.decay)
+            out[i] = feats[i] / np.maximum(self.peak, self.gate)
+        out[feats < self.gate] = 0.0
+        return np.clip(out, 0.0, 1.0)
+
+
+class StageStats:
+    """Bounded per-stage timing samples (ms) for periodic reports."""
+
+    def __init__(self, keep: int = 2000) -> None:
+        self.samples: Dict[str, Deque[float]] = {}
+        self.keep = keep
+        self.counters: Dict[str, int] = {}
+
+    def add(self, stage: str, ms: float) -> None:
+        self.samples.setdefault(stage, deque(maxlen=self.keep)).append(ms)
+
+    def count(self, name: str, n: int = 1) -> None:
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def report(self) -> str:
+        parts = []
+        for stage, values in self.samples.items():
+            arr = np.fromiter(values, dtype=np.float64)
+            parts.append(f"{stage} mean={arr.mean():.3f}ms p99={np.percentile(arr, 99):.3f}ms max={arr.max():.3f}ms")
+        parts += [f"{k}={v}" for k, v in sorted(self.counters.items())]
+        return " | ".join(parts)
+
+
+class LevelPublisher:
+    """Long-lived MQTT client sending compact per-segment level updates."""
+
+    def __init__(self, host: str, port: int, topic: str, username: Optional[str], password: Optional[str]) -> None:
+        import paho.mqtt.client as mqtt
+
+        self.topic = topic
+        self.client = mqtt.Client(client_id=f"led-audio-{os.getpid()}")
+        if username:
+            self.client.username_pw_set(username, password)
+        self.client.connect(host, port, keepalive=30)
+        self.client.loop_start()
+
+    def send(self, segment: str, level: float) -> None:
+        body = '{"cmd":"set","segment":"%s","params":{"level":%.3f}}' % (segment, level)
+        self.client.publish(self.topic, body, qos=0, retain=False)
+
+    def send_beat(self, segment: str) -> None:
+        body = '{"cmd":"set","segment":"%s","params":{"beat":true}}' % segment
+        self.client.publish(self.topic, body, qos=0, retain=False)
+
+    def close(self) -> None:
+        self.client.loop_stop()
+        self.client.disconnect()
+
+
+def run(
+    source,
+    analyzer: Analyzer,
+    mapping: Sequence[Tuple[str, str]],
+    publisher: Optional[LevelPublisher],
+    stats_every: float = 5.0,
+    stats: Optional[StageStats] = None,
+    drop_when_behind: bool = True,
+) -> StageStats:
+    """Capture -> analyze -> publish loop; returns the collected stats.
+
+    With `drop_when_behind` (live input) the oldest queued blocks are dropped
+    instead of letting latency grow; offline runs block the reader instead.
+    """
+    stats = stats or StageStats()
+    columns = [(seg, analyzer.names.index(feat)) for seg, feat in mapping]
+    blocks: "queue.Queue[Optional[Tuple[float, np.ndarray]]]" = queue.Queue(maxsize=QUEUE_BLOCKS)
+
+    def capture() -> None:
+        t_prev = time.perf_counter()
+        for block in source.blocks():
+            now = time.perf_counter()
+            stats.add("read", (now - t_prev) * 1000.0)
+            item = (now, block)
+            if not drop_when_behind:
+                blocks.put(item)
+                t_prev = time.perf_counter()
+                continue
+            while True:
+                try:
+                    blocks.put_nowait(item)
+                    break
+                except queue.Full:
+                    try:
+                        blocks.get_nowait()
+                        stats.count("dropped_blocks")
+                    except queue.Empty:
+                        pass
+            t_prev = time.perf_counter()
+        blocks.put(None)
+
+    threading.Thread(target=capture, name="led-audio-capture", daemon=True).start()
+    last_sent: Dict[str, Tuple[float, float]] = {}
+    audio_s = 0.0
+    busy_s = 0.0
+    next_report = time.monotonic() + stats_every
+    while True:
+        item = blocks.get()
+        if item is None:
+            break
+        captured_at, block = item
+        t0 = time.perf_counter()
+        levels = analyzer.process(block)
+        t1 = time.perf_counter()
+        stats.add("analyze", (t1 - t0) * 1000.0)
+        if len(levels):
+            row = levels[-1]  # newest hop wins; older hops in a batch are stale
+            now = time.monotonic()
+            for seg, col in columns:
+                value = round(float(row[col]), 3)
+                prev = last_sent.get(seg)
+                if prev and abs(prev[0] - value) < 1.0 / 256 and now - prev[1] < REFRESH_S:
+                    stats.count("suppressed")
+                    continue
+                if publisher is not None:
+                    publisher.send(seg, value)
+                last_sent[seg] = (value, now)
+                stats.count("published")
+        t2 = time.perf_counter()
+        stats.add("publish", (t2 - t1) * 1000.0)
+        stats.add("latency", (t2 - captured_at) * 1000.0)
+        audio_s += len(block) / analyzer.rate
+        busy_s += t2 - t0
+        if stats_every and time.monotonic() >= next_report:
+            rtf = busy_s / audio_s if audio_s else 0.0
+            print(f"[audio] rtf={rtf:.4f} | {stats.report()}", flush=True)
+            next_report = time.monotonic() + stats_every
+    rtf = busy_s / audio_s if audio_s else 0.0
+    print(f"[audio] done rtf={rtf:.4f} | {stats.report()}", flush=True)
+    return stats
+
+
+def parse_mapping(values: Sequence[str], names: Sequence[str]) -> List[Tuple[str, str]]:
+    out = []
+    for item in values:
+        seg, _, feat = item.partition("=")
+        feat = feat or "rms"
+        if feat not in names:
+            raise argparse.ArgumentTypeError(f"unknown feature {feat!r}; choose from {', '.join(names)}")
+        out.append((seg, feat))
+    return out
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Stream host audio levels to mic_vu segments over MQTT")
+    src = parser.add_mutually_exclusive_group(required=True)
+    src.add_argument("--wav", help="WAV file stand-in for live capture")
+    src.add_argument("--alsa", help="ALSA capture device, e.g. plughw:1,0")
+    parser.add_argument("--sample-rate", type=int, default=16000, help="ALSA capture rate")
+    parser.add_argument("--rate-hz", type=float, default=60.0, help="Level updates per second (50-100 typical)")
+    parser.add_argument("--window", type=int, default=1024, help="FFT window in samples")
+    parser.add_argument("--map", action="append", default=[], help="segment=feature (rms, low, mid, high)")
+    parser.add_argument("--loop", action="store_true", help="Loop the WAV file")
+    parser.add_argument("--fast", action="store_true", help="Do not pace WAV input to real time")
+    parser.add_argument("--dry-run", action="store_true", help="Analyze only; do not publish")
+    parser.add_argument("--stats-every", type=float, default=5.0)
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--topic", default=DEFAULT_TOPIC)
+    parser.add_argument("--username", default=os.getenv("MQTT_USER"))
+    parser.add_argument("--password", default=os.getenv("MQTT_PASS"))
+    args = parser.parse_args(argv)
+
+    rate = args.sample_rate
+    if args.wav:
+        with wave.open(args.wav, "rb") as wf:
+            rate = wf.getframerate()
+    hop = max(1, int(round(rate / args.rate_hz)))
+    if args.wav:
+        source = WavSource(args.wav, hop, realtime=not args.fast, loop=args.loop)
+    else:
+        source = AlsaSource(args.alsa, rate, hop)
+    analyzer = Analyzer(rate, hop, window=max(args.window, hop))
+    mapping = parse_mapping(args.map or ["strip1=rms"], analyzer.names)
+    publisher = None
+    if not args.dry_run:
+        publisher = LevelPublisher(args.host, args.port, args.topic, args.username, args.password)
+    try:
+        live = not (args.wav and args.fast)
+        run(source, analyzer, mapping, publisher, stats_every=args.stats_every, drop_when_behind=live)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if publisher is not None:
+            publisher.close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
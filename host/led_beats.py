@@ -0,0 +1,401 @@
+"""
+Streaming spectral-flux onset detector and beat tracker for `mic_beat` flashes.
+
+- `OnsetDetector` turns audio blocks into an onset-strength curve (band-wise
+  log-magnitude spectral flux weighted towards the kick band, one batched rFFT
+  per block) and picks peaks against an adaptive median threshold with a short
+  lookahead.
+- `BeatTracker` estimates tempo from the autocorrelation of recent onset
+  strength and the beat phase from folding it at that period; onsets off the
+  predicted grid are ignored.
+- `run` sends `params.beat` flashes to segments, at the predicted beat time
+  once the tracker has locked (confirmed by onsets, coasting up to 4 beats);
+  `bench` scores those flashes on annotated WAV files (one beat time in
+  seconds per line) and reports speed.
+Example:
+    python3 led_beats.py run --alsa plughw:1,0 --segment strip2 --segment strip3
+    python3 led_beats.py bench song1.wav song1.beats song2.wav song2.beats
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import time
+import wave
+from collections import deque
+from itertools import islice
+from typing import Deque, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from led_audio import AlsaSource, LevelPublisher, WavSource, _pcm_to_float
+
+DEFAULT_HOST = os.getenv("MQTT_HOST", "10.42.0.1")
+DEFAULT_PORT = int(os.getenv("MQTT_PORT", "1883"))
+DEFAULT_TOPIC = os.getenv("MQTT_CMD_TOPIC", "led/command")
+BENCH_TOLERANCE_S = 0.07
+# (low Hz, high Hz, weight): band-wise flux, averaged per band so the few kick
+# bins are not drowned out by hundreds of hi-hat bins.
+FLUX_BANDS: Tuple[Tuple[float, float, float], ...] = (
+    (30.0, 150.0, 1.0),
+    (150.0, 500.0, 0.4),
+    (500.0, 2000.0, 0.15),
+    (2000.0, 20000.0, 0.05),
+)
+
+
+class OnsetDetector:
+    """Spectral flux with adaptive threshold; returns (time_s, strength) onsets."""
+
+    def __init__(
+        self,
+        rate: int,
+        window: int = 1024,
+        hop: int = 256,
+        threshold_s: float = 1.0,
+        multiplier: float = 1.5,
+        delta: float = 0.05,
+        lookahead: int = 2,
+        min_gap_s: float = 0.1,
+        bands: Sequence[Tuple[float, float, float]] = FLUX_BANDS,
+    ) -> None:
+        self.rate = rate
+        self.window = window
+        self.hop = hop
+        self.win = np.hanning(window).astype(np.float32)
+        # Per-bin weight = band weight / bins in band, so flux.sum() is a weighted sum of band means.
+        freqs = np.fft.rfftfreq(window, 1.0 / rate)
+        self.bin_weights = np.zeros(len(freqs), dtype=np.float32)
+        for low, high, weight in bands:
+            sel = (freqs >= low) & (freqs < high)
+            if sel.any():
+                self.bin_weights[sel] = weight / sel.sum()
+        self.buf = np.zeros(window - hop, dtype=np.float32)
+        self.prev_mag: Optional[np.ndarray] = None
+        self.frame = 0  # index of the next onset-strength value
+        self.frame_s = hop / rate
+        self.history: Deque[float] = deque(maxlen=max(lookahead + 3, int(threshold_s / self.frame_s)))
+        self.multiplier = multiplier
+        self.delta = delta
+        self.lookahead = lookahead
+        self.min_gap = max(1, int(min_gap_s / self.frame_s))
+        self.last_onset = -self.min_gap
+        self.scale = 1e-3  # running max of flux for normalization
+        self.last_strengths = np.empty(0, dtype=np.float32)
+
+    def strengths(self, block: np.ndarray) -> np.ndarray:
+        """Onset strength per hop for `block` (normalized, roughly 0..1)."""
+        data = np.concatenate((self.buf, block))
+        n = 1 + (len(data) - self.window) // self.hop if len(data) >= self.window else 0
+        if n <= 0:
+            self.buf = data
+            return np.empty(0, dtype=np.float32)
+        frames = np.lib.stride_tricks.sliding_window_view(data, self.window)[:: self.hop][:n]
+        self.buf = data[n * self.hop:]
+        mag = np.log1p(100.0 * np.abs(np.fft.rfft(frames * self.win, axis=1))).astype(np.float32)
+        prev = mag[:1] if self.prev_mag is None else self.prev_mag[None, :]
+        diff = np.diff(np.vstack((prev, mag)), axis=0)
+        self.prev_mag = mag[-1]
+        flux = np.maximum(diff, 0.0) @ self.bin_weights
+        self.scale = max(self.scale * 0.999 ** n, float(flux.max()))
+        return flux / self.scale
+
+    def process(self, block: np.ndarray) -> List[Tuple[float, float]]:
+        onsets: List[Tuple[float, float]] = []
+        self.last_strengths = self.strengths(block)
+        for value in self.last_strengths:
+            self.history.append(float(value))
+            self.frame += 1
+            h = self.history
+            if len(h) <= self.lookahead * 2:
+                continue
+            # Candidate is `lookahead` frames back so we can see both sides of the peak.
+            idx = len(h) - 1 - self.lookahead
+            cand = h[idx]
+            frame_no = self.frame - 1 - self.lookahead
+            if frame_no - self.last_onset < self.min_gap:
+                continue
+            lo = max(0, idx - self.lookahead)
+            if cand < max(islice(h, lo, None)):
+                continue
+            threshold = self.multiplier * float(np.median(h)) + self.delta
+            if cand < threshold:
+                continue
+            self.last_onset = frame_no
+            onsets.append((self.frame_time(frame_no), cand))
+        return onsets
+
+    def frame_time(self, frame_no: int) -> float:
+        """Stream time (s) of the centre of onset-strength frame `frame_no`."""
+        # Frame 0 starts `window - hop` samples before the stream (zero padding).
+        return (frame_no * self.hop + self.hop - self.window / 2) / self.rate
+
+
+class BeatTracker:
+    """Tempo from onset-strength autocorrelation, beat phase from folding the same history.
+
+    Onsets within `tolerance` periods of the predicted beat grid count as beats;
+    `due()` emits the predicted beat itself when no onset has confirmed it yet,
+    for at most `max_coast` beats in a row.
+    """
+
+    def __init__(
+        self,
+        frame_s: float,
+        min_bpm: float = 60.0,
+        max_bpm: float = 200.0,
+        history_s: float = 6.0,
+        offset_s: float = 0.0,
+        tolerance: float = 0.2,
+        max_coast: int = 4,
+    ) -> None:
+        self.frame_s = frame_s
+        self.offset_s = offset_s  # time of onset-strength frame 0
+        self.tolerance = tolerance
+        self.max_coast = max_coast
+        self.env: Deque[float] = deque(maxlen=int(history_s / frame_s))
+        self.min_lag = int(60.0 / max_bpm / frame_s)
+        self.max_lag = int(60.0 / min_bpm / frame_s)
+        lags = np.arange(self.min_lag, self.max_lag + 1)
+        # Log-Gaussian prior around 120 BPM keeps octave errors down.
+        self.prior = np.exp(-0.5 * (np.log2(lags * frame_s / 0.5) / 1.0) ** 2)
+        self.period: Optional[float] = None
+        self.anchor: Optional[float] = None  # time of one beat on the current grid
+        self.last_beat: Optional[float] = None
+        self.coasting = 0
+        self.frames = 0
+        self._since_tempo = 0
+
+    def feed(self, strengths: np.ndarray) -> None:
+        self.env.extend(float(v) for v in strengths)
+        self.frames += len(strengths)
+        self._since_tempo += len(strengths)
+        if self._since_tempo * self.frame_s >= 1.0 and len(self.env) > 2 * self.max_lag:
+            self._since_tempo = 0
+            self._estimate()
+
+    def _estimate(self) -> None:
+        raw = np.fromiter(self.env, dtype=np.float64)
+        x = raw - raw.mean()
+        spec = np.fft.rfft(x, n=2 * len(x))
+        ac = np.fft.irfft(spec * np.conj(spec))[: self.max_lag + 2]
+        scores = ac[self.min_lag:self.max_lag + 1] * self.prior
+        if scores.max() <= 0:
+            return
+        lag = self.min_lag + int(np.argmax(scores))
+        a, b, c = ac[lag - 1], ac[lag], ac[lag + 1]
+        shift = float(0.5 * (a - c) / (a - 2 * b + c)) if a - 2 * b + c < 0 else 0.0
+        self.period = (lag + shift) * self.frame_s
+        if self.anchor is None or self.coasting:
+            # Phase: fold whole periods of strength and take the strongest offset.
+            n = (len(raw) // lag) * lag
+            folded = raw[len(raw) - n:].reshape(-1, lag).sum(axis=0)
+            self.anchor = self.offset_s + (self.frames - n + int(np.argmax(folded))) * self.frame_s
+
+    @property
+    def bpm(self) -> Optional[float]:
+        return 60.0 / self.period if self.period else None
+
+    def _nearest(self, t: float) -> float:
+        return self.anchor + round((t - self.anchor) / self.period) * self.period
+
+    def onset(self, t: float) -> Optional[Tuple[float, Optional[float]]]:
+        """Decide whether an onset at `t` is a beat; returns (beat_time, next_beat_time)."""
+        if self.period is None or self.anchor is None:
+            if self.last_beat is not None and t - self.last_beat < 0.3:
+                return None
+            self.last_beat = t
+            return t, None
+        if abs(t - self._nearest(t)) > self.tolerance * self.period:
+            return None
+        self.anchor = t  # an observed beat re-anchors the grid
+        self.coasting = 0
+        if self.last_beat is not None and t - self.last_beat < 0.6 * self.period:
+            # Already flashed (predicted) for this beat; keep the correction only.
+            self.last_beat = t
+            return None
+        self.last_beat = t
+        return t, t + self.period
+
+    def next_beat(self) -> Optional[float]:
+        if self.period is None or self.anchor is None:
+            return None
+        after = self.last_beat if self.last_beat is not None else self.anchor - self.period
+        nxt = self._nearest(after + self.period)
+        return nxt if nxt > after + 0.6 * self.period else nxt + self.period
+
+    def due(self, now: float) -> Optional[float]:
+        """Predicted beat time once `now` reaches it unconfirmed; None otherwise."""
+        nxt = self.next_beat()
+        if nxt is None or now < nxt:
+            return None
+        self.last_beat = nxt
+        if self.coasting >= self.max_coast:
+            return None  # lost the beat (silence, break): stop flashing until onsets return
+        self.coasting += 1
+        return nxt
+
+
+def track(det: OnsetDetector, tracker: BeatTracker, block: np.ndarray) -> List[Tuple[float, float, bool]]:
+    """Beats for one audio block as (time_s, strength, predicted).
+
+    Onset-confirmed beats are reported when the detector sees them; predicted
+    ones as soon as the stream passes the tracker's next-beat estimate, which
+    is earlier than the onset path by the detector's lookahead.
+    """
+    onsets = det.process(block)
+    tracker.feed(det.last_strengths)
+    beats = []
+    for t, strength in onsets:
+        hit = tracker.onset(t)
+        if hit:
+            beats.append((hit[0], strength, False))
+    predicted = tracker.due(det.frame_time(det.frame))
+    if predicted is not None:
+        beats.append((predicted, 0.0, True))
+    return beats
+
+
+def detect_file(path: str, hop: int = 256, window: int = 1024) -> Tuple[List[float], float, float]:
+    """Run detector + tracker over a WAV file as fast as possible.
+
+    Returns (beat_times, audio_seconds, processing_seconds).
+    """
+    with wave.open(path, "rb") as wf:
+        rate = wf.getframerate()
+        channels = wf.getnchannels()
+        width = wf.getsampwidth()
+        frames = wf.getnframes()
+        raw = wf.readframes(frames)
+    samples = _pcm_to_float(raw, width, channels)
+    det = OnsetDetector(rate, window=window, hop=hop)
+    tracker = BeatTracker(det.frame_s, offset_s=det.frame_time(0))
+    beats: List[float] = []
+    block = hop * 4
+    t0 = time.perf_counter()
+    for i in range(0, len(samples), block):
+        beats.extend(t for t, _, _ in track(det, tracker, samples[i:i + block]))
+    elapsed = time.perf_counter() - t0
+    return beats, len(samples) / rate, elapsed
+
+
+def score(detected: Sequence[float], reference: Sequence[float], tolerance: float = BENCH_TOLERANCE_S) -> Tuple[float, float, float]:
+    """Precision, recall and F-measure with one-to-one matching inside `tolerance`."""
+    ref = sorted(reference)
+    used = [False] * len(ref)
+    hits = 0
+    j = 0
+    for t in sorted(detected):
+        while j < len(ref) and ref[j] < t - tolerance:
+            j += 1
+        k = j
+        while k < len(ref) and ref[k] <= t + tolerance:
+            if not used[k]:
+                used[k] = True
+                hits += 1
+                break
+            k += 1
+    precision = hits / len(detected) if detected else 0.0
+    recall = hits / len(ref) if ref else 0.0
+    f = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return precision, recall, f
+
+
+def load_labels(path: str) -> List[float]:
+    out = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            parts = line.replace(",", " ").split()
+            if parts and not parts[0].startswith("#"):
+                out.append(float(parts[0]))
+    return out
+
+
+def bench(pairs: Sequence[Tuple[str, str]], tolerance: float = BENCH_TOLERANCE_S) -> int:
+    total_audio = total_cpu = 0.0
+    fs: List[float] = []
+    for wav_path, label_path in pairs:
+        beats, audio_s, cpu_s = detect_file(wav_path)
+        p, r, f = score(beats, load_labels(label_path), tolerance)
+        fs.append(f)
+        total_audio += audio_s
+        total_cpu += cpu_s
+        print(f"{os.path.basename(wav_path)}: P={p:.3f} R={r:.3f} F={f:.3f} beats={len(beats)} "
+              f"audio={audio_s:.1f}s cpu={cpu_s * 1000:.1f}ms ({audio_s / max(cpu_s, 1e-9):.0f}x realtime)")
+    if fs:
+        print(f"mean F={sum(fs) / len(fs):.3f} over {len(fs)} files; "
+              f"{total_audio / max(total_cpu, 1e-9):.0f}x realtime overall")
+    return 0
+
+
+def run_live(source, rate: int, segments: Sequence[str], publisher: Optional[LevelPublisher], hop: int = 256) -> None:
+    det = OnsetDetector(rate, hop=hop)
+    tracker = BeatTracker(det.frame_s, offset_s=det.frame_time(0))
+    t_start = time.monotonic()
+    worst_ms = 0.0
+    for block in source.blocks():
+        t0 = time.perf_counter()
+        for t, strength, predicted in track(det, tracker, block):
+            if publisher is not None:
+                for seg in segments:
+                    publisher.send_beat(seg)
+            bpm = f"{tracker.bpm:.1f}" if tracker.bpm else "?"
+            nxt = tracker.next_beat()
+            nxt = f"{nxt:.2f}s" if nxt else "?"
+            how = "predicted" if predicted else f"strength={strength:.2f}"
+            print(f"[beat] t={t:.2f}s {how} bpm={bpm} next={nxt} "
+                  f"wall={time.monotonic() - t_start:.2f}s", flush=True)
+        worst_ms = max(worst_ms, (time.perf_counter() - t0) * 1000.0)
+    print(f"[beat] done; worst block processing {worst_ms:.2f}ms", flush=True)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Spectral-flux beat detection for mic_beat flashes")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    run_p = sub.add_parser("run", help="Detect beats live and flash segments")
+    src = run_p.add_mutually_exclusive_group(required=True)
+    src.add_argument("--wav", help="WAV file stand-in for live capture")
+    src.add_argument("--alsa", help="ALSA capture device, e.g. plughw:1,0")
+    run_p.add_argument("--sample-rate", type=int, default=16000)
+    run_p.add_argument("--hop", type=int, default=256)
+    run_p.add_argument("--segment", action="append", default=[], help="Segment to flash (repeatable)")
+    run_p.add_argument("--dry-run", action="store_true")
+    run_p.add_argument("--host", default=DEFAULT_HOST)
+    run_p.add_argument("--port", type=int, default=DEFAULT_PORT)
+    run_p.add_argument("--topic", default=DEFAULT_TOPIC)
+    run_p.add_argument("--username", default=os.getenv("MQTT_USER"))
+    run_p.add_argument("--password", default=os.getenv("MQTT_PASS"))
+
+    bench_p = sub.add_parser("bench", help="Score detections against annotated WAV files")
+    bench_p.add_argument("files", nargs="+", help="wav labels [wav labels ...]")
+    bench_p.add_argument("--tolerance", type=float, default=BENCH_TOLERANCE_S)
+
+    args = parser.parse_args(argv)
+    if args.cmd == "bench":
+        if len(args.files) % 2:
+            parser.error("bench expects pairs of: wav labels")
+        pairs = list(zip(args.files[::2], args.files[1::2]))
+        return bench(pairs, args.tolerance)
+
+    if args.wav:
+        source = WavSource(args.wav, args.hop * 4)
+        rate = source.rate
+    else:
+        rate = args.sample_rate
+        source = AlsaSource(args.alsa, rate, args.hop * 4)
+    publisher = None
+    if not args.dry_run:
+        publisher = LevelPublisher(args.host, args.port, args.topic, args.username, args.password)
+    try:
+        run_live(source, rate, args.segment or ["strip1"], publisher, hop=args.hop)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if publisher is not None:
+            publisher.close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,395 @@
+"""
+Capture outbound commands and replay them on their original timeline.
+
+- While a capture runs, every command `led_web.py` publishes (after dedupe,
+  before the outbox) is appended to a `.ledcap` file with a monotonic
+  nanosecond timestamp, its topic and its kind (which picks the QoS).
+- Captures go to captures/ in led_shared.state_dir() unless LED_CAPTURE_DIR
+  says otherwise; the CLI takes a file path or a capture name from there.
+- Start/stop is a small control file in the capture directory, so every
+  worker under led_serve.py records into the same file; a worker looks at
+  it at most every `check_interval` seconds.
+- `Replayer` publishes a capture at the original pace, scaled by `speed`
+  (2 = twice as fast) or as fast as possible (`speed=0`), between `start` and
+  `end` seconds, optionally looping; `seek()` jumps while it plays.
+- Every message's scheduling error (sent - planned) and send time are kept,
+  and reported as p50/p95/p99/max. That makes a replay a load generator for
+  the publish path too.
+File layout (little-endian):
+    header  magic "LEDC", version u16, reserved u16, started_at f64 (unix), start monotonic ns u64
+    record  body length u32, offset ns u64 (from start), kind u8, topic length u8, topic, body
+CLI:
+    python led_capture.py info show
+    python led_capture.py replay show --speed 2 --loop --start 30 --end 90
+    python led_capture.py replay path/to/show.ledcap --speed 0     # as fast as possible
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import re
+import struct
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter as Tally, deque
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+from led_metrics import REGISTRY
+from led_shared import state_dir
+
+MAGIC = b"LEDC"
+VERSION = 1
+HEADER = struct.Struct("<4sHHdQ")
+REC = struct.Struct("<IQBB")
+KINDS = ("command", "preset", "stream", "retained")
+KIND_CODES = {kind: i for i, kind in enumerate(KINDS)}
+# QoS per kind when replaying outside led_web.py (matches its defaults).
+DEFAULT_QOS = {"command": 1, "preset": 1, "stream": 0, "retained": 1}
+
+CAPTURED = REGISTRY.counter("led_capture_messages_total", "Outbound messages written to a capture")
+REPLAY_LATENESS = REGISTRY.histogram(
+    "led_replay_lateness_seconds", "Replayed message sent after its planned time",
+    buckets=(0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0),
+)
+
+Message = Tuple[float, str, str, bytes]  # seconds from capture start, topic, kind, body
+Sender = Callable[[str, bytes, str], None]
+
+
+def default_dir() -> str:
+    return os.path.join(state_dir(), "captures")
+
+
+def _name(text: Optional[str]) -> str:
+    name = re.sub(r"[^A-Za-z0-9_.-]+", "-", (text or "").strip()).strip(".-")
+    return name or time.strftime("capture-%Y%m%d-%H%M%S")
+
+
+class Capture:
+    """Recording side; start/stop state is shared by all workers through `<dir>/active.json`."""
+
+    def __init__(self, directory: str, check_interval: float = 0.25) -> None:
+        self.dir = directory
+        self.control = os.path.join(directory, "active.json")
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._checked = 0.0
+        self._stamp: Optional[Tuple[int, int, int]] = None
+        self._active: Optional[Dict] = None
+        self._fd: Optional[int] = None
+
+    def _refresh(self, now: float) -> None:
+        if now - self._checked < self.check_interval:
+            return
+        self._checked = now
+        try:
+            st = os.stat(self.control)
+            stamp: Optional[Tuple[int, int, int]] = (st.st_mtime_ns, st.st_size, st.st_ino)
+        except OSError:
+            stamp = None
+        if stamp == self._stamp:
+            return
+        self._stamp = stamp
+        if self._fd is not None:
+            os.close(self._fd)
+        self._fd, self._active = None, None
+        if stamp is None:
+            return
+        try:
+            with open(self.control, "r", encoding="utf-8") as f:
+                active = json.load(f)
+            self._fd = os.open(active["path"], os.O_WRONLY | os.O_APPEND)
+            self._active = active
+        except (OSError, ValueError, KeyError) as exc:
+            print(f"capture: cannot follow {self.control}: {exc}")
+
+    def active(self) -> Optional[Dict]:
+        with self._lock:
+            self._refresh(time.monotonic())
+            return dict(self._active) if self._active else None
+
+    def record(self, messages: List[Tuple[str, bytes]], kind: str) -> bool:
+        """Append `messages` if a capture is running; False when none is."""
+        with self._lock:
+            self._refresh(time.monotonic())
+            if self._fd is None:
+                return False
+            offset = time.monotonic_ns() - self._active["start_ns"]
+            code = KIND_CODES.get(kind, 0)
+            out = bytearray()
+            for topic, body in messages:
+                raw = topic.encode()[:255]
+                out += REC.pack(len(body), offset, code, len(raw)) + raw + body
+            try:
+                # One write per batch: O_APPEND keeps workers' records whole.
+                os.write(self._fd, bytes(out))
+            except OSError as exc:
+                print(f"capture write failed: {exc}")
+                return False
+        CAPTURED.inc(len(messages))
+        return True
+
+    def start(self, name: Optional[str] = None) -> Dict:
+        os.makedirs(self.dir, exist_ok=True)
+        if os.path.exists(self.control):
+            raise ValueError("a capture is already running")
+        path = os.path.join(self.dir, _name(name) + ".ledcap")
+        active = {"name": os.path.basename(path)[:-7], "path": path, "started_at": time.time(),
+                  "start_ns": time.monotonic_ns()}
+        with open(path, "xb") as f:  # never overwrite an earlier capture
+            f.write(HEADER.pack(MAGIC, VERSION, 0, active["started_at"], active["start_ns"]))
+        tmp = f"{self.control}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(active, f)
+        os.replace(tmp, self.control)
+        self._checked = 0.0
+        return active
+
+    def stop(self) -> Optional[Dict]:
+        """Stop the running capture (in all workers); returns its summary."""
+        try:
+            with open(self.control, "r", encoding="utf-8") as f:
+                active = json.load(f)
+            os.remove(self.control)
+        except (OSError, ValueError):
+            return None
+        self._checked = 0.0
+        return info(active["path"])
+
+    def files(self) -> List[Dict]:
+        try:
+            names = sorted(n for n in os.listdir(self.dir) if n.endswith(".ledcap"))
+        except OSError:
+            return []
+        return [{"name": n[:-7], "bytes": os.path.getsize(os.path.join(self.dir, n))} for n in names]
+
+    def path(self, name: str) -> str:
+        path = os.path.join(self.dir, _name(name) + ".ledcap")
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"no capture named {name!r}")
+        return path
+
+
+# Reading -----------------------------------------------------------------------
+def load(path: str) -> Tuple[Dict, List[Message]]:
+    """(header, messages sorted by time); a record cut off at the end is ignored."""
+    with open(path, "rb") as f:
+        data = f.read()
+    if len(data) < HEADER.size:
+        raise ValueError(f"{path} is not a capture file")
+    magic, version, _, started_at, start_ns = HEADER.unpack_from(data, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"{path} is not a version-{VERSION} capture file")
+    messages: List[Message] = []
+    offset = HEADER.size
+    while offset + REC.size <= len(data):
+        length, at_ns, code, topic_len = REC.unpack_from(data, offset)
+        start = offset + REC.size
+        end = start + topic_len + length
+        if end > len(data):
+            break
+        topic = data[start:start + topic_len].decode("utf-8", "replace")
+        kind = KINDS[code] if code < len(KINDS) else "command"
+        messages.append((at_ns / 1e9, topic, kind, data[start + topic_len:end]))
+        offset = end
+    # Workers append independently, so their batches can land slightly out of order.
+    messages.sort(key=lambda m: m[0])
+    return {"started_at": started_at, "start_ns": start_ns}, messages
+
+
+def info(path: str) -> Dict:
+    header, messages = load(path)
+    return {
+        "name": os.path.basename(path)[:-7],
+        "started_at": header["started_at"],
+        "messages": len(messages),
+        "duration": round(messages[-1][0], 3) if messages else 0.0,
+        "bytes": sum(len(m[3]) for m in messages),
+        "topics": dict(Tally(m[1] for m in messages)),
+        "kinds": dict(Tally(m[2] for m in messages)),
+    }
+
+
+# Replay ------------------------------------------------------------------------
+def _percentiles(values: Deque[float]) -> Dict[str, float]:
+    if not values:
+        return {}
+    ordered = sorted(values)
+
+    def pick(q: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))] * 1000.0, 3)
+
+    return {"p50": pick(0.5), "p95": pick(0.95), "p99": pick(0.99), "max": round(ordered[-1] * 1000.0, 3)}
+
+
+class Replayer:
+    def __init__(
+        self,
+        messages: List[Message],
+        send: Sender,
+        speed: float = 1.0,
+        start: float = 0.0,
+        end: Optional[float] = None,
+        loop: bool = False,
+        on_done: Optional[Callable[["Replayer"], None]] = None,
+        keep: int = 100000,
+    ) -> None:
+        """`speed` 0 sends as fast as possible; `keep` bounds the timing samples held for the report."""
+        self.messages = messages
+        self.send = send
+        self.speed = max(0.0, speed)
+        self.start_at = max(0.0, start)
+        self.end_at = end
+        self.loop = loop
+        self.on_done = on_done
+        self._times = [m[0] for m in messages]
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._seek: Optional[float] = None
+        self._thread: Optional[threading.Thread] = None
+        self.state = "ready"
+        self.position = self.start_at
+        self.sent = 0
+        self.errors = 0
+        self.loops = 0
+        self.last_error: Optional[str] = None
+        self.lateness: Deque[float] = deque(maxlen=keep)
+        self.send_times: Deque[float] = deque(maxlen=keep)
+        self._began = 0.0
+        self._finished = 0.0
+
+    def _range(self) -> Tuple[int, int]:
+        last = len(self.messages) if self.end_at is None else bisect_left(self._times, self.end_at)
+        return bisect_left(self._times, self.start_at), last
+
+    def run(self) -> Dict:
+        """Play (blocking) until the end, or `stop()`; returns the report."""
+        self.state = "playing"
+        self._began = time.perf_counter()
+        first, last = self._range()
+        i, anchor_t, anchor = first, self.start_at, time.perf_counter()
+        while not self._stop.is_set():
+            if self._seek is not None:
+                anchor_t, self._seek = self._seek, None
+                i, anchor = bisect_left(self._times, anchor_t), time.perf_counter()
+                self._wake.clear()
+            if i >= last:
+                if not self.loop or first >= last:
+                    break
+                self.loops += 1
+                if self.speed:
+                    # Keep the loop period (up to `end`) so lateness does not accumulate.
+                    loop_end = self.end_at if self.end_at is not None else self._times[last - 1]
+                    anchor += (loop_end - anchor_t) / self.speed
+                i, anchor_t = first, self.start_at
+                continue
+            at, topic, kind, body = self.messages[i]
+            planned = anchor + (at - anchor_t) / self.speed if self.speed else time.perf_counter()
+            delay = planned - time.perf_counter()
+            if delay > 0 and self._wake.wait(delay):
+                continue  # seek or stop: re-plan
+            begin = time.perf_counter()
+            late = max(0.0, begin - planned)
+            self.lateness.append(late)
+            REPLAY_LATENESS.observe(late)
+            try:
+                self.send(topic, body, kind)
+                self.sent += 1
+            except Exception as exc:
+                self.errors += 1
+                self.last_error = str(exc)
+            self.send_times.append(time.perf_counter() - begin)
+            self.position = at
+            i += 1
+        self._finished = time.perf_counter()
+        self.state = "stopped" if self._stop.is_set() else "done"
+        if self.on_done is not None:
+            self.on_done(self)
+        return self.report()
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self.run, name="led-replay", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wake.set()
+
+    def seek(self, position: float) -> None:
+        """Continue from `position` seconds into the capture."""
+        self._seek = max(0.0, position)
+        self._wake.set()
+
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def report(self) -> Dict:
+        elapsed = (self._finished or time.perf_counter()) - self._began if self._began else 0.0
+        return {
+            "state": self.state,
+            "position": round(self.position, 3),
+            "speed": self.speed or "max",
+            "loop": self.loop,
+            "loops": self.loops,
+            "sent": self.sent,
+            "errors": self.errors,
+            "last_error": self.last_error,
+            "elapsed": round(elapsed, 3),
+            "rate": round(self.sent / elapsed, 1) if elapsed else 0.0,
+            "lateness_ms": _percentiles(self.lateness),
+            "send_ms": _percentiles(self.send_times),
+        }
+
+
+def main(argv: Optional[list] = None) -> int:
+    parser = argparse.ArgumentParser(description="Inspect or replay a command capture")
+    sub = parser.add_subparsers(dest="command", required=True)
+    info_p = sub.add_parser("info", help="Summarize a capture")
+    info_p.add_argument("path", help="Capture file, or a capture name in LED_CAPTURE_DIR")
+    play = sub.add_parser("replay", help="Publish a capture to the broker")
+    play.add_argument("path", help="Capture file, or a capture name in LED_CAPTURE_DIR")
+    play.add_argument("--speed", type=float, default=1.0, help="Time scale (2 = twice as fast, 0 = as fast as possible)")
+    play.add_argument("--start", type=float, default=0.0, help="Seconds into the capture to start from")
+    play.add_argument("--end", type=float, help="Seconds into the capture to stop at")
+    play.add_argument("--loop", action="store_true", help="Start over at the end (Ctrl-C to stop)")
+    play.add_argument("--host", default=os.getenv("MQTT_HOST", "10.42.0.1"))
+    play.add_argument("--port", type=int, default=int(os.getenv("MQTT_PORT", "1883")))
+    play.add_argument("--username", default=os.getenv("MQTT_USER"))
+    play.add_argument("--password", default=os.getenv("MQTT_PASS"))
+    play.add_argument("--qos", type=int, choices=(0, 1), help="Override the per-kind QoS")
+    args = parser.parse_args(argv)
+    if not os.path.exists(args.path):
+        try:
+            args.path = Capture(os.getenv("LED_CAPTURE_DIR") or default_dir()).path(args.path)
+        except FileNotFoundError as exc:
+            print(exc)
+            return 1
+    if args.command == "info":
+        print(json.dumps(info(args.path), indent=2))
+        return 0
+
+    from led_mqtt import Publisher
+
+    _, messages = load(args.path)
+    publisher = Publisher(args.host, args.port, args.username, args.password, client_id="led-replay", connect_wait=5.0)
+
+    def send(topic: str, body: bytes, kind: str) -> None:
+        qos = args.qos if args.qos is not None else DEFAULT_QOS.get(kind, 1)
+        publisher.send([(topic, body)], qos=qos, kind=kind, retain=kind == "retained")
+
+    replayer = Replayer(messages, send, args.speed, args.start, args.end, args.loop)
+    try:
+        report = replayer.run()
+    except KeyboardInterrupt:
+        replayer.stop()
+        replayer.state = "stopped"
+        report = replayer.report()
+    publisher.close()
+    print(json.dumps(report, indent=2))
+    return 1 if report["errors"] else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
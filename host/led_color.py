@@ -0,0 +1,146 @@
+"""
+Precomputed color tables shared by the web UI, renderers and palette tools.
+
+- Kelvin -> RGB at 1 K steps (1500-9000 K), same curve the white-balance slider used.
+- Gamma tables (256 entries per gamma value, cached).
+- The firmware's 256-entry `wheel()` and its `lerp_color` / `scale_color`
+  truncation, so host previews match the strip pixel for pixel.
+- Gradient ramps (low -> mid -> high, as `mic_vu` draws them), cached per length.
+Scalar helpers return plain lists for JSON; `*_array` variants take and return
+NumPy arrays for whole-frame conversion.
+"""
+from __future__ import annotations
+
+from functools import lru_cache
+from typing import List, Sequence
+
+import numpy as np
+
+KELVIN_MIN = 1500
+KELVIN_MAX = 9000
+DEFAULT_GAMMA = 2.2
+
+RGB = Sequence[int]
+
+
+def _kelvin_curve(kelvin: np.ndarray) -> np.ndarray:
+    """Tanner Helland's blackbody approximation, vectorized."""
+    tmp = kelvin.astype(np.float64) / 100.0
+    warm = tmp <= 66
+    red = np.where(warm, 255.0, 329.698727446 * np.power(np.maximum(tmp - 60, 1e-9), -0.1332047592))
+    green = np.where(
+        warm,
+        99.4708025861 * np.log(tmp) - 161.1195681661,
+        288.1221695283 * np.power(np.maximum(tmp - 60, 1e-9), -0.0755148492),
+    )
+    blue = np.where(
+        warm,
+        np.where(tmp <= 19, 0.0, 138.5177312231 * np.log(np.maximum(tmp - 10, 1e-9)) - 305.0447927307),
+        255.0,
+    )
+    rgb = np.stack([red, green, blue], axis=-1)
+    return np.clip(rgb, 0, 255).astype(np.uint8)
+
+
+def _wheel_table() -> np.ndarray:
+    table = np.zeros((256, 3), dtype=np.uint8)
+    for i in range(256):
+        pos = 255 - i
+        if pos < 85:
+            table[i] = (255 - pos * 3, 0, pos * 3)
+        elif pos < 170:
+            pos -= 85
+            table[i] = (0, pos * 3, 255 - pos * 3)
+        else:
+            pos -= 170
+            table[i] = (pos * 3, 255 - pos * 3, 0)
+    return table
+
+
+KELVIN_TABLE = _kelvin_curve(np.arange(KELVIN_MIN, KELVIN_MAX + 1))
+KELVIN_TABLE.setflags(write=False)
+WHEEL_TABLE = _wheel_table()
+WHEEL_TABLE.setflags(write=False)
+# Plain-list copies for the scalar helpers (no NumPy scalar overhead per call).
+_KELVIN_ROWS = [tuple(row) for row in KELVIN_TABLE.tolist()]
+_WHEEL_ROWS = [tuple(row) for row in WHEEL_TABLE.tolist()]
+
+
+@lru_cache(maxsize=8)
+def gamma_table(gamma: float = DEFAULT_GAMMA) -> np.ndarray:
+    table = np.round(255.0 * (np.arange(256) / 255.0) ** gamma).astype(np.uint8)
+    table.setflags(write=False)
+    return table
+
+
+def _kelvin_index(kelvin) -> np.ndarray:
+    k = np.clip(np.rint(np.asarray(kelvin, dtype=np.float64)), KELVIN_MIN, KELVIN_MAX)
+    return k.astype(np.intp) - KELVIN_MIN
+
+
+def kelvin_to_rgb(kelvin: float) -> List[int]:
+    """Color temperature (clamped to 1500-9000 K) to an RGB triplet."""
+    k = int(round(min(KELVIN_MAX, max(KELVIN_MIN, float(kelvin)))))
+    return list(_KELVIN_ROWS[k - KELVIN_MIN])
+
+
+def kelvin_to_rgb_array(kelvin) -> np.ndarray:
+    """Array of temperatures -> (..., 3) uint8."""
+    return KELVIN_TABLE[_kelvin_index(kelvin)]
+
+
+def wheel(pos: int) -> List[int]:
+    """Firmware `wheel()`: 0-255 around the rainbow."""
+    return list(_WHEEL_ROWS[int(pos) & 0xFF])
+
+
+def wheel_array(pos) -> np.ndarray:
+    return WHEEL_TABLE[np.asarray(pos, dtype=np.intp) & 0xFF]
+
+
+def gamma_correct(rgb: RGB, gamma: float = DEFAULT_GAMMA) -> List[int]:
+    table = gamma_table(gamma)
+    return [int(table[int(c)]) for c in rgb]
+
+
+def gamma_correct_array(colors, gamma: float = DEFAULT_GAMMA) -> np.ndarray:
+    return gamma_table(gamma)[np.asarray(colors, dtype=np.uint8)]
+
+
+def lerp_colors(a: RGB, b: RGB, t) -> np.ndarray:
+    """Firmware `lerp_color` for an array of t (clamped 0..1, truncated like the uint8 cast)."""
+    t = np.clip(np.asarray(t, dtype=np.float32), 0.0, 1.0)[..., None]
+    a = np.asarray(a, dtype=np.float32)
+    b = np.asarray(b, dtype=np.float32)
+    return (a + (b - a) * t).astype(np.uint8)
+
+
+def lerp_color(a: RGB, b: RGB, t: float) -> List[int]:
+    return lerp_colors(a, b, t).tolist()
+
+
+def scale_colors(colors, brightness: float) -> np.ndarray:
+    """Firmware `scale_color`: brightness on the 0-255 scale, truncating."""
+    k = np.float32(min(1.0, max(0.0, brightness / 255.0)))
+    return (np.asarray(colors, dtype=np.float32) * k).astype(np.uint8)
+
+
+@lru_cache(maxsize=64)
+def _ramp(low: tuple, mid: tuple, high: tuple, length: int) -> np.ndarray:
+    t = np.arange(length, dtype=np.float32) / (length - 1) if length > 1 else np.zeros(1, dtype=np.float32)
+    first = t < 0.5
+    ramp = np.where(first[:, None], lerp_colors(low, mid, t * 2.0), lerp_colors(mid, high, (t - 0.5) * 2.0))
+    ramp.setflags(write=False)
+    return ramp
+
+
+def gradient_ramp(low: RGB, mid: RGB, high: RGB, length: int) -> np.ndarray:
+    """(length, 3) uint8 gradient as the firmware draws `mic_vu` with gradient_enabled."""
+    return _ramp(tuple(int(c) for c in low), tuple(int(c) for c in mid), tuple(int(c) for c in high), int(length))
+
+
+def rainbow_positions(length: int, waves: float, phase: float) -> np.ndarray:
+    """Wheel positions for the firmware `rainbow` pattern at a given phase."""
+    waves = max(1.0, waves)
+    i = np.arange(length, dtype=np.float64)
+    return (np.floor(i * 256 * waves / length).astype(np.int64) + (int(phase) & 0xFFFF)) & 0xFF
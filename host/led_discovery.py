@@ -0,0 +1,312 @@
+"""
+Device discovery index over DHCP leases and the kernel neighbour table.
+
+- Lease files (dnsmasq `<expiry> <mac> <ip> <hostname> <client-id>` lines or
+  ISC dhcpd `lease <ip> { ... }` blocks) are re-parsed only when their mtime or
+  size changes; leases whose expiry has passed are left out of the index.
+- `/proc/net/arp` has no meaningful mtime (procfs reports "now"), so it is
+  read at most every `arp_ttl` seconds and re-parsed only when its bytes differ.
+- Devices are indexed by MAC, IP and hostname; `esp_devices()` lists every
+  device whose hostname matches `pattern` (those first) or whose MAC has an
+  Espressif prefix, each group in lease-file order, then neighbour-only.
+- A MAC seen at a new IP is recorded as a move (`moves()`) and passed to
+  listeners, e.g. to follow an ESP that got a different lease.
+CLI (works on fixture files too):
+    python led_discovery.py [--lease FILE ...] [--arp FILE] [--watch]
+"""
+from __future__ import annotations
+
+import argparse
+import calendar
+import json
+import os
+import re
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional, Sequence, Tuple
+
+DEFAULT_LEASE_FILES = ("/var/lib/misc/dnsmasq.leases", "/var/lib/NetworkManager/dnsmasq-wlan1.leases")
+DEFAULT_ARP_PATH = "/proc/net/arp"
+ESP_PATTERN = r"esp"
+# Espressif MAC prefixes, so neighbour-table entries without a hostname still count.
+ESPRESSIF_OUIS = (
+    "24:0a:c4", "24:6f:28", "30:ae:a4", "34:85:18", "3c:71:bf", "7c:9e:bd", "7c:df:a1", "84:0d:8e",
+    "8c:aa:b5", "94:b9:7e", "a4:cf:12", "ac:67:b2", "c8:2b:96", "e8:db:84", "f4:12:fa",
+)
+ARP_COMPLETE = 0x2
+ISC_LEASE = re.compile(r"lease\s+(\S+)\s*\{(.*?)\}", re.DOTALL)
+
+# (mac, hostname, old ip, new ip)
+MoveListener = Callable[[str, str, str, str], None]
+
+
+class Device:
+    __slots__ = ("mac", "ip", "hostname", "source", "expires", "order")
+
+    def __init__(self, mac: str, ip: str, hostname: str, source: str, expires: int = 0, order: int = 0) -> None:
+        self.mac = mac
+        self.ip = ip
+        self.hostname = hostname
+        self.source = source
+        self.expires = expires
+        self.order = order
+
+    def as_dict(self) -> Dict:
+        return {"mac": self.mac, "ip": self.ip, "hostname": self.hostname, "source": self.source,
+                "expires": self.expires or None}
+
+
+def parse_leases(text: str, source: str) -> List[Device]:
+    """Devices from a dnsmasq or ISC dhcpd lease file; expiry 0 means no expiry."""
+    if ISC_LEASE.search(text):
+        return parse_isc_leases(text, source)
+    devices = []
+    for line in text.splitlines():
+        parts = line.split()
+        if len(parts) < 3:
+            continue
+        try:
+            expires = int(parts[0])
+        except ValueError:
+            expires = 0
+        hostname = parts[3] if len(parts) >= 4 and parts[3] != "*" else ""
+        devices.append(Device(parts[1].lower(), parts[2], hostname, source, expires, len(devices)))
+    return devices
+
+
+def _isc_time(value: str) -> int:
+    # "4 2026/10/19 12:00:00" (weekday, UTC) or "never"
+    parts = value.split()
+    if len(parts) < 3:
+        return 0
+    try:
+        return calendar.timegm(time.strptime(f"{parts[1]} {parts[2]}", "%Y/%m/%d %H:%M:%S"))
+    except ValueError:
+        return 0
+
+
+def parse_isc_leases(text: str, source: str) -> List[Device]:
+    """dhcpd.leases is append-only: the last block for an IP wins, non-active ones drop it."""
+    by_ip: Dict[str, Device] = {}
+    for ip, body in ISC_LEASE.findall(text):
+        fields: Dict[str, str] = {}
+        for statement in body.split(";"):
+            statement = statement.strip()
+            for key in ("hardware ethernet", "client-hostname", "binding state", "ends"):
+                if statement.startswith(key + " "):
+                    fields[key] = statement[len(key) + 1:].strip().strip('"')
+        by_ip.pop(ip, None)
+        if "hardware ethernet" not in fields or fields.get("binding state", "active") != "active":
+            continue
+        by_ip[ip] = Device(fields["hardware ethernet"].lower(), ip, fields.get("client-hostname", ""), source,
+                           _isc_time(fields.get("ends", "")))
+    devices = list(by_ip.values())
+    for i, dev in enumerate(devices):
+        dev.order = i
+    return devices
+
+
+def parse_arp(text: str) -> List[Device]:
+    devices = []
+    for line in text.splitlines()[1:]:
+        parts = line.split()
+        if len(parts) < 6:
+            continue
+        try:
+            complete = int(parts[2], 16) & ARP_COMPLETE
+        except ValueError:
+            continue
+        if complete and parts[3] != "00:00:00:00:00:00":
+            devices.append(Device(parts[3].lower(), parts[0], "", "arp", 0, len(devices)))
+    return devices
+
+
+class _Source:
+    __slots__ = ("path", "stamp", "raw", "checked", "devices")
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.stamp: Optional[Tuple[int, int]] = None
+        self.raw: Optional[bytes] = None
+        self.checked = 0.0
+        self.devices: List[Device] = []
+
+
+class DiscoveryIndex:
+    def __init__(
+        self,
+        lease_files: Sequence[str] = DEFAULT_LEASE_FILES,
+        arp_path: Optional[str] = DEFAULT_ARP_PATH,
+        pattern: str = ESP_PATTERN,
+        arp_ttl: float = 2.0,
+        max_moves: int = 50,
+    ) -> None:
+        self.pattern = re.compile(pattern, re.IGNORECASE)
+        self.arp_ttl = arp_ttl
+        self._leases = [_Source(p) for p in lease_files]
+        self._arp = _Source(arp_path) if arp_path else None
+        self._lock = threading.Lock()
+        self._by_mac: Dict[str, Device] = {}
+        self._by_ip: Dict[str, Device] = {}
+        self._by_host: Dict[str, Device] = {}
+        self._esp: List[Device] = []
+        self._last_lease_ip: Optional[str] = None
+        self._next_expiry = 0.0  # earliest future lease expiry in the index, 0 = none
+        self._moves: Deque[Dict] = deque(maxlen=max_moves)
+        self._listeners: List[MoveListener] = []
+        self.loads = 0
+
+    def add_listener(self, listener: MoveListener) -> None:
+        self._listeners.append(listener)
+
+    # Loading -------------------------------------------------------------------
+    def _load_lease(self, src: _Source) -> bool:
+        try:
+            st = os.stat(src.path)
+        except OSError:
+            changed, src.stamp, src.devices = src.stamp is not None, None, []
+            return changed
+        stamp = (st.st_mtime_ns, st.st_size)
+        if stamp == src.stamp:
+            return False
+        try:
+            with open(src.path, "r", encoding="utf-8", errors="replace") as f:
+                src.devices = parse_leases(f.read(), src.path)
+        except OSError:
+            src.devices = []
+        src.stamp = stamp
+        self.loads += 1
+        return True
+
+    def _load_arp(self, src: _Source, now: float) -> bool:
+        if now - src.checked < self.arp_ttl:
+            return False
+        src.checked = now
+        try:
+            with open(src.path, "rb") as f:
+                raw = f.read()
+        except OSError:
+            raw = b""
+        if raw == src.raw:
+            return False
+        src.raw = raw
+        src.devices = parse_arp(raw.decode("utf-8", "replace"))
+        self.loads += 1
+        return True
+
+    def refresh(self) -> bool:
+        """Reload changed sources and rebuild the index; returns True if anything changed."""
+        with self._lock:
+            changed = False
+            for src in self._leases:
+                changed |= self._load_lease(src)
+            if self._arp is not None:
+                changed |= self._load_arp(self._arp, time.monotonic())
+            if self._next_expiry and time.time() >= self._next_expiry:
+                changed = True
+            if not changed:
+                return False
+            moves = self._rebuild()
+        for mac, hostname, old, new in moves:
+            for listener in self._listeners:
+                try:
+                    listener(mac, hostname, old, new)
+                except Exception as exc:
+                    print(f"discovery listener failed: {exc}")
+        return True
+
+    def _rebuild(self) -> List[Tuple[str, str, str, str]]:
+        by_mac: Dict[str, Device] = {}
+        rank: Dict[str, Tuple[int, int]] = {}
+        last_lease_ip = None
+        now = time.time()
+        next_expiry = 0.0
+        for i, src in enumerate(self._leases):
+            for dev in src.devices:
+                if dev.expires:
+                    if dev.expires <= now:
+                        continue
+                    next_expiry = min(next_expiry or dev.expires, dev.expires)
+                by_mac[dev.mac] = dev
+                rank.setdefault(dev.mac, (i, dev.order))
+                last_lease_ip = dev.ip
+        for dev in self._arp.devices if self._arp is not None else []:
+            # Leases win: the neighbour table may still hold a device's previous IP.
+            if dev.mac not in by_mac:
+                by_mac[dev.mac] = dev
+                rank[dev.mac] = (len(self._leases), dev.order)
+        moves = []
+        for mac, dev in by_mac.items():
+            old = self._by_mac.get(mac)
+            if old is not None and old.ip != dev.ip:
+                moves.append((mac, dev.hostname or old.hostname, old.ip, dev.ip))
+                self._moves.append({"mac": mac, "hostname": dev.hostname or old.hostname, "old_ip": old.ip,
+                                    "new_ip": dev.ip, "at": now})
+        self._by_mac = by_mac
+        self._by_ip = {dev.ip: dev for dev in by_mac.values()}
+        self._by_host = {dev.hostname.lower(): dev for dev in by_mac.values() if dev.hostname}
+        named = {mac for mac, dev in by_mac.items() if dev.hostname and self.pattern.search(dev.hostname)}
+        esp = [dev for mac, dev in by_mac.items() if mac in named or mac[:8] in ESPRESSIF_OUIS]
+        # Hostname matches first; lease files in the order given, then neighbour-only entries.
+        self._esp = sorted(esp, key=lambda d: (d.mac not in named, rank[d.mac]))
+        self._last_lease_ip = last_lease_ip
+        self._next_expiry = next_expiry
+        return moves
+
+    # Lookups -------------------------------------------------------------------
+    def esp_devices(self) -> List[Device]:
+        self.refresh()
+        return list(self._esp)
+
+    def guess_esp_ip(self) -> Optional[str]:
+        """First ESP-looking device; else the last leased IP (the old fallback)."""
+        self.refresh()
+        return self._esp[0].ip if self._esp else self._last_lease_ip
+
+    def by_mac(self, mac: str) -> Optional[Device]:
+        self.refresh()
+        return self._by_mac.get(mac.lower())
+
+    def by_ip(self, ip: str) -> Optional[Device]:
+        self.refresh()
+        return self._by_ip.get(ip)
+
+    def by_hostname(self, hostname: str) -> Optional[Device]:
+        self.refresh()
+        return self._by_host.get(hostname.lower())
+
+    def moves(self) -> List[Dict]:
+        self.refresh()
+        return list(self._moves)
+
+    def status(self) -> Dict:
+        self.refresh()
+        return {
+            "devices": len(self._by_mac),
+            "esp": [dev.as_dict() for dev in self._esp],
+            "moves": list(self._moves),
+            "sources": [src.path for src in self._leases] + ([self._arp.path] if self._arp else []),
+            "loads": self.loads,
+        }
+
+
+def main(argv: Optional[list] = None) -> int:
+    parser = argparse.ArgumentParser(description="List ESP devices from DHCP leases and the ARP table")
+    parser.add_argument("--lease", action="append", help="Lease file (repeatable; default dnsmasq + NetworkManager)")
+    parser.add_argument("--arp", default=DEFAULT_ARP_PATH, help="Neighbour table ('' to skip)")
+    parser.add_argument("--pattern", default=ESP_PATTERN, help="Hostname regex for ESP devices")
+    parser.add_argument("--watch", action="store_true", help="Keep running and print IP changes")
+    args = parser.parse_args(argv)
+    index = DiscoveryIndex(args.lease or DEFAULT_LEASE_FILES, args.arp or None, args.pattern)
+    print(json.dumps(index.status(), indent=2))
+    if args.watch:
+        index.add_listener(lambda mac, host, old, new: print(f"{host or mac}: {old} -> {new}", flush=True))
+        while True:
+            time.sleep(1.0)
+            index.refresh()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
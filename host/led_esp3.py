@@ -0,0 +1,166 @@
+"""
+Command path for the camming ESP32U (`esp32u/command`).
+
+- `Esp3Driver` sends a full `set` (strip layout, target, pattern) only after
+  the ESP (re)connects, when the layout, pattern or target changes, or when
+  forced; brightness and white-balance changes are sent as small deltas that
+  the firmware applies on top of what it has.
+- Deltas pass through a latest-wins channel limited to `rate_hz`: a change
+  after a quiet period is sent at once, changes within the interval collapse
+  and only the newest goes out when it ends, so a slider drag never queues
+  behind stale values.
+- White-balance colors are computed once per Kelvin value.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from typing import Any, Callable, Dict, List, Mapping, Optional
+
+from led_color import kelvin_to_rgb
+from led_metrics import REGISTRY
+
+DEFAULT_STRIPS = [{"pin": 33, "length": 300}, {"pin": 32, "length": 300}]
+DELTA_FIELDS = ("brightness", "white_balance")
+
+ESP3_SENT = REGISTRY.counter("led_esp3_messages_total", "Camming commands sent by type", ["type"])
+ESP3_COALESCED = REGISTRY.counter("led_esp3_coalesced_total", "Camming deltas replaced by a newer one before sending")
+
+# (payload, kind, force) -> True when the command was queued instead of sent
+Esp3Sender = Callable[[Dict[str, Any], str, bool], bool]
+
+
+def parse_strips(text: str) -> List[Dict[str, int]]:
+    """"33:300,32:300" -> [{"pin": 33, "length": 300}, {"pin": 32, "length": 300}]"""
+    strips = []
+    for part in text.split(","):
+        if part.strip():
+            pin, length = part.split(":")
+            strips.append({"pin": int(pin), "length": int(length)})
+    return strips or [dict(s) for s in DEFAULT_STRIPS]
+
+
+class Esp3Driver:
+    def __init__(self, send: Esp3Sender, strips: Optional[List[Dict[str, int]]] = None, rate_hz: float = 30.0) -> None:
+        self.send = send
+        self.strips = [dict(s) for s in (strips or DEFAULT_STRIPS)]
+        self.interval = 1.0 / rate_hz if rate_hz > 0 else 0.0
+        self._lock = threading.Lock()
+        self._synced = False  # a full command went out since the last reset
+        self._pending: Optional[Dict[str, Any]] = None
+        self._pending_kind = "command"
+        self._last_send = 0.0
+        self._timer: Optional[threading.Timer] = None
+        self._colors: Dict[int, List[int]] = {}
+
+    def color(self, white_balance: float) -> List[int]:
+        kelvin = int(round(white_balance))
+        rgb = self._colors.get(kelvin)
+        if rgb is None:
+            rgb = self._colors[kelvin] = kelvin_to_rgb(kelvin)
+        return rgb
+
+    def full_payload(self, values: Mapping[str, Any]) -> Dict[str, Any]:
+        pattern = values.get("last_pattern") or "white"
+        payload: Dict[str, Any] = {"cmd": "set", "pattern": pattern, "target": values.get("target") or "both",
+                                   "strips": self.strips}
+        if values.get("brightness") is not None:
+            payload["brightness"] = float(values["brightness"])
+        payload["white_balance"] = float(values.get("white_balance") or 4500.0)
+        if pattern == "white":
+            payload["color"] = self.color(payload["white_balance"])
+        return payload
+
+    def delta_payload(self, values: Mapping[str, Any]) -> Dict[str, Any]:
+        """Brightness / white balance only; the ESP keeps pattern, target and layout."""
+        payload: Dict[str, Any] = {"cmd": "set", "white_balance": float(values.get("white_balance") or 4500.0)}
+        if values.get("brightness") is not None:
+            payload["brightness"] = float(values["brightness"])
+        if (values.get("last_pattern") or "white") == "white":
+            payload["color"] = self.color(payload["white_balance"])
+        return payload
+
+    # Sending -----------------------------------------------------------------
+    def apply(
+        self,
+        values: Mapping[str, Any],
+        current: Optional[Mapping[str, Any]] = None,
+        force: bool = False,
+        kind: str = "command",
+    ) -> bool:
+        """Send what moving the ESP from `current` to `values` (cache fields) needs.
+
+        Returns True when the command was queued because the broker is down.
+        """
+        values = dict(values)
+        current = current or {}
+        with self._lock:
+            if force or not self._synced or any(values.get(k) != current.get(k) for k in ("last_pattern", "target")):
+                self._cancel_pending()
+                self._synced, self._last_send = True, time.monotonic()
+                payload, kind, label = self.full_payload(values), "command", "full"
+            elif self._pending is None and all(values.get(k) == current.get(k) for k in DELTA_FIELDS):
+                return False
+            else:
+                wait = self._last_send + self.interval - time.monotonic()
+                if wait > 0 or self._pending is not None:
+                    if self._pending is not None:
+                        ESP3_COALESCED.inc()
+                    self._pending, self._pending_kind = values, kind
+                    if self._timer is None:
+                        self._timer = threading.Timer(max(0.0, wait), self._flush_pending)
+                        self._timer.daemon = True
+                        self._timer.start()
+                    return False
+                self._last_send = time.monotonic()
+                payload, label = self.delta_payload(values), "delta"
+        return self._send(payload, kind, force or label == "full", label)
+
+    def _send(self, payload: Dict[str, Any], kind: str, force: bool, label: str) -> bool:
+        ESP3_SENT.inc(type=label)
+        try:
+            return self.send(payload, kind, force)
+        except Exception:
+            # Unknown what the ESP has now: resend the full command next time.
+            self.reset()
+            raise
+
+    def _flush_pending(self) -> None:
+        with self._lock:
+            self._timer = None
+            values, self._pending = self._pending, None
+            if values is None:
+                return
+            self._last_send = time.monotonic()
+            kind = self._pending_kind
+        try:
+            self._send(self.delta_payload(values), kind, False, "delta")
+        except Exception as exc:
+            print(f"camming delta send failed: {exc}")
+
+    def _cancel_pending(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._pending = None
+
+    def reset(self) -> None:
+        """The ESP (re)connected or a send failed: the next `apply()` sends everything."""
+        with self._lock:
+            self._cancel_pending()
+            self._synced = False
+
+    def set_strips(self, strips: List[Dict[str, int]]) -> None:
+        with self._lock:
+            if strips != self.strips:
+                self.strips = [dict(s) for s in strips]
+                self._synced = False
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "strips": self.strips,
+                "synced": self._synced,
+                "pending": dict(self._pending) if self._pending else None,
+                "rate_hz": round(1.0 / self.interval, 1) if self.interval else None,
+            }
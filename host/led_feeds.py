@@ -0,0 +1,344 @@
+"""
+Numeric data feeds (wind speed etc.) pushed to segments such as `wind_meter`.
+
+- Sources: a local weather-station file (plain number or JSON), a JSON HTTP
+  endpoint, or an MQTT sensor topic. Dotted `key` paths pick the value.
+- Readings are smoothed with an EMA and only published when the smoothed value
+  moves by `threshold` or `max_interval` seconds pass since the last send.
+- All feeds share one scheduler thread (a heap of due times) and, for MQTT
+  sources, one subscriber client; each feed keeps a fixed-size history.
+- HTTP fetches run on a small shared pool, never on the scheduler thread, so a
+  slow endpoint cannot delay the other feeds; a finished fetch wakes the
+  scheduler and failures back off exponentially (up to `max_backoff`).
+Config (`LED_FEEDS_FILE`, JSON):
+    {"feeds": [{"name": "station", "type": "file", "path": "/run/wind.json",
+                "key": "wind.mph", "segment": "strip2", "interval": 5}]}
+"""
+from __future__ import annotations
+
+import abc
+import heapq
+import json
+import os
+import threading
+import time
+import urllib.request
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+HISTORY_SIZE = 120
+HTTP_WORKERS = 2
+Publisher = Callable[[Dict], None]
+
+
+def pick(data: Any, key: Optional[str]) -> float:
+    """Follow a dotted key path into parsed JSON and return a float."""
+    if key:
+        for part in key.split("."):
+            if isinstance(data, list):
+                data = data[int(part)]
+            else:
+                data = data[part]
+    return float(data)
+
+
+def parse_reading(raw: str, key: Optional[str]) -> float:
+    raw = raw.strip()
+    try:
+        return float(raw)
+    except ValueError:
+        return pick(json.loads(raw), key)
+
+
+class Feed(abc.ABC):
+    """One numeric source mapped onto a segment param."""
+
+    def __init__(
+        self,
+        name: str,
+        segment: str,
+        param: str = "wind_mph",
+        interval: float = 10.0,
+        smoothing: float = 0.3,
+        threshold: float = 0.5,
+        max_interval: float = 60.0,
+        scale: float = 1.0,
+        key: Optional[str] = None,
+    ) -> None:
+        self.name = name
+        self.segment = segment
+        self.param = param
+        self.interval = max(0.5, float(interval))
+        self.alpha = min(1.0, max(0.0, float(smoothing)))
+        self.threshold = float(threshold)
+        self.max_interval = float(max_interval)
+        self.scale = float(scale)
+        self.key = key
+        self.latest: Optional[float] = None
+        self.latest_at: Optional[float] = None
+        self.smoothed: Optional[float] = None
+        self.sent: Optional[float] = None
+        self.sent_at = 0.0
+        self.error: Optional[str] = None
+        self.history: Deque[Tuple[float, float]] = deque(maxlen=HISTORY_SIZE)
+        # Set by the scheduler: ask for an early poll (a background read finished).
+        self.wake: Optional[Callable[["Feed"], None]] = None
+        self.woken = False
+
+    @abc.abstractmethod
+    def read(self) -> Optional[float]:
+        """Return a new raw reading, or None if nothing new is available; must not block."""
+
+    def poll(self, now: float) -> Optional[Dict]:
+        """Read, smooth and return a payload if it should be published."""
+        try:
+            value = self.read()
+            self.error = None
+        except Exception as exc:
+            self.error = f"{type(exc).__name__}: {exc}"
+            value = None
+        if value is not None:
+            value *= self.scale
+            self.latest = value
+            self.latest_at = now
+            if self.smoothed is None:
+                self.smoothed = value
+            else:
+                self.smoothed += self.alpha * (value - self.smoothed)
+            self.history.append((now, round(self.smoothed, 3)))
+        if self.smoothed is None:
+            return None
+        moved = self.sent is None or abs(self.smoothed - self.sent) >= self.threshold
+        stale = now - self.sent_at >= self.max_interval
+        if not (moved or stale):
+            return None
+        self.sent = round(self.smoothed, 2)
+        self.sent_at = now
+        return {"cmd": "set", "segment": self.segment, "params": {self.param: self.sent}}
+
+    def status(self) -> Dict:
+        return {
+            "name": self.name,
+            "type": type(self).__name__,
+            "segment": self.segment,
+            "param": self.param,
+            "latest": self.latest,
+            "latest_at": self.latest_at,
+            "smoothed": None if self.smoothed is None else round(self.smoothed, 3),
+            "sent": self.sent,
+            "sent_at": self.sent_at or None,
+            "error": self.error,
+            "history": list(self.history)[-20:],
+        }
+
+
+class FileFeed(Feed):
+    """Weather-station style file; re-read only when its mtime changes."""
+
+    def __init__(self, name: str, segment: str, path: str, **kw) -> None:
+        super().__init__(name, segment, **kw)
+        self.path = path
+        self._mtime: Optional[float] = None
+
+    def read(self) -> Optional[float]:
+        mtime = os.stat(self.path).st_mtime
+        if mtime == self._mtime:
+            return None
+        with open(self.path, "r", encoding="utf-8") as f:
+            value = parse_reading(f.read(4096), self.key)
+        self._mtime = mtime
+        return value
+
+
+_http_pool: Optional[ThreadPoolExecutor] = None
+_http_pool_lock = threading.Lock()
+
+
+def _http_executor() -> ThreadPoolExecutor:
+    global _http_pool
+    with _http_pool_lock:
+        if _http_pool is None:
+            _http_pool = ThreadPoolExecutor(HTTP_WORKERS, thread_name_prefix="led-feeds-http")
+        return _http_pool
+
+
+class HttpFeed(Feed):
+    """JSON endpoint; each poll collects the last fetch and starts the next one in the background."""
+
+    def __init__(self, name: str, segment: str, url: str, timeout: float = 3.0, max_backoff: float = 300.0, **kw) -> None:
+        super().__init__(name, segment, **kw)
+        self.url = url
+        self.timeout = timeout
+        self.max_backoff = float(max_backoff)
+        self.failures = 0
+        self._retry_at = 0.0
+        self._last_error = ""
+        self._future: Optional[Future] = None
+
+    def fetch(self) -> float:
+        with urllib.request.urlopen(self.url, timeout=self.timeout) as resp:
+            return parse_reading(resp.read(65536).decode("utf-8"), self.key)
+
+    def read(self) -> Optional[float]:
+        value = None
+        future = self._future
+        if future is not None:
+            if not future.done():
+                return None
+            self._future = None
+            try:
+                value = future.result()
+                self.failures = 0
+            except Exception as exc:
+                self.failures += 1
+                self._retry_at = time.monotonic() + min(self.max_backoff, self.interval * 2 ** self.failures)
+                self._last_error = f"{type(exc).__name__}: {exc}"
+                raise
+            if self.wake is not None:
+                return value  # collected on wake-up; the next scheduled poll starts the next fetch
+        wait = self._retry_at - time.monotonic()
+        if wait > 0:
+            raise OSError(f"retrying in {wait:.0f} s after {self.failures} failures ({self._last_error})")
+        self._future = _http_executor().submit(self.fetch)
+        if self.wake is not None:
+            self._future.add_done_callback(lambda _: self.wake(self))
+        return value
+
+
+class MqttFeed(Feed):
+    """Sensor topic; the shared subscriber stores the newest message here."""
+
+    def __init__(self, name: str, segment: str, topic: str, **kw) -> None:
+        super().__init__(name, segment, **kw)
+        self.topic = topic
+        self._pending: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def on_message(self, payload: bytes) -> None:
+        value = parse_reading(payload.decode("utf-8", "replace"), self.key)
+        with self._lock:
+            self._pending = value
+
+    def read(self) -> Optional[float]:
+        with self._lock:
+            value, self._pending = self._pending, None
+        return value
+
+
+FEED_TYPES = {"file": FileFeed, "http": HttpFeed, "mqtt": MqttFeed}
+
+
+def build_feed(spec: Dict) -> Feed:
+    spec = dict(spec)
+    kind = spec.pop("type", "file")
+    if kind not in FEED_TYPES:
+        raise ValueError(f"unknown feed type {kind!r}")
+    name = spec.pop("name", None) or f"{kind}-{spec.get('segment', 'strip1')}"
+    segment = spec.pop("segment", "strip1")
+    return FEED_TYPES[kind](name, segment, **spec)
+
+
+def load_feeds(path: str) -> List[Feed]:
+    if not path or not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    specs = data.get("feeds", []) if isinstance(data, dict) else data
+    return [build_feed(spec) for spec in specs]
+
+
+class FeedScheduler:
+    """Runs every feed on one thread, ordered by next due time."""
+
+    def __init__(self, feeds: List[Feed], publish: Publisher, on_sent: Optional[Callable[[Feed, Dict], None]] = None) -> None:
+        self.feeds = feeds
+        self.publish = publish
+        self.on_sent = on_sent
+        self._heap: List[Tuple[float, int, Feed]] = []
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._mqtt = None
+
+    def start(self, mqtt_host: str, mqtt_port: int, username: Optional[str] = None, password: Optional[str] = None) -> None:
+        now = time.monotonic()
+        self._heap = [(now, i, feed) for i, feed in enumerate(self.feeds)]
+        heapq.heapify(self._heap)
+        for feed in self.feeds:
+            feed.wake = self.wake
+        mqtt_feeds = [f for f in self.feeds if isinstance(f, MqttFeed)]
+        if mqtt_feeds:
+            self._start_subscriber(mqtt_feeds, mqtt_host, mqtt_port, username, password)
+        self._thread = threading.Thread(target=self._run, name="led-feeds", daemon=True)
+        self._thread.start()
+
+    def _start_subscriber(self, feeds: List[MqttFeed], host: str, port: int, username, password) -> None:
+        import paho.mqtt.client as mqtt
+
+        by_topic: Dict[str, List[MqttFeed]] = {}
+        for feed in feeds:
+            by_topic.setdefault(feed.topic, []).append(feed)
+
+        def on_connect(client, userdata, flags, rc, *args):
+            for topic in by_topic:
+                client.subscribe(topic)
+
+        def on_message(client, userdata, msg):
+            for feed in by_topic.get(msg.topic, []):
+                try:
+                    feed.on_message(msg.payload)
+                except Exception as exc:
+                    feed.error = f"{type(exc).__name__}: {exc}"
+
+        client = mqtt.Client(client_id=f"led-web-feeds-{os.getpid()}")
+        if username:
+            client.username_pw_set(username, password)
+        client.on_connect = on_connect
+        client.on_message = on_message
+        client.connect_async(host, port, keepalive=30)
+        client.loop_start()
+        self._mqtt = client
+
+    def wake(self, feed: Feed) -> None:
+        """Poll `feed` now instead of at its next due time (any thread)."""
+        feed.woken = True
+        self._wake.set()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wake.set()
+        if self._mqtt is not None:
+            self._mqtt.loop_stop()
+            self._mqtt.disconnect()
+
+    def _run(self) -> None:
+        while not self._stop.is_set() and self._heap:
+            self._wake.clear()
+            for feed in self.feeds:
+                if feed.woken:
+                    feed.woken = False
+                    self._poll(feed)
+            due, idx, feed = self._heap[0]
+            delay = due - time.monotonic()
+            if delay > 0:
+                self._wake.wait(delay)
+                continue
+            heapq.heapreplace(self._heap, (due + feed.interval, idx, feed))
+            self._poll(feed)
+
+    def _poll(self, feed: Feed) -> None:
+        payload = feed.poll(time.time())
+        if payload is None:
+            return
+        try:
+            self.publish(payload)
+        except Exception as exc:
+            feed.error = f"publish failed: {exc}"
+            feed.sent = None  # retry on the next poll
+            return
+        if self.on_sent:
+            self.on_sent(feed, payload)
+
+    def status(self) -> List[Dict]:
+        return [feed.status() for feed in self.feeds]
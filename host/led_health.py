@@ -0,0 +1,334 @@
+"""
+Host health sampler with downsampled history in a shared ring file.
+
+- One `HealthSampler` thread (the leader under led_serve.py) reads CPU
+  temperature and clock, load, memory and the broker round-trip once per
+  second; HTTP handlers only read what it wrote.
+- Samples land in fixed-size tiers of a memory-mapped file (`LED_HEALTH_PATH`,
+  default /dev/shm/led_health): 1 s for an hour, 1 min for a day, 1 h for 30
+  days. A slot keeps min / max / mean / count per field, so coarser tiers are
+  exact aggregates of the samples and the bucket in progress is readable.
+- A slot is addressed by bucket number modulo the tier size and stores its
+  bucket start, so there is no head pointer to keep and a new leader (or a
+  restarted service) carries on in the same file.
+- Writes bump a seqlock like led_shm.py; readers in any worker copy the tier
+  and retry if a write was in progress.
+Layout (little-endian):
+    header  magic "LEDH", layout u16, fields u16, seq u64, latest time f64,
+            latest values (f32 per field), padded to 64 bytes
+    tiers   back to back; slot = bucket start f64, then min, max, mean (f32)
+            and count (u16) per field
+CLI:
+    python led_health.py                      # latest sample
+    python led_health.py --tier 1m --last 3600
+    python led_health.py --sample             # run a sampler in the foreground (no broker probe)
+"""
+from __future__ import annotations
+
+import argparse
+import fcntl
+import json
+import math
+import mmap
+import os
+import struct
+import subprocess
+import tempfile
+import threading
+import time
+from typing import Callable, Dict, List, Mapping, Optional, Sequence
+
+from led_metrics import REGISTRY
+
+MAGIC = b"LEDH"
+LAYOUT = 1
+FIELDS = ("temp_c", "cpu_mhz", "load1", "mem_used_pct", "broker_rtt_ms")
+# name, bucket seconds, slots
+TIERS = (("1s", 1, 3600), ("1m", 60, 1440), ("1h", 3600, 720))
+HEADER = struct.Struct("<4sHHQd" + "f" * len(FIELDS))
+HEADER_SIZE = 64
+SEQ_OFFSET = 8  # offset of `seq` inside HEADER
+SLOT = struct.Struct("<d" + "fffH" * len(FIELDS))
+TIER_OFFSETS = {}
+_offset = HEADER_SIZE
+for _name, _step, _slots in TIERS:
+    TIER_OFFSETS[_name] = _offset
+    _offset += _slots * SLOT.size
+FILE_SIZE = _offset
+
+THERMAL_PATH = "/sys/class/thermal/thermal_zone0/temp"
+CPUFREQ_PATH = "/sys/devices/system/cpu/cpu0/cpufreq/scaling_cur_freq"
+
+HEALTH = REGISTRY.gauge("led_host_health", "Latest host health sample", ["field"])
+
+Probe = Callable[[], Optional[float]]
+
+
+def default_path() -> str:
+    base = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(base, "led_health")
+
+
+# Probes ------------------------------------------------------------------------
+_vcgencmd_missing = False
+
+
+def read_cpu_temp() -> Optional[float]:
+    """CPU temperature in Celsius: sysfs, else `vcgencmd` (not retried once it is missing)."""
+    global _vcgencmd_missing
+    try:
+        with open(THERMAL_PATH, "r", encoding="utf-8") as f:
+            return round(float(f.read().strip()) / 1000.0, 1)
+    except Exception:
+        pass
+    if _vcgencmd_missing:
+        return None
+    try:
+        out = subprocess.check_output(["vcgencmd", "measure_temp"], text=True).strip()
+        if out.startswith("temp=") and out.endswith("'C"):
+            return round(float(out.split("=")[1].split("'")[0]), 1)
+    except FileNotFoundError:
+        _vcgencmd_missing = True
+    except Exception:
+        pass
+    return None
+
+
+def read_cpu_mhz() -> Optional[float]:
+    """Current clock of cpu0; drops when the Pi throttles."""
+    try:
+        with open(CPUFREQ_PATH, "r", encoding="utf-8") as f:
+            return float(f.read().strip()) / 1000.0
+    except Exception:
+        return None
+
+
+def read_load() -> Optional[float]:
+    try:
+        return os.getloadavg()[0]
+    except OSError:
+        return None
+
+
+def read_memory() -> Optional[float]:
+    """Percentage of memory in use (MemTotal - MemAvailable)."""
+    info = {}
+    try:
+        with open("/proc/meminfo", "r", encoding="utf-8") as f:
+            for line in f:
+                key, _, rest = line.partition(":")
+                if key in ("MemTotal", "MemAvailable"):
+                    info[key] = float(rest.split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
+    if not info.get("MemTotal") or "MemAvailable" not in info:
+        return None
+    return round(100.0 * (1.0 - info["MemAvailable"] / info["MemTotal"]), 2)
+
+
+def default_probes() -> Dict[str, Probe]:
+    return {"temp_c": read_cpu_temp, "cpu_mhz": read_cpu_mhz, "load1": read_load, "mem_used_pct": read_memory}
+
+
+# Ring file ---------------------------------------------------------------------
+def _clean(value: float) -> Optional[float]:
+    return None if math.isnan(value) else round(value, 2)
+
+
+class HealthRing:
+    """The shared history file; any process may read, the sampler writes."""
+
+    def __init__(self, path: Optional[str] = None) -> None:
+        self.path = path or os.getenv("LED_HEALTH_PATH") or default_path()
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            if os.fstat(fd).st_size != FILE_SIZE:
+                os.ftruncate(fd, FILE_SIZE)
+            self._mm = mmap.mmap(fd, FILE_SIZE)
+            magic, layout, fields = struct.unpack_from("<4sHH", self._mm, 0)
+            if magic != MAGIC or layout != LAYOUT or fields != len(FIELDS):
+                self._mm[:FILE_SIZE] = b"\0" * FILE_SIZE
+                HEADER.pack_into(self._mm, 0, MAGIC, LAYOUT, len(FIELDS), 0, 0.0, *([math.nan] * len(FIELDS)))
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        self._fd = fd
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+
+    # Writing -------------------------------------------------------------------
+    def record(self, ts: float, values: Mapping[str, Optional[float]]) -> None:
+        """Add one sample taken at unix time `ts` to every tier."""
+        sample = [values.get(f) for f in FIELDS]
+        with self._lock:
+            if self._pid != os.getpid():
+                # flock cannot tell a forked child's inherited descriptor from the parent's.
+                self._fd, self._pid = os.open(self.path, os.O_RDWR), os.getpid()
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                self._record_locked(ts, sample)
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _record_locked(self, ts: float, sample: List[Optional[float]]) -> None:
+        mm = self._mm
+        (seq,) = struct.unpack_from("<Q", mm, SEQ_OFFSET)
+        seq += 1 if seq % 2 == 0 else 2  # recover from a writer that died mid-write
+        struct.pack_into("<Q", mm, SEQ_OFFSET, seq)
+        latest = [math.nan if v is None else float(v) for v in sample]
+        struct.pack_into("<d" + "f" * len(FIELDS), mm, SEQ_OFFSET + 8, ts, *latest)
+        for name, step, slots in TIERS:
+            bucket = int(ts // step)
+            offset = TIER_OFFSETS[name] + (bucket % slots) * SLOT.size
+            start, *cells = SLOT.unpack_from(mm, offset)
+            if start != bucket * step:
+                cells = [math.nan, math.nan, math.nan, 0] * len(FIELDS)
+            for i, value in enumerate(sample):
+                if value is None:
+                    continue
+                lo, hi, mean, n = cells[i * 4:i * 4 + 4]
+                n += 1
+                cells[i * 4:i * 4 + 4] = [
+                    value if n == 1 else min(lo, value),
+                    value if n == 1 else max(hi, value),
+                    value if n == 1 else mean + (value - mean) / n,
+                    min(n, 0xFFFF),
+                ]
+            SLOT.pack_into(mm, offset, float(bucket * step), *cells)
+        struct.pack_into("<Q", mm, SEQ_OFFSET, seq + 1)
+
+    # Reading -------------------------------------------------------------------
+    def _copy(self, start: int, end: int, retries: int = 10000) -> bytes:
+        mm = self._mm
+        for attempt in range(retries):
+            (s1,) = struct.unpack_from("<Q", mm, SEQ_OFFSET)
+            if s1 % 2 == 0:
+                data = mm[start:end]
+                (s2,) = struct.unpack_from("<Q", mm, SEQ_OFFSET)
+                if s1 == s2:
+                    return data
+            if attempt > 100:
+                time.sleep(0)
+        raise TimeoutError("health history kept changing while reading")
+
+    def latest(self) -> Dict:
+        """{"t": unix time or None, "age": seconds, field: value or None}."""
+        data = self._copy(0, HEADER.size)
+        _, _, _, _, ts, *values = HEADER.unpack_from(data, 0)
+        out: Dict = {"t": ts or None, "age": round(time.time() - ts, 1) if ts else None}
+        for field, value in zip(FIELDS, values):
+            out[field] = _clean(value)
+        return out
+
+    def history(
+        self,
+        tier: str = "1m",
+        since: Optional[float] = None,
+        until: Optional[float] = None,
+        fields: Optional[Sequence[str]] = None,
+    ) -> Dict:
+        """Buckets of `tier` between `since` and `until` (unix times), oldest first, as columns.
+
+        {"tier", "step", "t": [bucket starts], "fields": {field: {"min", "max", "mean", "count"}}}
+        """
+        spec = {name: (step, slots) for name, step, slots in TIERS}.get(tier)
+        if spec is None:
+            raise ValueError(f"unknown tier {tier!r}; use one of {', '.join(t[0] for t in TIERS)}")
+        step, slots = spec
+        fields = [f for f in (fields or FIELDS) if f in FIELDS]
+        until = time.time() if until is None else until
+        last = int(until // step)
+        first = max(last - slots + 1, int((since if since is not None else 0) // step))
+        base = TIER_OFFSETS[tier]
+        data = self._copy(base, base + slots * SLOT.size)
+        starts: List[float] = []
+        columns = {f: {"min": [], "max": [], "mean": [], "count": []} for f in fields}
+        index = [FIELDS.index(f) for f in fields]
+        for bucket in range(first, last + 1):
+            start, *cells = SLOT.unpack_from(data, (bucket % slots) * SLOT.size)
+            if start != bucket * step:
+                continue
+            starts.append(start)
+            for field, i in zip(fields, index):
+                lo, hi, mean, n = cells[i * 4:i * 4 + 4]
+                col = columns[field]
+                col["min"].append(_clean(lo) if n else None)
+                col["max"].append(_clean(hi) if n else None)
+                col["mean"].append(_clean(mean) if n else None)
+                col["count"].append(n)
+        return {"tier": tier, "step": step, "t": starts, "fields": columns}
+
+
+# Sampler -----------------------------------------------------------------------
+class HealthSampler:
+    def __init__(self, ring: HealthRing, probes: Optional[Dict[str, Probe]] = None, interval: float = 1.0) -> None:
+        self.ring = ring
+        self.probes = dict(probes or default_probes())
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def sample(self) -> Dict[str, Optional[float]]:
+        values: Dict[str, Optional[float]] = {}
+        for field, probe in self.probes.items():
+            try:
+                values[field] = probe()
+            except Exception:
+                values[field] = None
+            if values[field] is not None:
+                HEALTH.set(values[field], field=field)
+        return values
+
+    def run(self) -> None:
+        next_at = time.time()
+        while not self._stop.is_set():
+            # Stamp the sample with its slot time, not when a slow probe finished.
+            ts = next_at
+            try:
+                self.ring.record(ts, self.sample())
+            except Exception as exc:
+                print(f"health sample failed: {exc}")
+            next_at += self.interval
+            now = time.time()
+            if next_at < now:
+                # Probes overran (e.g. a hung broker): skip the missed ticks.
+                next_at = now
+            self._stop.wait(next_at - now)
+
+    def start(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self.run, name="led-health", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+
+def main(argv: Optional[list] = None) -> int:
+    parser = argparse.ArgumentParser(description="Show host health history")
+    parser.add_argument("--path", help="History file (default LED_HEALTH_PATH or /dev/shm/led_health)")
+    parser.add_argument("--tier", choices=[t[0] for t in TIERS], help="Print this tier instead of the latest sample")
+    parser.add_argument("--last", type=float, default=3600.0, help="Seconds of history with --tier")
+    parser.add_argument("--sample", action="store_true", help="Run a sampler (without broker probe) and print each sample")
+    args = parser.parse_args(argv)
+    try:
+        ring = HealthRing(args.path)
+    except (OSError, ValueError) as exc:
+        print(f"cannot open health history: {exc}")
+        return 1
+    if args.sample:
+        sampler = HealthSampler(ring)
+        sampler.start()
+        while True:
+            time.sleep(sampler.interval)
+            print(json.dumps(ring.latest()), flush=True)
+    if args.tier:
+        print(json.dumps(ring.history(args.tier, since=time.time() - args.last)))
+    else:
+        print(json.dumps(ring.latest()))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
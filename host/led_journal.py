@@ -0,0 +1,350 @@
+"""
+Append-only journal of the state the host last sent, for restart recovery.
+
+- Every cache commit that follows an outbound command is appended as one
+  length-prefixed record: the fields that changed for one entry (segment or
+  camming key). `Journal.listener(store)` plugs into a `StateStore`.
+- Records live in segment files; a segment is closed after
+  `segment_records` records or `segment_bytes`, and a snapshot of the whole
+  state is written next to it. Only the newest `keep_segments` closed
+  segments (and the snapshots they need) are kept.
+- The default directory is led_journal/ in led_shared.state_dir(), outside
+  the source tree.
+- Recovery loads the newest intact snapshot and replays the records after it;
+  a torn record at the end of the last segment (crash mid-write) is cut off.
+- Each segment has a sparse time index (`.idx`, one entry per
+  `index_every` records) used by `records(since)` and `state_at(ts)`.
+Record layout (little-endian):
+    body length u32, crc32 u32 (of the rest), seq u64, unix time f64,
+    body = store NUL key NUL compact JSON of the changed fields
+Snapshots use the same framing with the JSON state of all stores as body.
+CLI:
+    python led_journal.py                     # recovered state + stats
+    python led_journal.py --since 600         # records of the last 10 minutes
+    python led_journal.py --at 1760000000     # state as of a unix time
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+from bisect import bisect_right
+from typing import Any, Callable, Dict, Iterator, List, Mapping, Optional, Tuple
+
+from led_metrics import REGISTRY
+from led_shared import state_dir
+from led_store import thaw
+
+REC = struct.Struct("<IIQd")  # body length, crc32, seq, time
+IDX = struct.Struct("<dQQ")  # time, seq, offset in the segment
+
+JOURNAL_RECORDS = REGISTRY.counter("led_journal_records_total", "Records appended to the command journal")
+JOURNAL_SNAPSHOTS = REGISTRY.counter("led_journal_snapshots_total", "Journal snapshots written")
+JOURNAL_ERRORS = REGISTRY.counter("led_journal_errors_total", "Journal appends that failed")
+
+State = Dict[str, Dict[str, Dict[str, Any]]]  # store -> key -> fields
+Record = Tuple[int, float, str, str, Dict[str, Any]]  # seq, time, store, key, changed fields
+
+
+def _frame(seq: int, ts: float, body: bytes) -> bytes:
+    tail = struct.pack("<Qd", seq, ts) + body
+    return struct.pack("<II", len(body), zlib.crc32(tail)) + tail
+
+
+def _scan(data: bytes, offset: int = 0) -> Iterator[Tuple[int, int, float, bytes]]:
+    """(end offset, seq, time, body) of each intact record from `offset`; stops at a torn or corrupt one."""
+    while offset + REC.size <= len(data):
+        length, crc, seq, ts = REC.unpack_from(data, offset)
+        end = offset + REC.size + length
+        if end > len(data) or zlib.crc32(data[offset + 8:end]) != crc:
+            return
+        yield end, seq, ts, data[offset + REC.size:end]
+        offset = end
+
+
+def _decode(body: bytes) -> Tuple[str, str, Dict[str, Any]]:
+    store, key, raw = body.split(b"\0", 2)
+    return store.decode(), key.decode(), json.loads(raw)
+
+
+def default_dir() -> str:
+    return os.path.join(state_dir(), "led_journal")
+
+
+class Journal:
+    def __init__(
+        self,
+        directory: str,
+        segment_records: int = 1000,
+        segment_bytes: int = 256 * 1024,
+        keep_segments: int = 8,
+        index_every: int = 64,
+        fsync: bool = False,
+        readonly: bool = False,
+    ) -> None:
+        """`readonly` inspects a journal another process is writing: no truncation, no appends."""
+        self.dir = directory
+        self.segment_records = segment_records
+        self.segment_bytes = segment_bytes
+        self.keep_segments = max(1, keep_segments)
+        self.index_every = max(1, index_every)
+        self.fsync = fsync
+        self.readonly = readonly
+        if not readonly:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._state: State = {}
+        self._seq = 0
+        self._fd: Optional[int] = None
+        self._idx_fd: Optional[int] = None
+        self._seg_first = 0
+        self._seg_count = 0
+        self._seg_size = 0
+        self.snapshot_seq = 0
+        self.replayed = 0
+        self.recovery_ms = 0.0
+        self._recover()
+
+    # Files -------------------------------------------------------------------
+    def _files(self, ext: str) -> List[Tuple[int, str]]:
+        out = []
+        for name in os.listdir(self.dir):
+            stem, _, suffix = name.partition(".")
+            if suffix == ext and stem.isdigit():
+                out.append((int(stem), os.path.join(self.dir, name)))
+        return sorted(out)
+
+    def _path(self, seq: int, ext: str) -> str:
+        return os.path.join(self.dir, f"{seq:016d}.{ext}")
+
+    @staticmethod
+    def _read(path: str) -> bytes:
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except OSError:
+            return b""
+
+    def _read_snapshot(self, path: str) -> Optional[Tuple[int, float, State]]:
+        for _, seq, ts, body in _scan(self._read(path)):
+            try:
+                return seq, ts, json.loads(body)
+            except ValueError:
+                return None
+        return None
+
+    # Recovery ----------------------------------------------------------------
+    def _recover(self) -> None:
+        start = time.perf_counter()
+        for _, path in reversed(self._files("snap")):
+            loaded = self._read_snapshot(path)
+            if loaded is not None:
+                self.snapshot_seq, _, self._state = loaded
+                break
+        self._seq = self.snapshot_seq
+        segments = self._files("log")
+        for i, (first, path) in enumerate(segments):
+            last = i == len(segments) - 1
+            if not last and segments[i + 1][0] <= self.snapshot_seq + 1:
+                continue  # everything in it is in the snapshot
+            data = self._read(path)
+            good, count = 0, 0
+            for end, seq, _, body in _scan(data):
+                good, count = end, count + 1
+                if seq > self._seq:
+                    store, key, fields = _decode(body)
+                    self._state.setdefault(store, {}).setdefault(key, {}).update(fields)
+                    self._seq = seq
+                    self.replayed += 1
+            if last and not self.readonly:
+                if good < len(data):
+                    print(f"journal: dropping {len(data) - good} torn byte(s) at the end of {path}")
+                    with open(path, "r+b") as f:
+                        f.truncate(good)
+                if count < self.segment_records and good < self.segment_bytes:
+                    self._open_segment(first, count, good)
+        self.recovery_ms = round((time.perf_counter() - start) * 1000.0, 2)
+
+    def _open_segment(self, first: int, count: int = 0, size: int = 0) -> None:
+        flags = os.O_WRONLY | os.O_CREAT | os.O_APPEND
+        self._fd = os.open(self._path(first, "log"), flags, 0o644)
+        self._idx_fd = os.open(self._path(first, "idx"), flags, 0o644)
+        self._seg_first, self._seg_count, self._seg_size = first, count, size
+
+    def _close_segment(self) -> None:
+        for fd in (self._fd, self._idx_fd):
+            if fd is not None:
+                if self.fsync:
+                    os.fsync(fd)
+                os.close(fd)
+        self._fd = self._idx_fd = None
+
+    # Writing -----------------------------------------------------------------
+    def record(self, store: str, key: str, values: Mapping[str, Any], ts: Optional[float] = None) -> bool:
+        """Append the fields of `values` that differ from the journaled state; False if none did."""
+        ts = time.time() if ts is None else ts
+        with self._lock:
+            current = self._state.setdefault(store, {}).setdefault(key, {})
+            delta = {k: v for k, v in values.items() if current.get(k) != v}
+            if not delta:
+                return False
+            current.update(delta)
+            body = b"%s\0%s\0%s" % (store.encode(), key.encode(), json.dumps(delta, separators=(",", ":")).encode())
+            if self._fd is None:
+                if self.readonly:
+                    raise OSError(f"journal {self.dir} is open read-only")
+                self._open_segment(self._seq + 1)
+            self._seq += 1
+            frame = _frame(self._seq, ts, body)
+            if self._seg_count % self.index_every == 0:
+                os.write(self._idx_fd, IDX.pack(ts, self._seq, self._seg_size))
+            os.write(self._fd, frame)
+            self._seg_count += 1
+            self._seg_size += len(frame)
+            if self._seg_count >= self.segment_records or self._seg_size >= self.segment_bytes:
+                self._rotate(ts)
+        JOURNAL_RECORDS.inc()
+        return True
+
+    def listener(self, store: str) -> Callable[[int, Dict[str, Mapping[str, Any]]], None]:
+        """StateStore listener journaling commits of `store`."""
+
+        def on_state(version: int, updated: Dict[str, Mapping[str, Any]]) -> None:
+            for key, entry in updated.items():
+                try:
+                    self.record(store, key, thaw(entry))
+                except OSError as exc:
+                    JOURNAL_ERRORS.inc()
+                    print(f"journal append failed: {exc}")
+
+        return on_state
+
+    def _rotate(self, ts: float) -> None:
+        self._close_segment()
+        self._write_snapshot(ts)
+        self._compact()
+
+    def _write_snapshot(self, ts: float) -> None:
+        path = self._path(self._seq, "snap")
+        tmp = f"{path}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(_frame(self._seq, ts, json.dumps(self._state, separators=(",", ":")).encode()))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+        self.snapshot_seq = self._seq
+        JOURNAL_SNAPSHOTS.inc()
+
+    def _compact(self) -> None:
+        """Keep the newest `keep_segments` segments and the snapshots needed to replay them."""
+        segments = self._files("log")
+        for first, path in segments[:-self.keep_segments]:
+            for p in (path, self._path(first, "idx")):
+                try:
+                    os.remove(p)
+                except OSError:
+                    pass
+        kept = segments[-self.keep_segments:]
+        snaps = self._files("snap")
+        # The newest snapshot before the oldest kept segment is the base for replaying it.
+        base = max([seq for seq, _ in snaps if kept and seq < kept[0][0]], default=None)
+        for seq, path in snaps:
+            if base is not None and seq < base:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    # Reading -----------------------------------------------------------------
+    @property
+    def seq(self) -> int:
+        return self._seq
+
+    def state(self) -> State:
+        with self._lock:
+            return json.loads(json.dumps(self._state))
+
+    def records(
+        self, since: Optional[float] = None, until: Optional[float] = None, after: int = 0
+    ) -> Iterator[Record]:
+        """Journaled records (oldest first) between unix times `since` and `until`, with seq > `after`."""
+        segments = self._files("log")
+        start_seg, offset = 0, 0
+        while start_seg + 1 < len(segments) and segments[start_seg + 1][0] <= after + 1:
+            start_seg += 1
+        if since is not None:
+            # The time index: last segment / index entry at or before `since`.
+            for i, (first, _) in enumerate(segments[start_seg:], start_seg):
+                entries = self._index(first)
+                if entries and entries[0][0] <= since:
+                    start_seg, offset = i, entries[bisect_right([e[0] for e in entries], since) - 1][2]
+        for i, (first, path) in enumerate(segments[start_seg:]):
+            data = self._read(path)
+            for _, seq, ts, body in _scan(data, offset if i == 0 else 0):
+                if until is not None and ts > until:
+                    return
+                if seq > after and (since is None or ts >= since):
+                    yield (seq, ts, *_decode(body))
+
+    def _index(self, first: int) -> List[Tuple[float, int, int]]:
+        data = self._read(self._path(first, "idx"))
+        return [IDX.unpack_from(data, off) for off in range(0, len(data) - IDX.size + 1, IDX.size)]
+
+    def state_at(self, ts: float) -> Optional[State]:
+        """State as of unix time `ts`, or None when that is older than the kept history."""
+        base: Optional[Tuple[int, float, State]] = None
+        for _, path in self._files("snap"):
+            loaded = self._read_snapshot(path)
+            if loaded is not None and loaded[1] <= ts:
+                base = loaded
+        segments = self._files("log")
+        if base is None and (not segments or segments[0][0] != 1):
+            return None
+        seq0, _, state = base or (0, 0.0, {})
+        for _, _, store, key, fields in self.records(until=ts, after=seq0):
+            state.setdefault(store, {}).setdefault(key, {}).update(fields)
+        return state
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "seq": self._seq,
+                "snapshot_seq": self.snapshot_seq,
+                "segment": {"first": self._seg_first, "records": self._seg_count, "bytes": self._seg_size}
+                if self._fd is not None else None,
+                "segments": len(self._files("log")),
+                "recovery_ms": self.recovery_ms,
+                "replayed": self.replayed,
+            }
+
+    def close(self) -> None:
+        with self._lock:
+            self._close_segment()
+
+
+def main(argv: Optional[list] = None) -> int:
+    parser = argparse.ArgumentParser(description="Inspect the LED command journal")
+    parser.add_argument("--dir", default=os.getenv("LED_JOURNAL_DIR") or default_dir())
+    parser.add_argument("--since", type=float, help="Print records of the last N seconds")
+    parser.add_argument("--at", type=float, help="Print the state as of this unix time")
+    args = parser.parse_args(argv)
+    if not os.path.isdir(args.dir):
+        print(f"no journal in {args.dir}")
+        return 1
+    journal = Journal(args.dir, readonly=True)
+    if args.since is not None:
+        for seq, ts, store, key, fields in journal.records(since=time.time() - args.since):
+            print(json.dumps({"seq": seq, "t": round(ts, 3), "store": store, "key": key, "fields": fields}))
+    elif args.at is not None:
+        print(json.dumps(journal.state_at(args.at), indent=2))
+    else:
+        print(json.dumps({"status": journal.status(), "state": journal.state()}, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,435 @@
+"""
+Load test for `led_web.py`: the real Flask app against an in-process MQTT broker stand-in.
+
+- `FakeBroker` speaks enough MQTT 3.1.1 (CONNECT, PUBLISH QoS 0/1, SUBSCRIBE,
+  retained messages, PINGREQ) for the app's publish paths; tests can make it
+  refuse CONNECTs and drop or hold PUBACKs.
+- Client mix, modeled on the web UI:
+  pollers   /api/status + /api/state every 5 s, /api/pi-temp every 6 s, 3x /api/esp-status every 7 s
+  sliders   bursts of /api/set (or /api/esp3/set) every 80 ms, then a pause
+  presets   /api/state/apply alternating between two presets every few seconds
+- Reports p50/p99/max latency and errors per route; `--save-baseline` stores the
+  result, `--baseline` compares and exits 1 on a regression.
+Usage:
+    python led_loadtest.py --pollers 20 --sliders 4 --presets 2 --duration 30
+    python led_loadtest.py --duration 30 --save-baseline loadtest_baseline.json
+    python led_loadtest.py --duration 30 --baseline loadtest_baseline.json
+"""
+from __future__ import annotations
+
+import argparse
+import http.client
+import json
+import logging
+import os
+import random
+import socket
+import socketserver
+import struct
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict, deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+# Regression rule: slower than baseline * TOLERANCE + SLACK_MS (absolute slack
+# keeps sub-millisecond routes from flapping on scheduler noise).
+TOLERANCE = 1.25
+SLACK_MS = {"p50": 2.0, "p99": 10.0}
+ERROR_RATE_SLACK = 0.01
+MIN_P99_SAMPLES = 50  # fewer samples than this make p99 just "the max"
+
+
+# Broker stand-in ------------------------------------------------------------
+def _read_exact(sock: socket.socket, n: int) -> bytes:
+    buf = b""
+    while len(buf) < n:
+        chunk = sock.recv(n - len(buf))
+        if not chunk:
+            raise ConnectionError("closed")
+        buf += chunk
+    return buf
+
+
+def _read_packet(sock: socket.socket) -> Tuple[int, int, bytes]:
+    head = _read_exact(sock, 1)[0]
+    length, shift = 0, 0
+    while True:
+        byte = _read_exact(sock, 1)[0]
+        length |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            break
+        shift += 7
+    return head >> 4, head & 0x0F, _read_exact(sock, length) if length else b""
+
+
+def _packet(kind: int, flags: int, body: bytes) -> bytes:
+    out = bytearray([(kind << 4) | flags])
+    n = len(body)
+    while True:
+        byte = n % 128
+        n //= 128
+        out.append(byte | (0x80 if n else 0))
+        if not n:
+            break
+    return bytes(out) + body
+
+
+def topic_matches(pattern: str, topic: str) -> bool:
+    p, t = pattern.split("/"), topic.split("/")
+    for i, part in enumerate(p):
+        if part == "#":
+            return True
+        if i >= len(t) or (part != "+" and part != t[i]):
+            return False
+    return len(p) == len(t)
+
+
+class FakeBroker(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0) -> None:
+        super().__init__((host, port), _BrokerHandler)
+        self.lock = threading.Lock()
+        self.retained: Dict[str, bytes] = {}
+        self.subscribers: List[Tuple[str, "_BrokerHandler"]] = []
+        self.published: Dict[str, int] = defaultdict(int)
+        self.connects = 0
+        self.connack_rc = 0  # non-zero: refuse CONNECTs with this return code
+        self.received: Deque[Tuple[str, bytes]] = deque(maxlen=4096)  # latest publishes, for tests
+        self.drop_acks = 0  # PUBACKs to swallow, as if lost on the way back
+        self.hold_acks = False  # keep PUBACKs until release_acks()
+        self._held: List[Tuple["_BrokerHandler", bytes]] = []
+
+    def release_acks(self) -> None:
+        with self.lock:
+            self.hold_acks = False
+            held, self._held = self._held, []
+        for handler, ack in held:
+            handler.send(ack)
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+    def start(self) -> None:
+        threading.Thread(target=self.serve_forever, name="fake-broker", daemon=True).start()
+
+
+class _BrokerHandler(socketserver.BaseRequestHandler):
+    server: FakeBroker
+
+    def send(self, data: bytes) -> None:
+        try:
+            self.request.sendall(data)
+        except OSError:
+            pass
+
+    def handle(self) -> None:
+        broker = self.server
+        try:
+            while True:
+                kind, flags, body = _read_packet(self.request)
+                if kind == 1:  # CONNECT
+                    with broker.lock:
+                        broker.connects += 1
+                    self.send(_packet(2, 0, bytes([0, broker.connack_rc])))
+                elif kind == 3:  # PUBLISH
+                    (tlen,) = struct.unpack("!H", body[:2])
+                    topic = body[2:2 + tlen].decode("utf-8")
+                    qos = (flags >> 1) & 3
+                    pos = 2 + tlen
+                    ack = None
+                    if qos:
+                        ack = _packet(4, 0, body[pos:pos + 2])
+                        pos += 2
+                    payload = body[pos:]
+                    with broker.lock:
+                        if ack is not None and broker.drop_acks:
+                            broker.drop_acks -= 1
+                            ack = None
+                        elif ack is not None and broker.hold_acks:
+                            broker._held.append((self, ack))
+                            ack = None
+                        broker.received.append((topic, payload))
+                        broker.published[topic] += 1
+                        if flags & 1:
+                            if payload:
+                                broker.retained[topic] = payload
+                            else:
+                                broker.retained.pop(topic, None)
+                        targets = [h for pat, h in broker.subscribers if topic_matches(pat, topic)]
+                    if ack is not None:
+                        self.send(ack)
+                    for handler in targets:
+                        handler.send(_packet(3, 0, body[:2 + tlen] + payload))
+                elif kind == 8:  # SUBSCRIBE
+                    pid, pos, granted, patterns = body[:2], 2, b"", []
+                    while pos < len(body):
+                        (flen,) = struct.unpack("!H", body[pos:pos + 2])
+                        patterns.append(body[pos + 2:pos + 2 + flen].decode("utf-8"))
+                        pos += 3 + flen
+                        granted += b"\x00"
+                    self.send(_packet(9, 0, pid + granted))
+                    with broker.lock:
+                        broker.subscribers.extend((p, self) for p in patterns)
+                        retained = [(t, v) for t, v in broker.retained.items() if any(topic_matches(p, t) for p in patterns)]
+                    for topic, payload in retained:
+                        raw = topic.encode("utf-8")
+                        self.send(_packet(3, 1, struct.pack("!H", len(raw)) + raw + payload))
+                elif kind == 12:  # PINGREQ
+                    self.send(_packet(13, 0, b""))
+                elif kind == 14:  # DISCONNECT
+                    break
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            with broker.lock:
+                broker.subscribers = [(p, h) for p, h in broker.subscribers if h is not self]
+
+
+# Clients --------------------------------------------------------------------
+class Recorder:
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+
+    def request(self, port: int, method: str, path: str, body: Optional[Dict] = None) -> None:
+        route = path.split("?", 1)[0]
+        data = json.dumps(body).encode("utf-8") if body is not None else None
+        headers = {"Content-Type": "application/json"} if data else {}
+        start = time.perf_counter()
+        ok = False
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+            conn.request(method, path, body=data, headers=headers)
+            resp = conn.getresponse()
+            resp.read()
+            conn.close()
+            ok = resp.status < 500
+        except Exception:
+            ok = False
+        elapsed = (time.perf_counter() - start) * 1000.0
+        with self.lock:
+            self.samples[route].append(elapsed)
+            if not ok:
+                self.errors[route] += 1
+
+
+def _sleep_until(deadline: float, stop: threading.Event, delay: float) -> bool:
+    """Sleep `delay` unless the run ends first; returns False when stopping."""
+    return not stop.wait(min(delay, max(0.0, deadline - time.monotonic())))
+
+
+def poller(rec: Recorder, port: int, stop: threading.Event, deadline: float) -> None:
+    # Stagger start like phones opening the page at different times.
+    stop.wait(random.uniform(0, 5))
+    due = {"status": 0.0, "temp": 0.0, "esp": 0.0}
+    t0 = time.monotonic()
+    while time.monotonic() < deadline and not stop.is_set():
+        now = time.monotonic() - t0
+        if now >= due["status"]:
+            rec.request(port, "GET", "/api/status")
+            rec.request(port, "GET", "/api/state")
+            due["status"] = now + 5.0
+        if now >= due["temp"]:
+            rec.request(port, "GET", "/api/pi-temp")
+            due["temp"] = now + 6.0
+        if now >= due["esp"]:
+            for ip in ("", "?ip=127.0.0.2", "?ip=127.0.0.3"):
+                rec.request(port, "GET", "/api/esp-status" + ip)
+            due["esp"] = now + 7.0
+        if not _sleep_until(deadline, stop, min(due.values()) - (time.monotonic() - t0)):
+            break
+
+
+def slider(rec: Recorder, port: int, stop: threading.Event, deadline: float, segments: List[str]) -> None:
+    stop.wait(random.uniform(0, 2))
+    while time.monotonic() < deadline and not stop.is_set():
+        camming = random.random() < 0.2
+        seg = random.choice(segments)
+        for step in range(random.randint(10, 30)):
+            value = 40 + (step * 7) % 200
+            if camming:
+                rec.request(port, "POST", "/api/esp3/set", {"pattern": "white", "brightness": value, "white_balance": 3000 + step * 50})
+            else:
+                rec.request(port, "POST", "/api/set", {"segment": seg, "pattern": "solid", "brightness": value, "color": [255, value, 40]})
+            if not _sleep_until(deadline, stop, 0.08):
+                return
+        if not _sleep_until(deadline, stop, random.uniform(1.0, 4.0)):
+            return
+
+
+def presets(rec: Recorder, port: int, stop: threading.Event, deadline: float) -> None:
+    stop.wait(random.uniform(0, 3))
+    names = ["loadtest-a", "loadtest-b"]
+    i = 0
+    while time.monotonic() < deadline and not stop.is_set():
+        rec.request(port, "POST", "/api/state/apply", {"name": names[i % 2]})
+        i += 1
+        if not _sleep_until(deadline, stop, random.uniform(3.0, 8.0)):
+            return
+
+
+# Harness --------------------------------------------------------------------
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, int(round(q * (len(ordered) - 1)))))
+    return ordered[idx]
+
+
+def summarize(rec: Recorder, duration: float) -> Dict:
+    routes = {}
+    for route, samples in sorted(rec.samples.items()):
+        routes[route] = {
+            "count": len(samples),
+            "errors": rec.errors.get(route, 0),
+            "p50": round(_percentile(samples, 0.50), 2),
+            "p99": round(_percentile(samples, 0.99), 2),
+            "max": round(max(samples), 2),
+        }
+    total = sum(r["count"] for r in routes.values())
+    return {"duration_s": duration, "requests": total, "rps": round(total / max(duration, 1e-9), 1), "routes": routes}
+
+
+def compare(result: Dict, baseline: Dict, tolerance: float = TOLERANCE) -> List[str]:
+    """Return human-readable regressions of `result` against `baseline`."""
+    problems = []
+    for route, base in baseline.get("routes", {}).items():
+        cur = result["routes"].get(route)
+        if cur is None:
+            continue
+        for key, slack in SLACK_MS.items():
+            if key == "p99" and min(cur["count"], base["count"]) < MIN_P99_SAMPLES:
+                continue
+            limit = base[key] * tolerance + slack
+            if cur[key] > limit:
+                problems.append(f"{route} {key} {cur[key]:.1f} ms > {limit:.1f} ms (baseline {base[key]:.1f})")
+        base_rate = base["errors"] / max(1, base["count"])
+        cur_rate = cur["errors"] / max(1, cur["count"])
+        if cur_rate > base_rate + ERROR_RATE_SLACK:
+            problems.append(f"{route} error rate {cur_rate:.1%} > baseline {base_rate:.1%}")
+    return problems
+
+
+def _seed_files(directory: str, segments: List[str]) -> None:
+    def snapshot(color):
+        return {"segments": {seg: {"pattern": "solid", "brightness": 150, "speed": 1.0, "color": color} for seg in segments}}
+
+    with open(os.path.join(directory, "led_states.json"), "w", encoding="utf-8") as f:
+        json.dump({"states": {"loadtest-a": snapshot([255, 0, 0]), "loadtest-b": snapshot([0, 0, 255])}}, f)
+    with open(os.path.join(directory, "esp3_states.json"), "w", encoding="utf-8") as f:
+        json.dump({"states": {}}, f)
+
+
+def isolated_env(workdir: str, broker_port: int) -> Dict[str, str]:
+    """Environment that keeps every file led_web writes inside `workdir`.
+
+    Without it a run appends to the live journal, outbox ring, shared-memory
+    table, health ring and captures of the installation it is started from.
+    """
+    return {
+        "MQTT_HOST": "127.0.0.1",
+        "MQTT_PORT": str(broker_port),
+        "LED_STATE_FILE": os.path.join(workdir, "led_states.json"),
+        "ESP3_STATE_FILE": os.path.join(workdir, "esp3_states.json"),
+        "LED_FEEDS_FILE": os.path.join(workdir, "feeds.json"),
+        "LED_JOURNAL_DIR": os.path.join(workdir, "journal"),
+        "LED_OUTBOX_PATH": os.path.join(workdir, "led_outbox.ring"),
+        "LED_SHM_PATH": os.path.join(workdir, "led_state.shm"),
+        "LED_HEALTH_PATH": os.path.join(workdir, "led_health.ring"),
+        "LED_CAPTURE_DIR": os.path.join(workdir, "captures"),
+        "ESP_IP": "127.0.0.1",
+        "ESP3_IP": "127.0.0.1",
+    }
+
+
+def run(pollers: int, sliders: int, preset_clients: int, duration: float) -> Tuple[Dict, FakeBroker]:
+    broker = FakeBroker()
+    broker.start()
+    workdir = tempfile.mkdtemp(prefix="led-loadtest-")
+    # led_web reads its configuration at import time.
+    os.environ.update(isolated_env(workdir, broker.port))
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import led_web
+    from werkzeug.serving import make_server
+
+    _seed_files(workdir, led_web.SEGMENTS)
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    server = make_server("127.0.0.1", 0, led_web.app, threaded=True)
+    threading.Thread(target=server.serve_forever, name="loadtest-http", daemon=True).start()
+    port = server.server_port
+
+    rec = Recorder()
+    stop = threading.Event()
+    deadline = time.monotonic() + duration
+    threads = [threading.Thread(target=poller, args=(rec, port, stop, deadline)) for _ in range(pollers)]
+    threads += [threading.Thread(target=slider, args=(rec, port, stop, deadline, led_web.SEGMENTS)) for _ in range(sliders)]
+    threads += [threading.Thread(target=presets, args=(rec, port, stop, deadline)) for _ in range(preset_clients)]
+    for t in threads:
+        t.daemon = True
+        t.start()
+    try:
+        for t in threads:
+            t.join(max(0.0, deadline - time.monotonic()) + 15)
+    except KeyboardInterrupt:
+        stop.set()
+    server.shutdown()
+    result = summarize(rec, duration)
+    result["clients"] = {"pollers": pollers, "sliders": sliders, "presets": preset_clients}
+    result["mqtt_messages"] = dict(broker.published)
+    broker.shutdown()
+    return result, broker
+
+
+def print_report(result: Dict) -> None:
+    print(f"{result['requests']} requests in {result['duration_s']:.0f} s ({result['rps']} req/s), clients {result['clients']}")
+    print(f"{'route':28} {'count':>7} {'errors':>7} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for route, r in result["routes"].items():
+        print(f"{route:28} {r['count']:7d} {r['errors']:7d} {r['p50']:8.1f} {r['p99']:8.1f} {r['max']:8.1f}")
+    print(f"MQTT messages: {result['mqtt_messages']}")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Load-test led_web.py against a local broker stand-in")
+    parser.add_argument("--pollers", type=int, default=20, help="Open UI tabs polling status")
+    parser.add_argument("--sliders", type=int, default=4, help="Clients dragging sliders (80 ms sends)")
+    parser.add_argument("--presets", type=int, default=2, help="Clients tapping presets")
+    parser.add_argument("--duration", type=float, default=30.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--baseline", help="Compare against this baseline JSON; exit 1 on regression")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    parser.add_argument("--save-baseline", help="Write the result as a new baseline")
+    parser.add_argument("--json", action="store_true", help="Print the raw result as JSON")
+    args = parser.parse_args(argv)
+
+    random.seed(args.seed)
+    result, _ = run(args.pollers, args.sliders, args.presets, args.duration)
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print_report(result)
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+        print(f"baseline written to {args.save_baseline}")
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        problems = compare(result, baseline, args.tolerance)
+        if problems:
+            print("REGRESSION:")
+            for line in problems:
+                print(f"  {line}")
+            return 1
+        print("no regressions against baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
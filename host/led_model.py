@@ -0,0 +1,424 @@
+"""
+Slotted command / segment-state model for the web API.
+
+- `Command.from_request()` runs one table-driven validator built from
+  `COMMAND_FIELDS` and raises `CommandError` for wrong types or out-of-range
+  values instead of failing deep inside a handler.
+- `Command` and `SegmentState` cache their `set` payload and the checked MQTT
+  bodies per topic; a `SegmentState` drops them only when an update actually
+  changes a field.
+- `SegmentStates` keeps one `SegmentState` per segment in step with the state
+  store's (immutable) entries, so diffs and retained payloads skip re-thawing
+  and re-encoding unchanged state.
+- `merge_sets()` folds queued `set` commands for one segment into one.
+Microbenchmark:
+    python led_model.py bench
+"""
+from __future__ import annotations
+
+import os
+import sys
+import threading
+import timeit
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple
+
+from led_payload import encode, prepare_messages
+from led_trace import traced
+
+
+class CommandError(ValueError):
+    """A `set` request with a missing, malformed or out-of-range field."""
+
+
+# name, kind, default (None = optional), low, high
+COMMAND_FIELDS: Sequence[Tuple[str, str, Any, Optional[float], Optional[float]]] = (
+    ("segment", "str", "strip1", None, None),
+    ("pattern", "str", "solid", None, None),
+    ("brightness", "num", 255.0, 0, 255),
+    ("speed", "num", 1.0, 0, 100),
+    ("color", "rgb", [0, 180, 160], None, None),
+    ("wave_shape", "str", None, None, None),
+    ("wave_count", "num", 1.0, 0, 1000),
+    ("mic_gain", "num", None, -100, 100),
+    ("mic_floor", "num", None, 0, 1),
+    ("mic_smooth", "num", None, 0, 1),
+    ("mic_enabled", "bool", None, None, None),
+    ("gradient_low", "rgb", None, None, None),
+    ("gradient_mid", "rgb", None, None, None),
+    ("gradient_high", "rgb", None, None, None),
+    ("gradient_enabled", "bool", None, None, None),
+    ("mic_beat", "bool", None, None, None),
+)
+MAX_TEXT = 32
+# Cache keys sent at the top level of a `set`; everything else goes in params.
+TOP_LEVEL_FIELDS = ("pattern", "brightness", "speed")
+# Param order matters to the firmware: `color` clears gradient mode, `gradient_*`
+# re-enables it and `gradient_enabled` has the last word.
+PARAM_ORDER = ("color", "wave_shape", "wave_count", "mic_gain", "mic_floor", "mic_smooth", "mic_enabled", "mic_beat",
+               "gradient_low", "gradient_mid", "gradient_high", "gradient_enabled")
+# Optional Command fields that only overwrite the cache when sent.
+OPTIONAL_STATE_FIELDS = tuple(name for name, _, default, _, _ in COMMAND_FIELDS if default is None and name != "wave_shape")
+GRADIENT_SENSITIVE = ("color", "gradient_low", "gradient_mid", "gradient_high")
+STATE_FIELDS = TOP_LEVEL_FIELDS + PARAM_ORDER + ("wind_mph",)
+
+
+def _num(value: Any, field: str, low: float, high: float) -> float:
+    cls = value.__class__
+    if cls is int:
+        value = float(value)
+    elif cls is not float:
+        if cls is bool:
+            raise CommandError(f"{field} must be a number")
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            raise CommandError(f"{field} must be a number") from None
+    if not low <= value <= high:  # also rejects NaN
+        raise CommandError(f"{field} must be within {low}..{high}")
+    return value
+
+
+def _rgb(value: Any, field: str) -> List[int]:
+    if value.__class__ is list and len(value) == 3:
+        r, g, b = value
+        if r.__class__ is int and g.__class__ is int and b.__class__ is int and 0 <= r <= 255 and 0 <= g <= 255 and 0 <= b <= 255:
+            return [r, g, b]
+    if not isinstance(value, (list, tuple)) or len(value) < 3:
+        raise CommandError(f"{field} must be [r, g, b]")
+    try:
+        rgb = [int(value[0]), int(value[1]), int(value[2])]
+    except (TypeError, ValueError):
+        raise CommandError(f"{field} must be [r, g, b]") from None
+    if not (0 <= rgb[0] <= 255 and 0 <= rgb[1] <= 255 and 0 <= rgb[2] <= 255):
+        raise CommandError(f"{field} values must be within 0..255")
+    return rgb
+
+
+def _bool(value: Any, field: str) -> bool:
+    if value is True or value is False:
+        return value
+    if value in (0, 1) and not isinstance(value, float):
+        return bool(value)
+    raise CommandError(f"{field} must be true/false")
+
+
+def _str(value: Any, field: str) -> str:
+    if value.__class__ is not str or len(value) > MAX_TEXT:
+        raise CommandError(f"{field} must be a string of at most {MAX_TEXT} characters")
+    return value
+
+
+_CHECKS = {"num": _num, "rgb": _rgb, "bool": _bool, "str": _str}
+
+
+def make_parser(fields=COMMAND_FIELDS):
+    """Build `parse(obj, data)` that validates `data` into `obj`'s attributes.
+
+    The field table is resolved once into a defaults row and a name -> check
+    map, so a request costs one attribute store per field plus one check per
+    key it actually sends; unknown keys are ignored and `None` counts as absent.
+    """
+    defaults = tuple((name, default, isinstance(default, list)) for name, _, default, _, _ in fields)
+    checks = {name: (_CHECKS[kind], (low, high) if kind == "num" else ()) for name, kind, _, low, high in fields}
+
+    def parse(obj: Any, data: Mapping[str, Any]) -> None:
+        for name, default, copy in defaults:
+            setattr(obj, name, list(default) if copy else default)
+        for name, value in data.items():
+            row = checks.get(name)
+            if row is not None and value is not None:
+                setattr(obj, name, row[0](value, name, *row[1]))
+
+    return parse
+
+
+_parse = make_parser()
+
+
+class Command:
+    """One validated `set` request; treat as immutable (payload/bodies are cached)."""
+
+    __slots__ = tuple(name for name, *_ in COMMAND_FIELDS) + ("_payload", "_messages")
+
+    @classmethod
+    @traced("parse_command")
+    def from_request(cls, data: Any) -> "Command":
+        if not isinstance(data, dict):
+            raise CommandError("request body must be a JSON object")
+        cmd = cls.__new__(cls)
+        _parse(cmd, data)
+        cmd._payload = None
+        cmd._messages = None
+        return cmd
+
+    def to_payload(self) -> Dict:
+        if self._payload is None:
+            params: Dict = {"color": self.color}
+            if self.wave_shape:
+                params["wave_shape"] = self.wave_shape
+            params["wave_count"] = self.wave_count
+            for key in ("mic_gain", "mic_floor", "mic_smooth", "mic_enabled", "gradient_low", "gradient_mid",
+                        "gradient_high", "gradient_enabled", "mic_beat"):
+                value = getattr(self, key)
+                if value is not None:
+                    params[key] = value
+            self._payload = {
+                "cmd": "set",
+                "segment": self.segment,
+                "pattern": self.pattern,
+                "brightness": self.brightness,
+                "speed": self.speed,
+                "params": params,
+            }
+        return self._payload
+
+    payload = to_payload
+
+    def messages(self, topic: str, main_topic: str) -> List[bytes]:
+        """Checked (possibly split) MQTT bodies for `topic`, encoded once."""
+        if self._messages is None or self._messages[0] != topic:
+            payload = self.to_payload()
+            params = payload["params"]
+            # Flat payload: one slot per member plus three per [r, g, b] param.
+            nodes = len(payload) + len(params) + 3 * sum(1 for v in params.values() if v.__class__ is list)
+            self._messages = (topic, prepare_messages(payload, topic, main_topic, nodes=nodes))
+        return self._messages[1]
+
+    def state(self) -> Dict:
+        """Cache fields for this command; optional fields keep their cached value when omitted."""
+        values = {
+            "segment": self.segment,
+            "pattern": self.pattern,
+            "brightness": self.brightness,
+            "speed": self.speed,
+            "color": self.color,
+            "wave_shape": self.wave_shape or "",
+            "wave_count": self.wave_count,
+        }
+        for key in OPTIONAL_STATE_FIELDS:
+            value = getattr(self, key)
+            if value is not None:
+                values[key] = value
+        return values
+
+    def __repr__(self) -> str:
+        return f"Command({self.to_payload()!r})"
+
+
+def merge_sets(payloads: Sequence[Mapping[str, Any]]) -> Dict[str, Any]:
+    """One `set` with the effect of applying `payloads` (same segment) in order.
+
+    Later fields win; the gradient mode the sequence would have left behind is
+    made explicit with `gradient_enabled`, which the firmware applies last.
+    """
+    merged: Dict[str, Any] = {}
+    params: Dict[str, Any] = {}
+    gradient: Optional[bool] = None
+    for payload in payloads:
+        if payload.get("cmd") != "set":
+            raise CommandError(f"cannot merge a {payload.get('cmd')!r} command")
+        merged.update((k, v) for k, v in payload.items() if k != "params")
+        extra = payload.get("params") or {}
+        params.update(extra)
+        if "gradient_enabled" in extra:
+            gradient = bool(extra["gradient_enabled"])
+        elif any(k in extra for k in GRADIENT_SENSITIVE[1:]):
+            gradient = True
+        elif "color" in extra:
+            gradient = False
+    if params:
+        ordered = {k: params[k] for k in PARAM_ORDER if k in params}
+        ordered.update((k, v) for k, v in params.items() if k not in ordered)
+        if gradient is not None:
+            ordered.pop("gradient_enabled", None)
+            ordered["gradient_enabled"] = gradient
+        merged["params"] = ordered
+    return merged
+
+
+def _plain(value: Any) -> Any:
+    # State store entries freeze lists into tuples; compare and encode as lists.
+    return [_plain(v) for v in value] if isinstance(value, tuple) else value
+
+
+class SegmentState:
+    """Full cached state of one segment with its encoded `set` payload."""
+
+    __slots__ = ("segment",) + STATE_FIELDS + ("extra", "_source", "_payload", "_body", "_messages")
+
+    def __init__(self, segment: str, values: Optional[Mapping[str, Any]] = None) -> None:
+        self.segment = segment
+        for key in STATE_FIELDS:
+            setattr(self, key, None)
+        self.extra: Dict[str, Any] = {}
+        self._source: Any = None
+        self._invalidate()
+        if values:
+            self.update(values)
+
+    def _invalidate(self) -> None:
+        self._payload = None
+        self._body = None
+        self._messages: Dict[str, List[bytes]] = {}
+
+    def get(self, key: str, default: Any = None) -> Any:
+        if key in _STATE_FIELD_SET:
+            value = getattr(self, key)
+            return default if value is None else value
+        return self.extra.get(key, default)
+
+    def update(self, values: Mapping[str, Any]) -> List[str]:
+        """Merge `values`; returns the fields that changed (cached bodies are kept if none did)."""
+        changed = []
+        for key, value in values.items():
+            if key == "segment":
+                continue
+            value = _plain(value)
+            if key in _STATE_FIELD_SET:
+                if getattr(self, key) != value:
+                    setattr(self, key, value)
+                    changed.append(key)
+            elif self.extra.get(key) != value:
+                self.extra[key] = value
+                changed.append(key)
+        if changed:
+            self._invalidate()
+        return changed
+
+    def as_dict(self) -> Dict[str, Any]:
+        out = {"segment": self.segment}
+        out.update((key, getattr(self, key)) for key in STATE_FIELDS if getattr(self, key) is not None)
+        out.update(self.extra)
+        return out
+
+    def diff(self, target: Mapping[str, Any]) -> Dict[str, Any]:
+        """Fields of `target` that differ from this state.
+
+        Re-sending `color` or a gradient stop flips the firmware's gradient mode,
+        so `gradient_enabled` rides along whenever one of those goes out.
+        """
+        get = self.get
+        diff = {k: v for k, v in target.items() if k != "segment" and v not in (None, "") and get(k) != v}
+        if target.get("gradient_enabled") is not None and any(k in diff for k in GRADIENT_SENSITIVE):
+            diff["gradient_enabled"] = target["gradient_enabled"]
+        return diff
+
+    def payload(self) -> Dict[str, Any]:
+        if self._payload is None:
+            payload: Dict[str, Any] = {"cmd": "set", "segment": self.segment}
+            for key in TOP_LEVEL_FIELDS:
+                value = getattr(self, key)
+                if value is not None:
+                    payload[key] = value
+            params = {key: getattr(self, key) for key in PARAM_ORDER if getattr(self, key) is not None}
+            if self.wind_mph is not None:
+                params["wind_mph"] = self.wind_mph
+            params.update(self.extra)
+            if params:
+                payload["params"] = params
+            self._payload = payload
+        return self._payload
+
+    def body(self) -> bytes:
+        if self._body is None:
+            self._body = encode(self.payload())
+        return self._body
+
+    def messages(self, topic: str, main_topic: str) -> List[bytes]:
+        bodies = self._messages.get(topic)
+        if bodies is None:
+            bodies = self._messages[topic] = prepare_messages(self.payload(), topic, main_topic, self.body())
+        return bodies
+
+
+_STATE_FIELD_SET = frozenset(STATE_FIELDS)
+
+
+class SegmentStates:
+    """One `SegmentState` per segment, refreshed from state store entries by identity."""
+
+    def __init__(self) -> None:
+        self._states: Dict[str, SegmentState] = {}
+        self._lock = threading.Lock()
+
+    def _view(self, segment: str, entry: Optional[Mapping[str, Any]]) -> SegmentState:
+        state = self._states.get(segment)
+        if state is None:
+            state = self._states[segment] = SegmentState(segment)
+        if entry is not None and state._source is not entry:
+            # Entries are immutable and replaced on every commit, so identity tells us it changed.
+            state.update(entry)
+            state._source = entry
+        return state
+
+    def diff(self, segment: str, entry: Optional[Mapping[str, Any]], target: Mapping[str, Any]) -> Dict[str, Any]:
+        with self._lock:
+            return self._view(segment, entry).diff(target)
+
+    def encoded(self, segment: str, entry: Mapping[str, Any]) -> Tuple[Dict[str, Any], bytes]:
+        """(payload, body) of the full state in `entry`."""
+        with self._lock:
+            state = self._view(segment, entry)
+            return state.payload(), state.body()
+
+
+# Microbenchmark --------------------------------------------------------------
+BENCH_REQUESTS = {
+    "small": {"segment": "strip1", "pattern": "solid", "brightness": 120, "color": [255, 80, 0]},
+    "full": {
+        "segment": "strip1", "pattern": "mic_vu", "brightness": 120, "speed": 1.5, "color": [255, 80, 0],
+        "wave_shape": "sine", "wave_count": 4, "mic_gain": 0.4, "mic_floor": 0.02, "mic_smooth": 0.3,
+        "mic_enabled": True, "gradient_low": [0, 120, 255], "gradient_mid": [255, 255, 255],
+        "gradient_high": [255, 0, 120], "gradient_enabled": True,
+    },
+}
+
+
+def bench(number: int = 20000) -> Dict[str, Dict[str, float]]:
+    """Microseconds per call for the per-request parse/encode steps.
+
+    `legacy_*` times the same requests through the old unvalidated parser
+    (tests/legacy_command.py), so the before/after numbers come from one run
+    on one machine.
+    """
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "tests"))
+    from legacy_command import LegacyCommand
+    topic = "led/cmd"
+    results = {}
+    for name, data in BENCH_REQUESTS.items():
+        def per_call(fn) -> float:
+            # best of 5 runs: the minimum is the least scheduler-noisy estimate
+            runs = max(number // 5, 1)
+            return round(min(timeit.repeat(fn, number=runs, repeat=5)) / runs * 1e6, 2)
+
+        cmd = Command.from_request(data)
+        cmd.messages(topic, topic)
+        state = SegmentState("strip1", cmd.state())
+        state.messages(topic, topic)
+        entry = dict(cmd.state(), brightness=121)
+        results[name] = {
+            "parse": per_call(lambda: Command.from_request(data)),
+            "parse_encode": per_call(lambda: Command.from_request(data).messages(topic, topic)),
+            "legacy_parse": per_call(lambda: LegacyCommand.from_request(data)),
+            "legacy_parse_encode": per_call(
+                lambda: prepare_messages(LegacyCommand.from_request(data).to_payload(), topic, topic)),
+            "cached_messages": per_call(lambda: cmd.messages(topic, topic)),
+            "state_update_noop": per_call(lambda: state.update(cmd.state())),
+            "state_update_encode": per_call(lambda: (state.update(entry), state.messages(topic, topic),
+                                                     state.update(cmd.state()), state.messages(topic, topic))) / 2,
+        }
+    return results
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    argv = list(sys.argv[1:] if argv is None else argv)
+    if argv[:1] != ["bench"]:
+        print(__doc__)
+        return 2
+    for name, timings in bench().items():
+        print(f"{name:>6}: " + "  ".join(f"{k} {v:.2f}us" for k, v in timings.items()))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
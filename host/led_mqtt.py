@@ -0,0 +1,408 @@
+"""
+Long-lived MQTT publisher with per-message delivery modes.
+
+- One paho connection per process, opened on first use (and again after a
+  fork) and kept up by paho's network thread, instead of a connect / publish /
+  disconnect per request.
+- QoS 0: fire and forget; `send()` returns once paho has written the packet.
+- QoS 1: at most `window` messages wait for a PUBACK at a time; each waits up
+  to `ack_timeout` and is re-published up to `retries` times before
+  `DeliveryError`. A newer `send()` for the same key (e.g. topic + segment)
+  supersedes older ones still queued or unacknowledged, so a retry never
+  re-applies stale state.
+- `led_mqtt_ack_seconds{kind,qos}`: publish -> PUBACK for QoS 1, publish ->
+  written to the socket for QoS 0; plus retry / superseded / failure counters.
+- Connecting happens on a background thread guarded by a `CircuitBreaker`:
+  `connect()` waits at most `connect_wait` and, once the broker is known to be
+  down, raises `BrokerUnavailable` at once instead of blocking in TCP connect.
+  The dialer (or paho's own reconnect) probes with exponential backoff and
+  the first successful CONNACK closes the breaker.
+"""
+from __future__ import annotations
+
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import paho.mqtt.client as mqtt
+
+from led_metrics import REGISTRY
+
+ACK_SECONDS = REGISTRY.histogram(
+    "led_mqtt_ack_seconds", "Publish to PUBACK (QoS 1) or to socket write (QoS 0)", ["kind", "qos"]
+)
+RETRIES = REGISTRY.counter("led_mqtt_retries_total", "QoS 1 messages re-published after an ack timeout", ["kind"])
+SUPERSEDED = REGISTRY.counter(
+    "led_mqtt_superseded_total", "QoS 1 messages dropped because a newer one for the same key was sent", ["kind"]
+)
+FAILURES = REGISTRY.counter("led_mqtt_delivery_failures_total", "Messages not acknowledged after all retries", ["kind"])
+INFLIGHT = REGISTRY.gauge("led_mqtt_inflight", "QoS 1 messages waiting for a PUBACK")
+BREAKER_OPEN = REGISTRY.gauge("led_mqtt_breaker_open", "1 while the broker is considered down")
+BREAKER_TRIPS = REGISTRY.counter("led_mqtt_breaker_trips_total", "Times the broker circuit breaker opened")
+FAST_FAILS = REGISTRY.counter("led_mqtt_fast_fail_total", "Connects refused at once because the breaker was open")
+
+
+class DeliveryError(RuntimeError):
+    """The broker is unreachable or did not acknowledge a QoS 1 message."""
+
+
+class BrokerUnavailable(ConnectionError):
+    """No broker connection right now (breaker open or still connecting)."""
+
+
+class CircuitBreaker:
+    """Consecutive-failure breaker with an exponential retry schedule.
+
+    Closed: callers go ahead. After `threshold` failures in a row it opens
+    and `allow()` is False until a probe succeeds; `retry_at` is when the next
+    probe is due (`backoff`, doubling up to `max_backoff`). `clock` is
+    injectable for tests.
+    """
+
+    def __init__(
+        self,
+        threshold: int = 1,
+        backoff: float = 0.5,
+        max_backoff: float = 30.0,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        self.threshold = max(1, threshold)
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.clock = clock
+        self._lock = threading.Lock()
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.retry_at = 0.0
+        self.last_error: Optional[str] = None
+
+    @property
+    def open(self) -> bool:
+        return self.opened_at is not None
+
+    def allow(self) -> bool:
+        return self.opened_at is None
+
+    def success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.retry_at = 0.0
+        BREAKER_OPEN.set(0)
+
+    def failure(self, error: object) -> float:
+        """Record a failure; returns seconds until the next probe."""
+        with self._lock:
+            self.failures += 1
+            self.last_error = str(error)
+            delay = min(self.max_backoff, self.backoff * 2 ** max(0, self.failures - self.threshold))
+            self.retry_at = self.clock() + delay
+            if self.opened_at is None and self.failures >= self.threshold:
+                self.opened_at = self.clock()
+                BREAKER_TRIPS.inc()
+                BREAKER_OPEN.set(1)
+            return delay
+
+    def describe(self) -> str:
+        now = self.clock()
+        since = now - (self.opened_at or now)
+        return f"down for {since:.0f}s ({self.last_error}); next probe in {max(0.0, self.retry_at - now):.1f}s"
+
+    def status(self) -> Dict:
+        return {
+            "state": "open" if self.open else "closed",
+            "failures": self.failures,
+            "opened_at": self.opened_at,
+            "next_probe_in": round(max(0.0, self.retry_at - self.clock()), 1) if self.open else None,
+            "last_error": self.last_error,
+        }
+
+
+class _Pending:
+    __slots__ = ("topic", "body", "qos", "retain", "kind", "key", "token", "mid", "sent_at", "acked", "attempts",
+                 "slot")
+
+    def __init__(self, topic: str, body: bytes, qos: int, retain: bool, kind: str, key, token) -> None:
+        self.topic = topic
+        self.body = body
+        self.qos = qos
+        self.retain = retain
+        self.kind = kind
+        self.key = key
+        self.token = token
+        self.mid = -1
+        self.sent_at = 0.0
+        self.acked = threading.Event()
+        self.attempts = 0
+        self.slot = False  # holds one of the Publisher's window slots
+
+
+class Publisher:
+    def __init__(
+        self,
+        host: str,
+        port: int = 1883,
+        username: Optional[str] = None,
+        password: Optional[str] = None,
+        client_id: str = "led-publisher",
+        window: int = 16,
+        ack_timeout: float = 1.0,
+        retries: int = 2,
+        keepalive: int = 30,
+        connect_wait: float = 0.25,
+        breaker: Optional[CircuitBreaker] = None,
+    ) -> None:
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.client_id = client_id
+        self.window = max(1, window)
+        self.ack_timeout = ack_timeout
+        self.retries = max(0, retries)
+        self.keepalive = keepalive
+        self.connect_wait = connect_wait
+        self.breaker = breaker or CircuitBreaker()
+        self._client: Optional[mqtt.Client] = None
+        self._dialer: Optional[threading.Thread] = None
+        self._connect_listeners: List[Callable[[], None]] = []
+        self._pid = 0
+        self._connect_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.window)
+        self._connected = threading.Event()
+        self._inflight: Dict[int, _Pending] = {}
+        self._early: Dict[int, float] = {}  # acks that arrived before publish() returned the mid
+        self._latest: Dict[object, object] = {}
+
+    # Connection --------------------------------------------------------------
+    def connect(self) -> mqtt.Client:
+        """The connected client for this process; raises BrokerUnavailable rather than block."""
+        if self._pid != os.getpid():
+            self._reset_after_fork()
+        client = self._client
+        if client is not None and self._connected.is_set():
+            return client
+        if not self.breaker.allow():
+            FAST_FAILS.inc()
+            raise BrokerUnavailable(f"broker {self.host}:{self.port} {self.breaker.describe()}")
+        if client is None:
+            self._start_dialer()
+        # Either the dialer or paho's reconnect (existing client) sets this; a
+        # refused connect opens the breaker, so stop waiting as soon as it does.
+        deadline = time.monotonic() + self.connect_wait
+        while not self._connected.wait(0.01):
+            if not self.breaker.allow():
+                raise BrokerUnavailable(f"broker {self.host}:{self.port} {self.breaker.describe()}")
+            if time.monotonic() >= deadline:
+                raise BrokerUnavailable(f"no connection to {self.host}:{self.port} within {self.connect_wait}s")
+        return self._client
+
+    def _reset_after_fork(self) -> None:
+        with self._connect_lock:
+            if self._pid == os.getpid():
+                return
+            # Forked child: the parent's client, dialer and slot accounting are not ours.
+            self._client, self._dialer = None, None
+            self._slots = threading.BoundedSemaphore(self.window)
+            self._inflight.clear()
+            self._early.clear()
+            self._connected.clear()
+            self._pid = os.getpid()
+
+    def _start_dialer(self) -> None:
+        with self._connect_lock:
+            if self._client is None and (self._dialer is None or not self._dialer.is_alive()):
+                self._dialer = threading.Thread(target=self._dial, name="mqtt-dial", daemon=True)
+                self._dialer.start()
+
+    def _dial(self) -> None:
+        """Connect, retrying on the breaker's backoff until the first CONNACK."""
+        while True:
+            client = mqtt.Client(client_id=f"{self.client_id}-{os.getpid()}")
+            if self.username:
+                client.username_pw_set(self.username, self.password)
+            client.on_connect = self._on_connect
+            client.on_disconnect = self._on_disconnect
+            client.on_publish = self._on_publish
+            client.max_inflight_messages_set(self.window)
+            client.reconnect_delay_set(self.breaker.backoff, self.breaker.max_backoff)
+            client.connect_timeout = max(1.0, self.ack_timeout)
+            # Set before connecting: on_connect may fire before connect() returns here.
+            self._client = client
+            failures = self.breaker.failures
+            try:
+                client.connect(self.host, self.port, keepalive=self.keepalive)
+                client.loop_start()
+                deadline = time.monotonic() + self.ack_timeout + 2.0
+                while not self._connected.wait(0.05):
+                    if self.breaker.failures > failures:
+                        raise ConnectionRefusedError(self.breaker.last_error)
+                    if time.monotonic() >= deadline:
+                        raise ConnectionError(f"no CONNACK from {self.host}:{self.port}")
+            except Exception as exc:
+                self._client = None
+                # Close the abandoned attempt, or every retry leaks a socket (and a paho thread).
+                client.disconnect()
+                client.loop_stop()
+                if self.breaker.failures <= failures:  # a refused CONNACK is counted in _on_connect
+                    self.breaker.failure(exc)
+                time.sleep(max(0.0, self.breaker.retry_at - self.breaker.clock()))
+                continue
+            return
+
+    def _on_connect(self, client, userdata, flags, rc) -> None:
+        if rc == 0:
+            self.breaker.success()
+            self._connected.set()
+            for listener in self._connect_listeners:
+                listener()
+        else:
+            self.breaker.failure(f"connection refused: {mqtt.connack_string(rc)}")
+
+    def _on_disconnect(self, client, userdata, rc) -> None:
+        was_up = self._connected.is_set()
+        self._connected.clear()
+        # paho also calls this after a refused CONNACK, which _on_connect already counted.
+        if rc != 0 and was_up:
+            # paho's loop thread reconnects on the same backoff and on_connect closes the breaker.
+            self.breaker.failure(f"connection lost: {mqtt.error_string(rc)}")
+
+    def _on_publish(self, client, userdata, mid) -> None:
+        now = time.perf_counter()
+        with self._lock:
+            pending = self._inflight.pop(mid, None)
+            if pending is None:
+                self._early[mid] = now
+                return
+        self._acked(pending, now)
+
+    def _acked(self, pending: _Pending, now: float) -> None:
+        ACK_SECONDS.observe(now - pending.sent_at, kind=pending.kind, qos=str(pending.qos))
+        # Free the window slot now, not when the whole batch is done, so later messages can go out.
+        self._release(pending)
+        pending.acked.set()
+
+    def _release(self, pending: _Pending) -> None:
+        with self._lock:
+            held, pending.slot = pending.slot, False
+        if held:
+            self._slots.release()
+            INFLIGHT.inc(-1)
+
+    def connected(self) -> bool:
+        return self._client is not None and self._pid == os.getpid() and self._connected.is_set()
+
+    def add_connect_listener(self, listener: Callable[[], None]) -> None:
+        """Call `listener()` (on paho's thread) after every successful (re)connect."""
+        self._connect_listeners.append(listener)
+
+    def status(self) -> Dict:
+        return {"connected": self.connected(), "breaker": self.breaker.status()}
+
+    def close(self) -> None:
+        client, self._client = self._client, None
+        if client is not None and self._pid == os.getpid():
+            client.disconnect()
+            client.loop_stop()
+
+    # Publishing --------------------------------------------------------------
+    def _publish(self, client: mqtt.Client, pending: _Pending) -> None:
+        pending.attempts += 1
+        pending.sent_at = time.perf_counter()
+        # Not under self._lock: paho runs on_publish while holding its own message lock.
+        info = client.publish(pending.topic, pending.body, qos=pending.qos, retain=pending.retain)
+        if info.rc not in (mqtt.MQTT_ERR_SUCCESS, mqtt.MQTT_ERR_NO_CONN):
+            raise DeliveryError(f"publish to {pending.topic} failed: {mqtt.error_string(info.rc)}")
+        with self._lock:
+            pending.mid = info.mid
+            early = self._early.pop(info.mid, None)
+            if early is None:
+                self._inflight[info.mid] = pending
+            if len(self._early) > 1024:
+                self._early.clear()
+        if early is not None:
+            self._acked(pending, early)
+
+    def _superseded(self, pending: _Pending) -> bool:
+        return pending.key is not None and self._latest.get(pending.key) is not pending.token
+
+    def _forget(self, pending: _Pending) -> None:
+        with self._lock:
+            if self._inflight.get(pending.mid) is pending:
+                del self._inflight[pending.mid]
+
+    def send(
+        self,
+        messages: Sequence[Tuple[str, bytes]],
+        qos: int = 0,
+        kind: str = "command",
+        retain: bool = False,
+        keys: Optional[Sequence[object]] = None,
+    ) -> Dict[str, int]:
+        """Publish `messages` in order and wait for their delivery at `qos`.
+
+        `keys` (one per message) let a later send supersede this one; parts of
+        one split command should share a key. Returns counts of
+        sent/superseded messages; raises DeliveryError when a message is not
+        acknowledged after all retries.
+        """
+        client = self.connect()
+        token = object()
+        pendings = [
+            _Pending(topic, body, qos, retain, kind, keys[i] if keys else None, token)
+            for i, (topic, body) in enumerate(messages)
+        ]
+        with self._lock:
+            for key in {p.key for p in pendings if p.key is not None}:
+                self._latest[key] = token
+        if qos == 0:
+            for pending in pendings:
+                self._publish(client, pending)
+            deadline = time.monotonic() + self.ack_timeout
+            for pending in pendings:
+                if not pending.acked.wait(max(0.0, deadline - time.monotonic())):
+                    self._forget(pending)
+                    FAILURES.inc(kind=kind)
+                    raise DeliveryError(f"{pending.topic}: not written within {self.ack_timeout}s")
+            return {"sent": len(pendings), "superseded": 0}
+        return self._send_acked(client, pendings, kind)
+
+    def _send_acked(self, client: mqtt.Client, pendings: List[_Pending], kind: str) -> Dict[str, int]:
+        held: List[_Pending] = []
+        superseded = 0
+        patience = self.ack_timeout * (self.retries + 1)
+        try:
+            for pending in pendings:
+                if not self._slots.acquire(timeout=patience):
+                    FAILURES.inc(kind=kind)
+                    raise DeliveryError(f"in-flight window of {self.window} stayed full for {patience:.1f}s")
+                if self._superseded(pending):
+                    self._slots.release()
+                    superseded += 1
+                    continue
+                pending.slot = True
+                held.append(pending)
+                INFLIGHT.inc()
+                self._publish(client, pending)
+            for pending in held:
+                while not pending.acked.wait(self.ack_timeout):
+                    self._forget(pending)
+                    if self._superseded(pending):
+                        superseded += 1
+                        break
+                    if pending.attempts > self.retries:
+                        FAILURES.inc(kind=kind)
+                        raise DeliveryError(
+                            f"{pending.topic}: no PUBACK after {pending.attempts} attempts of {self.ack_timeout}s"
+                        )
+                    RETRIES.inc(kind=kind)
+                    self._publish(client, pending)
+        finally:
+            for pending in held:
+                self._forget(pending)
+                self._release(pending)
+        if superseded:
+            SUPERSEDED.inc(superseded, kind=kind)
+        return {"sent": len(pendings) - superseded, "superseded": superseded}
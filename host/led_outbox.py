@@ -0,0 +1,376 @@
+"""
+Disk-backed store-and-forward queue for commands the broker did not take.
+
+- `Outbox` is a fixed-size ring file (default led_outbox.ring in
+  led_shared.state_dir()): a header with head/tail sequence numbers and
+  `slots` fixed-size records. A command that cannot be delivered (broker
+  restarting or unreachable) is appended instead of failing the request;
+  while anything is queued, later commands are appended behind it so they
+  are not overtaken.
+- `flush()` merges the queue down to the latest command per topic + segment
+  (via the `merge` callback, else the newest one wins) and sends the rest
+  oldest first. The head only moves once everything read was delivered, so a
+  failed flush is retried as a whole.
+- A full ring is compacted the same way before the oldest record is dropped.
+- Records carry a CRC32; a record torn by a crash is skipped on recovery.
+- `Forwarder` retries the flush in the background.
+- Workers of `led_serve.py` append to the same file under flock; the leader
+  flushes.
+Layout (little-endian):
+    header  magic "LEDQ", layout u16, slots u16, slot_size u32, head u64, tail u64,
+            generation u64, dropped u64 (padded to 64 bytes)
+    record  seq u64, group u64, queued_at f64, crc32 u32, topic_len u16,
+            key_len u16 (0xffff: no key), body_len u16, kind_len u8, flags u8 (1: retain),
+            then topic, key, kind and body bytes
+Inspect:
+    python led_outbox.py [--path FILE]
+"""
+from __future__ import annotations
+
+import argparse
+import fcntl
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from led_metrics import REGISTRY
+from led_shared import state_dir
+
+MAGIC = b"LEDQ"
+LAYOUT = 1
+HEADER = struct.Struct("<4sHHIQQQQ")
+HEADER_SIZE = 64
+RECORD = struct.Struct("<QQdIHHHBB")
+NO_KEY = 0xFFFF
+
+QUEUED = REGISTRY.counter("led_outbox_queued_total", "Messages stored while the broker was unavailable", ["topic"])
+FLUSHED = REGISTRY.counter("led_outbox_flushed_total", "Queued messages delivered after merging")
+MERGED = REGISTRY.counter("led_outbox_merged_total", "Queued commands folded into a later one for the same segment")
+DROPPED = REGISTRY.counter("led_outbox_dropped_total", "Queued messages lost to a full ring or an oversized record")
+DEPTH = REGISTRY.gauge("led_outbox_depth", "Messages waiting in the outbox")
+
+# (messages [(topic, body)], kind, retain, keys) -> raises when not delivered
+Sender = Callable[[List[Tuple[str, bytes]], str, bool, List[Optional[str]]], None]
+# (topic, [bodies of each queued command, oldest first]) -> merged bodies, or None to keep the newest
+Merger = Callable[[str, List[List[bytes]]], Optional[List[bytes]]]
+
+
+def default_path() -> str:
+    return os.path.join(state_dir(), "led_outbox.ring")
+
+
+class Record:
+    __slots__ = ("seq", "group", "queued_at", "topic", "key", "kind", "retain", "body")
+
+    def __init__(self, seq: int, group: int, queued_at: float, topic: str, key: Optional[str], kind: str,
+                 retain: bool, body: bytes) -> None:
+        self.seq = seq
+        self.group = group
+        self.queued_at = queued_at
+        self.topic = topic
+        self.key = key
+        self.kind = kind
+        self.retain = retain
+        self.body = body
+
+    def pack(self, slot_size: int) -> bytes:
+        topic, kind = self.topic.encode("utf-8"), self.kind.encode("utf-8")
+        key = b"" if self.key is None else self.key.encode("utf-8")
+        data = topic + key + kind + self.body
+        if RECORD.size + len(data) > slot_size:
+            raise ValueError(f"{len(data)}-byte record does not fit a {slot_size}-byte slot")
+        head = RECORD.pack(self.seq, self.group, self.queued_at, zlib.crc32(data), len(topic),
+                           NO_KEY if self.key is None else len(key), len(self.body), len(kind), int(self.retain))
+        return head + data
+
+    @classmethod
+    def unpack(cls, raw: bytes) -> Optional["Record"]:
+        seq, group, queued_at, crc, topic_len, key_len, body_len, kind_len, flags = RECORD.unpack_from(raw, 0)
+        size = topic_len + (0 if key_len == NO_KEY else key_len) + kind_len + body_len
+        data = raw[RECORD.size:RECORD.size + size]
+        if len(data) != size or zlib.crc32(data) != crc:
+            return None
+        pos = topic_len
+        key = None
+        if key_len != NO_KEY:
+            key, pos = data[pos:pos + key_len].decode("utf-8"), pos + key_len
+        kind = data[pos:pos + kind_len].decode("utf-8")
+        body = bytes(data[pos + kind_len:])
+        return cls(seq, group, queued_at, data[:topic_len].decode("utf-8"), key, kind, bool(flags & 1), body)
+
+
+class Batch:
+    """One command to send on flush: bodies for one topic and key."""
+
+    __slots__ = ("topic", "key", "kind", "retain", "bodies", "queued_at", "merged")
+
+    def __init__(self, topic: str, key: Optional[str], kind: str, retain: bool, bodies: List[bytes],
+                 queued_at: float, merged: int = 0) -> None:
+        self.topic = topic
+        self.key = key
+        self.kind = kind
+        self.retain = retain
+        self.bodies = bodies
+        self.queued_at = queued_at
+        self.merged = merged
+
+
+def merge_records(records: Sequence[Record], merge: Optional[Merger] = None) -> List[Batch]:
+    """Collapse queued records to one batch per (topic, key), placed where its newest command was.
+
+    Commands without a key (e.g. `ping`) are kept as they are, in order.
+    """
+    groups: List[List[Record]] = []
+    for record in records:
+        if groups and groups[-1][0].group == record.group:
+            groups[-1].append(record)
+        else:
+            groups.append([record])
+    by_key: Dict[Tuple[str, str], List[List[Record]]] = {}
+    for group in groups:
+        if group[0].key is not None:
+            by_key.setdefault((group[0].topic, group[0].key), []).append(group)
+    batches: List[Batch] = []
+    for group in groups:
+        first = group[0]
+        # Fade frames collapse into the final state, which is replayed like a command.
+        kind = "command" if first.kind == "stream" else first.kind
+        if first.key is None:
+            batches.append(Batch(first.topic, None, kind, first.retain, [r.body for r in group], first.queued_at))
+            continue
+        chain = by_key[(first.topic, first.key)]
+        if group is not chain[-1]:
+            continue
+        bodies = [r.body for r in group]
+        if len(chain) > 1 and merge is not None and not first.retain:
+            bodies = merge(first.topic, [[r.body for r in g] for g in chain]) or bodies
+        batches.append(Batch(first.topic, first.key, kind, first.retain, bodies, chain[0][0].queued_at, len(chain) - 1))
+    return batches
+
+
+class Outbox:
+    def __init__(self, path: str, slots: int = 256, slot_size: int = 1024, merge: Optional[Merger] = None) -> None:
+        self.path = path
+        self.slots = max(2, min(slots, 0xFFFF))
+        self.slot_size = slot_size
+        self.merge = merge
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._fd = -1
+        self._pid = 0
+        self.last_error: Optional[str] = None
+        self.last_flush: Optional[float] = None
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._locked() as fd:
+            raw = os.pread(fd, HEADER.size, 0)
+            if len(raw) < HEADER.size or HEADER.unpack(raw)[:4] != (MAGIC, LAYOUT, self.slots, slot_size):
+                # New file or a different geometry: start empty rather than misread records.
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, HEADER_SIZE + self.slots * slot_size)
+                self._write_header(fd, 1, 1, 0, 0)
+            DEPTH.set(self._depth(fd))
+
+    # File access --------------------------------------------------------------
+    @contextmanager
+    def _locked(self) -> Iterator[int]:
+        with self._lock:
+            if self._pid != os.getpid():
+                # Per process: flock cannot tell a forked worker's inherited descriptor apart.
+                self._fd, self._pid = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644), os.getpid()
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                yield self._fd
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _header(self, fd: int) -> Tuple[int, int, int, int]:
+        """(head, tail, generation, dropped)"""
+        return HEADER.unpack(os.pread(fd, HEADER.size, 0))[4:]
+
+    def _write_header(self, fd: int, head: int, tail: int, generation: int, dropped: int) -> None:
+        os.pwrite(fd, HEADER.pack(MAGIC, LAYOUT, self.slots, self.slot_size, head, tail, generation, dropped), 0)
+
+    def _offset(self, seq: int) -> int:
+        return HEADER_SIZE + (seq % self.slots) * self.slot_size
+
+    def _depth(self, fd: int) -> int:
+        head, tail, _, _ = self._header(fd)
+        return tail - head
+
+    def _read(self, fd: int, head: int, tail: int) -> List[Record]:
+        out = []
+        for seq in range(head, tail):
+            record = Record.unpack(os.pread(fd, self.slot_size, self._offset(seq)))
+            if record is not None and record.seq == seq:
+                out.append(record)
+        return out
+
+    def _write(self, fd: int, records: Sequence[Record]) -> None:
+        for record in records:
+            os.pwrite(fd, record.pack(self.slot_size), self._offset(record.seq))
+
+    # Queue ---------------------------------------------------------------------
+    def depth(self) -> int:
+        with self._locked() as fd:
+            return self._depth(fd)
+
+    def append(self, messages: Sequence[Tuple[str, bytes]], kind: str, retain: bool = False,
+               keys: Optional[Sequence[Optional[str]]] = None) -> int:
+        """Queue one command (its messages share a group); returns the queue depth."""
+        now = time.time()
+        with self._locked() as fd:
+            head, tail, generation, dropped = self._header(fd)
+            if tail - head + len(messages) > self.slots:
+                head, tail, generation, dropped = self._compact(fd, head, tail, generation, dropped)
+            records = [
+                Record(tail + i, tail, now, topic, keys[i] if keys else None, kind, retain, body)
+                for i, (topic, body) in enumerate(messages)
+            ]
+            try:
+                for record in records:
+                    record.pack(self.slot_size)
+            except ValueError as exc:
+                print(f"outbox: dropping command for {messages[0][0]}: {exc}")
+                DROPPED.inc(len(records))
+                return tail - head
+            for record in records:
+                QUEUED.inc(topic=record.topic)
+            overflow = max(0, tail + len(records) - head - self.slots)
+            if overflow:
+                DROPPED.inc(overflow)
+            self._write(fd, records)
+            tail += len(records)
+            self._write_header(fd, head + overflow, tail, generation, dropped + overflow)
+            DEPTH.set(tail - head - overflow)
+            return tail - head - overflow
+
+    def _compact(self, fd: int, head: int, tail: int, generation: int, dropped: int) -> Tuple[int, int, int, int]:
+        batches = merge_records(self._read(fd, head, tail), self.merge)
+        records: List[Record] = []
+        for batch in batches:
+            group = head + len(records)
+            for i, body in enumerate(batch.bodies):
+                records.append(Record(group + i, group, batch.queued_at, batch.topic, batch.key, batch.kind,
+                                      batch.retain, body))
+            MERGED.inc(batch.merged)
+        self._write(fd, records)
+        tail = head + len(records)
+        generation += 1
+        self._write_header(fd, head, tail, generation, dropped)
+        return head, tail, generation, dropped
+
+    def flush(self, send: Sender) -> int:
+        """Deliver everything queued (merged); returns messages sent. Raises if a send fails."""
+        with self._flush_lock:
+            with self._locked() as fd:
+                head, tail, generation, _ = self._header(fd)
+                records = self._read(fd, head, tail)
+            if not records:
+                return 0
+            sent = 0
+            try:
+                for batch in merge_records(records, self.merge):
+                    send([(batch.topic, body) for body in batch.bodies], batch.kind, batch.retain,
+                         [batch.key] * len(batch.bodies))
+                    MERGED.inc(batch.merged)
+                    sent += len(batch.bodies)
+            except Exception as exc:
+                self.last_error = str(exc)
+                raise
+            finally:
+                FLUSHED.inc(sent)
+            with self._locked() as fd:
+                now_head, now_tail, now_generation, dropped = self._header(fd)
+                # A compaction while sending renumbered the records; keep them for the next flush.
+                if now_generation == generation:
+                    self._write_header(fd, max(now_head, tail), now_tail, now_generation, dropped)
+                DEPTH.set(self._depth(fd))
+            self.last_error, self.last_flush = None, time.time()
+            return sent
+
+    def status(self) -> Dict:
+        with self._locked() as fd:
+            head, tail, _, dropped = self._header(fd)
+            oldest = self._read(fd, head, min(tail, head + 1))
+        return {
+            "path": self.path,
+            "depth": tail - head,
+            "capacity": self.slots,
+            "oldest_age_seconds": round(time.time() - oldest[0].queued_at, 1) if oldest else None,
+            "dropped": dropped,
+            "last_flush": self.last_flush,
+            "last_error": self.last_error,
+        }
+
+    def pending(self) -> List[Dict]:
+        with self._locked() as fd:
+            head, tail, _, _ = self._header(fd)
+            records = self._read(fd, head, tail)
+        return [
+            {"seq": r.seq, "topic": r.topic, "segment": r.key, "kind": r.kind, "queued_at": r.queued_at,
+             "body": r.body.decode("utf-8", "replace")}
+            for r in records
+        ]
+
+
+class Forwarder:
+    """Background thread that flushes the outbox whenever it holds something.
+
+    Retries every `interval`; pacing against a dead broker is the publisher's
+    circuit breaker's job, so a failed flush is cheap. `kick()` retries now.
+    """
+
+    def __init__(self, outbox: Outbox, send: Sender, interval: float = 1.0) -> None:
+        self.outbox = outbox
+        self.send = send
+        self.interval = interval
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def kick(self) -> None:
+        self._wake.set()
+
+    def start(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="led-outbox", daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        failing = False
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                if self.outbox.depth():
+                    self.outbox.flush(self.send)
+                failing = False
+            except Exception as exc:
+                if not failing:
+                    print(f"outbox flush failed ({self.outbox.depth()} queued), retrying: {exc}")
+                failing = True
+
+
+def main(argv: Optional[list] = None) -> int:
+    parser = argparse.ArgumentParser(description="Show commands waiting in the LED outbox")
+    parser.add_argument("--path", default=os.getenv("LED_OUTBOX_PATH") or default_path())
+    args = parser.parse_args(argv)
+    if not os.path.exists(args.path):
+        print(f"no outbox at {args.path}")
+        return 1
+    with open(args.path, "rb") as f:
+        magic, layout, slots, slot_size = HEADER.unpack(f.read(HEADER.size))[:4]
+    if (magic, layout) != (MAGIC, LAYOUT):
+        print(f"{args.path} is not a layout-{LAYOUT} outbox")
+        return 1
+    outbox = Outbox(args.path, slots, slot_size)
+    print(json.dumps({**outbox.status(), "pending": outbox.pending()}, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,247 @@
+"""
+MQTT payload encoding with size guards for the ESP32 firmwares.
+
+- Main engine (`esp32_firmware.ino`) runs PubSubClient with `setBufferSize(512)`,
+  drops any payload over 512 bytes and parses into a `StaticJsonDocument<512>`.
+- Camming ESP32U uses the PubSubClient default 256-byte packet buffer.
+- `encode_messages()` serializes compactly, checks the exact packet size and
+  ArduinoJson node count, and splits oversized `set` commands into several
+  partial `set` messages for the same segment.
+- `prepare_messages()` / `record_messages()` are the same two steps apart, for
+  callers that cache checked bodies (led_model.py).
+- `SendFilter` remembers a fingerprint of the last `set` delivered per topic
+  and segment, so byte-identical repeats within a TTL are not sent again.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from led_metrics import REGISTRY
+
+MAIN_BUFFER_SIZE = 512  # mqtt.setBufferSize(512) in esp32_firmware.ino
+MAIN_MAX_PAYLOAD = 512  # on_mqtt_message() rejects length > 512
+MAIN_JSON_POOL = 512  # StaticJsonDocument<512>
+ESP3_BUFFER_SIZE = 256  # PubSubClient default (MQTT_MAX_PACKET_SIZE)
+ESP3_JSON_POOL = 512
+# ArduinoJson 6 VariantSlot on a 32-bit ESP32; strings are zero-copy because
+# the firmware deserializes straight from the mutable MQTT buffer.
+JSON_SLOT_BYTES = 16
+# Keys that stay on the first message of a split `set`.
+HEAD_KEYS = ("pattern", "brightness", "speed")
+
+PAYLOAD_MESSAGES = REGISTRY.counter("led_payload_messages_total", "MQTT messages encoded for publish", ["topic"])
+PAYLOAD_SPLITS = REGISTRY.counter(
+    "led_payload_split_commands_total", "Set commands split to fit firmware limits", ["topic"]
+)
+PAYLOAD_SPLIT_PARTS = REGISTRY.counter(
+    "led_payload_split_parts_total", "Partial set messages produced by splitting", ["topic"]
+)
+PAYLOAD_BYTES = REGISTRY.histogram(
+    "led_payload_bytes", "Encoded MQTT payload size", ["topic"], buckets=(64, 128, 192, 256, 320, 384, 448, 512)
+)
+PAYLOAD_MAX_BYTES = REGISTRY.gauge("led_payload_max_bytes", "Largest payload encoded so far", ["topic"])
+PAYLOAD_SUPPRESSED = REGISTRY.counter(
+    "led_payload_suppressed_total", "Set commands not sent because they repeat the last delivered one", ["topic"]
+)
+
+
+class PayloadTooLarge(ValueError):
+    """Raised when a payload cannot be made to fit the firmware limits."""
+
+
+_ENCODER = json.JSONEncoder(separators=(",", ":"))
+
+
+def encode(payload: Dict[str, Any]) -> bytes:
+    """Compact JSON encoding (no spaces after separators)."""
+    return _ENCODER.encode(payload).encode("utf-8")
+
+
+def packet_size(topic: str, body: bytes) -> int:
+    """Exact size of an MQTT 3.1.1 QoS 1 PUBLISH packet for topic + body.
+
+    The firmware subscribes at QoS 1, so deliveries carry a 2-byte packet id.
+    """
+    remaining = 2 + len(topic.encode("utf-8")) + 2 + len(body)
+    varint = 1
+    n = remaining
+    while n >= 128:
+        n //= 128
+        varint += 1
+    return 1 + varint + remaining
+
+
+def json_nodes(value: Any) -> int:
+    """Number of ArduinoJson slots the decoded document needs (members + elements)."""
+    if isinstance(value, dict):
+        value = value.values()
+    elif not isinstance(value, (list, tuple)):
+        return 0
+    nodes = 0
+    for v in value:
+        nodes += 1
+        if isinstance(v, (dict, list, tuple)):
+            nodes += json_nodes(v)
+    return nodes
+
+
+def limits_for(topic: str, main_topic: str) -> Tuple[int, int, int]:
+    """Return (buffer_size, max_payload, json_pool) for a command topic."""
+    if topic == main_topic:
+        return MAIN_BUFFER_SIZE, MAIN_MAX_PAYLOAD, MAIN_JSON_POOL
+    return ESP3_BUFFER_SIZE, ESP3_BUFFER_SIZE, ESP3_JSON_POOL
+
+
+def fits(
+    topic: str, payload: Dict[str, Any], body: bytes, limits: Tuple[int, int, int], nodes: Optional[int] = None
+) -> bool:
+    """`nodes` may be passed when the caller knows the payload's shape (see `json_nodes`)."""
+    buffer_size, max_payload, json_pool = limits
+    if len(body) > max_payload or packet_size(topic, body) > buffer_size:
+        return False
+    return (json_nodes(payload) if nodes is None else nodes) * JSON_SLOT_BYTES <= json_pool
+
+
+def split_set(payload: Dict[str, Any], topic: str, limits: Tuple[int, int, int]) -> List[Dict[str, Any]]:
+    """Split a `set` command into partial `set` messages that each fit the limits.
+
+    Param order is preserved across parts: the firmware clears `gradientEnabled`
+    when it sees `color` and re-enables it on `gradient_*`, so parts must be
+    published in the returned order.
+    """
+    base = {"cmd": "set"}
+    if "segment" in payload:
+        base["segment"] = payload["segment"]
+    head = dict(base)
+    for key in HEAD_KEYS:
+        if key in payload:
+            head[key] = payload[key]
+    extra = {k: v for k, v in payload.items() if k not in head and k != "params"}
+    head.update(extra)
+    if not fits(topic, head, encode(head), limits):
+        raise PayloadTooLarge(f"set header for {payload.get('segment')} exceeds firmware limits")
+
+    parts: List[Dict[str, Any]] = []
+    current = head
+    for key, value in (payload.get("params") or {}).items():
+        candidate = dict(current)
+        candidate["params"] = dict(current.get("params", {}))
+        candidate["params"][key] = value
+        if fits(topic, candidate, encode(candidate), limits):
+            current = candidate
+            continue
+        parts.append(current)
+        current = dict(base)
+        current["params"] = {key: value}
+        if not fits(topic, current, encode(current), limits):
+            raise PayloadTooLarge(f"param {key!r} alone exceeds firmware limits")
+    parts.append(current)
+    return parts
+
+
+def prepare_messages(
+    payload: Dict[str, Any], topic: str, main_topic: str, body: Optional[bytes] = None, nodes: Optional[int] = None
+) -> List[bytes]:
+    """Check (and split) a command for `topic` without touching the metrics.
+
+    `body` / `nodes` may be passed when the caller already knows `encode(payload)`
+    and `json_nodes(payload)`.
+    """
+    limits = limits_for(topic, main_topic)
+    if body is None:
+        body = encode(payload)
+    if fits(topic, payload, body, limits, nodes):
+        return [body]
+    if payload.get("cmd") == "set":
+        return [encode(part) for part in split_set(payload, topic, limits)]
+    raise PayloadTooLarge(f"{payload.get('cmd')} payload of {len(body)} bytes exceeds firmware limits")
+
+
+def record_messages(bodies: List[bytes], topic: str) -> List[bytes]:
+    """Count bodies from `prepare_messages` as published; returns them."""
+    if len(bodies) > 1:
+        PAYLOAD_SPLITS.inc(topic=topic)
+        PAYLOAD_SPLIT_PARTS.inc(len(bodies), topic=topic)
+    PAYLOAD_MESSAGES.inc(len(bodies), topic=topic)
+    for b in bodies:
+        PAYLOAD_BYTES.observe(len(b), topic=topic)
+        if len(b) > PAYLOAD_MAX_BYTES.value(topic=topic):
+            PAYLOAD_MAX_BYTES.set(len(b), topic=topic)
+    return bodies
+
+
+def encode_messages(payload: Dict[str, Any], topic: str, main_topic: str) -> List[bytes]:
+    """Encode a command for `topic`, splitting oversized `set` commands.
+
+    Returns the list of message bodies to publish in order.
+    """
+    return record_messages(prepare_messages(payload, topic, main_topic), topic)
+
+
+class SendFilter:
+    """Last delivered `set` fingerprint per (topic, segment).
+
+    `admit()` says whether bodies differ from what was last delivered for that
+    key (or the TTL ran out); callers `remember()` only after a successful
+    publish and `forget()` keys whose publish failed. `ttl <= 0` disables it.
+    """
+
+    def __init__(self, ttl: float, max_keys: int = 1024) -> None:
+        self.ttl = ttl
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._last: Dict[Tuple[str, str], Tuple[bytes, float]] = {}
+
+    @staticmethod
+    def fingerprint(bodies: List[bytes]) -> bytes:
+        return hashlib.blake2b(b"\0".join(bodies), digest_size=16).digest()
+
+    def admit(self, topic: str, key: str, bodies: List[bytes]) -> bool:
+        if self.ttl <= 0:
+            return True
+        with self._lock:
+            last = self._last.get((topic, key))
+        if last is None or last[0] != self.fingerprint(bodies) or time.monotonic() - last[1] >= self.ttl:
+            return True
+        PAYLOAD_SUPPRESSED.inc(topic=topic)
+        return False
+
+    def remember(self, topic: str, sent: Iterable[Tuple[str, List[bytes]]]) -> None:
+        if self.ttl <= 0:
+            return
+        now = time.monotonic()
+        with self._lock:
+            for key, bodies in sent:
+                self._last[(topic, key)] = (self.fingerprint(bodies), now)
+            if len(self._last) > self.max_keys:
+                for old in sorted(self._last, key=lambda k: self._last[k][1])[: len(self._last) - self.max_keys]:
+                    del self._last[old]
+
+    def forget(self, topic: str, keys: Iterable[str]) -> None:
+        with self._lock:
+            for key in keys:
+                self._last.pop((topic, key), None)
+
+    def clear(self, topic: Optional[str] = None) -> None:
+        """Drop fingerprints (e.g. when a device reboots and lost its state)."""
+        with self._lock:
+            if topic is None:
+                self._last.clear()
+            else:
+                for k in [k for k in self._last if k[0] == topic]:
+                    del self._last[k]
+
+
+def payload_stats() -> Dict[str, int]:
+    """Totals across topics for the status API."""
+    return {
+        "messages": int(PAYLOAD_MESSAGES.total()),
+        "suppressed": int(PAYLOAD_SUPPRESSED.total()),
+        "split_commands": int(PAYLOAD_SPLITS.total()),
+        "split_parts": int(PAYLOAD_SPLIT_PARTS.total()),
+        "max_bytes": int(max(PAYLOAD_MAX_BYTES.values().values(), default=0)),
+    }
@@ -0,0 +1,433 @@
+"""
+Streaming JSONL export/import for preset libraries (`led_states.json`, `esp3_states.json`).
+
+- One preset per line: {"name": "...", "data": {...}} (+ "default": true on the default).
+- Main-strip segments are checked with the same parser as `/api/set` (`led_model.Command`),
+  so a preset that imports also applies.
+- Import validates each line as it arrives, spools accepted presets to a temporary
+  SQLite file next to the library and then rewrites the library entry by entry,
+  so the upload is never held in memory (only the existing library is).
+- Conflict policies for names that already exist: skip, overwrite, rename, merge.
+CLI:
+    python led_presets.py export --kind main > show.jsonl
+    python led_presets.py import show.jsonl --policy rename
+    python led_presets.py import show.jsonl --url http://10.42.0.1:5000 --policy overwrite
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import numbers
+import os
+import sqlite3
+import sys
+import tempfile
+import urllib.error
+import urllib.parse
+import urllib.request
+from typing import Callable, Dict, Iterable, Iterator, List, Mapping, Optional, Tuple, Union
+
+from led_model import Command, CommandError
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_FILES = {
+    "main": os.getenv("LED_STATE_FILE", os.path.join(HERE, "led_states.json")),
+    "esp3": os.getenv("ESP3_STATE_FILE", os.path.join(HERE, "esp3_states.json")),
+}
+POLICIES = ("skip", "overwrite", "rename", "merge")
+MAX_NAME = 80
+MAX_LINE = 64 * 1024
+MAX_ERRORS = 50
+PROGRESS_EVERY = 500
+
+RGB_FIELDS = ("color", "gradient_low", "gradient_mid", "gradient_high")
+NUMBER_FIELDS = ("brightness", "speed", "wave_count", "mic_gain", "mic_floor", "mic_smooth", "wind_mph")
+BOOL_FIELDS = ("mic_enabled", "gradient_enabled", "mic_beat")
+STRING_FIELDS = ("pattern", "wave_shape", "segment")
+ESP3_PATTERNS = ("white", "rainbow", "rainbow_hills")
+
+
+class PresetError(ValueError):
+    """A preset line that fails validation."""
+
+
+def _number(field: str, value, low: Optional[float] = None, high: Optional[float] = None) -> float:
+    if isinstance(value, bool) or not isinstance(value, numbers.Real):
+        raise PresetError(f"{field} must be a number")
+    if (low is not None and value < low) or (high is not None and value > high):
+        raise PresetError(f"{field} must be within {low}..{high}")
+    return value
+
+
+def _rgb(field: str, value) -> List[int]:
+    if not isinstance(value, (list, tuple)) or len(value) != 3:
+        raise PresetError(f"{field} must be [r, g, b]")
+    return [int(_number(field, v, 0, 255)) for v in value]
+
+
+def validate_segment(name: str, values) -> Dict:
+    if not isinstance(values, dict):
+        raise PresetError(f"segment {name!r} must be an object")
+    out = dict(values)
+    for field, value in values.items():
+        if field in RGB_FIELDS:
+            out[field] = _rgb(field, value)
+        elif field == "brightness":
+            _number(field, value, 0, 255)
+        elif field in NUMBER_FIELDS:
+            _number(field, value)
+        elif field in BOOL_FIELDS:
+            if not isinstance(value, bool):
+                raise PresetError(f"{field} must be true/false")
+        elif field in STRING_FIELDS:
+            if not isinstance(value, str) or len(value) > 32:
+                raise PresetError(f"{field} must be a short string")
+    # Same ranges and types the apply path enforces, so an accepted preset always applies.
+    try:
+        Command.from_request({**out, "segment": name})
+    except CommandError as exc:
+        raise PresetError(f"segment {name!r}: {exc}") from None
+    return out
+
+
+def normalize_main(data) -> Dict:
+    """Validate a main-strip preset; legacy single-segment dicts become {"segments": {...}}."""
+    if not isinstance(data, dict):
+        raise PresetError("data must be an object")
+    segments = data.get("segments")
+    if segments is None and data and all(isinstance(v, dict) for v in data.values()):
+        segments = data  # bare {seg: {...}} map without the "segments" wrapper
+    elif segments is None:
+        segments = {data.get("segment", "strip1"): data}
+    if not isinstance(segments, dict) or not segments:
+        raise PresetError("segments must be a non-empty object")
+    out = {}
+    for seg, values in segments.items():
+        if not isinstance(seg, str) or not seg or len(seg) > 32:
+            raise PresetError(f"bad segment name {seg!r}")
+        out[seg] = validate_segment(seg, values)
+    return {"segments": out}
+
+
+def normalize_esp3(data) -> Dict:
+    if not isinstance(data, dict):
+        raise PresetError("data must be an object")
+    out = dict(data)
+    if out.get("pattern", "white") not in ESP3_PATTERNS:
+        raise PresetError(f"pattern must be one of {', '.join(ESP3_PATTERNS)}")
+    if "brightness" in out:
+        _number("brightness", out["brightness"], 0, 255)
+    if "white_balance" in out:
+        _number("white_balance", out["white_balance"], 1500, 9000)
+    if not isinstance(out.get("target", "both"), str):
+        raise PresetError("target must be a string")
+    return out
+
+
+NORMALIZERS: Dict[str, Callable[[object], Dict]] = {"main": normalize_main, "esp3": normalize_esp3}
+
+
+def parse_line(line: Union[str, bytes], kind: str) -> Tuple[str, Dict, bool]:
+    """Parse one JSONL line into (name, normalized data, is_default)."""
+    if len(line) > MAX_LINE:
+        raise PresetError(f"line longer than {MAX_LINE} bytes")
+    try:
+        entry = json.loads(line)
+    except ValueError as exc:
+        raise PresetError(f"invalid JSON: {exc}") from None
+    if not isinstance(entry, dict):
+        raise PresetError("line must be an object")
+    name = entry.get("name")
+    if not isinstance(name, str) or not name.strip() or len(name.strip()) > MAX_NAME:
+        raise PresetError(f"name must be 1-{MAX_NAME} characters")
+    return name.strip(), NORMALIZERS[kind](entry.get("data")), bool(entry.get("default"))
+
+
+def read_library(path: str, kind: str) -> Tuple[Dict[str, Dict], Optional[str]]:
+    """Load a library file ({"states": {...}, "default": name} or legacy flat dict)."""
+    if not os.path.exists(path):
+        return {}, None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except Exception:
+        return {}, None
+    if not isinstance(data, dict):
+        return {}, None
+    default = None
+    if isinstance(data.get("states"), dict):
+        states, default = data["states"], data.get("default")
+    else:
+        states = data
+    if kind == "main":
+        states = {
+            name: val if isinstance(val.get("segments"), dict) else {"segments": {val.get("segment", "strip1"): val}}
+            for name, val in states.items()
+            if isinstance(val, dict)
+        }
+    return states, default
+
+
+def export_lines(states: Mapping[str, Dict], default: Optional[str] = None) -> Iterator[str]:
+    for name, data in states.items():
+        entry = {"name": name, "data": data}
+        if name == default:
+            entry["default"] = True
+        yield json.dumps(entry, separators=(",", ":")) + "\n"
+
+
+class ImportReport:
+    def __init__(self, kind: str, policy: str) -> None:
+        self.kind = kind
+        self.policy = policy
+        self.lines = 0
+        self.added = 0
+        self.replaced = 0
+        self.merged = 0
+        self.renamed = 0
+        self.skipped = 0
+        self.invalid = 0
+        self.errors: List[Dict] = []
+        self.default: Optional[str] = None
+        self.written = False
+
+    def error(self, line: int, message: str) -> None:
+        self.invalid += 1
+        if len(self.errors) < MAX_ERRORS:
+            self.errors.append({"line": line, "error": message})
+
+    def to_dict(self) -> Dict:
+        return {
+            "kind": self.kind,
+            "policy": self.policy,
+            "lines": self.lines,
+            "added": self.added,
+            "replaced": self.replaced,
+            "merged": self.merged,
+            "renamed": self.renamed,
+            "skipped": self.skipped,
+            "invalid": self.invalid,
+            "errors": self.errors,
+            "default": self.default,
+            "written": self.written,
+        }
+
+
+def _merge(kind: str, old: Dict, new: Dict) -> Dict:
+    if kind == "main":
+        segments = {seg: dict(vals) for seg, vals in old.get("segments", {}).items()}
+        for seg, vals in new["segments"].items():
+            segments.setdefault(seg, {}).update(vals)
+        return {"segments": segments}
+    return {**old, **new}
+
+
+class _Spool:
+    """Accepted presets on disk, keyed by final name, in arrival order."""
+
+    def __init__(self, directory: str) -> None:
+        fd, self.path = tempfile.mkstemp(prefix=".preset-import-", suffix=".sqlite", dir=directory)
+        os.close(fd)
+        self.db = sqlite3.connect(self.path)
+        self.db.execute("CREATE TABLE presets (name TEXT PRIMARY KEY, data TEXT NOT NULL)")
+
+    def has(self, name: str) -> bool:
+        return self.db.execute("SELECT 1 FROM presets WHERE name = ?", (name,)).fetchone() is not None
+
+    def get(self, name: str) -> Optional[Dict]:
+        row = self.db.execute("SELECT data FROM presets WHERE name = ?", (name,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, name: str, data: Dict) -> None:
+        self.db.execute(
+            "INSERT INTO presets (name, data) VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET data = excluded.data",
+            (name, json.dumps(data, separators=(",", ":"))),
+        )
+
+    def rows(self) -> Iterator[Tuple[str, str]]:
+        yield from self.db.execute("SELECT name, data FROM presets ORDER BY rowid")
+
+    def close(self) -> None:
+        self.db.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+def _write_library(path: str, existing: Mapping[str, Dict], spool: _Spool, default: Optional[str]) -> None:
+    """Rewrite the library from existing entries + spool without building one big dict."""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(prefix=".presets-", suffix=".json", dir=directory)
+    names = set(existing)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write('{\n  "states": {')
+            first = True
+            for name, data in existing.items():
+                replacement = spool.get(name)
+                body = json.dumps(replacement if replacement is not None else data)
+                f.write(("\n" if first else ",\n") + f"    {json.dumps(name)}: {body}")
+                first = False
+            for name, body in spool.rows():
+                if name in names:
+                    continue
+                f.write(("\n" if first else ",\n") + f"    {json.dumps(name)}: {body}")
+                first = False
+            f.write("\n  }")
+            if default and (default in names or spool.has(default)):
+                f.write(f',\n  "default": {json.dumps(default)}')
+            f.write("\n}\n")
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def import_lines(
+    lines: Iterable[Union[str, bytes]],
+    path: str,
+    kind: str = "main",
+    policy: str = "skip",
+    strict: bool = False,
+    dry_run: bool = False,
+    set_default: bool = False,
+    progress: Optional[Callable[[ImportReport], None]] = None,
+    every: int = PROGRESS_EVERY,
+) -> ImportReport:
+    """Validate and merge JSONL presets into the library at `path`.
+
+    `strict` aborts without writing on the first invalid line; `dry_run` only
+    validates. `progress(report)` is called every `every` lines.
+    """
+    if kind not in NORMALIZERS:
+        raise ValueError(f"kind must be one of {', '.join(NORMALIZERS)}")
+    if policy not in POLICIES:
+        raise ValueError(f"policy must be one of {', '.join(POLICIES)}")
+    report = ImportReport(kind, policy)
+    existing, default = read_library(path, kind)
+    spool = _Spool(os.path.dirname(os.path.abspath(path)))
+    try:
+        for raw in lines:
+            report.lines += 1
+            if progress and report.lines % every == 0:
+                progress(report)
+            if not raw.strip():
+                continue
+            try:
+                name, data, is_default = parse_line(raw, kind)
+            except PresetError as exc:
+                report.error(report.lines, str(exc))
+                if strict:
+                    return report
+                continue
+            taken = name in existing or spool.has(name)
+            if taken and policy == "skip":
+                report.skipped += 1
+                continue
+            if taken and policy == "rename":
+                n = 2
+                while f"{name} ({n})" in existing or spool.has(f"{name} ({n})"):
+                    n += 1
+                name = f"{name} ({n})"
+                report.renamed += 1
+            elif taken and policy == "merge":
+                old = spool.get(name) or existing.get(name) or {}
+                data = _merge(kind, old, data)
+                report.merged += 1
+            elif taken:
+                report.replaced += 1
+            else:
+                report.added += 1
+            spool.put(name, data)
+            if is_default:
+                report.default = name
+        if progress:
+            progress(report)
+        if not dry_run:
+            spool.db.commit()
+            _write_library(path, existing, spool, report.default if set_default and report.default else default)
+            report.written = True
+        return report
+    finally:
+        spool.close()
+
+
+def _read_jsonl(path: str) -> Iterator[str]:
+    if path == "-":
+        yield from sys.stdin
+        return
+    with open(path, "r", encoding="utf-8") as f:
+        yield from f
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Export/import preset libraries as JSONL")
+    parser.add_argument("--kind", choices=sorted(NORMALIZERS), default="main")
+    parser.add_argument("--file", help="Library file (default: the one led_web.py uses)")
+    parser.add_argument("--url", help="Talk to a running led_web.py instead of the file, e.g. http://10.42.0.1:5000")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    exp = sub.add_parser("export", help="Write presets as JSONL")
+    exp.add_argument("-o", "--output", default="-")
+    imp = sub.add_parser("import", help="Merge presets from JSONL ('-' for stdin)")
+    imp.add_argument("input")
+    imp.add_argument("--policy", choices=POLICIES, default="skip")
+    imp.add_argument("--strict", action="store_true", help="Abort on the first invalid line")
+    imp.add_argument("--dry-run", action="store_true", help="Validate only")
+    imp.add_argument("--set-default", action="store_true", help="Adopt the default marked in the file")
+    args = parser.parse_args(argv)
+
+    path = args.file or DEFAULT_FILES[args.kind]
+    if args.cmd == "export":
+        out = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+        try:
+            if args.url:
+                with urllib.request.urlopen(f"{args.url.rstrip('/')}/api/states/export?kind={args.kind}") as resp:
+                    for line in resp:
+                        out.write(line.decode("utf-8"))
+            else:
+                states, default = read_library(path, args.kind)
+                out.writelines(export_lines(states, default))
+        finally:
+            if out is not sys.stdout:
+                out.close()
+        return 0
+
+    if args.url:
+        query = urllib.parse.urlencode({
+            "kind": args.kind,
+            "policy": args.policy,
+            "strict": int(args.strict),
+            "dry_run": int(args.dry_run),
+            "set_default": int(args.set_default),
+        })
+        with open(args.input, "rb") as f:
+            req = urllib.request.Request(
+                f"{args.url.rstrip('/')}/api/states/import?{query}",
+                data=f,
+                headers={"Content-Type": "application/x-ndjson", "Content-Length": str(os.path.getsize(args.input))},
+                method="POST",
+            )
+            try:
+                with urllib.request.urlopen(req) as resp:
+                    result = json.load(resp)
+            except urllib.error.HTTPError as exc:
+                result = json.load(exc)
+        print(json.dumps(result, indent=2))
+        return 0 if result.get("ok") else 1
+
+    def show(report: ImportReport) -> None:
+        print(f"\r{report.lines} lines, {report.invalid} invalid", end="", file=sys.stderr, flush=True)
+
+    report = import_lines(
+        _read_jsonl(args.input), path, args.kind, args.policy,
+        strict=args.strict, dry_run=args.dry_run, set_default=args.set_default, progress=show,
+    )
+    print(file=sys.stderr)
+    print(json.dumps(report.to_dict(), indent=2))
+    return 1 if args.strict and report.invalid else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
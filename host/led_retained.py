@@ -0,0 +1,196 @@
+"""
+Retained per-segment state topics (`led/state/<segment>`) on the broker.
+
+- `RetainedStateMirror` listens to the state store and republishes a full
+  `set` command for each changed segment as a retained message, coalescing
+  bursts on a background thread and skipping bodies the broker already holds.
+- A rebooted ESP32 subscribes to `led/state/+` and gets every segment back in
+  one round-trip; a restarted host reads the same topics with `collect()`.
+- `compact()` clears retained topics for segments that no longer exist.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Mapping, Optional, Tuple
+
+from led_payload import fits
+
+# [(topic, body)]; an empty body clears the retained message.
+RetainedSender = Callable[[List[Tuple[str, bytes]]], None]
+# (segment, state fields) -> (full `set` payload, its encoded body)
+PayloadBuilder = Callable[[str, Mapping], Tuple[Dict, bytes]]
+
+
+def fields_from_payload(payload: Mapping) -> Dict:
+    """Flatten a `set` command back into cache-style fields."""
+    fields = {k: v for k, v in payload.items() if k not in ("cmd", "segment", "params")}
+    fields.update(payload.get("params") or {})
+    return fields
+
+
+def collect(
+    prefix: str,
+    host: str,
+    port: int,
+    username: Optional[str] = None,
+    password: Optional[str] = None,
+    quiet: float = 0.5,
+    timeout: float = 3.0,
+) -> Dict[str, bytes]:
+    """Read every retained message under `prefix/+`; returns {segment: body}.
+
+    The broker sends retained messages right after SUBACK, so stop once no new
+    message has arrived for `quiet` seconds (or `timeout` passes).
+    """
+    import paho.mqtt.client as mqtt
+
+    found: Dict[str, bytes] = {}
+    subscribed = threading.Event()
+    last = [time.monotonic()]
+
+    def on_connect(client, userdata, flags, rc, *args):
+        client.subscribe(f"{prefix}/+")
+
+    def on_subscribe(client, userdata, mid, *args):
+        last[0] = time.monotonic()
+        subscribed.set()
+
+    def on_message(client, userdata, msg):
+        if msg.retain and msg.payload:
+            found[msg.topic[len(prefix) + 1:]] = bytes(msg.payload)
+            last[0] = time.monotonic()
+
+    client = mqtt.Client(client_id=f"led-web-retained-{int(time.time())}")
+    if username:
+        client.username_pw_set(username, password)
+    client.on_connect = on_connect
+    client.on_subscribe = on_subscribe
+    client.on_message = on_message
+    client.connect(host, port, keepalive=30)
+    client.loop_start()
+    try:
+        deadline = time.monotonic() + timeout
+        subscribed.wait(timeout)
+        while time.monotonic() < deadline and time.monotonic() - last[0] < quiet:
+            time.sleep(0.05)
+    finally:
+        client.loop_stop()
+        client.disconnect()
+    return found
+
+
+class RetainedStateMirror:
+    def __init__(
+        self,
+        prefix: str,
+        sender: RetainedSender,
+        build: PayloadBuilder,
+        limits: Tuple[int, int, int],
+        debounce: float = 0.2,
+    ) -> None:
+        self.prefix = prefix.rstrip("/")
+        self.sender = sender
+        self.build = build
+        self.limits = limits
+        self.debounce = debounce
+        self._lock = threading.Lock()
+        self._dirty: Dict[str, Mapping] = {}
+        self._published: Dict[str, bytes] = {}
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.errors = 0
+        self.skipped: List[str] = []
+
+    def topic(self, segment: str) -> str:
+        return f"{self.prefix}/{segment}"
+
+    def seed(self, bodies: Mapping[str, bytes]) -> None:
+        """Record what the broker already retains so identical state is not resent."""
+        with self._lock:
+            self._published.update(bodies)
+
+    def on_state(self, version: int, updated: Mapping[str, Mapping]) -> None:
+        """State store listener: queue changed segments for republishing."""
+        with self._lock:
+            self._dirty.update(updated)
+        self._ensure_thread()
+        self._wake.set()
+
+    def _ensure_thread(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="led-retained", daemon=True)
+            self._thread.start()
+
+    def _messages(self, entries: Mapping[str, Mapping]) -> List[Tuple[str, bytes]]:
+        out: List[Tuple[str, bytes]] = []
+        for segment, fields in entries.items():
+            payload, body = self.build(segment, fields)
+            topic = self.topic(segment)
+            if not fits(topic, payload, body, self.limits):
+                # Retained state has to be one message; leave the old one in place.
+                self.skipped.append(segment)
+                del self.skipped[:-20]
+                continue
+            if self._published.get(segment) == body:
+                continue
+            out.append((topic, body))
+        return out
+
+    def flush(self) -> int:
+        """Publish pending segments now; returns the number of messages sent."""
+        with self._lock:
+            pending, self._dirty = self._dirty, {}
+            messages = self._messages(pending)
+        if not messages:
+            return 0
+        try:
+            self.sender(messages)
+        except Exception as exc:
+            self.errors += 1
+            print(f"retained state publish failed: {exc}")
+            with self._lock:
+                for segment, fields in pending.items():
+                    self._dirty.setdefault(segment, fields)
+            return 0
+        with self._lock:
+            for topic, body in messages:
+                self._published[topic[len(self.prefix) + 1:]] = body
+        return len(messages)
+
+    def publish_all(self, entries: Mapping[str, Mapping]) -> int:
+        with self._lock:
+            self._dirty.update(entries)
+        return self.flush()
+
+    def compact(self, retained: Iterable[str], live: Iterable[str]) -> List[str]:
+        """Clear retained topics for segments not in `live`; returns those cleared."""
+        keep = set(live)
+        stale = sorted(seg for seg in retained if seg not in keep)
+        if stale:
+            self.sender([(self.topic(seg), b"") for seg in stale])
+            with self._lock:
+                for seg in stale:
+                    self._published.pop(seg, None)
+        return stale
+
+    def status(self) -> Dict:
+        with self._lock:
+            return {
+                "prefix": self.prefix,
+                "segments": sorted(self._published),
+                "pending": sorted(self._dirty),
+                "errors": self.errors,
+                "skipped_too_large": list(self.skipped),
+            }
+
+    def _run(self) -> None:
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            # Let a burst (preset apply, fade completion) settle into one publish.
+            time.sleep(self.debounce)
+            self.flush()
+            if self._dirty:
+                time.sleep(1.0)
+                self._wake.set()
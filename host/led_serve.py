@@ -0,0 +1,282 @@
+"""
+Production entry point: several `led_web.py` worker processes behind one port.
+
+- The parent binds the port, forks `--workers` processes that each run a threaded
+  WSGI server on the shared socket, and restarts any worker that dies.
+- Segment/camming state lives in a shared SQLite file (`LED_SHARED_STATE`, see
+  led_shared.py); preset files are written atomically under a file lock.
+- Exactly one worker holds the leader lock and runs the background watchers,
+  feeds and startup resync; if it dies another worker takes over.
+- Each worker imports led_web after the fork, so the broker connection, outbox,
+  shared-memory/health files and locks are its own; metrics, traces and fades
+  are per worker process too.
+- Defaults to one worker: extra workers only pay off with spare cores (see the
+  README for measured numbers).
+Usage:
+    python led_serve.py --workers 4 --port 5000
+    python led_serve.py bench --workers 1 2 4 --clients 32 --duration 20
+"""
+from __future__ import annotations
+
+import argparse
+import fcntl
+import http.client
+import json
+import logging
+import multiprocessing
+import os
+import random
+import signal
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_STATE_DB = os.path.join(HERE, "led_shared_state.sqlite")
+
+
+def _worker(sock: socket.socket, host: str, port: int, leader_lock: str) -> None:
+    from werkzeug.serving import make_server
+
+    import led_web
+
+    def lead() -> None:
+        fd = os.open(leader_lock, os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(fd, fcntl.LOCK_EX)  # blocks until no other worker leads
+        print(f"worker {os.getpid()} is leader: starting background tasks", flush=True)
+        led_web.start_background_tasks()
+
+    threading.Thread(target=lead, name="led-leader", daemon=True).start()
+    server = make_server(host, port, led_web.app, threaded=True, fd=sock.fileno())
+    signal.signal(signal.SIGTERM, lambda *_: os._exit(0))
+    server.serve_forever()
+
+
+def _prepare_state_db(path: str) -> None:
+    """Create the shared state schema once, so workers do not race on it at start."""
+    from led_shared import SCHEMA
+
+    db = sqlite3.connect(path, timeout=10.0)
+    try:
+        db.execute("PRAGMA journal_mode=WAL")
+        db.executescript(SCHEMA)
+    finally:
+        db.close()
+
+
+def serve(host: str, port: int, workers: int, state_db: str) -> None:
+    # Read by led_web at import time.
+    os.environ["LED_SHARED_STATE"] = state_db
+    sys.path.insert(0, HERE)
+    # led_web is imported by each worker after the fork, never here: its broker
+    # connection, outbox, shared-memory and health files, threads and locks
+    # must belong to the worker that uses them.
+    _prepare_state_db(state_db)
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(256)
+    sock.set_inheritable(True)
+    leader_lock = state_db + ".leader"
+
+    children: Dict[int, int] = {}
+    stopping = False
+
+    def spawn(slot: int) -> None:
+        pid = os.fork()
+        if pid == 0:
+            # Until _worker installs its own handler, a SIGTERM must not run the
+            # parent's `stop` on this process's copy of `children`.
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            try:
+                _worker(sock, host, port, leader_lock)
+            finally:
+                os._exit(1)
+        children[pid] = slot
+
+    def stop(*_) -> None:
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for slot in range(workers):
+        spawn(slot)
+    print(f"serving on http://{host}:{port} with {workers} workers (state: {state_db})", flush=True)
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        slot = children.pop(pid, None)
+        if slot is not None and not stopping:
+            print(f"worker {pid} exited ({status}); restarting", flush=True)
+            time.sleep(0.5)
+            if not stopping:  # a SIGTERM during the pause would miss the new child
+                spawn(slot)
+
+
+# Benchmark ------------------------------------------------------------------
+BENCH_MIX = [
+    ("GET", "/api/state", None, 0.45),
+    ("GET", "/api/status", None, 0.2),
+    ("GET", "/api/states", None, 0.1),
+    ("POST", "/api/set", {"segment": "strip1", "pattern": "solid", "brightness": 120, "color": [255, 80, 0]}, 0.25),
+]
+
+
+def _bench_client(port: int, duration: float, threads: int, out) -> None:
+    counts: List[float] = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def loop() -> None:
+        rng = random.Random()
+        local: List[float] = []
+        errs = 0
+        while time.monotonic() < deadline:
+            r, acc = rng.random(), 0.0
+            for method, path, body, weight in BENCH_MIX:
+                acc += weight
+                if r <= acc:
+                    break
+            start = time.perf_counter()
+            try:
+                conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+                data = json.dumps(body) if body else None
+                conn.request(method, path, body=data, headers={"Content-Type": "application/json"} if data else {})
+                resp = conn.getresponse()
+                resp.read()
+                conn.close()
+                if resp.status >= 500:
+                    errs += 1
+            except Exception:
+                errs += 1
+            local.append(time.perf_counter() - start)
+        with lock:
+            counts.extend(local)
+            errors[0] += errs
+
+    ts = [threading.Thread(target=loop) for _ in range(threads)]
+    for t in ts:
+        t.start()
+    for t in ts:
+        t.join()
+    out.put((counts, errors[0]))
+
+
+def _wait_for(port: int, timeout: float = 20.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            conn.request("GET", "/api/status")
+            if conn.getresponse().status == 200:
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError("server did not come up")
+
+
+def bench(worker_counts: List[int], clients: int, duration: float, client_procs: int) -> List[Dict]:
+    from led_loadtest import FakeBroker, _seed_files, isolated_env
+
+    broker = FakeBroker()
+    broker.start()
+    results = []
+    for workers in worker_counts:
+        workdir = tempfile.mkdtemp(prefix="led-serve-bench-")
+        _seed_files(workdir, ["strip0", "strip1", "strip2", "strip3"])
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            port = s.getsockname()[1]
+        env = dict(os.environ, **isolated_env(workdir, broker.port))
+        proc = subprocess.Popen(
+            [sys.executable, os.path.join(HERE, "led_serve.py"), "--host", "127.0.0.1", "--port", str(port),
+             "--workers", str(workers), "--state-db", os.path.join(workdir, "state.sqlite")],
+            env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        try:
+            _wait_for(port)
+            out = multiprocessing.Queue()
+            per_proc = max(1, clients // client_procs)
+            procs = [multiprocessing.Process(target=_bench_client, args=(port, duration, per_proc, out)) for _ in range(client_procs)]
+            for p in procs:
+                p.start()
+            samples: List[float] = []
+            errors = 0
+            for _ in procs:
+                got, errs = out.get()
+                samples.extend(got)
+                errors += errs
+            for p in procs:
+                p.join()
+        finally:
+            proc.terminate()
+            proc.wait(10)
+        samples.sort()
+
+        def pick(q: float) -> float:
+            return round(samples[min(len(samples) - 1, int(q * (len(samples) - 1)))] * 1000, 1) if samples else 0.0
+
+        results.append({
+            "workers": workers,
+            "requests": len(samples),
+            "rps": round(len(samples) / duration, 1),
+            "p50_ms": pick(0.5),
+            "p99_ms": pick(0.99),
+            "errors": errors,
+        })
+        print(f"workers={workers}: {results[-1]}", flush=True)
+    broker.shutdown()
+    base = results[0]["rps"] or 1.0
+    for r in results:
+        r["scaling"] = round(r["rps"] / base, 2)
+    return results
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    argv = list(sys.argv[1:] if argv is None else argv)
+    if argv and argv[0] == "bench":
+        parser = argparse.ArgumentParser(description="Throughput vs. worker count (local broker stand-in)")
+        parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+        parser.add_argument("--clients", type=int, default=32, help="Concurrent closed-loop clients")
+        parser.add_argument("--client-procs", type=int, default=2, help="Load-generator processes")
+        parser.add_argument("--duration", type=float, default=20.0)
+        args = parser.parse_args(argv[1:])
+        sys.path.insert(0, HERE)
+        results = bench(args.workers, args.clients, args.duration, args.client_procs)
+        print(f"{'workers':>7} {'req/s':>8} {'scaling':>8} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7}  ({os.cpu_count()} CPUs)")
+        for r in results:
+            print(f"{r['workers']:7d} {r['rps']:8.1f} {r['scaling']:8.2f} {r['p50_ms']:8.1f} {r['p99_ms']:8.1f} {r['errors']:7d}")
+        return 0
+
+    parser = argparse.ArgumentParser(description="Serve led_web.py with several worker processes")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "5000")))
+    # One worker unless asked: see README for measured scaling (flat on one core).
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--state-db", default=os.getenv("LED_SHARED_STATE", DEFAULT_STATE_DB))
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    serve(args.host, args.port, max(1, args.workers), args.state_db)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,150 @@
+"""
+Cross-process coordination for running `led_web.py` with several workers.
+
+- `SqliteBackend`: a small WAL-mode SQLite file holding every StateStore entry
+  with a per-store version. Writers take `BEGIN IMMEDIATE`, so merges from
+  different workers serialize; readers only reload rows newer than what they hold.
+- `FileLock`: flock-based lock (per acquire, so it also works across threads)
+  for read-modify-write of the preset JSON files.
+- `state_dir()`: where runtime files (outbox, journal, captures) go by default,
+  outside the source tree: `$LED_STATE_DIR`, else `$XDG_STATE_HOME/led-kit`
+  (`~/.local/state/led-kit`).
+Connections are opened lazily per process, so objects created before `fork()`
+are safe to use in the children.
+"""
+from __future__ import annotations
+
+import fcntl
+import json
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Mapping, Optional, Tuple
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS stores (name TEXT PRIMARY KEY, version INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS entries (
+    store TEXT NOT NULL,
+    key TEXT NOT NULL,
+    data TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    PRIMARY KEY (store, key)
+);
+CREATE INDEX IF NOT EXISTS entries_version ON entries (store, version);
+"""
+
+
+def state_dir() -> str:
+    """Default directory for runtime files; not created here."""
+    if os.getenv("LED_STATE_DIR"):
+        return os.environ["LED_STATE_DIR"]
+    base = os.getenv("XDG_STATE_HOME") or os.path.join(os.path.expanduser("~"), ".local", "state")
+    return os.path.join(base, "led-kit")
+
+
+class _Tx:
+    def __init__(self, db: sqlite3.Connection, store: str) -> None:
+        self.db = db
+        self.store = store
+        row = db.execute("SELECT version FROM stores WHERE name = ?", (store,)).fetchone()
+        self.version = row[0] if row else 0
+
+    def changes_since(self, version: int) -> Dict[str, Tuple[int, Dict[str, Any]]]:
+        rows = self.db.execute(
+            "SELECT key, version, data FROM entries WHERE store = ? AND version > ?", (self.store, version)
+        )
+        return {key: (ver, json.loads(data)) for key, ver, data in rows}
+
+    def write(self, entries: Mapping[str, Mapping[str, Any]]) -> int:
+        """Store `entries` under a new version; returns it."""
+        self.version += 1
+        self.db.executemany(
+            "INSERT INTO entries (store, key, data, version) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(store, key) DO UPDATE SET data = excluded.data, version = excluded.version",
+            [(self.store, key, json.dumps(values, separators=(",", ":")), self.version) for key, values in entries.items()],
+        )
+        self.db.execute(
+            "INSERT INTO stores (name, version) VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET version = excluded.version",
+            (self.store, self.version),
+        )
+        return self.version
+
+
+class SqliteBackend:
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._pid = 0
+
+    def _conn(self) -> sqlite3.Connection:
+        if self._db is None or self._pid != os.getpid():
+            db = sqlite3.connect(self.path, timeout=10.0, isolation_level=None, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.executescript(SCHEMA)
+            self._db, self._pid = db, os.getpid()
+        return self._db
+
+    @contextmanager
+    def transaction(self, store: str, write: bool = True) -> Iterator[_Tx]:
+        with self._lock:
+            db = self._conn()
+            db.execute("BEGIN IMMEDIATE" if write else "BEGIN")
+            try:
+                yield _Tx(db, store)
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+            db.execute("COMMIT")
+
+    def version(self, store: str) -> int:
+        with self._lock:
+            row = self._conn().execute("SELECT version FROM stores WHERE name = ?", (store,)).fetchone()
+        return row[0] if row else 0
+
+    def seed(self, store: str, entries: Mapping[str, Mapping[str, Any]]) -> None:
+        """Insert entries that do not exist yet (first worker to start wins)."""
+        with self.transaction(store) as tx:
+            existing = set(tx.changes_since(-1))
+            missing = {k: v for k, v in entries.items() if k not in existing}
+            if missing:
+                # Seeds keep version 0 so they never show up as "changed".
+                tx.db.executemany(
+                    "INSERT OR IGNORE INTO entries (store, key, data, version) VALUES (?, ?, ?, 0)",
+                    [(store, k, json.dumps(v, separators=(",", ":"))) for k, v in missing.items()],
+                )
+
+
+class FileLock:
+    """Exclusive advisory lock on `path`, usable as a context manager."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._local = threading.local()
+
+    def __enter__(self) -> "FileLock":
+        depth = getattr(self._local, "depth", 0)
+        if depth == 0:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            self._local.fd = fd
+        self._local.depth = depth + 1
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._local.depth -= 1
+        if self._local.depth == 0:
+            fcntl.flock(self._local.fd, fcntl.LOCK_UN)
+            os.close(self._local.fd)
+
+    def try_acquire(self) -> Optional[int]:
+        """Non-blocking acquire that is held until the process exits (leader election)."""
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return None
+        return fd
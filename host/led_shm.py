@@ -0,0 +1,230 @@
+"""
+Segment state in a fixed-layout, memory-mapped table for local readers.
+
+- `led_web.py` writes every committed segment into `LED_SHM_PATH`
+  (default /dev/shm/led_state) behind a seqlock: the sequence counter is odd
+  while a write is in progress and bumped to even when it completes.
+- `ShmReader` copies the table and re-checks the counter, so a snapshot is
+  consistent without sockets, JSON or syscalls (after the initial mmap).
+- Writers in different processes (multi-worker serving) serialize on flock;
+  each slot carries the store version it was written at, so a late writer
+  never replaces newer state.
+Layout (little-endian):
+    header  magic "LEDS", layout u16, slots u16, slot_size u32, seq u64,
+            state_version u64, updated_at f64 (padded to 64 bytes)
+    slot    version u64, name 16s, pattern 16s, wave_shape 12s, brightness, speed, wave_count,
+            mic_gain, mic_floor, mic_smooth, wind_mph (f32), color, gradient_low,
+            gradient_mid, gradient_high (3 x u8 each), flags u8
+Reader CLI:
+    python led_shm.py            # print current state as JSON
+    python led_shm.py --watch    # print on every change
+"""
+from __future__ import annotations
+
+import argparse
+import fcntl
+import json
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Tuple
+
+MAGIC = b"LEDS"
+LAYOUT = 1
+MAX_SLOTS = 16
+HEADER = struct.Struct("<4sHHIQQd")
+HEADER_SIZE = 64
+SEQ_OFFSET = 12  # offset of `seq` inside HEADER
+SLOT = struct.Struct("<Q16s16s12s7f12BB3x")
+FLOAT_FIELDS = ("brightness", "speed", "wave_count", "mic_gain", "mic_floor", "mic_smooth", "wind_mph")
+RGB_FIELDS = ("color", "gradient_low", "gradient_mid", "gradient_high")
+FLAG_FIELDS = ("mic_enabled", "gradient_enabled", "mic_beat")
+TABLE_SIZE = HEADER_SIZE + MAX_SLOTS * SLOT.size
+
+
+def default_path() -> str:
+    base = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(base, "led_state")
+
+
+def _text(value: Any, size: int) -> bytes:
+    return str(value or "").encode("utf-8")[:size]
+
+
+def pack_slot(name: str, state: Mapping[str, Any], version: int = 0) -> bytes:
+    floats = [float(state.get(f) or 0.0) for f in FLOAT_FIELDS]
+    rgb = []
+    for field in RGB_FIELDS:
+        value = state.get(field) or (0, 0, 0)
+        rgb.extend(max(0, min(255, int(c))) for c in list(value)[:3])
+    flags = sum(1 << i for i, f in enumerate(FLAG_FIELDS) if state.get(f))
+    return SLOT.pack(version, _text(name, 16), _text(state.get("pattern"), 16), _text(state.get("wave_shape"), 12), *floats, *rgb, flags)
+
+
+def unpack_slot(raw: bytes, offset: int = 0) -> Optional[Dict[str, Any]]:
+    version, *fields = SLOT.unpack_from(raw, offset)
+    name = fields[0].rstrip(b"\0").decode("utf-8", "replace")
+    if not name:
+        return None
+    out: Dict[str, Any] = {
+        "segment": name,
+        "version": version,
+        "pattern": fields[1].rstrip(b"\0").decode("utf-8", "replace"),
+        "wave_shape": fields[2].rstrip(b"\0").decode("utf-8", "replace"),
+    }
+    for i, field in enumerate(FLOAT_FIELDS):
+        out[field] = round(fields[3 + i], 4)
+    rgb = fields[10:22]
+    for i, field in enumerate(RGB_FIELDS):
+        out[field] = list(rgb[i * 3:i * 3 + 3])
+    for i, field in enumerate(FLAG_FIELDS):
+        out[field] = bool(fields[22] >> i & 1)
+    return out
+
+
+class ShmWriter:
+    """Owns the table file; `write()` updates changed slots under the seqlock."""
+
+    def __init__(self, path: str, segments: Iterable[str], version: int = 0) -> None:
+        """`version` is the store's current version; a table written ahead of it
+        (left over from an earlier run) is cleared."""
+        self.path = path
+        self.slots = {seg: i for i, seg in enumerate(list(segments)[:MAX_SLOTS])}
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            if os.fstat(fd).st_size != TABLE_SIZE:
+                os.ftruncate(fd, TABLE_SIZE)
+            self._mm = mmap.mmap(fd, TABLE_SIZE)
+            magic, layout = struct.unpack_from("<4sH", self._mm, 0)
+            (written,) = struct.unpack_from("<Q", self._mm, SEQ_OFFSET + 8)
+            if magic != MAGIC or layout != LAYOUT or written > version:
+                self._mm[:TABLE_SIZE] = b"\0" * TABLE_SIZE
+                HEADER.pack_into(self._mm, 0, MAGIC, LAYOUT, MAX_SLOTS, SLOT.size, 0, 0, 0.0)
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        self._fd = fd
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+
+    def write(self, version: int, entries: Mapping[str, Mapping[str, Any]]) -> None:
+        """Write `entries` as of store `version`; slots already holding a newer version are kept."""
+        packed = [(self.slots[seg], pack_slot(seg, state, version)) for seg, state in entries.items() if seg in self.slots]
+        if not packed:
+            return
+        # flock is per open file, so threads of this process also need the mutex.
+        with self._lock:
+            if self._pid != os.getpid():
+                # A forked worker shares the parent's open file, which flock cannot tell apart.
+                self._fd, self._pid = os.open(self.path, os.O_RDWR), os.getpid()
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                self._write_locked(version, packed)
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _write_locked(self, version: int, packed: List[Tuple[int, bytes]]) -> None:
+        mm = self._mm
+        packed = [
+            (idx, raw) for idx, raw in packed
+            if struct.unpack_from("<Q", mm, HEADER_SIZE + idx * SLOT.size)[0] <= version
+        ]
+        if not packed:
+            return
+        (seq,) = struct.unpack_from("<Q", mm, SEQ_OFFSET)
+        seq += 1 if seq % 2 == 0 else 2  # recover from a writer that died mid-write
+        struct.pack_into("<Q", mm, SEQ_OFFSET, seq)
+        for idx, raw in packed:
+            start = HEADER_SIZE + idx * SLOT.size
+            mm[start:start + SLOT.size] = raw
+        latest = max(version, struct.unpack_from("<Q", mm, SEQ_OFFSET + 8)[0])
+        struct.pack_into("<Qd", mm, SEQ_OFFSET + 8, latest, time.time())
+        struct.pack_into("<Q", mm, SEQ_OFFSET, seq + 1)
+
+    def on_state(self, version: int, updated: Mapping[str, Mapping[str, Any]]) -> None:
+        """StateStore listener."""
+        try:
+            self.write(version, updated)
+        except Exception as exc:
+            print(f"shared-memory state write failed: {exc}")
+
+
+class ShmReader:
+    def __init__(self, path: Optional[str] = None) -> None:
+        self.path = path or os.getenv("LED_SHM_PATH") or default_path()
+        with open(self.path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), TABLE_SIZE, access=mmap.ACCESS_READ)
+        magic, layout, slots, slot_size = struct.unpack_from("<4sHHI", self._mm, 0)
+        if magic != MAGIC or layout != LAYOUT or slot_size != SLOT.size:
+            raise ValueError(f"{self.path} is not a layout-{LAYOUT} LED state table")
+        self.slot_count = slots
+
+    def seq(self) -> int:
+        return struct.unpack_from("<Q", self._mm, SEQ_OFFSET)[0]
+
+    def raw(self, retries: int = 10000) -> bytes:
+        """Consistent copy of the whole table."""
+        mm = self._mm
+        for attempt in range(retries):
+            (s1,) = struct.unpack_from("<Q", mm, SEQ_OFFSET)
+            if s1 % 2 == 0:
+                data = mm[:TABLE_SIZE]
+                (s2,) = struct.unpack_from("<Q", mm, SEQ_OFFSET)
+                if s1 == s2:
+                    return data
+            if attempt > 100:
+                time.sleep(0)
+        raise TimeoutError("state table kept changing while reading")
+
+    def snapshot(self) -> Tuple[int, Dict[str, Dict[str, Any]]]:
+        """(state version, {segment: state})."""
+        data = self.raw()
+        _, _, _, _, _, version, _ = HEADER.unpack_from(data, 0)
+        out = {}
+        for i in range(self.slot_count):
+            slot = unpack_slot(data, HEADER_SIZE + i * SLOT.size)
+            if slot:
+                out[slot["segment"]] = slot
+        return version, out
+
+    def get(self, segment: str) -> Optional[Dict[str, Any]]:
+        return self.snapshot()[1].get(segment)
+
+    def wait_for_change(self, seq: int, timeout: float = 10.0, poll: float = 0.02) -> int:
+        """Return the new sequence number once it differs from `seq` (or on timeout)."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            current = self.seq()
+            if current != seq and current % 2 == 0:
+                return current
+            time.sleep(poll)
+        return self.seq()
+
+    def close(self) -> None:
+        self._mm.close()
+
+
+def main(argv: Optional[list] = None) -> int:
+    parser = argparse.ArgumentParser(description="Read LED segment state from shared memory")
+    parser.add_argument("--path", help="Table path (default LED_SHM_PATH or /dev/shm/led_state)")
+    parser.add_argument("--watch", action="store_true", help="Print again whenever the state changes")
+    args = parser.parse_args(argv)
+    try:
+        reader = ShmReader(args.path)
+    except (OSError, ValueError) as exc:
+        print(f"cannot open state table: {exc}")
+        return 1
+    seq = reader.seq()
+    while True:
+        version, state = reader.snapshot()
+        print(json.dumps({"version": version, "state": list(state.values())}), flush=True)
+        if not args.watch:
+            return 0
+        seq = reader.wait_for_change(seq, timeout=3600)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,157 @@
+"""
+Versioned, thread-safe key -> state store used for the host's in-memory cache.
+
+- Updates are applied under one lock and bump a monotonic version.
+- Readers get immutable snapshots (read-only mappings, lists frozen to tuples),
+  so Flask threads and watcher threads never see a half-applied update.
+- `changed_since(version)` returns only the entries touched after `version`.
+- Listeners run after each commit, outside the lock, with the new entries.
+- With a `backend` (see led_shared.SqliteBackend) entries and versions live in a
+  shared file: commits merge inside a backend write transaction and reads pull
+  rows other processes committed. Listeners only fire for local commits.
+"""
+from __future__ import annotations
+
+import threading
+from types import MappingProxyType
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional, Tuple
+
+Entry = Mapping[str, Any]
+Listener = Callable[[int, Dict[str, Entry]], None]
+
+
+def freeze(value: Any) -> Any:
+    if isinstance(value, Mapping):
+        return MappingProxyType({k: freeze(v) for k, v in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(v) for v in value)
+    return value
+
+
+def thaw(value: Any) -> Any:
+    """Plain dict/list copy of a frozen value (for JSON and mutation)."""
+    if isinstance(value, Mapping):
+        return {k: thaw(v) for k, v in value.items()}
+    if isinstance(value, tuple):
+        return [thaw(v) for v in value]
+    return value
+
+
+class StateStore:
+    def __init__(
+        self,
+        initial: Optional[Mapping[str, Mapping[str, Any]]] = None,
+        backend: Any = None,
+        name: str = "state",
+    ) -> None:
+        self._lock = threading.Lock()
+        self._version = 0
+        self._entries: Dict[str, Entry] = {}
+        self._changed: Dict[str, int] = {}
+        self._listeners: List[Listener] = []
+        self._backend = backend
+        self._name = name
+        for key, values in (initial or {}).items():
+            self._entries[key] = freeze(values)
+            self._changed[key] = 0
+        if backend is not None:
+            backend.seed(name, {k: thaw(v) for k, v in self._entries.items()})
+            with self._lock, backend.transaction(name, write=False) as tx:
+                self._pull(tx, -1)
+
+    def _pull(self, tx: Any, since: int) -> None:
+        """Apply rows committed after `since` (caller holds the lock)."""
+        for key, (version, values) in tx.changes_since(since).items():
+            self._entries[key] = freeze(values)
+            self._changed[key] = version
+        self._version = max(self._version, tx.version)
+
+    def _refresh(self) -> None:
+        if self._backend is None or self._backend.version(self._name) == self._version:
+            return
+        with self._lock, self._backend.transaction(self._name, write=False) as tx:
+            self._pull(tx, self._version)
+
+    @property
+    def version(self) -> int:
+        self._refresh()
+        return self._version
+
+    def add_listener(self, fn: Listener) -> None:
+        self._listeners.append(fn)
+
+    def _commit(
+        self, changes: Dict[str, Mapping[str, Any]], merge: bool
+    ) -> Tuple[int, Dict[str, Entry], Dict[str, Entry]]:
+        """Apply changes; returns (version, updated entries, current entries for `changes`)."""
+        with self._lock:
+            if self._backend is not None:
+                with self._backend.transaction(self._name) as tx:
+                    self._pull(tx, self._version)
+                    version, updated, current = self._merge(changes, merge, tx)
+            else:
+                version, updated, current = self._merge(changes, merge, None)
+        if updated:
+            for fn in self._listeners:
+                fn(version, updated)
+        return version, updated, current
+
+    def _merge(
+        self, changes: Dict[str, Mapping[str, Any]], merge: bool, tx: Any
+    ) -> Tuple[int, Dict[str, Entry], Dict[str, Entry]]:
+        updated: Dict[str, Entry] = {}
+        for key, values in changes.items():
+            old = self._entries.get(key)
+            if merge and old is not None:
+                merged = dict(old)
+                merged.update({k: freeze(v) for k, v in values.items()})
+                new = MappingProxyType(merged)
+            else:
+                new = freeze(values)
+            if new == old:
+                continue
+            updated[key] = new
+        if updated:
+            self._version = tx.write({k: thaw(v) for k, v in updated.items()}) if tx else self._version + 1
+            for key, new in updated.items():
+                self._entries[key] = new
+                self._changed[key] = self._version
+        current = {key: self._entries[key] for key in changes}
+        return self._version, updated, current
+
+    def update(self, key: str, values: Mapping[str, Any]) -> Entry:
+        """Merge `values` into one entry; returns the new immutable entry."""
+        return self._commit({key: values}, merge=True)[2][key]
+
+    def update_many(self, changes: Mapping[str, Mapping[str, Any]]) -> int:
+        """Merge several entries atomically; returns the resulting version."""
+        return self._commit(dict(changes), merge=True)[0]
+
+    def replace(self, key: str, values: Mapping[str, Any]) -> Entry:
+        return self._commit({key: values}, merge=False)[2][key]
+
+    def get(self, key: str, default: Optional[Entry] = None) -> Optional[Entry]:
+        self._refresh()
+        return self._entries.get(key, default)
+
+    def keys(self) -> Iterable[str]:
+        self._refresh()
+        return list(self._entries)
+
+    def snapshot(self) -> Tuple[int, Mapping[str, Entry]]:
+        self._refresh()
+        with self._lock:
+            return self._version, MappingProxyType(dict(self._entries))
+
+    def changed_since(self, version: int) -> Tuple[int, Dict[str, Entry]]:
+        self._refresh()
+        with self._lock:
+            changed = {k: self._entries[k] for k, v in self._changed.items() if v > version}
+            return self._version, changed
+
+    def as_json(self, key: str) -> Dict[str, Any]:
+        return thaw(self.get(key, {}))
+
+    def values_json(self) -> List[Dict[str, Any]]:
+        _, entries = self.snapshot()
+        return [thaw(v) for v in entries.values()]
@@ -0,0 +1,237 @@
+"""
+Opt-in request tracing and on-demand profiling for the Flask host.
+
+- `span("name")` records a timed stage in the current request's trace.
+- Requests slower than `LED_SLOW_MS` are logged with their span breakdown and
+  kept in a small ring for `/api/debug/slow`.
+- `ProfileCapture` profiles the next N requests to one route with cProfile or
+  a stack sampler; the result can be downloaded without a restart.
+Enable with `LED_TRACE=1` or at runtime via `/api/debug/trace`.
+"""
+from __future__ import annotations
+
+import cProfile
+import contextvars
+import functools
+import io
+import logging
+import marshal
+import os
+import sys
+import threading
+import time
+from collections import Counter as TallyCounter, deque
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+log = logging.getLogger("led_web.trace")
+
+TRACE_ENABLED = os.getenv("LED_TRACE", "0") not in ("", "0", "false", "no")
+SLOW_MS = float(os.getenv("LED_SLOW_MS", "250"))
+SLOW_LOG_SIZE = 50
+
+_current: contextvars.ContextVar[Optional["Trace"]] = contextvars.ContextVar("led_trace", default=None)
+
+
+class Trace:
+    __slots__ = ("method", "path", "start", "spans")
+
+    def __init__(self, method: str, path: str) -> None:
+        self.method = method
+        self.path = path
+        self.start = time.perf_counter()
+        self.spans: List[Tuple[str, float, float]] = []  # (name, offset_ms, duration_ms)
+
+    def summary(self, total_ms: float, status: int) -> Dict:
+        return {
+            "method": self.method,
+            "path": self.path,
+            "status": status,
+            "total_ms": round(total_ms, 3),
+            "at": time.time(),
+            "spans": [{"name": n, "offset_ms": round(o, 3), "ms": round(d, 3)} for n, o, d in self.spans],
+        }
+
+
+class span:
+    """Context manager recording a named stage; no-op outside a trace."""
+
+    __slots__ = ("name", "trace", "t0")
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.trace = _current.get()
+        self.t0 = 0.0
+
+    def __enter__(self) -> "span":
+        if self.trace is not None:
+            self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        if self.trace is not None:
+            now = time.perf_counter()
+            self.trace.spans.append((self.name, (self.t0 - self.trace.start) * 1000.0, (now - self.t0) * 1000.0))
+
+
+def traced(name: str) -> Callable:
+    """Decorator form of `span`."""
+
+    def wrap(fn: Callable) -> Callable:
+        @functools.wraps(fn)
+        def inner(*args, **kwargs):
+            if _current.get() is None:
+                return fn(*args, **kwargs)
+            with span(name):
+                return fn(*args, **kwargs)
+
+        return inner
+
+    return wrap
+
+
+SLOW_REQUESTS: Deque[Dict] = deque(maxlen=SLOW_LOG_SIZE)
+
+
+def begin(method: str, path: str) -> Optional[contextvars.Token]:
+    if not TRACE_ENABLED:
+        return None
+    return _current.set(Trace(method, path))
+
+
+def finish(token: Optional[contextvars.Token], status: int) -> None:
+    if token is None:
+        return
+    trace = _current.get()
+    _current.reset(token)
+    if trace is None:
+        return
+    total_ms = (time.perf_counter() - trace.start) * 1000.0
+    if total_ms < SLOW_MS:
+        return
+    summary = trace.summary(total_ms, status)
+    SLOW_REQUESTS.append(summary)
+    breakdown = ", ".join(f"{s['name']}={s['ms']:.1f}ms" for s in summary["spans"]) or "no spans"
+    log.warning("slow request %s %s %.1fms (%s)", trace.method, trace.path, total_ms, breakdown)
+
+
+def configure(enabled: Optional[bool] = None, slow_ms: Optional[float] = None) -> Dict:
+    global TRACE_ENABLED, SLOW_MS
+    if enabled is not None:
+        TRACE_ENABLED = bool(enabled)
+    if slow_ms is not None:
+        SLOW_MS = max(0.0, float(slow_ms))
+    return {"enabled": TRACE_ENABLED, "slow_ms": SLOW_MS}
+
+
+class _Sampler:
+    """Samples one thread's Python stack at a fixed interval."""
+
+    def __init__(self, thread_id: int, interval: float, stacks: TallyCounter) -> None:
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = stacks
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+
+class ProfileCapture:
+    """Profile the next `count` requests to `route`, one request at a time."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._busy = threading.Lock()
+        self.route: Optional[str] = None
+        self.mode = "cprofile"
+        self.remaining = 0
+        self.captured = 0
+        self.interval = 0.005
+        self._profile: Optional[cProfile.Profile] = None
+        self._stacks: TallyCounter = TallyCounter()
+        self.finished_at: Optional[float] = None
+
+    def arm(self, route: str, count: int, mode: str = "cprofile", interval_ms: float = 5.0) -> Dict:
+        if mode not in ("cprofile", "sample"):
+            raise ValueError("mode must be cprofile or sample")
+        with self._lock:
+            self.route = route
+            self.mode = mode
+            self.remaining = max(1, int(count))
+            self.captured = 0
+            self.interval = max(0.001, float(interval_ms) / 1000.0)
+            self._profile = cProfile.Profile() if mode == "cprofile" else None
+            self._stacks = TallyCounter()
+            self.finished_at = None
+        return self.status()
+
+    def status(self) -> Dict:
+        return {
+            "route": self.route,
+            "mode": self.mode,
+            "remaining": self.remaining,
+            "captured": self.captured,
+            "done": self.finished_at is not None,
+        }
+
+    def start(self, route: Optional[str]):
+        """Called per request; returns a handle if this request is profiled."""
+        if self.remaining <= 0 or route != self.route:
+            return None
+        if not self._busy.acquire(blocking=False):
+            return None
+        if self.remaining <= 0:
+            self._busy.release()
+            return None
+        if self.mode == "cprofile":
+            self._profile.enable()
+            return ("cprofile", None)
+        sampler = _Sampler(threading.get_ident(), self.interval, self._stacks)
+        sampler.start()
+        return ("sample", sampler)
+
+    def stop(self, handle) -> None:
+        if handle is None:
+            return
+        kind, sampler = handle
+        try:
+            if kind == "cprofile":
+                self._profile.disable()
+            else:
+                sampler.stop()
+            with self._lock:
+                self.remaining -= 1
+                self.captured += 1
+                if self.remaining <= 0:
+                    self.finished_at = time.time()
+        finally:
+            self._busy.release()
+
+    def export(self) -> Tuple[bytes, str, str]:
+        """Return (data, mimetype, filename) for the captured profile."""
+        if self.mode == "cprofile" and self._profile is not None:
+            self._profile.create_stats()
+            return marshal.dumps(self._profile.stats), "application/octet-stream", "led_web.pstats"
+        out = io.StringIO()
+        for stack, n in self._stacks.most_common():
+            out.write(f"{stack} {n}\n")
+        return out.getvalue().encode("utf-8"), "text/plain", "led_web.collapsed.txt"
+
+
+PROFILER = ProfileCapture()
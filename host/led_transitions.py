@@ -0,0 +1,215 @@
+"""
+Server-side fades for brightness, color, gradient stops, speed and white balance.
+
+- `TransitionEngine.start()` interpolates numeric fields (floats and RGB
+  triplets) from the current value to a target over `duration` seconds.
+- One background thread ticks each device at its own frame rate and hands all
+  active segments of that device to a single sender call per tick.
+- Starting a new fade on a segment that is mid-fade begins from the value last
+  sent, so interruptions never jump.
+- A failing sender is logged once per transition, not once per frame, and a
+  fade whose final frame was not sent does not call `on_done` (the cache is
+  not moved to a target the device never got).
+"""
+from __future__ import annotations
+
+import threading
+import time
+from typing import Any, Callable, Dict, List, Mapping, Optional, Tuple
+
+# (key, values, static_fields, final)
+Frame = Tuple[str, Dict[str, Any], Dict[str, Any], bool]
+Sender = Callable[[List[Frame]], None]
+DoneCallback = Callable[[str, Dict[str, Any]], None]
+
+
+def _ease_in(t: float) -> float:
+    return t * t * t
+
+
+def _ease_out(t: float) -> float:
+    u = 1.0 - t
+    return 1.0 - u * u * u
+
+
+def _ease_in_out(t: float) -> float:
+    if t < 0.5:
+        return 4.0 * t * t * t
+    u = -2.0 * t + 2.0
+    return 1.0 - u * u * u / 2.0
+
+
+EASINGS: Dict[str, Callable[[float], float]] = {
+    "linear": lambda t: t,
+    "ease_in": _ease_in,
+    "ease_out": _ease_out,
+    "ease_in_out": _ease_in_out,
+    "smoothstep": lambda t: t * t * (3.0 - 2.0 * t),
+}
+DEFAULT_EASING = "ease_in_out"
+
+
+def lerp_value(a: Any, b: Any, k: float) -> Any:
+    if isinstance(b, (list, tuple)):
+        return [int(round(x + (y - x) * k)) for x, y in zip(a, b)]
+    return a + (b - a) * k
+
+
+class Transition:
+    __slots__ = ("key", "start_values", "end_values", "static", "t0", "duration", "ease", "last", "sent_static", "failed")
+
+    def __init__(
+        self,
+        key: str,
+        start_values: Dict[str, Any],
+        end_values: Dict[str, Any],
+        static: Dict[str, Any],
+        duration: float,
+        easing: str,
+    ) -> None:
+        self.key = key
+        self.start_values = start_values
+        self.end_values = end_values
+        self.static = static
+        self.t0 = time.monotonic()
+        self.duration = max(0.0, duration)
+        self.ease = EASINGS.get(easing, EASINGS[DEFAULT_EASING])
+        self.last: Dict[str, Any] = dict(start_values)
+        self.sent_static = False
+        self.failed = False  # a frame send failed (logged once per transition)
+
+    def progress(self, now: float) -> float:
+        if self.duration <= 0:
+            return 1.0
+        return min(1.0, max(0.0, (now - self.t0) / self.duration))
+
+    def values_at(self, now: float) -> Dict[str, Any]:
+        k = self.ease(self.progress(now))
+        return {f: lerp_value(self.start_values[f], v, k) for f, v in self.end_values.items()}
+
+
+class _Device:
+    def __init__(self, name: str, sender: Sender, fps: float, on_done: Optional[DoneCallback]) -> None:
+        self.name = name
+        self.sender = sender
+        self.interval = 1.0 / max(1.0, fps)
+        self.on_done = on_done
+        self.active: Dict[str, Transition] = {}
+        self.next_tick = 0.0
+
+
+class TransitionEngine:
+    def __init__(self) -> None:
+        self._devices: Dict[str, _Device] = {}
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+
+    def register(self, device: str, sender: Sender, fps: float = 20.0, on_done: Optional[DoneCallback] = None) -> None:
+        self._devices[device] = _Device(device, sender, fps, on_done)
+
+    def _ensure_thread(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="led-transitions", daemon=True)
+            self._thread.start()
+
+    def start(
+        self,
+        device: str,
+        key: str,
+        current: Mapping[str, Any],
+        target: Mapping[str, Any],
+        duration: float,
+        easing: str = DEFAULT_EASING,
+        static: Optional[Mapping[str, Any]] = None,
+    ) -> None:
+        """Fade `key` on `device` from `current` (or its in-flight value) to `target`.
+
+        Only fields present in `target` with a value in `current` are
+        interpolated; `static` fields go out once with the first frame.
+        """
+        dev = self._devices[device]
+        with self._cond:
+            running = dev.active.get(key)
+            base = dict(current)
+            if running is not None:
+                base.update(running.last)
+            start_values = {}
+            end_values = {}
+            fixed = dict(static or {})
+            for field, value in target.items():
+                if value is None:
+                    continue
+                if base.get(field) is None:
+                    fixed[field] = value
+                    continue
+                start = list(base[field]) if isinstance(value, (list, tuple)) else float(base[field])
+                end = list(value) if isinstance(value, (list, tuple)) else float(value)
+                if start == end:
+                    # Nothing to fade; send once with the first frame.
+                    fixed[field] = value
+                    continue
+                start_values[field] = start
+                end_values[field] = end
+            dev.active[key] = Transition(key, start_values, end_values, fixed, duration, easing)
+            self._ensure_thread()
+            self._cond.notify()
+
+    def cancel(self, device: str, key: str) -> Optional[Dict[str, Any]]:
+        """Stop a fade without sending anything; returns the last values sent."""
+        dev = self._devices.get(device)
+        if dev is None:
+            return None
+        with self._cond:
+            running = dev.active.pop(key, None)
+        return dict(running.last) if running else None
+
+    def active(self) -> Dict[str, List[str]]:
+        with self._cond:
+            return {name: sorted(dev.active) for name, dev in self._devices.items() if dev.active}
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                now = time.monotonic()
+                due: List[Tuple[_Device, List[Frame], List[Transition], List[Transition]]] = []
+                wait = None
+                for dev in self._devices.values():
+                    if not dev.active:
+                        continue
+                    if now < dev.next_tick:
+                        wait = dev.next_tick - now if wait is None else min(wait, dev.next_tick - now)
+                        continue
+                    frames: List[Frame] = []
+                    finished: List[Transition] = []
+                    ticking = list(dev.active.values())
+                    for tr in ticking:
+                        values = tr.values_at(now)
+                        final = tr.progress(now) >= 1.0
+                        static = {} if tr.sent_static else tr.static
+                        tr.sent_static = True
+                        tr.last.update(values)
+                        frames.append((tr.key, values, static, final))
+                        if final:
+                            dev.active.pop(tr.key, None)
+                            finished.append(tr)
+                    dev.next_tick = now + dev.interval
+                    wait = dev.interval if wait is None else min(wait, dev.interval)
+                    due.append((dev, frames, ticking, finished))
+                if not due:
+                    self._cond.wait(timeout=wait)
+                    continue
+            for dev, frames, ticking, finished in due:
+                try:
+                    dev.sender(frames)
+                    sent = True
+                except Exception as exc:
+                    sent = False
+                    fresh = [tr.key for tr in ticking if not tr.failed]
+                    for tr in ticking:
+                        tr.failed = True
+                    if fresh:
+                        print(f"transition frames for {dev.name} {', '.join(fresh)} failed: {exc}")
+                if dev.on_done and sent:
+                    # A final frame that never went out must not move the cache to its target.
+                    for tr in finished:
+                        dev.on_done(tr.key, {**tr.static, **tr.last})
@@ -6,22 +6,55 @@ Run: source .env.mqtt && python3 led_web.py
 """
 from __future__ import annotations
 
+import functools
+import io
 import json
+import logging
 import os
 import time
-import subprocess
-import math
-from dataclasses import dataclass
-from typing import Dict, List, Optional
-
-from flask import Flask, jsonify, render_template_string, request
-import paho.mqtt.client as mqtt
+import threading
+from collections import deque
+from typing import Dict, List, Optional, Set, Tuple
+
+from flask import Flask, Response, g, jsonify, render_template_string, request, send_file
+
+from led_metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, REGISTRY, timed
+from led_mqtt import BrokerUnavailable, CircuitBreaker, DeliveryError, Publisher
+from led_outbox import Forwarder, Outbox, default_path as default_outbox_path
+from led_model import GRADIENT_SENSITIVE, PARAM_ORDER, TOP_LEVEL_FIELDS, Command, CommandError, SegmentStates, merge_sets
+from led_presets import export_lines, import_lines, read_library
+from led_payload import PayloadTooLarge, SendFilter, limits_for, payload_stats, prepare_messages, record_messages
+from led_retained import RetainedStateMirror, collect as collect_retained, fields_from_payload
+from led_capture import Capture, Replayer, default_dir as default_capture_dir, load as load_capture
+from led_color import kelvin_to_rgb
+from led_discovery import DEFAULT_LEASE_FILES, DiscoveryIndex
+from led_esp3 import Esp3Driver, parse_strips
+from led_feeds import FeedScheduler, load_feeds
+from led_journal import Journal, default_dir as default_journal_dir
+from led_health import TIERS as HEALTH_TIERS, HealthRing, HealthSampler, default_probes, read_cpu_temp
+from led_health import default_path as default_health_path
+from led_shared import FileLock, SqliteBackend
+from led_shm import ShmWriter, default_path as default_shm_path
+from led_store import StateStore, thaw
+from led_transitions import DEFAULT_EASING, EASINGS, TransitionEngine
+import led_trace
+from led_trace import PROFILER, span, traced
 
 MQTT_HOST = os.getenv("MQTT_HOST", "10.42.0.1")
 MQTT_PORT = int(os.getenv("MQTT_PORT", "1883"))
 MQTT_USER = os.getenv("MQTT_USER") or None
 MQTT_PASS = os.getenv("MQTT_PASS") or None
 MQTT_CMD_TOPIC = os.getenv("MQTT_CMD_TOPIC", "led/command")
+MQTT_STATE_PREFIX = os.getenv("MQTT_STATE_PREFIX", "led/state")
+RETAIN_STATE = os.getenv("MQTT_RETAIN_STATE", "1") != "0"
+# Delivery mode per kind of traffic: single commands, preset applies, and
+# high-rate streams (fade frames, the brightness slider).
+MQTT_QOS = {
+    "command": int(os.getenv("MQTT_QOS_COMMAND", "1")),
+    "preset": int(os.getenv("MQTT_QOS_PRESET", "1")),
+    "stream": int(os.getenv("MQTT_QOS_STREAM", "0")),
+    "retained": 1,
+}
 STATES_FILE = os.getenv("LED_STATE_FILE", os.path.join(os.path.dirname(__file__), "led_states.json"))
 SEGMENTS = [
     "strip0",
@@ -29,6 +62,9 @@ SEGMENTS = [
     "strip2",
     "strip3",
 ]
+# Named sub-ranges of strip1 in the firmware's segment table; presets drive them directly.
+SUB_SEGMENTS = ["seg250_323", "seg330_400"]
+KNOWN_SEGMENTS = SEGMENTS + SUB_SEGMENTS
 SEGMENT_LABELS = {
     "strip1": "Main Surround Lights",
     "strip2": "Right Speaker",
@@ -117,141 +153,436 @@ ESP2_DEFAULT_IP = os.getenv("ESP2_IP", "10.42.0.29")
 ESP3_DEFAULT_IP = os.getenv("ESP3_IP", "10.42.0.173")
 ESP3_CMD_TOPIC = os.getenv("ESP3_CMD_TOPIC", "esp32u/command")
 ESP3_STATES_FILE = os.getenv("ESP3_STATE_FILE", os.path.join(os.path.dirname(__file__), "esp3_states.json"))
+FEEDS_FILE = os.getenv("LED_FEEDS_FILE", os.path.join(os.path.dirname(__file__), "feeds.json"))
+# Seconds a byte-identical `set` for the same segment is not re-sent (0 disables).
+SEND_DEDUPE_TTL = float(os.getenv("LED_SEND_DEDUPE_TTL", "30"))
+# Journal of the last-sent state for restart recovery ("" disables).
+JOURNAL_DIR = os.getenv("LED_JOURNAL_DIR", default_journal_dir())
+# Where command captures are recorded and replayed from ("" disables).
+CAPTURE_DIR = os.getenv("LED_CAPTURE_DIR", default_capture_dir())
+# Ring file holding commands while the broker is unreachable ("" disables).
+OUTBOX_PATH = os.getenv("LED_OUTBOX_PATH", default_outbox_path())
 
 app = Flask(__name__)
-# In-memory cache of last sent state (best effort for display)
-STATE_CACHE = {seg: {"segment": seg, "pattern": "solid", "brightness": 180, "speed": 1.0, "color": [0, 180, 160], "wave_shape": "sine"} for seg in SEGMENTS}
-for seg in STATE_CACHE:
-    STATE_CACHE[seg]["wave_count"] = 5.0
-    STATE_CACHE[seg]["mic_gain"] = 0.3
-    STATE_CACHE[seg]["mic_floor"] = 0.02
-    STATE_CACHE[seg]["mic_smooth"] = 0.3
-    STATE_CACHE[seg]["mic_enabled"] = True
-    STATE_CACHE[seg]["gradient_enabled"] = False
-    STATE_CACHE[seg]["gradient_low"] = [0, 120, 255]
-    STATE_CACHE[seg]["gradient_mid"] = [255, 255, 255]
-    STATE_CACHE[seg]["gradient_high"] = [255, 0, 120]
-    STATE_CACHE[seg]["mic_beat"] = False
-ESP3_STATE: Dict[str, float] = {"brightness": 200, "white_balance": 4500, "last_pattern": "white", "target": "both"}
+# In-memory cache of last sent state (best effort for display); versioned + thread-safe.
+DEFAULT_SEGMENT_STATE = {
+    "pattern": "solid",
+    "brightness": 180,
+    "speed": 1.0,
+    "color": [0, 180, 160],
+    "wave_shape": "sine",
+    "wave_count": 5.0,
+    "mic_gain": 0.3,
+    "mic_floor": 0.02,
+    "mic_smooth": 0.3,
+    "mic_enabled": True,
+    "gradient_enabled": False,
+    "gradient_low": [0, 120, 255],
+    "gradient_mid": [255, 255, 255],
+    "gradient_high": [255, 0, 120],
+    "mic_beat": False,
+}
+# Set by led_serve.py so every worker process shares one state file.
+SHARED_BACKEND = SqliteBackend(os.environ["LED_SHARED_STATE"]) if os.getenv("LED_SHARED_STATE") else None
+STATE = StateStore({seg: {"segment": seg, **DEFAULT_SEGMENT_STATE} for seg in SEGMENTS}, SHARED_BACKEND, "segments")
+ESP3_KEY = "esp3"
+ESP3 = StateStore({ESP3_KEY: {"brightness": 200, "white_balance": 4500, "last_pattern": "white", "target": "both"}},
+                  SHARED_BACKEND, "esp3")
+# Serializes preset read-modify-write across threads and worker processes.
+PRESET_LOCK = FileLock(os.path.join(os.path.dirname(os.path.abspath(STATES_FILE)), ".presets.lock"))
 LAST_DEFAULT_APPLY = 0.0
 LAST_ESP_UP = False
 LAST_ESP3_UP = False
 
+SEND_FILTER = SendFilter(SEND_DEDUPE_TTL)
+# One broker connection per process (see led_mqtt.py).
+PUBLISHER = Publisher(
+    MQTT_HOST,
+    MQTT_PORT,
+    MQTT_USER,
+    MQTT_PASS,
+    client_id="led-web",
+    window=int(os.getenv("MQTT_INFLIGHT_WINDOW", "16")),
+    ack_timeout=float(os.getenv("MQTT_ACK_TIMEOUT", "1.0")),
+    retries=int(os.getenv("MQTT_RETRIES", "2")),
+    # Handlers wait this long for a connection, then queue or answer "broker down".
+    connect_wait=float(os.getenv("MQTT_CONNECT_WAIT", "0.25")),
+    breaker=CircuitBreaker(max_backoff=float(os.getenv("MQTT_PROBE_MAX_BACKOFF", "30"))),
+)
+
+MQTT_PUBLISH_SECONDS = REGISTRY.histogram("led_mqtt_publish_seconds", "Publish until delivered per QoS", ["topic"])
+MQTT_PUBLISH_TOTAL = REGISTRY.counter("led_mqtt_publish_total", "Publish attempts by outcome", ["topic", "result"])
+MQTT_CONNECT_FAILURES = REGISTRY.counter("led_mqtt_connect_failures_total", "Broker connect failures", ["topic"])
+HTTP_SECONDS = REGISTRY.histogram("led_http_request_seconds", "API handler latency", ["endpoint", "method"])
+HTTP_TOTAL = REGISTRY.counter("led_http_requests_total", "API requests by status", ["endpoint", "method", "status"])
+PRESET_IO_SECONDS = REGISTRY.histogram("led_preset_io_seconds", "Preset file load/write time", ["op"])
+PROBE_SECONDS = REGISTRY.histogram("led_probe_seconds", "Watcher and sensor probe duration", ["probe"])
+
+
+@app.before_request
+def _metrics_start():
+    g.metrics_start = time.perf_counter()
+    g.trace_token = led_trace.begin(request.method, request.path)
+    g.profile_handle = PROFILER.start(request.url_rule.rule if request.url_rule else None)
+
+
+@app.after_request
+def _metrics_record(response):
+    PROFILER.stop(g.pop("profile_handle", None))
+    led_trace.finish(g.pop("trace_token", None), response.status_code)
+    start = g.pop("metrics_start", None)
+    if start is not None and request.path.startswith("/api/"):
+        endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+        HTTP_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint, method=request.method)
+        HTTP_TOTAL.inc(endpoint=endpoint, method=request.method, status=str(response.status_code))
+    return response
+
+
+@app.teardown_request
+def _trace_teardown(exc):
+    # after_request is skipped on unhandled errors; release profiler/trace here.
+    PROFILER.stop(g.pop("profile_handle", None))
+    led_trace.finish(g.pop("trace_token", None), 500)
+
+
+@app.errorhandler(BrokerUnavailable)
+def _broker_down(exc):
+    # Only reached with the outbox disabled; otherwise the command is queued.
+    return jsonify({"ok": False, "error": "broker down", "detail": str(exc)}), 503
+
+
+@app.route("/metrics")
+def metrics():
+    return Response(REGISTRY.render(), mimetype=METRICS_CONTENT_TYPE)
+
+
+def _publish_to(topic: str, payloads: List, kind: str, force: bool = False) -> bool:
+    """Publish one or more commands over a single broker connection.
+
+    Payloads are dicts or led_model objects that cache their encoded bodies.
+    A `set` identical to the last one delivered for its segment within
+    SEND_DEDUPE_TTL is dropped unless `force` is set. Commands the broker does
+    not take go to the outbox and are delivered once it is back; returns
+    True when that happened.
+    """
+    with span("encode"):
+        bodies: List[bytes] = []
+        keys: List[Tuple[str, str]] = []
+        sent: List[Tuple[str, List[bytes]]] = []
+        for payload in payloads:
+            if isinstance(payload, dict):
+                parts = prepare_messages(payload, topic, MQTT_CMD_TOPIC)
+                is_set, key = payload.get("cmd") == "set", str(payload.get("segment", ""))
+            else:
+                parts = payload.messages(topic, MQTT_CMD_TOPIC)
+                is_set, key = True, payload.segment
+            if is_set:
+                if not force and not SEND_FILTER.admit(topic, key, parts):
+                    continue
+                sent.append((key, parts))
+            bodies += record_messages(parts, topic)
+            # A newer command for the same segment supersedes this one in QoS 1 retries.
+            keys += [(topic, key)] * len(parts) if is_set else [None] * len(parts)
+    if not bodies:
+        return False
+    messages = [(topic, body) for body in bodies]
+    if CAPTURE is not None:
+        CAPTURE.record(messages, kind)
+    if OUTBOX is not None and OUTBOX.depth():
+        # Queue behind what is already waiting so this command is not overtaken.
+        _queue(messages, kind, keys)
+        return True
+    try:
+        _send_bodies(messages, topic, kind, keys=keys)
+    except (OSError, DeliveryError) as exc:
+        SEND_FILTER.forget(topic, [key for key, _ in sent])
+        if OUTBOX is None:
+            raise
+        print(f"broker unavailable, queueing {len(messages)} message(s) for {topic}: {exc}")
+        _queue(messages, kind, keys)
+        return True
+    except Exception:
+        SEND_FILTER.forget(topic, [key for key, _ in sent])
+        raise
+    SEND_FILTER.remember(topic, sent)
+    return False
+
+
+def _queue(messages: List[Tuple[str, bytes]], kind: str, keys: List) -> None:
+    OUTBOX.append(messages, kind, keys=[key[1] if key else None for key in keys])
+    if FORWARDER is not None:
+        FORWARDER.kick()
+
 
-def publish(payload: Dict) -> None:
-    client = mqtt.Client(client_id="led-web-ui")
-    if MQTT_USER:
-        client.username_pw_set(MQTT_USER, MQTT_PASS)
-    client.connect(MQTT_HOST, MQTT_PORT, keepalive=30)
-    client.loop_start()
+def _send_bodies(
+    messages: List[Tuple[str, bytes]], metric_topic: str, kind: str, retain: bool = False, keys: Optional[List] = None
+) -> None:
+    start = time.perf_counter()
     try:
-        client.publish(MQTT_CMD_TOPIC, json.dumps(payload), qos=0, retain=False)
+        with span("mqtt_connect"):
+            PUBLISHER.connect()
+    except BrokerUnavailable:
+        MQTT_PUBLISH_TOTAL.inc(topic=metric_topic, result="broker_down")
+        raise
+    except Exception:
+        MQTT_CONNECT_FAILURES.inc(topic=metric_topic)
+        MQTT_PUBLISH_TOTAL.inc(topic=metric_topic, result="connect_error")
+        raise
+    try:
+        with span("mqtt_publish"):
+            PUBLISHER.send(messages, qos=MQTT_QOS[kind], kind=kind, retain=retain, keys=keys)
+    except DeliveryError:
+        MQTT_PUBLISH_TOTAL.inc(topic=metric_topic, result="not_delivered")
+        raise
     finally:
-        client.loop_stop()
-        client.disconnect()
+        MQTT_PUBLISH_SECONDS.observe(time.perf_counter() - start, topic=metric_topic)
+    MQTT_PUBLISH_TOTAL.inc(topic=metric_topic, result="ok")
 
 
-def publish_esp3(payload: Dict) -> None:
-    """Send a message to the ESP32U (camming lights) topic."""
-    client = mqtt.Client(client_id="led-web-ui-esp3")
-    if MQTT_USER:
-        client.username_pw_set(MQTT_USER, MQTT_PASS)
-    client.connect(MQTT_HOST, MQTT_PORT, keepalive=30)
-    client.loop_start()
+def _send_queued(messages: List[Tuple[str, bytes]], kind: str, retain: bool, keys: List[Optional[str]]) -> None:
+    """Outbox sender: deliver merged commands once the broker is back."""
+    topic = messages[0][0]
+    _send_bodies(messages, topic, kind, retain, [(topic, key) if key is not None else None for key in keys])
+
+
+def _merge_queued(topic: str, groups: List[List[bytes]]) -> Optional[List[bytes]]:
+    """Outbox merger: fold the queued `set` commands for one segment into one."""
     try:
-        client.publish(ESP3_CMD_TOPIC, json.dumps(payload), qos=0, retain=False)
-    finally:
-        client.loop_stop()
-        client.disconnect()
+        payload = merge_sets([json.loads(body) for group in groups for body in group])
+        return prepare_messages(payload, topic, MQTT_CMD_TOPIC)
+    except (ValueError, PayloadTooLarge):
+        return None
+
+
+def _open_outbox() -> Optional[Outbox]:
+    if not OUTBOX_PATH:
+        return None
+    try:
+        return Outbox(OUTBOX_PATH, int(os.getenv("LED_OUTBOX_SLOTS", "256")), merge=_merge_queued)
+    except Exception as exc:
+        print(f"outbox disabled: {exc}")
+        return None
+
+
+OUTBOX = _open_outbox()
+FORWARDER = Forwarder(OUTBOX, _send_queued) if OUTBOX is not None else None
+if FORWARDER is not None:
+    # Flush as soon as the broker is back instead of on the next retry tick.
+    PUBLISHER.add_connect_listener(FORWARDER.kick)
+
+
+CAPTURE = Capture(CAPTURE_DIR) if CAPTURE_DIR else None
+REPLAY: Optional[Replayer] = None
+REPLAY_LOCK = threading.Lock()
+
+
+def publish(payload, force: bool = False, kind: str = "command") -> bool:
+    """Returns True when the broker was down and the command was queued."""
+    return _publish_to(MQTT_CMD_TOPIC, [payload], kind, force)
+
+
+def publish_many(payloads: List, force: bool = False, kind: str = "preset") -> bool:
+    return bool(payloads) and _publish_to(MQTT_CMD_TOPIC, payloads, kind, force)
+
+
+def publish_esp3(payload: Dict, force: bool = False, kind: str = "command") -> bool:
+    """Send a message to the ESP32U (camming lights) topic."""
+    return _publish_to(ESP3_CMD_TOPIC, [payload], kind, force)
+
+
+ESP3_DRIVER = Esp3Driver(
+    lambda payload, kind, force: publish_esp3(payload, force=force, kind=kind),
+    parse_strips(os.getenv("ESP3_STRIPS", "33:300,32:300")),
+    rate_hz=float(os.getenv("ESP3_RATE_HZ", "30")),
+)
 
 
 def color_temp_to_rgb(kelvin: float) -> List[int]:
-    """Approximate color temperature (K) to RGB for white balance slider."""
-    k = max(1500.0, min(9000.0, float(kelvin)))
-    tmp = k / 100.0
-    if tmp <= 66:
-        red = 255
-        green = 99.4708025861 * math.log(tmp) - 161.1195681661
-        blue = 0 if tmp <= 19 else 138.5177312231 * math.log(tmp - 10) - 305.0447927307
-    else:
-        red = 329.698727446 * ((tmp - 60) ** -0.1332047592)
-        green = 288.1221695283 * ((tmp - 60) ** -0.0755148492)
-        blue = 255
-    return [int(max(0, min(255, red))), int(max(0, min(255, green))), int(max(0, min(255, blue)))]
-
-
-@dataclass
-class Command:
-    segment: str
-    pattern: str
-    brightness: float  # 0-255
-    speed: float
-    color: List[int]
-    wave_shape: Optional[str] = None
-    wave_count: float = 1.0
-    mic_gain: Optional[float] = None
-    mic_floor: Optional[float] = None
-    mic_smooth: Optional[float] = None
-    mic_enabled: Optional[bool] = None
-    gradient_low: Optional[List[int]] = None
-    gradient_mid: Optional[List[int]] = None
-    gradient_high: Optional[List[int]] = None
-    gradient_enabled: Optional[bool] = None
-    mic_beat: Optional[bool] = None
-
-    @classmethod
-    def from_request(cls, data: Dict) -> "Command":
-        return cls(
-            segment=data.get("segment", "strip1"),
-            pattern=data.get("pattern", "solid"),
-            brightness=float(data.get("brightness", 255.0)),
-            speed=float(data.get("speed", 1.0)),
-            color=[int(x) for x in data.get("color", [0, 180, 160])][:3],
-            wave_shape=data.get("wave_shape"),
-            wave_count=float(data.get("wave_count", 1.0)),
-            mic_gain=float(data["mic_gain"]) if "mic_gain" in data else None,
-            mic_floor=float(data["mic_floor"]) if "mic_floor" in data else None,
-            mic_smooth=float(data["mic_smooth"]) if "mic_smooth" in data else None,
-            mic_enabled=bool(data["mic_enabled"]) if "mic_enabled" in data else None,
-            gradient_low=[int(x) for x in data["gradient_low"]] if "gradient_low" in data else None,
-            gradient_mid=[int(x) for x in data["gradient_mid"]] if "gradient_mid" in data else None,
-            gradient_high=[int(x) for x in data["gradient_high"]] if "gradient_high" in data else None,
-            gradient_enabled=bool(data["gradient_enabled"]) if "gradient_enabled" in data else None,
-            mic_beat=bool(data["mic_beat"]) if "mic_beat" in data else None,
-        )
+    """Color temperature (K) to RGB for the white balance slider (table lookup)."""
+    return kelvin_to_rgb(kelvin)
 
-    def to_payload(self) -> Dict:
-        params: Dict = {"color": self.color}
-        if self.wave_shape:
-            params["wave_shape"] = self.wave_shape
-        if self.wave_count is not None:
-            params["wave_count"] = self.wave_count
-        if self.mic_gain is not None:
-            params["mic_gain"] = self.mic_gain
-        if self.mic_floor is not None:
-            params["mic_floor"] = self.mic_floor
-        if self.mic_smooth is not None:
-            params["mic_smooth"] = self.mic_smooth
-        if self.mic_enabled is not None:
-            params["mic_enabled"] = self.mic_enabled
-        if self.gradient_low is not None:
-            params["gradient_low"] = self.gradient_low
-        if self.gradient_mid is not None:
-            params["gradient_mid"] = self.gradient_mid
-        if self.gradient_high is not None:
-            params["gradient_high"] = self.gradient_high
-        if self.gradient_enabled is not None:
-            params["gradient_enabled"] = self.gradient_enabled
-        if self.mic_beat is not None:
-            params["mic_beat"] = self.mic_beat
-        return {
-            "cmd": "set",
-            "segment": self.segment,
-            "pattern": self.pattern,
-            "brightness": self.brightness,
-            "speed": self.speed,
-            "params": params,
-        }
+
+def esp3_state() -> Dict:
+    return ESP3.as_json(ESP3_KEY)
+
+
+def state_payload(segment: str, fields: Dict) -> Dict:
+    """Build a (possibly partial) `set` payload from cache-style fields."""
+    payload: Dict = {"cmd": "set", "segment": segment}
+    for key in TOP_LEVEL_FIELDS:
+        if key in fields:
+            payload[key] = fields[key]
+    params = {key: fields[key] for key in PARAM_ORDER if key in fields}
+    params.update({k: v for k, v in fields.items() if k not in params and k not in TOP_LEVEL_FIELDS and k != "segment"})
+    if params:
+        payload["params"] = params
+    return payload
+
+
+def split_fade_fields(values: Dict) -> (Dict, Dict):
+    """Split cache fields into (interpolated, static) for a fade.
+
+    Gradient stops fade when the target uses the gradient, otherwise `color`
+    fades; the other one is sent once up front so the firmware mode is right.
+    """
+    fade_keys = ["brightness", "speed"]
+    fade_keys += ["gradient_low", "gradient_mid", "gradient_high"] if values.get("gradient_enabled") else ["color"]
+    fade = {k: values[k] for k in fade_keys if values.get(k) is not None}
+    static = {k: v for k, v in values.items() if k not in fade and v not in (None, "") and k != "segment"}
+    return fade, static
+
+
+def _send_segment_frames(frames) -> None:
+    publish_many([state_payload(seg, {**static, **values}) for seg, values, static, _ in frames], kind="stream")
+
+
+# Pattern/target of the running camming fade (the engine passes them with the first frame only).
+_ESP3_FADE_STATIC: Dict = {}
+
+
+def _send_esp3_frames(frames) -> None:
+    current = ESP3.get(ESP3_KEY)
+    for _, values, static, _ in frames:
+        if static:
+            _ESP3_FADE_STATIC.clear()
+            _ESP3_FADE_STATIC.update(static)
+        # Pattern/target went out before the fade started; frames are deltas.
+        base = {**current, **_ESP3_FADE_STATIC}
+        ESP3_DRIVER.apply({**base, **values}, base, kind="stream")
+
+
+TRANSITIONS = TransitionEngine()
+TRANSITIONS.register("main", _send_segment_frames, fps=float(os.getenv("LED_FADE_FPS", "20")),
+                     on_done=lambda seg, values: STATE.update(seg, values))
+TRANSITIONS.register("esp3", _send_esp3_frames, fps=float(os.getenv("ESP3_FADE_FPS", "10")),
+                     on_done=lambda key, values: ESP3.update(key, values))
+
+
+def _open_journal() -> Optional[Journal]:
+    """Journal every cache commit and restore the last-sent state from it.
+
+    Under led_serve.py the shared SQLite state already survives restarts, so
+    there is no journal.
+    """
+    if not JOURNAL_DIR or SHARED_BACKEND is not None:
+        return None
+    try:
+        journal = Journal(JOURNAL_DIR, fsync=os.getenv("LED_JOURNAL_FSYNC", "0") == "1")
+    except Exception as exc:
+        print(f"command journal disabled: {exc}")
+        return None
+    recovered = journal.state()
+    STATE.update_many({seg: v for seg, v in recovered.get("segments", {}).items() if seg in KNOWN_SEGMENTS})
+    ESP3.update_many({k: v for k, v in recovered.get("esp3", {}).items() if k == ESP3_KEY})
+    JOURNAL_RESTORED.update(recovered)
+    if journal.seq:
+        print(f"restored state from journal (seq {journal.seq}) in {journal.recovery_ms} ms")
+    STATE.add_listener(journal.listener("segments"))
+    ESP3.add_listener(journal.listener("esp3"))
+    return journal
+
+
+# Recovered before the retained mirror and shared-memory table listen, so they start from it.
+JOURNAL_RESTORED: Dict[str, Dict] = {}
+JOURNAL = _open_journal()
+
+
+def _publish_retained(messages: List[Tuple[str, bytes]]) -> None:
+    _send_bodies(messages, MQTT_STATE_PREFIX, "retained", retain=True)
+
+
+# Full per-segment state with cached payload bytes (diffs and retained topics).
+SEGMENT_MODELS = SegmentStates()
+RETAINED = RetainedStateMirror(
+    MQTT_STATE_PREFIX,
+    _publish_retained,
+    SEGMENT_MODELS.encoded,
+    limits_for(MQTT_CMD_TOPIC, MQTT_CMD_TOPIC),
+)
+if RETAIN_STATE:
+    STATE.add_listener(RETAINED.on_state)
+
+
+def _open_shm_writer() -> Optional[ShmWriter]:
+    """Mirror segment state into shared memory for local readers (led_shm.py); LED_SHM_PATH="" disables."""
+    path = os.getenv("LED_SHM_PATH", default_shm_path())
+    if not path:
+        return None
+    try:
+        version, entries = STATE.snapshot()
+        writer = ShmWriter(path, SEGMENTS, version)
+        writer.write(version, entries)
+    except Exception as exc:
+        print(f"shared-memory state table disabled: {exc}")
+        return None
+    STATE.add_listener(writer.on_state)
+    return writer
+
+
+SHM_WRITER = _open_shm_writer()
+
+
+def resync_retained_state() -> Set[str]:
+    """Load the broker's retained segment state into STATE and clear stale topics.
+
+    Returns the segments that had retained state.
+    """
+    bodies = collect_retained(MQTT_STATE_PREFIX, MQTT_HOST, MQTT_PORT, MQTT_USER, MQTT_PASS)
+    keep = retained_segments()
+    live = {seg: body for seg, body in bodies.items() if seg in keep}
+    RETAINED.seed(live)
+    changes = {}
+    for seg, body in live.items():
+        try:
+            changes[seg] = fields_from_payload(json.loads(body))
+        except ValueError:
+            continue
+    STATE.update_many(changes)
+    stale = RETAINED.compact(bodies, keep)
+    if stale:
+        print(f"cleared retained state for removed segments: {', '.join(stale)}")
+    return set(changes)
+
+
+def retained_segments() -> Set[str]:
+    """Segments whose retained topic must survive a compact.
+
+    That is every segment in the store plus every segment a saved preset
+    drives (the firmware sub-segments such as seg250_323 only live there).
+    """
+    _, current = STATE.snapshot()
+    keep = set(SEGMENTS) | set(current)
+    states, _ = load_states()
+    for data in states.values():
+        keep.update((data or {}).get("segments", {}))
+    return keep
+
+
+def _load_feed_scheduler() -> FeedScheduler:
+    try:
+        feeds = load_feeds(FEEDS_FILE)
+    except Exception as exc:
+        print(f"feed config {FEEDS_FILE} ignored: {exc}")
+        feeds = []
+    return FeedScheduler(feeds, publish, on_sent=lambda feed, payload: STATE.update(feed.segment, payload["params"]))
+
+
+FEEDS = _load_feed_scheduler()
+
+
+def start_feeds() -> None:
+    """Start polling data feeds (no-op when none are configured)."""
+    if FEEDS.feeds:
+        FEEDS.start(MQTT_HOST, MQTT_PORT, MQTT_USER, MQTT_PASS)
+
+
+def fade_options(body: Dict) -> (float, str):
+    """Read optional `duration` (seconds) and `easing` from a request body."""
+    duration = max(0.0, min(60.0, float(body.get("duration") or 0.0)))
+    easing = body.get("easing") or DEFAULT_EASING
+    if easing not in EASINGS:
+        raise ValueError(f"easing must be one of {', '.join(sorted(EASINGS))}")
+    return duration, easing
 
 
 @app.route("/")
@@ -273,33 +604,46 @@ def index():
 @app.route("/api/set", methods=["POST"])
 def api_set():
     data = request.get_json(force=True)
-    cmd = Command.from_request(data)
-    publish(cmd.to_payload())
-    STATE_CACHE[cmd.segment] = {
-        "segment": cmd.segment,
-        "pattern": cmd.pattern,
-        "brightness": cmd.brightness,
-        "speed": cmd.speed,
-        "color": cmd.color,
-        "wave_shape": cmd.wave_shape or "",
-        "wave_count": cmd.wave_count,
-        "mic_gain": cmd.mic_gain if cmd.mic_gain is not None else STATE_CACHE[cmd.segment].get("mic_gain", 4.0),
-        "mic_floor": cmd.mic_floor if cmd.mic_floor is not None else STATE_CACHE[cmd.segment].get("mic_floor", 0.02),
-        "mic_smooth": cmd.mic_smooth if cmd.mic_smooth is not None else STATE_CACHE[cmd.segment].get("mic_smooth", 0.8),
-        "mic_enabled": cmd.mic_enabled if cmd.mic_enabled is not None else STATE_CACHE[cmd.segment].get("mic_enabled", True),
-        "gradient_enabled": cmd.gradient_enabled if cmd.gradient_enabled is not None else STATE_CACHE[cmd.segment].get("gradient_enabled", False),
-        "gradient_low": cmd.gradient_low if cmd.gradient_low is not None else STATE_CACHE[cmd.segment].get("gradient_low", [0, 120, 255]),
-        "gradient_mid": cmd.gradient_mid if cmd.gradient_mid is not None else STATE_CACHE[cmd.segment].get("gradient_mid", [255, 255, 255]),
-        "gradient_high": cmd.gradient_high if cmd.gradient_high is not None else STATE_CACHE[cmd.segment].get("gradient_high", [255, 0, 120]),
-    }
-    return jsonify({"ok": True})
+    try:
+        cmd = Command.from_request(data)
+        duration, easing = fade_options(data)
+    except (TypeError, ValueError) as exc:
+        return jsonify({"ok": False, "error": str(exc)}), 400
+    if duration > 0:
+        fade, static = split_fade_fields(cmd.state())
+        TRANSITIONS.start("main", cmd.segment, STATE.get(cmd.segment, {}), fade, duration, easing, static)
+        return jsonify({"ok": True, "fading": duration})
+    TRANSITIONS.cancel("main", cmd.segment)
+    queued = publish(cmd, force=bool(data.get("force")))
+    STATE.update(cmd.segment, cmd.state())
+    return jsonify({"ok": True, "queued": queued})
 
 
 @app.route("/api/ping", methods=["POST"])
 def api_ping():
     seg = request.get_json(force=True).get("segment", "strip1")
-    publish({"cmd": "ping", "segment": seg})
-    return jsonify({"ok": True})
+    queued = publish({"cmd": "ping", "segment": seg})
+    return jsonify({"ok": True, "queued": queued})
+
+
+@app.route("/api/state/retained")
+def api_state_retained():
+    return jsonify({"enabled": RETAIN_STATE, **RETAINED.status()})
+
+
+@app.route("/api/state/retained/compact", methods=["POST"])
+def api_state_retained_compact():
+    try:
+        bodies = collect_retained(MQTT_STATE_PREFIX, MQTT_HOST, MQTT_PORT, MQTT_USER, MQTT_PASS)
+        cleared = RETAINED.compact(bodies, retained_segments())
+    except Exception as exc:
+        return jsonify({"ok": False, "error": str(exc)}), 502
+    return jsonify({"ok": True, "cleared": cleared})
+
+
+@app.route("/api/feeds")
+def api_feeds():
+    return jsonify({"config": FEEDS_FILE, "feeds": FEEDS.status()})
 
 
 @app.route("/api/status")
@@ -313,10 +657,160 @@ def api_status():
             "mqtt_topic": MQTT_CMD_TOPIC,
             "esp_default_ip": ESP_DEFAULT_IP,
             "esp3_default_ip": ESP3_DEFAULT_IP,
+            "payload": payload_stats(),
+            "mqtt": PUBLISHER.status(),
+            "outbox": OUTBOX.status() if OUTBOX is not None else {"enabled": False},
+            "journal": JOURNAL.status() if JOURNAL is not None else {"enabled": False},
         }
     )
 
 
+@app.route("/api/journal")
+def api_journal():
+    """Journal status and records: ?since=<unix time> or ?last=<seconds>, &limit (newest, default 200)."""
+    if JOURNAL is None:
+        return jsonify({"enabled": False})
+    try:
+        since = float(request.args["since"]) if "since" in request.args else None
+        if "last" in request.args:
+            since = time.time() - float(request.args["last"])
+        limit = int(request.args.get("limit", "200"))
+    except ValueError as exc:
+        return jsonify({"ok": False, "error": str(exc)}), 400
+    records = deque(JOURNAL.records(since=since), maxlen=max(0, limit))
+    return jsonify({
+        "enabled": True,
+        **JOURNAL.status(),
+        "records": [{"seq": seq, "t": ts, "store": store, "key": key, "fields": fields}
+                    for seq, ts, store, key, fields in records],
+    })
+
+
+@app.route("/api/capture")
+def api_capture():
+    if CAPTURE is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, "active": CAPTURE.active(), "captures": CAPTURE.files()})
+
+
+@app.route("/api/capture/start", methods=["POST"])
+def api_capture_start():
+    if CAPTURE is None:
+        return jsonify({"ok": False, "error": "capture disabled"}), 404
+    body = request.get_json(force=True, silent=True) or {}
+    try:
+        active = CAPTURE.start(body.get("name"))
+    except (ValueError, FileExistsError) as exc:
+        return jsonify({"ok": False, "error": str(exc)}), 409
+    return jsonify({"ok": True, "capture": active})
+
+
+@app.route("/api/capture/stop", methods=["POST"])
+def api_capture_stop():
+    summary = CAPTURE.stop() if CAPTURE is not None else None
+    if summary is None:
+        return jsonify({"ok": False, "error": "no capture running"}), 409
+    return jsonify({"ok": True, "capture": summary})
+
+
+def _send_replayed(topic: str, body: bytes, kind: str, update_state: bool) -> None:
+    """Replay sender: straight to the broker (no dedupe, outbox or capture), then mirror the cache."""
+    _send_bodies([(topic, body)], topic, kind)
+    if not update_state:
+        return
+    payload = json.loads(body)
+    if payload.get("cmd") != "set":
+        return
+    if topic == MQTT_CMD_TOPIC and payload.get("segment") in SEGMENTS:
+        STATE.update(payload["segment"], fields_from_payload(payload))
+    elif topic == ESP3_CMD_TOPIC:
+        values = {k: payload[k] for k in ("brightness", "white_balance", "target") if k in payload}
+        if "pattern" in payload:
+            values["last_pattern"] = payload["pattern"]
+        ESP3.update(ESP3_KEY, values)
+
+
+def _replay_done(replayer: Replayer) -> None:
+    # The lights now show the replay: drop dedupe fingerprints and resync the camming driver.
+    SEND_FILTER.clear(MQTT_CMD_TOPIC)
+    SEND_FILTER.clear(ESP3_CMD_TOPIC)
+    ESP3_DRIVER.reset()
+    print(f"replay {replayer.state}: {json.dumps(replayer.report())}")
+
+
+@app.route("/api/replay")
+def api_replay():
+    return jsonify({"replay": REPLAY.report() if REPLAY is not None else None})
+
+
+@app.route("/api/replay/start", methods=["POST"])
+def api_replay_start():
+    """{"name", "speed" (1; 0 = as fast as possible), "start"/"end" (seconds), "loop", "update_state" (true)}"""
+    global REPLAY
+    if CAPTURE is None:
+        return jsonify({"ok": False, "error": "capture disabled"}), 404
+    body = request.get_json(force=True) or {}
+    try:
+        _, messages = load_capture(CAPTURE.path(str(body.get("name") or "")))
+        speed = float(body.get("speed", 1.0))
+        start = float(body.get("start", 0.0))
+        end = float(body["end"]) if body.get("end") is not None else None
+    except FileNotFoundError as exc:
+        return jsonify({"ok": False, "error": str(exc)}), 404
+    except (TypeError, ValueError) as exc:
+        return jsonify({"ok": False, "error": str(exc)}), 400
+    update_state = body.get("update_state", True) is not False
+    with REPLAY_LOCK:
+        if REPLAY is not None and REPLAY.running():
+            return jsonify({"ok": False, "error": "a replay is already running"}), 409
+        REPLAY = Replayer(
+            messages,
+            lambda topic, payload, kind: _send_replayed(topic, payload, kind, update_state),
+            speed, start, end, bool(body.get("loop")), on_done=_replay_done,
+        )
+        REPLAY.start()
+    return jsonify({"ok": True, "messages": len(messages), "replay": REPLAY.report()})
+
+
+@app.route("/api/replay/stop", methods=["POST"])
+def api_replay_stop():
+    if REPLAY is None or not REPLAY.running():
+        return jsonify({"ok": False, "error": "no replay running"}), 409
+    REPLAY.stop()
+    return jsonify({"ok": True})
+
+
+@app.route("/api/replay/seek", methods=["POST"])
+def api_replay_seek():
+    body = request.get_json(force=True) or {}
+    if REPLAY is None or not REPLAY.running():
+        return jsonify({"ok": False, "error": "no replay running"}), 409
+    try:
+        REPLAY.seek(float(body["position"]))
+    except (KeyError, TypeError, ValueError):
+        return jsonify({"ok": False, "error": "position (seconds) required"}), 400
+    return jsonify({"ok": True})
+
+
+def _write_json_atomic(path: str, payload: Dict) -> None:
+    """Write via a temp file + rename so other workers never read a half-written file."""
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(payload, f, indent=2)
+    os.replace(tmp, path)
+
+
+def preset_write(view):
+    """Hold PRESET_LOCK for a route that loads, changes and writes a preset file."""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        with PRESET_LOCK:
+            return view(*args, **kwargs)
+    return wrapper
+
+
+@timed(PRESET_IO_SECONDS, op="load_esp3")
+@traced("load_esp3_states")
 def load_esp3_states() -> (Dict[str, Dict], Optional[str]):
     if not os.path.exists(ESP3_STATES_FILE):
         return {}, None
@@ -330,58 +824,66 @@ def load_esp3_states() -> (Dict[str, Dict], Optional[str]):
     return {}, None
 
 
+@timed(PRESET_IO_SECONDS, op="write_esp3")
+@traced("write_esp3_states")
 def write_esp3_states(states: Dict[str, Dict], default_name: Optional[str] = None) -> None:
     payload = {"states": states}
     if default_name and default_name in states:
         payload["default"] = default_name
     try:
-        with open(ESP3_STATES_FILE, "w", encoding="utf-8") as f:
-            json.dump(payload, f, indent=2)
+        _write_json_atomic(ESP3_STATES_FILE, payload)
     except Exception:
         pass
 
 
-def _apply_esp3_snapshot(data: Dict) -> Dict:
-    """Apply a camming snapshot dict."""
-    pattern = data.get("pattern", ESP3_STATE.get("last_pattern", "white"))
+def _apply_esp3_snapshot(
+    data: Dict, duration: float = 0.0, easing: str = DEFAULT_EASING, force: bool = False
+) -> (Dict, bool):
+    """Apply a camming snapshot dict, optionally fading brightness/white balance.
+
+    Nothing is published when the cached state already matches, unless `force`.
+    Returns (new state, whether anything was sent).
+    """
+    current = ESP3.get(ESP3_KEY)
+    pattern = data.get("pattern", current.get("last_pattern", "white"))
     if pattern not in CAMMING_PATTERNS:
         pattern = "white"
-    brightness = data.get("brightness", ESP3_STATE.get("brightness", 200))
-    white_balance = data.get("white_balance", ESP3_STATE.get("white_balance", 4500))
-    target = data.get("target", ESP3_STATE.get("target", "both"))
-    payload = {
-        "cmd": "set",
-        "pattern": pattern,
-        "brightness": brightness,
-        "white_balance": white_balance,
+    brightness = data.get("brightness", current.get("brightness", 200))
+    white_balance = data.get("white_balance", current.get("white_balance", 4500))
+    target = data.get("target", current.get("target", "both"))
+    values = {
+        "brightness": float(brightness),
+        "white_balance": float(white_balance),
+        "last_pattern": pattern,
         "target": target,
-        "strips": [{"pin": 33, "length": 300}, {"pin": 32, "length": 300}],
     }
-    if pattern == "white":
-        payload["color"] = color_temp_to_rgb(white_balance)
-    publish_esp3(payload)
-    ESP3_STATE.update(
-        {
-            "brightness": float(brightness),
-            "white_balance": float(white_balance),
-            "last_pattern": pattern,
-            "target": target,
-        }
-    )
-    return ESP3_STATE
-
-
-def apply_default_esp3() -> bool:
+    fading = ESP3_KEY in TRANSITIONS.active().get("esp3", [])
+    if not force and not fading and all(current.get(k) == v for k, v in values.items()):
+        return thaw(current), False
+    if duration > 0:
+        fade = {"brightness": values["brightness"], "white_balance": values["white_balance"]}
+        static = {"last_pattern": pattern, "target": target}
+        ESP3_DRIVER.apply({**current, **static}, current, force=force)
+        TRANSITIONS.start("esp3", ESP3_KEY, current, fade, duration, easing, static)
+        return values, True
+    TRANSITIONS.cancel("esp3", ESP3_KEY)
+    ESP3_DRIVER.apply(values, current, force=force)
+    new_state = ESP3.update(ESP3_KEY, values)
+    return thaw(new_state), True
+
+
+def apply_default_esp3(force: bool = False) -> bool:
     states, default_name = load_esp3_states()
     if not default_name or default_name not in states:
         return False
-    _apply_esp3_snapshot(states[default_name])
+    _apply_esp3_snapshot(states[default_name], force=force)
     return True
 
 
 @app.route("/api/esp3/state")
 def api_esp3_state():
-    return jsonify({"ok": True, "state": ESP3_STATE, "ip": ESP3_DEFAULT_IP})
+    return jsonify({"ok": True, "state": esp3_state(), "ip": ESP3_DEFAULT_IP, "version": ESP3.version,
+                    "driver": ESP3_DRIVER.status()})
 
 
 @app.route("/api/esp3/states", methods=["GET"])
@@ -392,17 +894,19 @@ def api_esp3_states():
 
 
 @app.route("/api/esp3/state/save", methods=["POST"])
+@preset_write
 def api_esp3_state_save():
     body = request.get_json(force=True) or {}
     name = (body.get("name") or "").strip()
     if not name:
         return jsonify({"ok": False, "error": "Name required"}), 400
     states, default_name = load_esp3_states()
+    current = esp3_state()
     snapshot = {
-        "pattern": ESP3_STATE.get("last_pattern", "white"),
-        "brightness": ESP3_STATE.get("brightness", 200),
-        "white_balance": ESP3_STATE.get("white_balance", 4500),
-        "target": ESP3_STATE.get("target", "both"),
+        "pattern": current.get("last_pattern", "white"),
+        "brightness": current.get("brightness", 200),
+        "white_balance": current.get("white_balance", 4500),
+        "target": current.get("target", "both"),
     }
     states[name] = snapshot
     write_esp3_states(states, default_name)
@@ -417,11 +921,16 @@ def api_esp3_state_apply():
     if not name or name not in states:
         return jsonify({"ok": False, "error": "State not found"}), 404
     data = states[name]
-    new_state = _apply_esp3_snapshot(data)
-    return jsonify({"ok": True, "state": {"name": name, "data": data}, "applied": new_state})
+    try:
+        duration, easing = fade_options(body)
+    except (TypeError, ValueError) as exc:
+        return jsonify({"ok": False, "error": str(exc)}), 400
+    new_state, changed = _apply_esp3_snapshot(data, duration, easing, force=bool(body.get("force")))
+    return jsonify({"ok": True, "state": {"name": name, "data": data}, "applied": new_state, "changed": changed})
 
 
 @app.route("/api/esp3/state/default", methods=["POST"])
+@preset_write
 def api_esp3_state_default():
     body = request.get_json(force=True) or {}
     name = (body.get("name") or "").strip()
@@ -434,6 +943,7 @@ def api_esp3_state_default():
 
 
 @app.route("/api/esp3/state/delete", methods=["POST"])
+@preset_write
 def api_esp3_state_delete():
     body = request.get_json(force=True) or {}
     name = (body.get("name") or "").strip()
@@ -450,41 +960,111 @@ def api_esp3_state_delete():
 @app.route("/api/esp3/set", methods=["POST"])
 def api_esp3_set():
     body = request.get_json(force=True) or {}
+    current = ESP3.get(ESP3_KEY)
     pattern = body.get("pattern", "white")
-    brightness = body.get("brightness", ESP3_STATE.get("brightness", 200))
-    white_balance = body.get("white_balance", ESP3_STATE.get("white_balance", 4500))
+    brightness = body.get("brightness", current.get("brightness", 200))
+    white_balance = body.get("white_balance", current.get("white_balance", 4500))
     target = body.get("target", "both")
     if pattern not in CAMMING_PATTERNS:
         pattern = "white"
-    payload: Dict = {
-        "cmd": "set",
-        "pattern": pattern,
+    try:
+        duration, easing = fade_options(body)
+    except (TypeError, ValueError) as exc:
+        return jsonify({"ok": False, "error": str(exc)}), 400
+    wb = float(white_balance) if white_balance is not None else 4500.0
+    values = {
+        "brightness": float(brightness) if brightness is not None else current.get("brightness"),
+        "white_balance": wb,
+        "last_pattern": pattern,
         "target": target,
-        "strips": [{"pin": 33, "length": 300}, {"pin": 32, "length": 300}],
     }
-    if brightness is not None:
-        payload["brightness"] = float(brightness)
-    wb = float(white_balance) if white_balance is not None else 4500.0
-    payload["white_balance"] = wb
-    if pattern == "white":
-        payload["color"] = color_temp_to_rgb(wb)
-    publish_esp3(payload)
-    ESP3_STATE.update(
-        {
-            "brightness": float(brightness) if brightness is not None else ESP3_STATE.get("brightness"),
-            "white_balance": wb,
-            "last_pattern": payload.get("pattern", pattern),
-            "target": target,
-        }
-    )
-    return jsonify({"ok": True, "state": ESP3_STATE})
+    if duration > 0:
+        fade = {"brightness": values["brightness"], "white_balance": wb}
+        static = {"last_pattern": pattern, "target": target}
+        ESP3_DRIVER.apply({**current, **static}, current, force=bool(body.get("force")))
+        TRANSITIONS.start("esp3", ESP3_KEY, current, fade, duration, easing, static)
+        return jsonify({"ok": True, "state": values, "fading": duration})
+    TRANSITIONS.cancel("esp3", ESP3_KEY)
+    queued = ESP3_DRIVER.apply(values, current, force=bool(body.get("force")))
+    new_state = ESP3.update(ESP3_KEY, values)
+    return jsonify({"ok": True, "state": thaw(new_state), "queued": queued})
+
+
+def _open_health_ring() -> Optional[HealthRing]:
+    """Shared health history (led_health.py); LED_HEALTH_PATH="" disables the sampler."""
+    path = os.getenv("LED_HEALTH_PATH", default_health_path())
+    if not path:
+        return None
+    try:
+        return HealthRing(path)
+    except Exception as exc:
+        print(f"health history disabled: {exc}")
+        return None
+
+
+HEALTH_RING = _open_health_ring()
+HEALTH_INTERVAL = float(os.getenv("LED_HEALTH_INTERVAL", "1"))
+HEALTH_TOPIC = os.getenv("LED_HEALTH_TOPIC", "led/health/ping")
+HEALTH_SAMPLER: Optional[HealthSampler] = None
+
+
+def _broker_rtt_ms() -> Optional[float]:
+    """QoS 1 publish -> PUBACK on the shared connection; None while the broker is down."""
+    start = time.perf_counter()
+    try:
+        PUBLISHER.send([(HEALTH_TOPIC, b"")], qos=1, kind="health")
+    except (OSError, DeliveryError):
+        return None
+    return round((time.perf_counter() - start) * 1000.0, 2)
+
+
+def _health_latest() -> Optional[Dict]:
+    """Latest sample if the sampler (possibly in another worker) is still writing."""
+    if HEALTH_RING is None:
+        return None
+    sample = HEALTH_RING.latest()
+    if sample["age"] is None or sample["age"] > max(5.0, 5 * HEALTH_INTERVAL):
+        return None
+    return sample
+
 
 @app.route("/api/pi-temp")
 def api_pi_temp():
-    temp = read_pi_temp()
+    sample = _health_latest()
+    # Probe directly only when no sampler is running.
+    temp = sample["temp_c"] if sample is not None else read_pi_temp()
     return jsonify({"temp_c": temp, "ok": temp is not None})
 
 
+@app.route("/api/health")
+def api_health():
+    if HEALTH_RING is None:
+        return jsonify({"enabled": False})
+    return jsonify({
+        "enabled": True,
+        "interval": HEALTH_INTERVAL,
+        "latest": HEALTH_RING.latest(),
+        "tiers": [{"name": name, "step": step, "slots": slots} for name, step, slots in HEALTH_TIERS],
+    })
+
+
+@app.route("/api/health/history")
+def api_health_history():
+    """?tier=1s|1m|1h (default 1m) &since=<unix time> or &last=<seconds> &fields=temp_c,load1"""
+    if HEALTH_RING is None:
+        return jsonify({"ok": False, "error": "health history disabled"}), 404
+    args = request.args
+    fields = [f for f in (args.get("fields") or "").split(",") if f] or None
+    try:
+        since = float(args["since"]) if "since" in args else None
+        if "last" in args:
+            since = time.time() - float(args["last"])
+        history = HEALTH_RING.history(args.get("tier", "1m"), since=since, fields=fields)
+    except ValueError as exc:
+        return jsonify({"ok": False, "error": str(exc)}), 400
+    return jsonify({"ok": True, **history})
+
+
 @app.route("/api/states", methods=["GET"])
 def api_states():
     states, default_name = load_states()
@@ -493,6 +1073,7 @@ def api_states():
 
 
 @app.route("/api/state/save", methods=["POST"])
+@preset_write
 def api_state_save():
     body = request.get_json(force=True) or {}
     name = (body.get("name") or "").strip()
@@ -500,9 +1081,8 @@ def api_state_save():
         return jsonify({"ok": False, "error": "Name required"}), 400
     states, default_name = load_states()
     # Snapshot current in-memory state for every segment.
-    snapshot = {"segments": {}}
-    for seg, data in STATE_CACHE.items():
-        snapshot["segments"][seg] = dict(data)
+    _, current = STATE.snapshot()
+    snapshot = {"segments": {seg: thaw(data) for seg, data in current.items()}}
     states[name] = snapshot
     write_states(states, default_name)
     return jsonify({"ok": True, "state": {"name": name, "data": snapshot}})
@@ -516,8 +1096,15 @@ def api_state_apply():
     if not name or name not in states:
         return jsonify({"ok": False, "error": "State not found"}), 404
     data = states[name]
-    _apply_segments_snapshot(data)
-    return jsonify({"ok": True, "state": {"name": name, "data": data}})
+    try:
+        duration, easing = fade_options(body)
+    except (TypeError, ValueError) as exc:
+        return jsonify({"ok": False, "error": str(exc)}), 400
+    try:
+        summary = _apply_segments_snapshot(data, duration, easing, force=bool(body.get("force")))
+    except CommandError as exc:
+        return jsonify({"ok": False, "error": f"State {name!r} is invalid: {exc}"}), 400
+    return jsonify({"ok": True, "state": {"name": name, "data": data}, "summary": summary})
 
 
 @app.route("/api/esp-status")
@@ -561,6 +1148,7 @@ def check_mqtt():
         return False
 
 
+@timed(PROBE_SECONDS, probe="ping")
 def ping_ip(target: str) -> bool:
     from subprocess import run, DEVNULL
 
@@ -606,60 +1194,53 @@ def reset_esp_serial(port: str = "/dev/ttyACM0"):
     return False
 
 
+@timed(PROBE_SECONDS, probe="pi_temp")
 def read_pi_temp() -> Optional[float]:
-    """Return Pi CPU temperature in Celsius if available."""
-    # Primary path exposed by Raspberry Pi OS kernels.
-    path = "/sys/class/thermal/thermal_zone0/temp"
-    try:
-        with open(path, "r", encoding="utf-8") as f:
-            raw = f.read().strip()
-            return round(float(raw) / 1000.0, 1)
-    except Exception:
-        pass
-    # Fallback to vcgencmd if installed.
-    try:
-        out = subprocess.check_output(["vcgencmd", "measure_temp"], text=True).strip()
-        if out.startswith("temp=") and out.endswith("'C"):
-            return round(float(out.split("=")[1].split("'")[0]), 1)
-    except Exception:
-        pass
-    return None
+    """Return Pi CPU temperature in Celsius if available (sysfs, else vcgencmd)."""
+    return read_cpu_temp()
 
 
 def guess_esp_ip() -> Optional[str]:
-    """Try to guess ESP IP from dnsmasq leases if available."""
-    lease_file = "/var/lib/misc/dnsmasq.leases"
-    nm_lease_file = "/var/lib/NetworkManager/dnsmasq-wlan1.leases"
-    last_ip = None
-    try:
-        with open(lease_file, "r", encoding="utf-8") as f:
-            for line in f:
-                parts = line.strip().split()
-                if len(parts) >= 3:
-                    ip = parts[2]
-                    last_ip = ip
-                    host = parts[3] if len(parts) >= 4 else ""
-                    if "esp32" in host.lower():
-                        return ip
-    except Exception:
-        pass
-    try:
-        with open(nm_lease_file, "r", encoding="utf-8") as f:
-            for line in f:
-                parts = line.strip().split()
-                if len(parts) >= 3:
-                    ip = parts[2]
-                    last_ip = ip
-                    host = parts[3] if len(parts) >= 4 else ""
-                    if "esp" in host.lower():
-                        return ip
-    except Exception:
-        pass
-    return last_ip
+    """First ESP-looking device in the DHCP leases / neighbour table (indexed, see led_discovery.py)."""
+    return DISCOVERY.guess_esp_ip()
+
+
+def _follow_device_move(mac: str, hostname: str, old_ip: str, new_ip: str) -> None:
+    """Keep probing an ESP that came back with a different lease."""
+    global ESP_DEFAULT_IP, ESP2_DEFAULT_IP, ESP3_DEFAULT_IP
+    print(f"device {hostname or mac} moved {old_ip} -> {new_ip}")
+    if ESP_DEFAULT_IP == old_ip:
+        ESP_DEFAULT_IP = new_ip
+    if ESP2_DEFAULT_IP == old_ip:
+        ESP2_DEFAULT_IP = new_ip
+    if ESP3_DEFAULT_IP == old_ip:
+        ESP3_DEFAULT_IP = new_ip
+
+
+DISCOVERY = DiscoveryIndex(
+    [p for p in os.getenv("LED_LEASE_FILES", ":".join(DEFAULT_LEASE_FILES)).split(":") if p],
+    os.getenv("LED_ARP_PATH", "/proc/net/arp") or None,
+)
+DISCOVERY.add_listener(_follow_device_move)
+
 
+@app.route("/api/devices")
+def api_devices():
+    return jsonify(DISCOVERY.status())
 
-def _apply_segments_snapshot(data: Dict) -> None:
-    """Apply a snapshot dict containing 'segments': {seg: {..}} or legacy single-segment dict."""
+
+def _apply_segments_snapshot(
+    data: Dict, duration: float = 0.0, easing: str = DEFAULT_EASING, force: bool = False
+) -> Dict:
+    """Apply a snapshot dict containing 'segments': {seg: {..}} or legacy single-segment dict.
+
+    Only segments/fields that differ from the cached state are published unless
+    `force` is set (segments mid-fade are always sent in full). With `duration`
+    > 0 the segments fade from their current values instead of jumping.
+    Segments the firmware does not know are left out (listed under "ignored");
+    a segment that fails validation raises CommandError before anything is sent.
+    Returns {"changed": {seg: [fields]}, "unchanged": [seg], "ignored": [seg], "messages": n}.
+    """
     global LAST_DEFAULT_APPLY
     segments = {}
     if isinstance(data, dict) and "segments" in data and isinstance(data["segments"], dict):
@@ -667,50 +1248,94 @@ def _apply_segments_snapshot(data: Dict) -> None:
     elif isinstance(data, dict):
         seg_name = data.get("segment", "strip1")
         segments = {seg_name: data}
+    ignored = sorted(seg for seg in segments if seg not in KNOWN_SEGMENTS)
+    commands = {}
     for seg_name, seg_data in segments.items():
-        payload = dict(seg_data)
-        payload["segment"] = seg_name
-        cmd = Command.from_request(payload)
-        publish(cmd.to_payload())
-        STATE_CACHE[seg_name] = {
-            "segment": seg_name,
-            "pattern": cmd.pattern,
-            "brightness": cmd.brightness,
-            "speed": cmd.speed,
-            "color": cmd.color,
-            "wave_shape": cmd.wave_shape,
-            "wave_count": cmd.wave_count,
-            "mic_gain": cmd.mic_gain if cmd.mic_gain is not None else STATE_CACHE.get(seg_name, {}).get("mic_gain"),
-            "mic_floor": cmd.mic_floor if cmd.mic_floor is not None else STATE_CACHE.get(seg_name, {}).get("mic_floor"),
-            "mic_smooth": cmd.mic_smooth if cmd.mic_smooth is not None else STATE_CACHE.get(seg_name, {}).get("mic_smooth"),
-            "mic_enabled": cmd.mic_enabled if cmd.mic_enabled is not None else STATE_CACHE.get(seg_name, {}).get("mic_enabled"),
-            "gradient_enabled": cmd.gradient_enabled if cmd.gradient_enabled is not None else STATE_CACHE.get(seg_name, {}).get("gradient_enabled"),
-            "gradient_low": cmd.gradient_low if cmd.gradient_low is not None else STATE_CACHE.get(seg_name, {}).get("gradient_low"),
-            "gradient_mid": cmd.gradient_mid if cmd.gradient_mid is not None else STATE_CACHE.get(seg_name, {}).get("gradient_mid"),
-            "gradient_high": cmd.gradient_high if cmd.gradient_high is not None else STATE_CACHE.get(seg_name, {}).get("gradient_high"),
-        }
+        if seg_name not in KNOWN_SEGMENTS:
+            continue
+        if not isinstance(seg_data, dict):
+            raise CommandError(f"{seg_name}: segment state must be an object")
+        try:
+            commands[seg_name] = Command.from_request({**seg_data, "segment": seg_name})
+        except CommandError as exc:
+            raise CommandError(f"{seg_name}: {exc}") from None
+    fading = set(TRANSITIONS.active().get("main", []))
+    changed: Dict[str, List[str]] = {}
+    unchanged: List[str] = []
+    payloads: List[Dict] = []
+    applied: Dict[str, Dict] = {}
+    for seg_name, cmd in commands.items():
+        target = cmd.state()
+        if target.get("gradient_enabled") is None:
+            # What the firmware ends up with: `color` clears gradient mode, any stop re-enables it.
+            target["gradient_enabled"] = any(target.get(k) is not None for k in GRADIENT_SENSITIVE[1:])
+        if force or seg_name in fading:
+            diff = {k: v for k, v in target.items() if k != "segment"}
+        else:
+            diff = SEGMENT_MODELS.diff(seg_name, STATE.get(seg_name), target)
+        if not diff:
+            unchanged.append(seg_name)
+            continue
+        changed[seg_name] = sorted(diff)
+        if duration > 0:
+            fade, static = split_fade_fields(target)
+            fade = {k: v for k, v in fade.items() if k in diff}
+            static = {k: v for k, v in static.items() if k in diff}
+            TRANSITIONS.start("main", seg_name, STATE.get(seg_name, {}), fade, duration, easing, static)
+            continue
+        TRANSITIONS.cancel("main", seg_name)
+        payloads.append(cmd if force else state_payload(seg_name, diff))
+        applied[seg_name] = target
+    # One connection for the batch, then one atomic cache update for what went out,
+    # also when a later message failed: part of the batch may be on the wire.
+    try:
+        queued = publish_many(payloads, force=force)
+    finally:
+        STATE.update_many(applied)
     LAST_DEFAULT_APPLY = time.time()
+    return {"changed": changed, "unchanged": unchanged, "ignored": ignored, "messages": len(payloads), "forced": force,
+            "queued": queued}
 
 
-def apply_default_state() -> bool:
-    """Apply the currently saved default state, if any."""
+def apply_default_state(force: bool = False, skip: Optional[Set[str]] = None) -> bool:
+    """Apply the currently saved default state, if any, leaving out the segments in `skip`."""
     states, default_name = load_states()
     if not default_name or default_name not in states:
         return False
-    _apply_segments_snapshot(states[default_name])
+    data = states[default_name]
+    if skip:
+        data = {"segments": {seg: v for seg, v in data["segments"].items() if seg not in skip}}
+        if not data["segments"]:
+            return False
+    try:
+        _apply_segments_snapshot(data, force=force)
+    except CommandError as exc:
+        print(f"default state {default_name!r} not applied: {exc}")
+        return False
     return True
 
 
 def start_default_watcher():
-    """Background thread: when ESP comes online, push the default preset."""
+    """Background thread: when ESP comes online, push the default preset.
+
+    With retained state topics the ESP restores itself from the broker, so the
+    watcher only tracks reachability.
+    """
     import threading
 
     def loop():
         global LAST_ESP_UP
         while True:
+            DISCOVERY.refresh()  # notices an ESP that moved to a new IP
             reachable = ping_ip(ESP_DEFAULT_IP)
             if reachable and not LAST_ESP_UP:
-                apply_default_state()
+                SEND_FILTER.clear(MQTT_CMD_TOPIC)
+            try:
+                if reachable and not LAST_ESP_UP and not RETAIN_STATE:
+                    # A rebooted ESP lost its state, so the cache can't be diffed against.
+                    apply_default_state(force=True)
+            except Exception as exc:
+                print(f"default watcher: apply failed: {exc}")
             LAST_ESP_UP = reachable
             time.sleep(5)
 
@@ -727,7 +1352,12 @@ def start_esp3_default_watcher():
         while True:
             reachable = ping_ip(ESP3_DEFAULT_IP)
             if reachable and not LAST_ESP3_UP:
-                apply_default_esp3()
+                SEND_FILTER.clear(ESP3_CMD_TOPIC)
+                ESP3_DRIVER.reset()
+                try:
+                    apply_default_esp3(force=True)
+                except Exception as exc:
+                    print(f"esp3 default watcher: apply failed: {exc}")
             LAST_ESP3_UP = reachable
             time.sleep(5)
 
@@ -735,6 +1365,8 @@ def start_esp3_default_watcher():
     t.start()
 
 
+@timed(PRESET_IO_SECONDS, op="load")
+@traced("load_states")
 def load_states() -> (Dict[str, Dict], Optional[str]):
     """Load saved LED states from disk.
     Returns (states_dict, default_name). Supports both legacy dict-only format and new wrapped format.
@@ -768,14 +1400,15 @@ def load_states() -> (Dict[str, Dict], Optional[str]):
     return normalized, default_name
 
 
+@timed(PRESET_IO_SECONDS, op="write")
+@traced("write_states")
 def write_states(states: Dict[str, Dict], default_name: Optional[str] = None) -> None:
     """Persist states to disk; best-effort."""
     payload = {"states": states}
     if default_name and default_name in states:
         payload["default"] = default_name
     try:
-        with open(STATES_FILE, "w", encoding="utf-8") as f:
-            json.dump(payload, f, indent=2)
+        _write_json_atomic(STATES_FILE, payload)
     except Exception:
         pass
 
@@ -806,17 +1439,26 @@ def api_troubleshoot():
             "esp_reset_attempted": esp_reset,
             "wlan": wlan,
             "suggestions": suggestions,
-            "state": list(STATE_CACHE.values()),
+            "state": STATE.values_json(),
         }
     )
 
 
 @app.route("/api/state")
 def api_state():
-    return jsonify({"state": list(STATE_CACHE.values())})
+    since = request.args.get("since")
+    if since is None:
+        version, entries = STATE.snapshot()
+    else:
+        try:
+            version, entries = STATE.changed_since(int(since))
+        except ValueError:
+            return jsonify({"ok": False, "error": "since must be an integer version"}), 400
+    return jsonify({"version": version, "state": [thaw(v) for v in entries.values()]})
 
 
 @app.route("/api/state/default", methods=["POST"])
+@preset_write
 def api_state_default():
     body = request.get_json(force=True) or {}
     name = (body.get("name") or "").strip()
@@ -824,12 +1466,16 @@ def api_state_default():
     if not name or name not in states:
         return jsonify({"ok": False, "error": "State not found"}), 404
     # Save default and apply it immediately so lights match the choice.
+    try:
+        _apply_segments_snapshot(states[name])
+    except CommandError as exc:
+        return jsonify({"ok": False, "error": f"State {name!r} is invalid: {exc}"}), 400
     write_states(states, name)
-    _apply_segments_snapshot(states[name])
     return jsonify({"ok": True, "default": name})
 
 
 @app.route("/api/state/delete", methods=["POST"])
+@preset_write
 def api_state_delete():
     body = request.get_json(force=True) or {}
     name = (body.get("name") or "").strip()
@@ -843,79 +1489,135 @@ def api_state_delete():
     return jsonify({"ok": True, "default": default_name})
 
 
+PRESET_FILES = {"main": STATES_FILE, "esp3": ESP3_STATES_FILE}
+IMPORT_LOCK = threading.Lock()
+IMPORT_PROGRESS: Dict = {}
+
+
+@app.route("/api/states/export")
+def api_states_export():
+    kind = request.args.get("kind", "main")
+    if kind not in PRESET_FILES:
+        return jsonify({"ok": False, "error": "kind must be main or esp3"}), 400
+    states, default_name = read_library(PRESET_FILES[kind], kind)
+    return Response(
+        export_lines(states, default_name),
+        mimetype="application/x-ndjson",
+        headers={"Content-Disposition": f"attachment; filename={kind}-presets.jsonl"},
+    )
+
+
+@app.route("/api/states/import", methods=["POST"])
+def api_states_import():
+    """Stream a JSONL upload into a preset library (see led_presets.py).
+
+    IMPORT_LOCK is taken before PRESET_LOCK so a second import gets a 409
+    instead of queueing behind the first.
+    """
+    kind = request.args.get("kind", "main")
+    if kind not in PRESET_FILES:
+        return jsonify({"ok": False, "error": "kind must be main or esp3"}), 400
+
+    def flag(key: str) -> bool:
+        return request.args.get(key, "0") in ("1", "true", "yes")
+
+    if not IMPORT_LOCK.acquire(blocking=False):
+        return jsonify({"ok": False, "error": "another import is running", "progress": IMPORT_PROGRESS}), 409
+    try:
+        IMPORT_PROGRESS.clear()
+        with PRESET_LOCK:
+            report = import_lines(
+                request.stream,
+                PRESET_FILES[kind],
+                kind,
+                request.args.get("policy", "skip"),
+                strict=flag("strict"),
+                dry_run=flag("dry_run"),
+                set_default=flag("set_default"),
+                progress=lambda r: IMPORT_PROGRESS.update(r.to_dict()),
+            )
+    except ValueError as exc:
+        return jsonify({"ok": False, "error": str(exc)}), 400
+    finally:
+        IMPORT_LOCK.release()
+    result = report.to_dict()
+    ok = not (flag("strict") and report.invalid)
+    return jsonify({"ok": ok, **result}), 200 if ok else 422
+
+
+@app.route("/api/states/import/progress")
+def api_states_import_progress():
+    return jsonify({"running": IMPORT_LOCK.locked(), **IMPORT_PROGRESS})
+
+
 @app.route("/api/state/apply-default", methods=["POST"])
 def api_state_apply_default():
-    ok = apply_default_state()
+    body = request.get_json(silent=True) or {}
+    ok = apply_default_state(force=bool(body.get("force")))
     return jsonify({"ok": ok})
 
 
 @app.route("/api/set-all", methods=["POST"])
 def api_set_all():
+    """Send the posted fields to every segment; fields left out keep each segment's cached value."""
     data = request.get_json(force=True)
-    brightness = data.get("brightness")
-    pattern = data.get("pattern")
-    color = data.get("color")
-    wave_shape = data.get("wave_shape")
-    speed = data.get("speed")
-    wave_count = data.get("wave_count")
-    mic_gain = data.get("mic_gain")
-    mic_floor = data.get("mic_floor")
-    mic_smooth = data.get("mic_smooth")
-    mic_enabled = data.get("mic_enabled")
-    mic_beat = data.get("mic_beat")
-    for seg in SEGMENTS:
-        payload = {"cmd": "set", "segment": seg}
-        if brightness is not None:
-            payload["brightness"] = float(brightness)
-        if pattern:
-            payload["pattern"] = pattern
-        if speed is not None:
-            payload["speed"] = float(speed)
-        params = {}
-        if color:
-            params["color"] = [int(x) for x in color[:3]]
-        if wave_shape:
-            params["wave_shape"] = wave_shape
-        if wave_count is not None:
-            params["wave_count"] = float(wave_count)
-        if mic_gain is not None:
-            params["mic_gain"] = float(mic_gain)
-        if mic_floor is not None:
-            params["mic_floor"] = float(mic_floor)
-        if mic_smooth is not None:
-            params["mic_smooth"] = float(mic_smooth)
-        if mic_enabled is not None:
-            params["mic_enabled"] = bool(mic_enabled)
-        if mic_beat is not None:
-            params["mic_beat"] = bool(mic_beat)
-        if params:
-            payload["params"] = params
-        publish(payload)
-        cached = STATE_CACHE.get(seg, {"segment": seg})
-        if brightness is not None:
-            cached["brightness"] = float(brightness)
-        if pattern:
-            cached["pattern"] = pattern
-        if speed is not None:
-            cached["speed"] = float(speed)
-        if color:
-            cached["color"] = [int(x) for x in color[:3]]
-        if wave_shape:
-            cached["wave_shape"] = wave_shape
-        if wave_count is not None:
-            cached["wave_count"] = float(wave_count)
-        if mic_gain is not None:
-            cached["mic_gain"] = float(mic_gain)
-        if mic_floor is not None:
-            cached["mic_floor"] = float(mic_floor)
-        if mic_smooth is not None:
-            cached["mic_smooth"] = float(mic_smooth)
-        if mic_enabled is not None:
-            cached["mic_enabled"] = bool(mic_enabled)
-        if mic_beat is not None:
-            cached["mic_beat"] = bool(mic_beat)
-        STATE_CACHE[seg] = cached
-    return jsonify({"ok": True, "state": list(STATE_CACHE.values())})
+    if not isinstance(data, dict):
+        return jsonify({"ok": False, "error": "request body must be a JSON object"}), 400
+    fields = {k: v for k, v in data.items() if v is not None}
+    commands = []
+    try:
+        for seg in SEGMENTS:
+            commands.append(Command.from_request({**STATE.get(seg, {}), **fields, "segment": seg}))
+    except CommandError as exc:
+        return jsonify({"ok": False, "error": str(exc)}), 400
+    for cmd in commands:
+        TRANSITIONS.cancel("main", cmd.segment)
+    try:
+        queued = publish_many(commands, kind="stream")
+    finally:
+        # Part of the batch may be on the wire even when a later message failed.
+        STATE.update_many({cmd.segment: cmd.state() for cmd in commands})
+    return jsonify({"ok": True, "queued": queued, "state": STATE.values_json()})
+
+
+@app.route("/api/debug/trace", methods=["GET", "POST"])
+def api_debug_trace():
+    if request.method == "GET":
+        return jsonify({"ok": True, **led_trace.configure()})
+    body = request.get_json(force=True) or {}
+    try:
+        cfg = led_trace.configure(body.get("enabled"), body.get("slow_ms"))
+    except (TypeError, ValueError):
+        return jsonify({"ok": False, "error": "slow_ms must be a number"}), 400
+    return jsonify({"ok": True, **cfg})
+
+
+@app.route("/api/debug/slow")
+def api_debug_slow():
+    return jsonify({"ok": True, "slow_ms": led_trace.SLOW_MS, "requests": list(led_trace.SLOW_REQUESTS)})
+
+
+@app.route("/api/debug/profile", methods=["GET", "POST"])
+def api_debug_profile():
+    if request.method == "GET":
+        return jsonify({"ok": True, **PROFILER.status()})
+    body = request.get_json(force=True) or {}
+    route = (body.get("route") or "").strip()
+    if not route:
+        return jsonify({"ok": False, "error": "route required"}), 400
+    try:
+        status = PROFILER.arm(route, int(body.get("count", 10)), body.get("mode", "cprofile"), float(body.get("interval_ms", 5)))
+    except (TypeError, ValueError) as exc:
+        return jsonify({"ok": False, "error": str(exc)}), 400
+    return jsonify({"ok": True, **status})
+
+
+@app.route("/api/debug/profile/download")
+def api_debug_profile_download():
+    if not PROFILER.captured:
+        return jsonify({"ok": False, "error": "No profile captured"}), 404
+    data, mimetype, filename = PROFILER.export()
+    return send_file(io.BytesIO(data), mimetype=mimetype, as_attachment=True, download_name=filename)
 
 
 @app.route("/quickmenu")
@@ -1268,13 +1970,16 @@ async function sendEsp3(pattern, opts = {}) {
 function esp3White() { sendEsp3('white'); }
 function esp3Rainbow() { sendEsp3('rainbow'); }
 function esp3Hills() { sendEsp3('rainbow_hills'); }
-// Debounced apply when sliders move so brightness takes effect.
+// Throttled while the slider moves; the value is read when the send fires, so the latest wins.
 let esp3ApplyTimer = null;
+let esp3LastSent = 0;
 function scheduleEsp3Apply() {
-  if (esp3ApplyTimer) clearTimeout(esp3ApplyTimer);
+  if (esp3ApplyTimer) return;
   esp3ApplyTimer = setTimeout(() => {
+    esp3ApplyTimer = null;
+    esp3LastSent = Date.now();
     sendEsp3(esp3LastPattern || 'white');
-  }, 120);
+  }, Math.max(0, 50 - (Date.now() - esp3LastSent)));
 }
 
 async function lightsOff() {
@@ -2096,18 +2801,74 @@ function refreshBadges() {
 """
 
 
-if __name__ == "__main__":
-    port = int(os.getenv("PORT", "5000"))
+def restore_startup_state() -> Dict[str, List[str]]:
+    """Put every segment back in the state it was last sent, one segment at a time.
+
+    The journal holds exactly what was last sent; the broker's retained copy
+    and then the default preset are only fallbacks for the segments it (and
+    then the broker) does not know. Returns where each segment came from.
+    """
+    restored = {seg: v for seg, v in JOURNAL_RESTORED.get("segments", {}).items() if seg in KNOWN_SEGMENTS}
+    known = set(restored)
+    retained: Set[str] = set()
+    if RETAIN_STATE and not known.issuperset(SEGMENTS):
+        try:
+            retained = resync_retained_state() - known
+        except Exception as exc:
+            print(f"retained state resync failed: {exc}")
+        # A retained publish may have failed after the journal recorded the send.
+        STATE.update_many(restored)
+    elif restored and not RETAIN_STATE:
+        # Without retained topics, put the recovered state back on the strips ourselves.
+        try:
+            _apply_segments_snapshot({"segments": {seg: thaw(STATE.get(seg)) for seg in restored}}, force=True)
+        except Exception as exc:
+            print(f"journal resend failed: {exc}")
+    known |= retained
+    defaulted: List[str] = []
+    if not known.issuperset(SEGMENTS):
+        # Default preset for whatever neither source had (all of it on a first boot).
+        states, default_name = load_states()
+        defaulted = sorted(set(states.get(default_name, {}).get("segments", {})) - known)
+        try:
+            if not apply_default_state(force=True, skip=known):
+                defaulted = []
+        except Exception as exc:
+            # Keep the web UI up even if MQTT/ESP is unreachable on boot.
+            print(f"apply_default_state failed: {exc}")
+            defaulted = []
+    return {"journal": sorted(restored), "retained": sorted(retained), "default": defaulted}
+
+
+def start_background_tasks() -> None:
+    """Watchers, feeds and the startup resync/default apply; run once per deployment."""
+    global HEALTH_SAMPLER
+    if FORWARDER is not None:
+        FORWARDER.start()
+    if HEALTH_RING is not None:
+        probes = default_probes()
+        probes["temp_c"] = read_pi_temp
+        probes["broker_rtt_ms"] = _broker_rtt_ms
+        HEALTH_SAMPLER = HealthSampler(HEALTH_RING, probes, HEALTH_INTERVAL)
+        HEALTH_SAMPLER.start()
     start_default_watcher()
     start_esp3_default_watcher()
-    # Apply default once on startup in case ESP is already online.
+    start_feeds()
+    restore_startup_state()
+    if RETAIN_STATE:
+        # Make sure every segment has a retained message for the next ESP reboot.
+        RETAINED.publish_all(STATE.snapshot()[1])
     try:
-        apply_default_state()
-    except Exception as exc:
-        # Keep the web UI up even if MQTT/ESP is unreachable on boot.
-        print(f"apply_default_state failed: {exc}")
-    try:
-        apply_default_esp3()
+        if ESP3_KEY in JOURNAL_RESTORED.get("esp3", {}):
+            ESP3_DRIVER.apply(ESP3.get(ESP3_KEY), force=True)
+        else:
+            apply_default_esp3(force=True)
     except Exception as exc:
         print(f"apply_default_esp3 failed: {exc}")
+
+
+if __name__ == "__main__":
+    port = int(os.getenv("PORT", "5000"))
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    start_background_tasks()
     app.run(host="0.0.0.0", port=port, debug=False)
@@ -0,0 +1,49 @@
+"""Shared test setup.
+
+The host modules import each other by bare name, so host/ goes on sys.path.
+led_web configures itself from the environment at import time: every on-disk
+path points into a throwaway directory and MQTT at the loadtest fake broker.
+"""
+
+from __future__ import annotations
+
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+HOST_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+sys.path.insert(0, HOST_DIR)
+
+from led_loadtest import FakeBroker, isolated_env  # noqa: E402
+
+BROKER = FakeBroker()
+BROKER.start()
+WORKDIR = tempfile.mkdtemp(prefix="led-tests-")
+shutil.copy(os.path.join(HOST_DIR, "led_states.json"), os.path.join(WORKDIR, "led_states.json"))
+os.environ.update(isolated_env(WORKDIR, BROKER.port))
+os.environ.update({"LED_LEASE_FILES": "", "LED_ARP_PATH": "", "LED_SHARED_STATE": ""})
+
+
+def fixture_path(name: str) -> str:
+    return os.path.join(FIXTURES, name)
+
+
+@pytest.fixture(scope="session")
+def broker() -> FakeBroker:
+    return BROKER
+
+
+@pytest.fixture(scope="session")
+def web():
+    import led_web
+
+    return led_web
+
+
+@pytest.fixture()
+def client(web):
+    return web.app.test_client()
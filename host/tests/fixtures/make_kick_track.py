@@ -0,0 +1,75 @@
+"""Regenerate kick_124bpm.wav / kick_124bpm.beats (synthetic, annotated by construction).
+
+Four-on-the-floor kick at 124 BPM under loud off-beat hi-hats, a snare on
+2 and 4, a bass line that changes note between beats and background noise.
+    python tests/fixtures/make_kick_track.py
+"""
+from __future__ import annotations
+
+import os
+import wave
+
+import numpy as np
+
+RATE = 16000
+BPM = 124.0
+SECONDS = 8.0
+FIRST_BEAT = 0.25
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def _kick(rate: int) -> np.ndarray:
+    t = np.arange(int(0.25 * rate)) / rate
+    freq = 50.0 + 90.0 * np.exp(-t / 0.03)
+    return np.sin(2 * np.pi * np.cumsum(freq) / rate) * np.exp(-t / 0.09)
+
+
+def _noise_hit(rng, rate: int, length: float, decay: float, highpass: bool) -> np.ndarray:
+    n = int(length * rate)
+    hit = rng.standard_normal(n)
+    if highpass:
+        hit = np.diff(hit, prepend=0.0)
+    return hit * np.exp(-np.arange(n) / rate / decay)
+
+
+def build(seed: int = 7):
+    rng = np.random.default_rng(seed)
+    total = int(SECONDS * RATE)
+    out = 0.02 * rng.standard_normal(total)
+    period = 60.0 / BPM
+    beats = list(np.arange(FIRST_BEAT, SECONDS - 0.3, period))
+
+    def place(at: float, sound: np.ndarray, gain: float) -> None:
+        i = int(at * RATE)
+        end = min(total, i + len(sound))
+        out[i:end] += gain * sound[: end - i]
+
+    kick = _kick(RATE)
+    for n, b in enumerate(beats):
+        place(b, kick, 0.8)
+        if n % 2:
+            place(b, _noise_hit(rng, RATE, 0.2, 0.05, False), 0.35)
+        place(b + period / 2, _noise_hit(rng, RATE, 0.08, 0.02, True), 0.45)
+        place(b + period / 4, _noise_hit(rng, RATE, 0.05, 0.01, True), 0.2)
+    notes = [55.0, 65.4, 49.0, 73.4]
+    for n, b in enumerate(beats):
+        t = np.arange(int(period * RATE)) / RATE
+        place(b + period * 0.75, np.sin(2 * np.pi * notes[n % 4] * 2 * t) * np.minimum(1, t / 0.01), 0.15)
+    out /= max(1.0, float(np.abs(out).max()) / 0.9)
+    return (out * 32767).astype("<i2"), beats
+
+
+def main() -> None:
+    pcm, beats = build()
+    with wave.open(os.path.join(HERE, "kick_124bpm.wav"), "wb") as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(RATE)
+        wf.writeframes(pcm.tobytes())
+    with open(os.path.join(HERE, "kick_124bpm.beats"), "w", encoding="utf-8") as f:
+        f.write("# beat times in seconds (kick onsets)\n")
+        f.writelines(f"{b:.4f}\n" for b in beats)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""Pre-validation `set` parser, kept as a reference for tests and `python led_model.py bench`."""
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+
+@dataclass
+class LegacyCommand:
+    """The request dataclass led_model.Command replaced (no validation); `led_model.bench` times both."""
+    segment: str
+    pattern: str
+    brightness: float
+    speed: float
+    color: List[int]
+    wave_shape: Optional[str] = None
+    wave_count: float = 1.0
+    mic_gain: Optional[float] = None
+    mic_floor: Optional[float] = None
+    mic_smooth: Optional[float] = None
+    mic_enabled: Optional[bool] = None
+    gradient_low: Optional[List[int]] = None
+    gradient_mid: Optional[List[int]] = None
+    gradient_high: Optional[List[int]] = None
+    gradient_enabled: Optional[bool] = None
+    mic_beat: Optional[bool] = None
+
+    @classmethod
+    def from_request(cls, data: Dict) -> "LegacyCommand":
+        return cls(
+            segment=data.get("segment", "strip1"),
+            pattern=data.get("pattern", "solid"),
+            brightness=float(data.get("brightness", 255.0)),
+            speed=float(data.get("speed", 1.0)),
+            color=[int(x) for x in data.get("color", [0, 180, 160])][:3],
+            wave_shape=data.get("wave_shape"),
+            wave_count=float(data.get("wave_count", 1.0)),
+            mic_gain=float(data["mic_gain"]) if "mic_gain" in data else None,
+            mic_floor=float(data["mic_floor"]) if "mic_floor" in data else None,
+            mic_smooth=float(data["mic_smooth"]) if "mic_smooth" in data else None,
+            mic_enabled=bool(data["mic_enabled"]) if "mic_enabled" in data else None,
+            gradient_low=[int(x) for x in data["gradient_low"]] if "gradient_low" in data else None,
+            gradient_mid=[int(x) for x in data["gradient_mid"]] if "gradient_mid" in data else None,
+            gradient_high=[int(x) for x in data["gradient_high"]] if "gradient_high" in data else None,
+            gradient_enabled=bool(data["gradient_enabled"]) if "gradient_enabled" in data else None,
+            mic_beat=bool(data["mic_beat"]) if "mic_beat" in data else None,
+        )
+
+    def to_payload(self) -> Dict:
+        params: Dict = {"color": self.color}
+        if self.wave_shape:
+            params["wave_shape"] = self.wave_shape
+        for name in ("wave_count", "mic_gain", "mic_floor", "mic_smooth", "mic_enabled", "gradient_low",
+                     "gradient_mid", "gradient_high", "gradient_enabled", "mic_beat"):
+            value = getattr(self, name)
+            if value is not None:
+                params[name] = value
+        return {
+            "cmd": "set",
+            "segment": self.segment,
+            "pattern": self.pattern,
+            "brightness": self.brightness,
+            "speed": self.speed,
+            "params": params,
+        }
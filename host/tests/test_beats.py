@@ -0,0 +1,55 @@
+from __future__ import annotations
+
+import wave
+
+import numpy as np
+
+from conftest import fixture_path
+from led_audio import _pcm_to_float
+from led_beats import FLUX_BANDS, BeatTracker, OnsetDetector, detect_file, load_labels, score, track
+
+WAV = fixture_path("kick_124bpm.wav")
+LABELS = load_labels(fixture_path("kick_124bpm.beats"))
+
+
+def _samples():
+    with wave.open(WAV, "rb") as wf:
+        return wf.getframerate(), _pcm_to_float(wf.readframes(wf.getnframes()), wf.getsampwidth(), wf.getnchannels())
+
+
+def _onsets(bands):
+    rate, samples = _samples()
+    det = OnsetDetector(rate, bands=bands)
+    found = []
+    for i in range(0, len(samples), 1024):
+        found.extend(t for t, _ in det.process(samples[i:i + 1024]))
+    return found
+
+
+def test_kick_band_weighting_finds_the_kicks():
+    _, recall, _ = score(_onsets(FLUX_BANDS), LABELS)
+    _, flat_recall, _ = score(_onsets(((0.0, 20000.0, 1.0),)), LABELS)
+    assert recall >= 0.9
+    assert recall > flat_recall
+
+
+def test_beat_f_measure_on_annotated_track():
+    beats, audio_s, _ = detect_file(WAV)
+    precision, recall, f = score(beats, LABELS)
+    assert audio_s == 8.0
+    assert f >= 0.65, (precision, recall, f)
+
+
+def test_locked_tracker_flashes_predicted_beats_then_stops_in_silence():
+    rate, samples = _samples()
+    samples = np.concatenate((samples, np.zeros(rate * 4, dtype=np.float32)))
+    det = OnsetDetector(rate)
+    tracker = BeatTracker(det.frame_s, offset_s=det.frame_time(0))
+    beats = []
+    for i in range(0, len(samples), 1024):
+        beats.extend(track(det, tracker, samples[i:i + 1024]))
+    assert abs(tracker.bpm - 124.0) < 2.0
+    predicted = [t for t, _, was_predicted in beats if was_predicted and t < LABELS[-1] + 0.1]
+    assert predicted
+    assert score(predicted, LABELS)[0] == 1.0  # every predicted flash lands on a real beat
+    assert len([t for t, _, _ in beats if t > LABELS[-1] + 0.3]) <= tracker.max_coast + 1
@@ -0,0 +1,110 @@
+from __future__ import annotations
+
+import time
+
+from led_capture import Capture, Replayer, default_dir, info, load, main
+
+TOPIC = "led/cmd"
+
+
+def _timeline(*times):
+    return [(t, TOPIC, "command", f'{{"n":{i}}}'.encode()) for i, t in enumerate(times)]
+
+
+class Clocked:
+    def __init__(self, fail_on=()):
+        self.fail_on = set(fail_on)
+        self.sent = []
+        self.t0 = time.perf_counter()
+
+    def __call__(self, topic, body, kind):
+        if body in self.fail_on:
+            raise OSError("publish failed")
+        self.sent.append((time.perf_counter() - self.t0, body))
+
+
+def test_capture_round_trip(tmp_path):
+    cap = Capture(str(tmp_path), check_interval=0)
+    assert not cap.record([(TOPIC, b"{}")], "command")
+    active = cap.start("show one")
+    assert active["name"] == "show-one" and cap.active()["name"] == "show-one"
+    assert cap.record([(TOPIC, b'{"a":1}'), ("esp3/cmd", b'{"b":2}')], "command")
+    time.sleep(0.05)
+    assert cap.record([(TOPIC, b'{"c":3}')], "stream")
+    summary = cap.stop()
+    assert summary["messages"] == 3 and summary["kinds"] == {"command": 2, "stream": 1}
+    assert not cap.record([(TOPIC, b"{}")], "command")
+    _, messages = load(cap.path("show-one"))
+    assert [m[1:] for m in messages] == [(TOPIC, "command", b'{"a":1}'), ("esp3/cmd", "command", b'{"b":2}'),
+                                         (TOPIC, "stream", b'{"c":3}')]
+    assert messages[0][0] == messages[1][0] and messages[2][0] - messages[0][0] >= 0.05
+
+
+def test_truncated_tail_record_is_ignored(tmp_path):
+    cap = Capture(str(tmp_path), check_interval=0)
+    cap.start("cut")
+    cap.record([(TOPIC, b'{"a":1}')], "command")
+    cap.record([(TOPIC, b'{"b":2}')], "command")
+    cap.stop()
+    path = cap.path("cut")
+    with open(path, "r+b") as f:
+        f.truncate(f.seek(0, 2) - 3)
+    assert info(path)["messages"] == 1
+
+
+def test_replay_keeps_scaled_timeline_and_reports_lateness():
+    send = Clocked()
+    report = Replayer(_timeline(0.0, 0.2, 0.4), send, speed=2).run()
+    assert report["state"] == "done" and report["sent"] == 3
+    offsets = [t for t, _ in send.sent]
+    for got, want in zip(offsets, (0.0, 0.1, 0.2)):
+        assert want <= got + 0.002 and got < want + 0.05
+    assert set(report["lateness_ms"]) == {"p50", "p95", "p99", "max"}
+    assert report["lateness_ms"]["max"] < 50
+
+
+def _wait(replay, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while replay.running() and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def test_replay_range_errors_and_loop():
+    messages = _timeline(0.0, 0.1, 0.2, 0.3)
+    send = Clocked(fail_on={b'{"n":2}'})
+    report = Replayer(messages, send, speed=0, start=0.1, end=0.3).run()
+    assert [b for _, b in send.sent] == [b'{"n":1}']
+    assert report["sent"] == 1 and report["errors"] == 1 and report["last_error"] == "publish failed"
+
+    send = Clocked()
+    replay = Replayer(messages, send, speed=0, loop=True)
+    replay.start()
+    deadline = time.monotonic() + 5
+    while replay.loops < 3 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    replay.stop()
+    _wait(replay)
+    assert replay.state == "stopped" and replay.loops >= 3 and replay.sent >= 12
+
+
+def test_seek_skips_ahead():
+    send = Clocked()
+    replay = Replayer(_timeline(0.0, 5.0, 5.05), send)
+    replay.start()
+    time.sleep(0.05)
+    replay.seek(5.0)
+    _wait(replay)
+    assert [b for _, b in send.sent] == [b'{"n":0}', b'{"n":1}', b'{"n":2}']
+    assert send.sent[-1][0] < 1.0
+
+
+def test_cli_finds_captures_by_name_in_the_state_dir(monkeypatch, tmp_path, capsys):
+    monkeypatch.delenv("LED_CAPTURE_DIR", raising=False)
+    monkeypatch.setenv("LED_STATE_DIR", str(tmp_path))
+    cap = Capture(default_dir(), check_interval=0)
+    cap.start("friday")
+    cap.record([(TOPIC, b'{"a":1}')], "command")
+    cap.stop()
+    assert cap.path("friday").startswith(str(tmp_path / "captures"))
+    assert main(["info", "friday"]) == 0 and '"messages": 1' in capsys.readouterr().out
+    assert main(["info", "missing"]) == 1
@@ -0,0 +1,79 @@
+from __future__ import annotations
+
+import math
+
+import numpy as np
+import pytest
+
+from led_color import (
+    KELVIN_MAX,
+    KELVIN_MIN,
+    KELVIN_TABLE,
+    WHEEL_TABLE,
+    gamma_correct,
+    gamma_correct_array,
+    gamma_table,
+    gradient_ramp,
+    kelvin_to_rgb,
+    kelvin_to_rgb_array,
+    lerp_color,
+    rainbow_positions,
+    scale_colors,
+    wheel,
+    wheel_array,
+)
+
+
+def _scalar_kelvin(kelvin):
+    """The per-call curve color_temp_to_rgb used before the table."""
+    tmp = max(1500.0, min(9000.0, float(kelvin))) / 100.0
+    if tmp <= 66:
+        red = 255
+        green = 99.4708025861 * math.log(tmp) - 161.1195681661
+        blue = 0 if tmp <= 19 else 138.5177312231 * math.log(tmp - 10) - 305.0447927307
+    else:
+        red = 329.698727446 * ((tmp - 60) ** -0.1332047592)
+        green = 288.1221695283 * ((tmp - 60) ** -0.0755148492)
+        blue = 255
+    return [int(max(0, min(255, red))), int(max(0, min(255, green))), int(max(0, min(255, blue)))]
+
+
+def test_kelvin_table_matches_the_scalar_curve():
+    kelvins = range(KELVIN_MIN, KELVIN_MAX + 1)
+    assert [kelvin_to_rgb(k) for k in kelvins] == [_scalar_kelvin(k) for k in kelvins]
+    assert kelvin_to_rgb(100) == kelvin_to_rgb(KELVIN_MIN) and kelvin_to_rgb(20000) == kelvin_to_rgb(KELVIN_MAX)
+    batch = kelvin_to_rgb_array([[1000, 4500.4], [6600, 12000]])
+    assert batch.shape == (2, 2, 3) and batch.dtype == np.uint8
+    assert batch[0, 1].tolist() == kelvin_to_rgb(4500)
+
+
+def test_tables_are_read_only():
+    for table in (KELVIN_TABLE, WHEEL_TABLE, gamma_table(1.8)):
+        with pytest.raises(ValueError):
+            table[0] = 0
+
+
+def test_wheel_matches_firmware():
+    assert wheel(0) == [255, 0, 0] and wheel(85) == [0, 255, 0] and wheel(170) == [0, 0, 255]
+    assert wheel(256 + 10) == wheel(10)
+    assert wheel_array([0, 85, 170, 300]).tolist() == [wheel(0), wheel(85), wheel(170), wheel(44)]
+
+
+def test_gamma_lerp_and_scale_truncate_like_uint8():
+    assert gamma_correct([0, 128, 255]) == [0, 56, 255]
+    assert gamma_correct_array([[0, 128, 255]]).tolist() == [[0, 56, 255]]
+    assert lerp_color([0, 0, 0], [255, 100, 3], 0.5) == [127, 50, 1]
+    assert lerp_color([0, 0, 0], [10, 10, 10], 2.0) == [10, 10, 10]
+    assert scale_colors([[255, 100, 3]], 128).tolist() == [[128, 50, 1]]
+
+
+def test_gradient_ramp_runs_low_mid_high_and_is_cached():
+    ramp = gradient_ramp([255, 0, 0], [0, 255, 0], [0, 0, 255], 5)
+    assert ramp.tolist() == [[255, 0, 0], [127, 127, 0], [0, 255, 0], [0, 127, 127], [0, 0, 255]]
+    assert gradient_ramp((255, 0, 0), (0, 255, 0), (0, 0, 255), 5) is ramp
+    assert gradient_ramp([1, 2, 3], [4, 5, 6], [7, 8, 9], 1).tolist() == [[1, 2, 3]]
+
+
+def test_rainbow_positions_wrap():
+    assert rainbow_positions(4, 1, 0).tolist() == [0, 64, 128, 192]
+    assert rainbow_positions(4, 0.5, 0x10000 + 200).tolist() == [200, 8, 72, 136]
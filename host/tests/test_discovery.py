@@ -0,0 +1,85 @@
+from __future__ import annotations
+
+import shutil
+import time
+
+from conftest import fixture_path
+from led_discovery import DiscoveryIndex, parse_arp, parse_leases
+
+NOW = time.time()
+
+
+def _read(name):
+    with open(fixture_path(name), encoding="utf-8") as f:
+        return f.read()
+
+
+def test_parse_dnsmasq_leases():
+    devices = parse_leases(_read("dnsmasq.leases"), "dnsmasq")
+    assert [(d.mac, d.ip, d.hostname) for d in devices][:3] == [
+        ("24:6f:28:aa:10:01", "10.42.0.13", "esp32-led-engine"),
+        ("3c:22:fb:00:00:07", "10.42.0.50", "laptop"),
+        ("b8:27:eb:12:34:56", "10.42.0.2", ""),
+    ]
+    assert [d.expires for d in devices] == [4102444800, 4102444800, 0, 1000000000]
+
+
+def test_parse_isc_leases_last_block_wins():
+    devices = {d.ip: d for d in parse_leases(_read("dhcpd.leases"), "dhcpd")}
+    assert sorted(devices) == ["10.42.0.173", "10.42.0.60"]  # .61 was released (binding state free)
+    cam = devices["10.42.0.173"]
+    assert (cam.mac, cam.hostname) == ("7c:df:a1:cc:30:03", "esp32u-camming")
+    assert time.gmtime(cam.expires)[:3] == (2099, 12, 31)
+    assert devices["10.42.0.60"].expires == 0  # ends never
+
+
+def test_parse_arp_skips_incomplete_entries():
+    assert [(d.ip, d.mac) for d in parse_arp(_read("proc_net_arp"))] == [
+        ("10.42.0.44", "a4:cf:12:bb:20:02"),
+        ("10.42.0.13", "24:6f:28:aa:10:01"),
+        ("10.42.0.77", "84:0d:8e:dd:40:04"),
+    ]
+
+
+def test_lookups_across_sources():
+    index = DiscoveryIndex([fixture_path("dnsmasq.leases"), fixture_path("dhcpd.leases")], fixture_path("proc_net_arp"))
+    assert index.by_mac("24:6F:28:AA:10:01").hostname == "esp32-led-engine"
+    assert index.by_ip("10.42.0.173").hostname == "esp32u-camming"
+    assert index.by_hostname("ESP32U-CAMMING").ip == "10.42.0.173"
+    assert index.by_ip("10.42.0.79") is None
+    # Hostname matches first (lease file order), then Espressif MACs from the neighbour table.
+    assert [d.ip for d in index.esp_devices()] == ["10.42.0.13", "10.42.0.173", "10.42.0.44", "10.42.0.77"]
+    assert index.guess_esp_ip() == "10.42.0.13"
+
+
+def test_expired_leases_drop_out(tmp_path, monkeypatch):
+    leases = tmp_path / "dnsmasq.leases"
+    leases.write_text(f"{int(NOW) + 60} 24:6f:28:aa:10:01 10.42.0.13 esp32-led-engine *\n"
+                      f"{int(NOW) + 3600} 3c:22:fb:00:00:07 10.42.0.50 laptop *\n")
+    index = DiscoveryIndex([str(leases)], None)
+    # Lease already expired in the fixture: not indexed by hostname, only by its ARP entry.
+    fixture = DiscoveryIndex([fixture_path("dnsmasq.leases")], fixture_path("proc_net_arp"))
+    assert fixture.by_hostname("esp32-old-lease") is None
+    assert fixture.by_ip("10.42.0.44").source == "arp"
+
+    assert index.by_hostname("esp32-led-engine").ip == "10.42.0.13"
+    loads = index.loads
+    monkeypatch.setattr("led_discovery.time.time", lambda: NOW + 120)
+    # Nothing on disk changed, but the index is rebuilt once the first lease runs out.
+    assert index.by_hostname("esp32-led-engine") is None
+    assert index.by_mac("3c:22:fb:00:00:07").ip == "10.42.0.50"
+    assert index.loads == loads
+    assert index.guess_esp_ip() == "10.42.0.50"
+
+
+def test_lease_move_notifies_listeners(tmp_path):
+    leases = tmp_path / "dnsmasq.leases"
+    shutil.copy(fixture_path("dnsmasq.leases"), leases)
+    index = DiscoveryIndex([str(leases)], None)
+    seen = []
+    index.add_listener(lambda mac, host, old, new: seen.append((host, old, new)))
+    assert index.by_hostname("esp32-led-engine").ip == "10.42.0.13"
+    leases.write_text(leases.read_text().replace("10.42.0.13 ", "10.42.0.14 "))
+    assert index.by_hostname("esp32-led-engine").ip == "10.42.0.14"
+    assert seen == [("esp32-led-engine", "10.42.0.13", "10.42.0.14")]
+    assert index.moves()[0]["new_ip"] == "10.42.0.14"
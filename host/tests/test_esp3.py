@@ -0,0 +1,92 @@
+from __future__ import annotations
+
+import threading
+import time
+
+import pytest
+
+from led_color import kelvin_to_rgb
+from led_esp3 import DEFAULT_STRIPS, Esp3Driver, parse_strips
+
+BASE = {"brightness": 200, "white_balance": 4500, "last_pattern": "white", "target": "both"}
+
+
+class Sent:
+    def __init__(self, fail=0):
+        self.fail = fail
+        self.payloads = []
+        self.arrived = threading.Event()
+
+    def __call__(self, payload, kind, force):
+        if self.fail:
+            self.fail -= 1
+            raise OSError("broker down")
+        self.payloads.append(payload)
+        self.arrived.set()
+        return False
+
+
+def test_parse_strips():
+    assert parse_strips("33:300, 32:150") == [{"pin": 33, "length": 300}, {"pin": 32, "length": 150}]
+    assert parse_strips("") == DEFAULT_STRIPS and parse_strips("") is not DEFAULT_STRIPS
+    with pytest.raises(ValueError):
+        parse_strips("33")
+
+
+def test_full_command_first_then_deltas():
+    send = Sent()
+    esp = Esp3Driver(send, rate_hz=0)
+    esp.apply(BASE)
+    full = send.payloads[0]
+    assert full["strips"] == DEFAULT_STRIPS and full["pattern"] == "white" and full["color"] == kelvin_to_rgb(4500)
+
+    esp.apply({**BASE, "brightness": 100}, BASE)
+    assert send.payloads[1] == {"cmd": "set", "white_balance": 4500.0, "brightness": 100.0, "color": kelvin_to_rgb(4500)}
+    assert not esp.apply(BASE, BASE) and len(send.payloads) == 2
+
+    esp.apply({**BASE, "last_pattern": "rainbow"}, BASE)
+    assert send.payloads[2]["pattern"] == "rainbow" and "color" not in send.payloads[2]
+    esp.set_strips(parse_strips("33:150"))
+    esp.apply(BASE, BASE)
+    assert send.payloads[3]["strips"] == [{"pin": 33, "length": 150}]
+
+
+def test_failed_send_resends_the_full_command():
+    send = Sent()
+    esp = Esp3Driver(send, rate_hz=0)
+    esp.apply(BASE)
+    send.fail = 1
+    with pytest.raises(OSError):
+        esp.apply({**BASE, "brightness": 10}, BASE)
+    assert not esp.status()["synced"]
+    esp.apply({**BASE, "brightness": 10}, BASE)
+    assert "strips" in send.payloads[-1]
+
+
+def test_deltas_within_the_interval_collapse_to_the_newest():
+    send = Sent()
+    esp = Esp3Driver(send, rate_hz=10)
+    esp.apply(BASE)
+    send.arrived.clear()
+    t0 = time.monotonic()
+    for value in range(1, 20):
+        assert esp.apply({**BASE, "brightness": value}, BASE) is False
+    assert esp.status()["pending"]["brightness"] == 19
+    assert send.arrived.wait(2)
+    assert time.monotonic() - t0 >= 0.09
+    assert [p["brightness"] for p in send.payloads[1:]] == [19.0]
+    assert esp.status()["pending"] is None
+
+    time.sleep(0.15)  # quiet for longer than the interval: the next change goes out at once
+    esp.apply({**BASE, "brightness": 50}, BASE)
+    assert send.payloads[-1]["brightness"] == 50.0
+
+
+def test_full_command_cancels_a_pending_delta():
+    send = Sent()
+    esp = Esp3Driver(send, rate_hz=5)
+    esp.apply(BASE)
+    esp.apply({**BASE, "brightness": 1}, BASE)
+    esp.apply({**BASE, "target": "left"}, BASE, force=True)
+    time.sleep(0.3)
+    assert [("strips" in p, p.get("target")) for p in send.payloads] == [(True, "both"), (True, "left")]
@@ -0,0 +1,76 @@
+from __future__ import annotations
+
+import http.server
+import json
+import threading
+import time
+
+import pytest
+
+from led_feeds import Feed, FeedScheduler, FileFeed, HttpFeed
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    delay = 0.0
+    status = 200
+
+    def do_GET(self):
+        time.sleep(type(self).delay)
+        self.send_response(type(self).status)
+        self.end_headers()
+        self.wfile.write(json.dumps({"current": {"wind_mph": 12.5}}).encode())
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture()
+def server():
+    class Handler(_Handler):
+        pass
+
+    httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield Handler, f"http://127.0.0.1:{httpd.server_address[1]}/"
+    httpd.shutdown()
+
+
+def test_feed_read_is_abstract():
+    with pytest.raises(TypeError):
+        Feed("x", "strip1")
+
+
+def test_slow_http_feed_does_not_stall_other_feeds(server, tmp_path):
+    handler, url = server
+    handler.delay = 1.0
+    path = tmp_path / "wind"
+    path.write_text("3")
+    sent = []
+    slow = HttpFeed("api", "strip3", url, key="current.wind_mph", interval=0.5)
+    local = FileFeed("station", "strip2", str(path), interval=0.5)
+    scheduler = FeedScheduler([slow, local], lambda payload: sent.append((time.monotonic(), payload)))
+    t0 = time.monotonic()
+    scheduler.start("127.0.0.1", 1)
+    try:
+        deadline = t0 + 3
+        while time.monotonic() < deadline and not any(p["segment"] == "strip3" for _, p in sent):
+            time.sleep(0.02)
+    finally:
+        scheduler.stop()
+    first_local = next(t for t, p in sent if p["segment"] == "strip2")
+    assert first_local - t0 < 0.3  # not queued behind the 1 s fetch
+    assert [p["params"]["wind_mph"] for _, p in sent if p["segment"] == "strip3"] == [12.5]
+
+
+def test_http_failures_back_off(server):
+    handler, url = server
+    handler.status = 500
+    feed = HttpFeed("api", "strip3", url, interval=1.0, max_backoff=8.0)
+    feed.poll(time.time())  # starts the first fetch
+    while not feed._future.done():
+        time.sleep(0.01)
+    feed.poll(time.time())
+    assert feed.failures == 1 and "HTTPError" in feed.error
+    feed.poll(time.time())
+    assert "retrying in 2 s" in feed.error
+    assert feed._future is None  # no new request while backing off
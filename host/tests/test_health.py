@@ -0,0 +1,78 @@
+from __future__ import annotations
+
+import time
+
+import pytest
+
+from led_health import HealthRing, HealthSampler, main
+
+T0 = 1_700_000_040.0  # start of a minute
+
+
+@pytest.fixture
+def ring(tmp_path):
+    return HealthRing(str(tmp_path / "led_health"))
+
+
+def test_tiers_keep_exact_min_max_mean_count(ring):
+    for i, temp in enumerate((40.0, 42.0, 44.5)):
+        ring.record(T0 + i, {"temp_c": temp, "load1": None if i else 0.5})
+    ring.record(T0 + 60, {"temp_c": 50.0})
+
+    seconds = ring.history("1s", since=T0, until=T0 + 2, fields=["temp_c"])
+    assert seconds["t"] == [T0, T0 + 1, T0 + 2] and seconds["fields"]["temp_c"]["mean"] == [40.0, 42.0, 44.5]
+    assert list(seconds["fields"]) == ["temp_c"]
+
+    minutes = ring.history("1m", since=T0, until=T0 + 60)
+    temp, load = minutes["fields"]["temp_c"], minutes["fields"]["load1"]
+    assert minutes["t"] == [T0, T0 + 60]
+    assert (temp["min"], temp["max"], temp["mean"], temp["count"]) == ([40.0, 50.0], [44.5, 50.0], [42.17, 50.0], [3, 1])
+    assert load["count"] == [1, 0] and load["mean"] == [0.5, None]
+    assert minutes["fields"]["broker_rtt_ms"]["count"] == [0, 0]
+    with pytest.raises(ValueError):
+        ring.history("5m")
+
+
+def test_wrapped_slots_are_not_reported_as_old_buckets(ring):
+    ring.record(T0, {"temp_c": 40.0})
+    ring.record(T0 + 3600, {"temp_c": 60.0})  # same 1 s slot, an hour later
+    assert ring.history("1s", since=T0 - 10, until=T0 + 10)["t"] == []
+    later = ring.history("1s", since=T0 + 3590, until=T0 + 3600)
+    assert later["t"] == [T0 + 3600] and later["fields"]["temp_c"]["max"] == [60.0]
+
+
+def test_reopened_file_carries_on(tmp_path, capsys):
+    path = str(tmp_path / "led_health")
+    HealthRing(path).record(T0, {"temp_c": 40.0})
+    reopened = HealthRing(path)
+    reopened.record(T0 + 30, {"temp_c": 41.0})
+    assert reopened.history("1m", since=T0, until=T0 + 59)["fields"]["temp_c"]["count"] == [2]
+    latest = reopened.latest()
+    assert latest["t"] == T0 + 30 and latest["temp_c"] == 41.0 and latest["load1"] is None
+    assert main(["--path", path]) == 0 and '"temp_c": 41.0' in capsys.readouterr().out
+
+
+def test_sampler_records_and_survives_failing_probes(ring):
+    def broken():
+        raise OSError("sensor gone")
+
+    sampler = HealthSampler(ring, {"temp_c": lambda: 45.0, "load1": broken}, interval=0.02)
+    assert sampler.sample() == {"temp_c": 45.0, "load1": None}
+    sampler.start()
+    try:
+        deadline = time.monotonic() + 5
+        while ring.latest()["t"] is None and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        sampler.stop()
+    latest = ring.latest()
+    assert latest["temp_c"] == 45.0 and latest["load1"] is None and latest["age"] < 5
+
+
+def test_web_reads_the_sampled_temperature(web, client):
+    web.HEALTH_RING.record(time.time(), {"temp_c": 51.5})
+    assert client.get("/api/pi-temp").get_json() == {"temp_c": 51.5, "ok": True}
+    res = client.get("/api/health/history?tier=1s&last=10&fields=temp_c").get_json()
+    assert res["ok"] and res["fields"]["temp_c"]["max"][-1] == 51.5
+    assert client.get("/api/health/history?tier=5m").status_code == 400
+    assert client.get("/api/health").get_json()["enabled"]
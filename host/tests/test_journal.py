@@ -0,0 +1,79 @@
+from __future__ import annotations
+
+import json
+import os
+import time
+
+import pytest
+
+from led_journal import Journal, default_dir
+
+
+def test_restore_after_restart_across_rotations(tmp_path):
+    journal = Journal(str(tmp_path), segment_records=10, keep_segments=2)
+    for i in range(35):
+        journal.record("segments", f"strip{i % 4}", {"brightness": i, "pattern": "solid"}, ts=1000.0 + i)
+    journal.record("esp3", "esp3", {"white_balance": 4200}, ts=1040.0)
+    expected = journal.state()
+    journal.close()
+
+    reopened = Journal(str(tmp_path), segment_records=10, keep_segments=2)
+    assert reopened.state() == expected
+    assert reopened.state()["segments"]["strip2"]["brightness"] == 34
+    assert reopened.seq == 36
+    assert reopened.state_at(1033.5)["segments"]["strip1"]["brightness"] == 33
+    reopened.close()
+
+
+def test_torn_tail_is_cut_off(tmp_path):
+    journal = Journal(str(tmp_path))
+    journal.record("segments", "strip1", {"brightness": 10})
+    journal.record("segments", "strip1", {"brightness": 20})
+    journal.close()
+    log = sorted(p for p in os.listdir(tmp_path) if p.endswith(".log"))[-1]
+    with open(tmp_path / log, "r+b") as f:
+        f.truncate(os.path.getsize(tmp_path / log) - 3)  # crash mid-write of the last record
+    reopened = Journal(str(tmp_path))
+    assert reopened.state()["segments"]["strip1"]["brightness"] == 10
+    assert reopened.record("segments", "strip1", {"brightness": 30})
+    reopened.close()
+    assert Journal(str(tmp_path)).state()["segments"]["strip1"]["brightness"] == 30
+
+
+@pytest.fixture()
+def startup(web, broker, tmp_path, monkeypatch):
+    """Journal knows strip2, the broker retains strip0, the default preset covers the rest."""
+    web.RETAINED.flush()
+    time.sleep(0.3)
+    with broker.lock:
+        for topic in [t for t in broker.retained if t.startswith("led/state/")]:
+            del broker.retained[topic]
+        broker.retained["led/state/strip0"] = json.dumps(
+            {"cmd": "set", "segment": "strip0", "pattern": "rainbow", "brightness": 40, "speed": 1.0,
+             "params": {"color": [0, 0, 40]}}).encode()
+    path = tmp_path / "led_states.json"
+    default = {"segments": {seg: {"pattern": "solid", "brightness": 90, "color": [90, 0, i]}
+                            for i, seg in enumerate(web.SEGMENTS)}}
+    path.write_text(json.dumps({"states": {"boot": default}, "default": "boot"}))
+    monkeypatch.setattr(web, "STATES_FILE", str(path))
+    restored = {"pattern": "sine", "brightness": 70, "color": [0, 70, 0]}
+    monkeypatch.setattr(web, "JOURNAL_RESTORED", {"segments": {"strip2": dict(restored)}})
+    web.STATE.update("strip2", restored)
+    return web
+
+
+def test_defaults_only_for_segments_missing_from_journal_and_broker(startup):
+    web = startup
+    sources = web.restore_startup_state()
+    assert sources == {"journal": ["strip2"], "retained": ["strip0"], "default": ["strip1", "strip3"]}
+    assert web.STATE.get("strip2")["pattern"] == "sine"
+    assert web.STATE.get("strip0")["pattern"] == "rainbow"
+    assert list(web.STATE.get("strip1")["color"]) == [90, 0, 1]
+    assert list(web.STATE.get("strip3")["color"]) == [90, 0, 3]
+
+
+def test_default_dir_follows_the_state_dir(monkeypatch, tmp_path):
+    monkeypatch.setenv("LED_STATE_DIR", str(tmp_path))
+    assert default_dir() == str(tmp_path / "led_journal")
+    Journal(default_dir()).close()
+    assert (tmp_path / "led_journal").is_dir()
@@ -0,0 +1,90 @@
+from __future__ import annotations
+
+import socket
+import threading
+
+import paho.mqtt.client as mqtt
+import pytest
+from werkzeug.serving import make_server
+
+from led_loadtest import MIN_P99_SAMPLES, Recorder, compare, summarize, topic_matches
+
+
+@pytest.mark.parametrize("pattern, topic, expected", [
+    ("led/#", "led/state/strip1", True),
+    ("led/+/strip1", "led/state/strip1", True),
+    ("led/+", "led/state/strip1", False),
+    ("led/state/strip1", "led/state/strip1", True),
+    ("led/state/strip1/x", "led/state/strip1", False),
+    ("#", "anything", True),
+])
+def test_topic_matches(pattern, topic, expected):
+    assert topic_matches(pattern, topic) is expected
+
+
+def _route(count, p50, p99, errors=0):
+    return {"count": count, "errors": errors, "p50": p50, "p99": p99, "max": p99}
+
+
+def test_compare_applies_tolerance_slack_and_error_rate():
+    baseline = {"routes": {"/api/set": _route(1000, 4.0, 20.0), "/api/gone": _route(10, 1.0, 1.0)}}
+    ok = {"routes": {"/api/set": _route(1000, 4.0 * 1.25 + 2.0, 20.0 * 1.25 + 10.0, errors=10)}}
+    assert compare(ok, baseline) == []
+    slow = {"routes": {"/api/set": _route(1000, 7.1, 36.0, errors=30)}}
+    problems = compare(slow, baseline)
+    assert [p.split(" ", 2)[1] for p in problems] == ["p50", "p99", "error"]
+    few = {"routes": {"/api/set": _route(MIN_P99_SAMPLES - 1, 4.0, 500.0)}}
+    assert compare(few, baseline) == []
+
+
+def test_recorder_summarizes_routes_against_the_app(web):
+    server = make_server("127.0.0.1", 0, web.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        rec = Recorder()
+        for _ in range(3):
+            rec.request(server.server_port, "GET", "/api/state?since=0")
+        rec.request(server.server_port, "POST", "/api/set", {"segment": "strip1", "pattern": "solid"})
+        with socket.socket() as closed:
+            closed.bind(("127.0.0.1", 0))
+            dead_port = closed.getsockname()[1]
+        rec.request(dead_port, "GET", "/api/status")
+    finally:
+        server.shutdown()
+    result = summarize(rec, 2.0)
+    assert result["requests"] == 5 and result["rps"] == 2.5
+    assert result["routes"]["/api/state"]["count"] == 3 and result["routes"]["/api/state"]["errors"] == 0
+    assert result["routes"]["/api/set"]["errors"] == 0
+    assert result["routes"]["/api/status"]["errors"] == 1
+
+
+def test_fake_broker_delivers_retained_and_live_messages(broker):
+    got = []
+    done = threading.Event()
+
+    def on_message(client, userdata, msg):
+        got.append((msg.topic, msg.payload, bool(msg.retain)))
+        if len(got) == 2:
+            done.set()
+
+    pub = mqtt.Client(client_id="loadtest-pub")
+    pub.connect("127.0.0.1", broker.port)
+    pub.loop_start()
+    pub.publish("loadtest/retained", b"old", qos=1, retain=True).wait_for_publish(5)
+    sub = mqtt.Client(client_id="loadtest-sub")
+    sub.on_message = on_message
+    subscribed = threading.Event()
+    sub.on_subscribe = lambda *args: subscribed.set()
+    sub.connect("127.0.0.1", broker.port)
+    sub.loop_start()
+    try:
+        sub.subscribe("loadtest/#", qos=1)
+        assert subscribed.wait(5)
+        pub.publish("loadtest/live", b"new", qos=1).wait_for_publish(5)
+        assert done.wait(5)
+    finally:
+        for client in (pub, sub):
+            client.loop_stop()
+            client.disconnect()
+    assert got == [("loadtest/retained", b"old", True), ("loadtest/live", b"new", False)]
+    assert broker.retained["loadtest/retained"] == b"old"
@@ -0,0 +1,63 @@
+from __future__ import annotations
+
+import pytest
+
+from led_metrics import Registry, timed
+
+
+def test_histogram_buckets_are_cumulative_and_le_inclusive():
+    reg = Registry()
+    hist = reg.histogram("t_seconds", "Test", ["op"], buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        hist.observe(value, op="read")
+    assert hist.count(op="read") == 4 and hist.count(op="write") == 0
+    assert hist.collect() == [
+        't_seconds_bucket{op="read",le="0.1"} 2',
+        't_seconds_bucket{op="read",le="1"} 3',
+        't_seconds_bucket{op="read",le="+Inf"} 4',
+        't_seconds_sum{op="read"} 3.65',
+        't_seconds_count{op="read"} 4',
+    ]
+
+
+def test_render_has_help_type_and_escaped_labels():
+    reg = Registry()
+    counter = reg.counter("t_total", "Things", ["topic"])
+    assert reg.counter("t_total", "Again", ["topic"]) is counter  # re-registering returns the first
+    counter.inc(topic='a"b\\c')
+    counter.inc(2, topic="plain")
+    reg.gauge("t_depth", "Depth").set(7)
+    assert reg.render().splitlines() == [
+        "# HELP t_total Things",
+        "# TYPE t_total counter",
+        't_total{topic="a\\"b\\\\c"} 1',
+        't_total{topic="plain"} 2',
+        "# HELP t_depth Depth",
+        "# TYPE t_depth gauge",
+        "t_depth 7",
+    ]
+    assert counter.total() == 3
+
+
+def test_timed_records_failures_too():
+    hist = Registry().histogram("t_call_seconds", "Calls", ["op"])
+
+    @timed(hist, op="x")
+    def boom():
+        raise RuntimeError("no")
+
+    with pytest.raises(RuntimeError):
+        boom()
+    with hist.time(op="x"):
+        pass
+    assert hist.count(op="x") == 2
+
+
+def test_metrics_endpoint_counts_publishes(web, client):
+    client.post("/api/set", json={"segment": "strip1", "pattern": "solid", "brightness": 11, "force": True})
+    res = client.get("/metrics")
+    assert res.status_code == 200 and res.mimetype == "text/plain"
+    body = res.get_data(as_text=True)
+    assert "# TYPE led_payload_messages_total counter" in body
+    assert f'led_mqtt_publish_total{{topic="{web.MQTT_CMD_TOPIC}",result="ok"}}' in body
+    assert 'led_http_request_seconds_count{endpoint="/api/set",method="POST"}' in body
@@ -0,0 +1,34 @@
+from __future__ import annotations
+
+import pytest
+
+from led_model import BENCH_REQUESTS, Command, CommandError
+from legacy_command import LegacyCommand
+
+
+@pytest.mark.parametrize("name", sorted(BENCH_REQUESTS))
+def test_payload_matches_legacy_command(name):
+    data = BENCH_REQUESTS[name]
+    assert Command.from_request(data).to_payload() == LegacyCommand.from_request(data).to_payload()
+
+
+def test_absent_and_null_fields_take_defaults():
+    cmd = Command.from_request({"brightness": None, "unknown": 1})
+    assert cmd.brightness == 255.0
+    assert cmd.color == [0, 180, 160]
+    cmd.color.append(1)
+    assert Command.from_request({}).color == [0, 180, 160]
+
+
+@pytest.mark.parametrize("data, field", [
+    ({"brightness": 300}, "brightness"),
+    ({"brightness": True}, "brightness"),
+    ({"speed": "fast"}, "speed"),
+    ({"color": [1, 2]}, "color"),
+    ({"gradient_low": [0, 0, 256]}, "gradient_low"),
+    ({"mic_enabled": "yes"}, "mic_enabled"),
+    ({"pattern": "x" * 100}, "pattern"),
+])
+def test_invalid_fields_are_rejected(data, field):
+    with pytest.raises(CommandError, match=field):
+        Command.from_request(data)
@@ -0,0 +1,158 @@
+from __future__ import annotations
+
+import socket
+import threading
+import time
+
+import pytest
+
+from led_loadtest import FakeBroker
+from led_mqtt import BrokerUnavailable, CircuitBreaker, DeliveryError, Publisher
+
+
+@pytest.fixture
+def fake():
+    broker = FakeBroker()
+    broker.start()
+    yield broker
+    broker.shutdown()
+    broker.server_close()
+
+
+def _wait_for(check, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not check() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return check()
+
+
+def test_refused_connack_counts_one_failure_and_drops_the_client(fake):
+    fake.connack_rc = 5  # not authorized
+    pub = Publisher("127.0.0.1", fake.port, ack_timeout=0.1, connect_wait=0.05,
+                    breaker=CircuitBreaker(backoff=30.0, max_backoff=30.0))
+    with pytest.raises(BrokerUnavailable):
+        pub.connect()
+    assert _wait_for(lambda: pub.breaker.failures >= 1)
+    time.sleep(2.5)  # past the CONNACK wait, where the refusal used to be counted again
+    assert pub.breaker.failures == 1 and "refused" in pub.breaker.last_error
+    assert pub._client is None
+    with pytest.raises(BrokerUnavailable):
+        pub.connect()
+
+
+def test_connack_timeout_closes_the_abandoned_socket():
+    silent = socket.socket()
+    silent.bind(("127.0.0.1", 0))
+    silent.listen(4)
+    pub = Publisher("127.0.0.1", silent.getsockname()[1], ack_timeout=0.1, connect_wait=0.05,
+                    breaker=CircuitBreaker(backoff=30.0, max_backoff=30.0))
+    with pytest.raises(BrokerUnavailable):
+        pub.connect()
+    conn, _ = silent.accept()
+    conn.settimeout(5)
+    try:
+        assert _wait_for(lambda: pub.breaker.failures == 1)
+        assert "no CONNACK" in pub.breaker.last_error
+        while conn.recv(1024):  # the CONNECT packet, then EOF once the client gives up
+            pass
+    finally:
+        conn.close()
+        silent.close()
+
+
+def _publisher(fake, **kwargs):
+    pub = Publisher("127.0.0.1", fake.port, connect_wait=2.0, **kwargs)
+    pub.connect()
+    return pub
+
+
+def _bodies(fake):
+    with fake.lock:
+        return [body for _, body in fake.received]
+
+
+def test_dropped_puback_is_retried(fake):
+    pub = _publisher(fake, ack_timeout=0.2, retries=2)
+    fake.drop_acks = 1
+    assert pub.send([("led/cmd", b"a")], qos=1, keys=[("led/cmd", "strip1")]) == {"sent": 1, "superseded": 0}
+    assert _bodies(fake) == [b"a", b"a"]
+    pub.close()
+
+
+def test_unacked_message_fails_after_retries(fake):
+    pub = _publisher(fake, ack_timeout=0.1, retries=1)
+    fake.drop_acks = 2
+    with pytest.raises(DeliveryError, match="2 attempts"):
+        pub.send([("led/cmd", b"a")], qos=1)
+    assert _bodies(fake) == [b"a", b"a"]
+    pub.close()
+
+
+def test_newer_command_supersedes_an_unacked_one(fake):
+    pub = _publisher(fake, ack_timeout=0.5, retries=2)
+    key = ("led/cmd", "strip1")
+    fake.drop_acks = 1
+    results = {}
+    old = threading.Thread(target=lambda: results.update(old=pub.send([("led/cmd", b"old")], qos=1, keys=[key])))
+    old.start()
+    assert _wait_for(lambda: _bodies(fake) == [b"old"])
+    assert pub.send([("led/cmd", b"new")], qos=1, keys=[key]) == {"sent": 1, "superseded": 0}
+    old.join(5)
+    assert results["old"] == {"sent": 0, "superseded": 1}
+    assert _bodies(fake) == [b"old", b"new"]  # the stale command was not re-published
+    pub.close()
+
+
+def test_window_bounds_messages_in_flight(fake):
+    pub = _publisher(fake, window=3, ack_timeout=5.0)
+    fake.hold_acks = True
+    messages = [("led/cmd", str(i).encode()) for i in range(8)]
+    sender = threading.Thread(target=pub.send, args=(messages,), kwargs={"qos": 1})
+    sender.start()
+    assert _wait_for(lambda: len(_bodies(fake)) == 3)
+    time.sleep(0.2)
+    assert len(_bodies(fake)) == 3
+    fake.release_acks()
+    sender.join(5)
+    assert _bodies(fake) == [body for _, body in messages]
+    pub.close()
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_breaker_opens_after_threshold_and_backs_off():
+    clock = Clock()
+    breaker = CircuitBreaker(threshold=2, backoff=0.5, max_backoff=3.0, clock=clock)
+    assert breaker.failure("refused") == 0.5 and breaker.allow()
+    assert breaker.failure("refused") == 0.5 and not breaker.allow()
+    assert breaker.opened_at == 1000.0 and breaker.status()["next_probe_in"] == 0.5
+    assert [breaker.failure("refused") for _ in range(4)] == [1.0, 2.0, 3.0, 3.0]
+    clock.now += 10
+    assert breaker.opened_at == 1000.0 and "down for 10s (refused)" in breaker.describe()
+
+
+def test_breaker_closes_on_success():
+    breaker = CircuitBreaker(clock=Clock())
+    breaker.failure("lost")
+    assert breaker.open and breaker.status()["state"] == "open"
+    breaker.success()
+    assert breaker.allow() and breaker.failures == 0
+    assert breaker.status() == {"state": "closed", "failures": 0, "opened_at": None, "next_probe_in": None,
+                                "last_error": "lost"}
+    assert breaker.failure("lost again") == 0.5  # backoff starts over
+
+
+def test_open_breaker_fails_fast_without_dialing(fake):
+    breaker = CircuitBreaker(backoff=30.0, clock=Clock())
+    breaker.failure("down")
+    pub = Publisher("127.0.0.1", fake.port, connect_wait=5.0, breaker=breaker)
+    started = time.monotonic()
+    with pytest.raises(BrokerUnavailable, match="down for 0s"):
+        pub.connect()
+    assert time.monotonic() - started < 0.5 and fake.connects == 0 and pub._dialer is None
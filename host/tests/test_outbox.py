@@ -0,0 +1,127 @@
+from __future__ import annotations
+
+import json
+import time
+
+import pytest
+
+from conftest import HOST_DIR
+from led_model import merge_sets
+from led_outbox import HEADER_SIZE, Forwarder, Outbox, default_path
+from led_payload import encode
+
+TOPIC = "led/cmd"
+
+
+def _set(segment, **params):
+    return encode({"cmd": "set", "segment": segment, "pattern": "solid", "params": params})
+
+
+def _merge(topic, groups):
+    return [encode(merge_sets([json.loads(b) for group in groups for b in group]))]
+
+
+class Recorder:
+    def __init__(self, fail=0):
+        self.fail = fail
+        self.sent = []
+
+    def __call__(self, messages, kind, retain, keys):
+        if self.fail:
+            self.fail -= 1
+            raise OSError("broker down")
+        self.sent.extend((key, json.loads(body)) for (_, body), key in zip(messages, keys))
+
+
+def _append(box, segment, **params):
+    box.append([(TOPIC, _set(segment, **params))], "command", keys=[segment])
+
+
+@pytest.fixture
+def box(tmp_path):
+    return Outbox(str(tmp_path / "outbox.ring"), slots=8, slot_size=256)
+
+
+def test_flush_keeps_newest_per_segment_in_order(box):
+    _append(box, "strip1", color=[1, 0, 0])
+    box.append([(TOPIC, b'{"cmd":"ping"}')], "command")
+    _append(box, "strip2", color=[0, 1, 0])
+    _append(box, "strip1", color=[0, 0, 1])
+    send = Recorder()
+    assert box.flush(send) == 3
+    assert [(k, p.get("params", {}).get("color")) for k, p in send.sent] == [
+        (None, None), ("strip2", [0, 1, 0]), ("strip1", [0, 0, 1])]
+    assert box.depth() == 0 and box.flush(send) == 0
+
+
+def test_merge_callback_folds_queued_sets(tmp_path):
+    box = Outbox(str(tmp_path / "outbox.ring"), slots=8, slot_size=256, merge=_merge)
+    _append(box, "strip1", color=[1, 0, 0], wave_count=2.0)
+    _append(box, "strip1", color=[0, 0, 1])
+    send = Recorder()
+    box.flush(send)
+    [(key, payload)] = send.sent
+    assert key == "strip1"
+    assert payload["params"]["color"] == [0, 0, 1] and payload["params"]["wave_count"] == 2.0
+
+
+def test_failed_flush_is_retried_whole_and_survives_reopen(tmp_path):
+    path = str(tmp_path / "outbox.ring")
+    box = Outbox(path, slots=8, slot_size=256)
+    _append(box, "strip1", color=[1, 0, 0])
+    _append(box, "strip2", color=[0, 1, 0])
+    with pytest.raises(OSError):
+        box.flush(Recorder(fail=1))
+    assert box.depth() == 2 and box.status()["last_error"] == "broker down"
+    reopened = Outbox(path, slots=8, slot_size=256)
+    send = Recorder()
+    assert reopened.flush(send) == 2
+    assert [k for k, _ in send.sent] == ["strip1", "strip2"]
+
+
+def test_torn_record_is_skipped(tmp_path):
+    path = str(tmp_path / "outbox.ring")
+    box = Outbox(path, slots=8, slot_size=256)
+    _append(box, "strip1", color=[1, 0, 0])
+    _append(box, "strip2", color=[0, 1, 0])
+    with open(path, "r+b") as f:
+        f.seek(HEADER_SIZE + 1 * 256 + 60)  # body of seq 1, the first record
+        f.write(b"\xff")
+    send = Recorder()
+    box.flush(send)
+    assert [k for k, _ in send.sent] == ["strip2"]
+
+
+def test_full_ring_compacts_before_dropping(box):
+    for i in range(20):
+        _append(box, "strip1" if i % 2 else "strip2", wave_count=float(i))
+    assert box.status()["dropped"] == 0
+    send = Recorder()
+    box.flush(send)
+    assert [(k, p["params"]["wave_count"]) for k, p in send.sent] == [("strip2", 18.0), ("strip1", 19.0)]
+    for i in range(10):
+        _append(box, f"seg{i}", wave_count=1.0)
+    assert box.depth() == 8 and box.status()["dropped"] == 2
+    assert [r["segment"] for r in box.pending()] == [f"seg{i}" for i in range(2, 10)]
+
+
+def test_forwarder_delivers_after_broker_returns(box):
+    _append(box, "strip1", color=[1, 0, 0])
+    send = Recorder(fail=1)
+    forwarder = Forwarder(box, send, interval=0.05)
+    forwarder.start()
+    deadline = time.monotonic() + 5
+    while box.depth() and time.monotonic() < deadline:
+        forwarder.kick()
+        time.sleep(0.02)
+    assert box.depth() == 0 and [k for k, _ in send.sent] == ["strip1"]
+
+
+def test_default_path_is_outside_the_source_tree(monkeypatch, tmp_path):
+    monkeypatch.delenv("LED_STATE_DIR", raising=False)
+    monkeypatch.setenv("XDG_STATE_HOME", str(tmp_path))
+    assert default_path() == str(tmp_path / "led-kit" / "led_outbox.ring")
+    monkeypatch.setenv("LED_STATE_DIR", str(tmp_path / "state"))
+    box = Outbox(default_path(), slots=4, slot_size=128)
+    assert box.path.startswith(str(tmp_path / "state")) and not box.path.startswith(HOST_DIR)
+    assert box.depth() == 0
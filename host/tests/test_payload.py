@@ -0,0 +1,114 @@
+from __future__ import annotations
+
+import json
+
+import pytest
+
+from led_model import BENCH_REQUESTS, Command
+from led_payload import (
+    HEAD_KEYS,
+    PayloadTooLarge,
+    SendFilter,
+    encode,
+    fits,
+    json_nodes,
+    limits_for,
+    packet_size,
+    prepare_messages,
+)
+
+MAIN = "led/cmd"
+SMALL = "esp3/cmd"  # any non-main topic gets the ESP3 limits
+
+
+def _full_payload():
+    return Command.from_request(BENCH_REQUESTS["full"]).to_payload()
+
+
+def test_packet_size_counts_varint_and_packet_id():
+    assert packet_size("t", b"x" * 10) == 1 + 1 + 2 + 1 + 2 + 10
+    assert packet_size("t", b"x" * 200) == 1 + 2 + 2 + 1 + 2 + 200
+
+
+def test_payload_that_fits_is_sent_as_is():
+    payload = _full_payload()
+    assert prepare_messages(payload, MAIN, MAIN) == [encode(payload)]
+
+
+def test_oversized_set_is_split_in_param_order():
+    payload = _full_payload()
+    limits = limits_for(SMALL, MAIN)
+    bodies = prepare_messages(payload, SMALL, MAIN)
+    assert len(bodies) > 1
+    parts = [json.loads(b) for b in bodies]
+    for part, body in zip(parts, bodies):
+        assert part["cmd"] == "set" and part["segment"] == payload["segment"]
+        assert fits(SMALL, part, body, limits)
+    assert {k: parts[0][k] for k in HEAD_KEYS} == {k: payload[k] for k in HEAD_KEYS}
+    assert all(k not in part for part in parts[1:] for k in HEAD_KEYS)
+    merged = [item for part in parts for item in part.get("params", {}).items()]
+    assert merged == list(payload["params"].items())
+
+
+def test_json_pool_limit_splits_even_when_bytes_fit():
+    params = {f"p{i}": [1, 2, 3] for i in range(12)}
+    payload = {"cmd": "set", "segment": "strip1", "pattern": "solid", "params": params}
+    assert len(encode(payload)) < 512 and json_nodes(payload) * 16 > 512
+    assert len(prepare_messages(payload, MAIN, MAIN)) == 2
+
+
+def test_param_too_large_on_its_own_raises():
+    payload = {"cmd": "set", "segment": "strip1", "pattern": "solid", "params": {"wave_shape": "x" * 600}}
+    with pytest.raises(PayloadTooLarge, match="wave_shape"):
+        prepare_messages(payload, MAIN, MAIN)
+
+
+def test_oversized_non_set_command_raises():
+    with pytest.raises(PayloadTooLarge, match="ota"):
+        prepare_messages({"cmd": "ota", "url": "x" * 600}, MAIN, MAIN)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("led_payload.time.monotonic", lambda: now[0])
+    return now
+
+
+def test_send_filter_suppresses_repeats_until_ttl(clock):
+    sf = SendFilter(ttl=5.0)
+    bodies = [b'{"cmd":"set"}']
+    assert sf.admit(MAIN, "strip1", bodies)
+    sf.remember(MAIN, [("strip1", bodies)])
+    assert not sf.admit(MAIN, "strip1", bodies)
+    assert sf.admit(MAIN, "strip1", [b'{"cmd":"set","x":1}'])
+    assert sf.admit(MAIN, "strip2", bodies) and sf.admit(SMALL, "strip1", bodies)
+    clock[0] += 4.9
+    assert not sf.admit(MAIN, "strip1", bodies)
+    clock[0] += 0.1
+    assert sf.admit(MAIN, "strip1", bodies)
+
+
+def test_send_filter_forget_and_clear(clock):
+    sf = SendFilter(ttl=5.0)
+    bodies = [b"a"]
+    sf.remember(MAIN, [("strip1", bodies), ("strip2", bodies)])
+    sf.remember(SMALL, [("strip1", bodies)])
+    sf.forget(MAIN, ["strip1"])
+    assert sf.admit(MAIN, "strip1", bodies) and not sf.admit(MAIN, "strip2", bodies)
+    sf.clear(MAIN)
+    assert sf.admit(MAIN, "strip2", bodies) and not sf.admit(SMALL, "strip1", bodies)
+    sf.clear()
+    assert sf.admit(SMALL, "strip1", bodies)
+
+
+def test_send_filter_evicts_oldest_and_zero_ttl_disables(clock):
+    sf = SendFilter(ttl=60.0, max_keys=2)
+    for key in ["a", "b", "c"]:
+        clock[0] += 1
+        sf.remember(MAIN, [(key, [b"x"])])
+    assert sf.admit(MAIN, "a", [b"x"])
+    assert not sf.admit(MAIN, "b", [b"x"]) and not sf.admit(MAIN, "c", [b"x"])
+    off = SendFilter(ttl=0)
+    off.remember(MAIN, [("a", [b"x"])])
+    assert off.admit(MAIN, "a", [b"x"])
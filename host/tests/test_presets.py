@@ -0,0 +1,61 @@
+from __future__ import annotations
+
+import json
+import os
+import threading
+
+import pytest
+
+from conftest import HOST_DIR
+from led_presets import PresetError, export_lines, import_lines, normalize_main, read_library
+
+
+def _line(name, data):
+    return json.dumps({"name": name, "data": data})
+
+
+def test_out_of_range_segment_is_rejected():
+    with pytest.raises(PresetError, match="strip1"):
+        normalize_main({"strip1": {"pattern": "solid", "speed": 500, "mic_floor": 3}})
+
+
+def test_import_reports_lines_the_apply_path_would_reject(tmp_path):
+    path = str(tmp_path / "states.json")
+    lines = [
+        _line("ok", {"segments": {"strip1": {"pattern": "solid", "speed": 2, "color": [1, 2, 3]}}}),
+        _line("too fast", {"segments": {"strip1": {"pattern": "solid", "speed": 500}}}),
+        _line("bad floor", {"segments": {"strip2": {"mic_floor": 3}}}),
+        _line("long shape", {"segments": {"strip2": {"wave_shape": "x" * 40}}}),
+    ]
+    report = import_lines(lines, path)
+    assert report.added == 1
+    assert report.invalid == 3
+    assert [e["line"] for e in report.errors] == [2, 3, 4]
+    assert "speed" in report.errors[0]["error"]
+    states, _ = read_library(path, "main")
+    assert list(states) == ["ok"]
+
+
+def test_shipped_library_round_trips(tmp_path):
+    states, default = read_library(os.path.join(HOST_DIR, "led_states.json"), "main")
+    report = import_lines(export_lines(states, default), str(tmp_path / "states.json"), dry_run=True)
+    assert report.invalid == 0, report.errors
+
+
+def test_second_import_gets_409_while_one_is_running(web, client):
+    holding, release = threading.Event(), threading.Event()
+
+    def running_import():
+        with web.IMPORT_LOCK, web.PRESET_LOCK:
+            holding.set()
+            release.wait(5)
+
+    worker = threading.Thread(target=running_import)
+    worker.start()
+    try:
+        assert holding.wait(5)
+        res = client.post("/api/states/import?dry_run=1", data=b"")
+        assert res.status_code == 409 and "another import" in res.get_json()["error"]
+    finally:
+        release.set()
+        worker.join(5)
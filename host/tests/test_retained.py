@@ -0,0 +1,37 @@
+from __future__ import annotations
+
+import json
+import time
+
+from led_retained import RetainedStateMirror
+
+
+def _mirror(sent):
+    return RetainedStateMirror("led/state", sent.extend, lambda seg, fields: (fields, json.dumps(fields).encode()), (4096, 4096, 512))
+
+
+def test_compact_clears_only_segments_outside_live():
+    sent = []
+    mirror = _mirror(sent)
+    mirror.seed({"strip1": b"{}", "old": b"{}"})
+    stale = mirror.compact(["strip1", "old", "seg250_323"], ["strip1", "seg250_323"])
+    assert stale == ["old"]
+    assert sent == [("led/state/old", b"")]
+    assert mirror.status()["segments"] == ["strip1"]
+
+
+def test_compact_keeps_preset_sub_segments(web, client, broker):
+    body = json.dumps({"segment": "x", "pattern": "solid"}).encode()
+    with broker.lock:
+        for seg in ("strip1", "seg250_323", "seg330_400", "removed_strip"):
+            broker.retained[f"led/state/{seg}"] = body
+    res = client.post("/api/state/retained/compact")
+    assert res.status_code == 200
+    assert res.get_json()["cleared"] == ["removed_strip"]
+    deadline = time.monotonic() + 2
+    while "led/state/removed_strip" in broker.retained and time.monotonic() < deadline:
+        time.sleep(0.02)
+    assert "led/state/removed_strip" not in broker.retained
+    assert "led/state/seg250_323" in broker.retained
+    assert "led/state/seg330_400" in broker.retained
+    assert {"seg250_323", "seg330_400"} <= web.retained_segments()
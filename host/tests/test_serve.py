@@ -0,0 +1,77 @@
+from __future__ import annotations
+
+import http.client
+import json
+import os
+import queue
+import re
+import signal
+import socket
+import subprocess
+import sys
+import threading
+
+import pytest
+
+from conftest import HOST_DIR
+from led_loadtest import _seed_files, isolated_env
+from led_serve import _wait_for
+
+LEADER = re.compile(r"worker (\d+) is leader")
+
+
+def _request(port, method, path, body=None):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+    data = json.dumps(body) if body is not None else None
+    conn.request(method, path, body=data, headers={"Content-Type": "application/json"} if data else {})
+    resp = conn.getresponse()
+    payload = json.loads(resp.read())
+    conn.close()
+    return resp.status, payload
+
+
+@pytest.fixture
+def served(tmp_path, broker):
+    _seed_files(str(tmp_path), ["strip1"])
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    env = dict(os.environ, **isolated_env(str(tmp_path), broker.port))
+    proc = subprocess.Popen(
+        [sys.executable, os.path.join(HOST_DIR, "led_serve.py"), "--host", "127.0.0.1", "--port", str(port),
+         "--workers", "2", "--state-db", str(tmp_path / "state.sqlite")],
+        env=env, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True,
+    )
+    lines: queue.Queue = queue.Queue()
+    threading.Thread(target=lambda: [lines.put(line) for line in proc.stdout], daemon=True).start()
+    try:
+        _wait_for(port)
+        yield port, lines
+    finally:
+        proc.terminate()
+        proc.wait(10)
+
+
+def _next_leader(lines, timeout=15.0):
+    while True:
+        match = LEADER.search(lines.get(timeout=timeout))
+        if match:
+            return int(match.group(1))
+
+
+def test_workers_share_state_and_leadership_fails_over(served):
+    port, lines = served
+    leader = _next_leader(lines)
+
+    for value in (10, 20, 30):
+        status, _ = _request(port, "POST", "/api/set", {"segment": "strip1", "pattern": "solid", "brightness": value})
+        assert status == 200
+    for _ in range(6):  # new connection each time, so both workers answer
+        _, state = _request(port, "GET", "/api/state")
+        assert {s["segment"]: s["brightness"] for s in state["state"]}["strip1"] == 30
+
+    os.kill(leader, signal.SIGKILL)
+    successor = _next_leader(lines)
+    assert successor != leader
+    _wait_for(port)
+    assert _request(port, "GET", "/api/state")[0] == 200
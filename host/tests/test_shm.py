@@ -0,0 +1,101 @@
+from __future__ import annotations
+
+import os
+import struct
+import threading
+
+import pytest
+
+from led_shm import SEQ_OFFSET, ShmReader, ShmWriter, main
+
+STATE = {
+    "pattern": "mic_vu",
+    "wave_shape": "sine",
+    "brightness": 128.0,
+    "speed": 0.5,
+    "color": [255, 300, -1],
+    "gradient_low": [1, 2, 3],
+    "mic_enabled": True,
+    "mic_beat": True,
+}
+
+
+@pytest.fixture
+def table(tmp_path):
+    return str(tmp_path / "led_state")
+
+
+def test_write_then_read_round_trip(table):
+    writer = ShmWriter(table, ["strip1", "strip2"])
+    writer.write(3, {"strip1": STATE, "unknown": STATE})
+    reader = ShmReader(table)
+    version, state = reader.snapshot()
+    assert version == 3 and list(state) == ["strip1"]
+    slot = state["strip1"]
+    assert (slot["pattern"], slot["wave_shape"], slot["brightness"], slot["speed"]) == ("mic_vu", "sine", 128.0, 0.5)
+    assert slot["color"] == [255, 255, 0] and slot["gradient_low"] == [1, 2, 3] and slot["gradient_high"] == [0, 0, 0]
+    assert (slot["mic_enabled"], slot["gradient_enabled"], slot["mic_beat"]) == (True, False, True)
+    assert reader.seq() % 2 == 0
+
+
+def test_older_versions_never_replace_newer_slots(table):
+    writer = ShmWriter(table, ["strip1"])
+    writer.write(5, {"strip1": {"pattern": "solid"}})
+    seq = ShmReader(table).seq()
+    writer.write(4, {"strip1": {"pattern": "stale"}})
+    reader = ShmReader(table)
+    assert reader.get("strip1")["pattern"] == "solid" and reader.seq() == seq
+
+
+def test_stale_table_is_cleared_and_torn_write_recovered(table):
+    ShmWriter(table, ["strip1"]).write(9, {"strip1": {"pattern": "old"}})
+    writer = ShmWriter(table, ["strip1"], version=2)  # a restarted store is behind the leftover table
+    assert ShmReader(table).snapshot() == (0, {})
+    with open(table, "r+b") as f:
+        f.seek(SEQ_OFFSET)
+        f.write(struct.pack("<Q", 7))  # a writer died mid-write
+    with pytest.raises(TimeoutError):
+        ShmReader(table).raw(retries=5)
+    writer.write(3, {"strip1": {"pattern": "solid"}})
+    reader = ShmReader(table)
+    assert reader.seq() == 10 and reader.get("strip1")["pattern"] == "solid"
+
+
+def test_reader_never_sees_a_half_written_slot(table):
+    writer = ShmWriter(table, ["strip1"])
+    reader = ShmReader(table)
+    stop = threading.Event()
+
+    def write():
+        version = 0
+        while not stop.is_set():
+            version += 1
+            writer.write(version, {"strip1": {"brightness": version % 256, "speed": version % 256}})
+
+    thread = threading.Thread(target=write)
+    thread.start()
+    try:
+        seq = reader.seq()
+        for _ in range(200):
+            slot = reader.get("strip1")
+            if slot:
+                assert slot["brightness"] == slot["speed"]
+        assert reader.wait_for_change(seq, timeout=1) != seq
+    finally:
+        stop.set()
+        thread.join()
+
+
+def test_web_mirrors_state_into_the_table(web, client, capsys):
+    client.post("/api/set", json={"segment": "strip1", "pattern": "solid", "brightness": 61, "force": True})
+    path = os.environ["LED_SHM_PATH"]
+    assert ShmReader(path).get("strip1")["brightness"] == 61
+    assert main(["--path", path]) == 0 and '"brightness": 61.0' in capsys.readouterr().out
+
+
+def test_reader_rejects_other_files(tmp_path, capsys):
+    other = tmp_path / "other"
+    other.write_bytes(b"\0" * 4096)
+    with pytest.raises(ValueError):
+        ShmReader(str(other))
+    assert main(["--path", str(tmp_path / "missing")]) == 1
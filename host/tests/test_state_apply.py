@@ -0,0 +1,84 @@
+from __future__ import annotations
+
+import json
+
+import pytest
+
+
+@pytest.fixture()
+def library(web, tmp_path, monkeypatch):
+    path = tmp_path / "led_states.json"
+    monkeypatch.setattr(web, "STATES_FILE", str(path))
+
+    def save(states):
+        path.write_text(json.dumps({"states": states, "default": None}))
+
+    return save
+
+
+def test_invalid_preset_is_a_400_and_sends_nothing(web, client, broker, library):
+    library({"bad": {"segments": {"strip2": {"pattern": "solid", "color": [1, 2, 3]},
+                                  "strip1": {"pattern": "solid", "speed": 500}}}})
+    before = web.STATE.get("strip2")
+    sent = sum(broker.published.values())
+    res = client.post("/api/state/apply", json={"name": "bad"})
+    assert res.status_code == 400
+    body = res.get_json()
+    assert body["ok"] is False and "strip1" in body["error"] and "speed" in body["error"]
+    assert web.STATE.get("strip2") == before
+    assert sum(broker.published.values()) == sent
+
+
+def test_unknown_segments_are_ignored(web, client, library):
+    library({"mixed": {"segments": {"strip3": {"pattern": "solid", "color": [9, 8, 7]},
+                                    "seg250_323": {"pattern": "rainbow"},
+                                    "strip9": {"pattern": "solid"}}}})
+    res = client.post("/api/state/apply", json={"name": "mixed", "force": True})
+    assert res.status_code == 200
+    summary = res.get_json()["summary"]
+    assert summary["ignored"] == ["strip9"]
+    assert set(summary["changed"]) == {"strip3", "seg250_323"}
+    assert web.STATE.get("strip9") is None
+    assert list(web.STATE.get("strip3")["color"]) == [9, 8, 7]
+    assert "strip9" not in web.STATE.snapshot()[1]
+
+
+def test_set_all_keeps_other_fields_and_updates_every_segment(web, client):
+    web.STATE.update("strip2", {"pattern": "rainbow", "brightness": 40.0, "speed": 3.0})
+    res = client.post("/api/set-all", json={"brightness": 90, "color": None})
+    assert res.status_code == 200 and res.get_json()["ok"] is True
+    for seg in web.SEGMENTS:
+        assert web.STATE.get(seg)["brightness"] == 90.0
+    assert web.STATE.get("strip2")["pattern"] == "rainbow" and web.STATE.get("strip2")["speed"] == 3.0
+
+
+@pytest.mark.parametrize("body", [{"brightness": 999}, {"color": ["red"]}, {"speed": "fast"}])
+def test_set_all_rejects_bad_values_before_sending(web, client, broker, body):
+    before = {seg: web.STATE.get(seg) for seg in web.SEGMENTS}
+    sent = sum(broker.published.values())
+    res = client.post("/api/set-all", json=body)
+    assert res.status_code == 400 and res.get_json()["ok"] is False
+    assert {seg: web.STATE.get(seg) for seg in web.SEGMENTS} == before
+    assert sum(broker.published.values()) == sent
+
+
+def test_set_all_commits_the_cache_when_the_publish_fails(web, client, monkeypatch):
+    def down(*args, **kwargs):
+        raise OSError("broker down")
+
+    monkeypatch.setattr(web, "OUTBOX", None)
+    monkeypatch.setattr(web, "_send_bodies", down)
+    monkeypatch.setitem(web.app.config, "PROPAGATE_EXCEPTIONS", False)
+    res = client.post("/api/set-all", json={"brightness": 17})
+    assert res.status_code == 500
+    assert all(web.STATE.get(seg)["brightness"] == 17.0 for seg in web.SEGMENTS)
+
+
+def test_set_all_reports_queued_while_the_broker_is_down(web, client, monkeypatch):
+    def down(*args, **kwargs):
+        raise OSError("broker down")
+
+    monkeypatch.setattr(web, "_send_bodies", down)
+    res = client.post("/api/set-all", json={"brightness": 33})
+    assert res.status_code == 200 and res.get_json()["queued"] is True
+    web.OUTBOX.flush(lambda *args: None)
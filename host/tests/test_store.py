@@ -0,0 +1,62 @@
+from __future__ import annotations
+
+import pytest
+
+from led_shared import SqliteBackend
+from led_store import StateStore, thaw
+
+
+def test_changed_since_returns_only_touched_entries():
+    store = StateStore({"a": {"x": 1}, "b": {"x": 2}})
+    v0, changed = store.changed_since(0)
+    assert v0 == 0 and changed == {}
+    v1 = store.update_many({"a": {"x": 5}, "b": {"x": 2}})
+    assert v1 == 1
+    version, changed = store.changed_since(v0)
+    assert version == 1 and list(changed) == ["a"]
+    assert store.changed_since(v1) == (1, {})
+
+
+def test_no_op_updates_keep_the_version_and_skip_listeners():
+    store = StateStore({"a": {"x": 1, "color": [1, 2, 3]}})
+    seen = []
+    store.add_listener(lambda version, updated: seen.append((version, sorted(updated))))
+    store.update("a", {"color": [1, 2, 3]})
+    assert store.version == 0 and seen == []
+    entry = store.update("a", {"y": 2})
+    assert seen == [(1, ["a"])]
+    assert thaw(entry) == {"x": 1, "color": [1, 2, 3], "y": 2}
+    with pytest.raises(TypeError):
+        entry["x"] = 3
+    assert store.replace("a", {"z": 0}) == {"z": 0}
+
+
+def test_sqlite_backend_merges_commits_from_other_workers(tmp_path):
+    path = str(tmp_path / "shared.db")
+    first = StateStore({"strip1": {"brightness": 255, "pattern": "solid"}}, SqliteBackend(path), "segments")
+    second = StateStore({"strip1": {"brightness": 1, "pattern": "off"}}, SqliteBackend(path), "segments")
+    assert thaw(second.get("strip1")) == {"brightness": 255, "pattern": "solid"}  # first seed wins
+
+    first.update("strip1", {"brightness": 10})
+    second.update("strip1", {"pattern": "wave"})
+    assert thaw(first.get("strip1")) == {"brightness": 10, "pattern": "wave"}
+    assert first.version == second.version == 2
+
+    heard = []
+    first.add_listener(lambda version, updated: heard.append(version))
+    second.update("strip2", {"pattern": "solid"})
+    version, changed = first.changed_since(2)
+    assert version == 3 and list(changed) == ["strip2"] and heard == []
+
+
+def test_state_endpoint_since_is_empty_when_unchanged(client):
+    full = client.get("/api/state").get_json()
+    assert full["state"]
+    res = client.get(f"/api/state?since={full['version']}").get_json()
+    assert res == {"version": full["version"], "state": []}
+
+    client.post("/api/set", json={"segment": "strip1", "pattern": "solid", "brightness": 47, "force": True})
+    res = client.get(f"/api/state?since={full['version']}").get_json()
+    assert res["version"] > full["version"]
+    assert [(s["segment"], s["brightness"]) for s in res["state"]] == [("strip1", 47)]
+    assert client.get("/api/state?since=latest").status_code == 400
@@ -0,0 +1,97 @@
+from __future__ import annotations
+
+import marshal
+import time
+
+import pytest
+
+import led_trace
+from led_trace import ProfileCapture, span, traced
+
+
+@pytest.fixture
+def tracing():
+    saved = led_trace.configure()
+    led_trace.SLOW_REQUESTS.clear()
+    yield led_trace.configure(enabled=True, slow_ms=0)
+    led_trace.configure(saved["enabled"], saved["slow_ms"])
+    led_trace.SLOW_REQUESTS.clear()
+
+
+@traced("work")
+def _work():
+    time.sleep(0.005)
+    return 42
+
+
+def test_spans_are_recorded_in_order(tracing):
+    token = led_trace.begin("POST", "/api/set")
+    with span("encode"):
+        pass
+    assert _work() == 42
+    led_trace.finish(token, 200)
+    [slow] = led_trace.SLOW_REQUESTS
+    assert (slow["method"], slow["path"], slow["status"]) == ("POST", "/api/set", 200)
+    assert [s["name"] for s in slow["spans"]] == ["encode", "work"]
+    work = slow["spans"][1]
+    assert work["ms"] >= 5 and work["offset_ms"] >= slow["spans"][0]["offset_ms"]
+    assert slow["total_ms"] >= work["offset_ms"] + work["ms"] - 0.01
+
+
+def test_fast_requests_and_disabled_tracing_are_not_kept(tracing):
+    led_trace.configure(slow_ms=10_000)
+    led_trace.finish(led_trace.begin("GET", "/api/state"), 200)
+    led_trace.configure(enabled=False, slow_ms=0)
+    assert led_trace.begin("GET", "/api/state") is None
+    with span("outside"):
+        pass
+    assert _work() == 42
+    assert not led_trace.SLOW_REQUESTS
+
+
+def test_slow_ring_is_bounded(tracing):
+    for i in range(led_trace.SLOW_LOG_SIZE + 5):
+        led_trace.finish(led_trace.begin("GET", f"/r{i}"), 200)
+    paths = [r["path"] for r in led_trace.SLOW_REQUESTS]
+    assert len(paths) == led_trace.SLOW_LOG_SIZE and paths[0] == "/r5"
+
+
+def test_debug_endpoints_configure_and_list_slow_requests(client, tracing):
+    res = client.post("/api/debug/trace", json={"slow_ms": "fast"})
+    assert res.status_code == 400
+    assert client.post("/api/debug/trace", json={"enabled": True, "slow_ms": 0}).get_json()["enabled"]
+    client.post("/api/set", json={"segment": "strip1", "pattern": "solid", "force": True})
+    slow = client.get("/api/debug/slow").get_json()
+    paths = [r["path"] for r in slow["requests"]]
+    assert slow["slow_ms"] == 0 and "/api/set" in paths
+    [entry] = [r for r in slow["requests"] if r["path"] == "/api/set"]
+    assert "mqtt_publish" in [s["name"] for s in entry["spans"]]
+
+
+def test_profile_capture_counts_only_the_armed_route():
+    prof = ProfileCapture()
+    with pytest.raises(ValueError):
+        prof.arm("/api/set", 1, mode="perf")
+    prof.arm("/api/set", 2)
+    assert prof.start("/api/state") is None
+    for _ in range(3):
+        handle = prof.start("/api/set")
+        _work()
+        prof.stop(handle)
+    assert prof.status() == {"route": "/api/set", "mode": "cprofile", "remaining": 0, "captured": 2, "done": True}
+    data, mimetype, filename = prof.export()
+    assert filename.endswith(".pstats") and mimetype == "application/octet-stream"
+    assert any(name == "_work" for (_, _, name) in marshal.loads(data))
+
+
+def test_sampler_collapses_stacks():
+    prof = ProfileCapture()
+    prof.arm("/api/set", 1, mode="sample", interval_ms=1)
+    handle = prof.start("/api/set")
+    time.sleep(0.05)
+    prof.stop(handle)
+    data, mimetype, _ = prof.export()
+    lines = data.decode().splitlines()
+    assert mimetype == "text/plain" and lines
+    stack, count = lines[0].rsplit(" ", 1)
+    assert "test_trace.py:test_sampler_collapses_stacks" in stack and int(count) > 0
@@ -0,0 +1,47 @@
+from __future__ import annotations
+
+import threading
+import time
+
+from led_transitions import TransitionEngine
+
+
+def _engine(sender, done, finished=None):
+    def on_done(key, values):
+        done.append((key, values))
+        if finished is not None:
+            finished.set()
+
+    engine = TransitionEngine()
+    engine.register("main", sender, fps=100, on_done=on_done)
+    return engine
+
+
+def test_fade_reaches_target_and_commits():
+    frames, done = [], []
+    finished = threading.Event()
+    engine = _engine(frames.extend, done, finished)
+    engine.start("main", "strip1", {"brightness": 0, "color": [0, 0, 0]}, {"brightness": 100, "color": [100, 0, 0]},
+                 0.1, "linear", {"pattern": "solid"})
+    assert finished.wait(2)
+    assert frames[0][2] == {"pattern": "solid"} and all(f[2] == {} for f in frames[1:])
+    assert frames[-1][1] == {"brightness": 100.0, "color": [100, 0, 0]} and frames[-1][3]
+    assert done == [("strip1", {"pattern": "solid", "brightness": 100.0, "color": [100, 0, 0]})]
+
+
+def test_failing_sender_logs_once_and_skips_on_done(capsys):
+    calls, done = [], []
+
+    def broken(frames):
+        calls.append(frames)
+        raise OSError("broker down")
+
+    engine = _engine(broken, done)
+    engine.start("main", "strip2", {"brightness": 0}, {"brightness": 100}, 0.1, "linear")
+    deadline = time.monotonic() + 2
+    while engine.active() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    time.sleep(0.05)
+    assert len(calls) > 3
+    assert capsys.readouterr().out.count("strip2") == 1
+    assert done == []